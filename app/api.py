@@ -1,18 +1,29 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, Body
+from fastapi import FastAPI, HTTPException, Query, Depends, Body, Request, Response
 from pydantic import BaseModel, Field, validator
 from .services import (
     TextToSQLService, 
     SQLResult, 
     DatabaseService, 
+    AsyncDatabaseService,
+    AsyncHistoryService,
+    BatchConverter,
     llm_service, 
     LLMResponse
 )
+from .services.http_clients import close_async_http_clients, close_http_clients
+from .services.token_meter import usage_context
 from .models import QueryHistoryModel
 from .utils import settings
+from .utils.metrics import metrics
+from .utils.profiling import render_metrics, slow_traces
+import asyncio
 import logging
+import time
 from typing import List, Optional, Dict, Any, Union
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+import json
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -34,9 +45,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# HTTP 請求延遲直方圖
+REQUEST_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "HTTP 請求耗時 (秒)", labelnames=("method", "path", "status")
+)
+
+# 設定 logfire 後，各階段的 OpenTelemetry span 會一併傳送
+if settings.logfire_token:
+    try:
+        import logfire
+        logfire.configure(token=settings.logfire_token)
+        logfire.instrument_fastapi(app)
+    except ImportError:
+        logger.warning("已設定 LOGFIRE_TOKEN 但未安裝 logfire，略過追蹤匯出")
+
+
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    """記錄每個請求的耗時 (以路由樣板作為標籤，避免路徑參數造成標籤爆量)，並標記 token 用量的端點"""
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        with usage_context(endpoint=request.url.path):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_DURATION.observe(
+            time.perf_counter() - start_time,
+            method=request.method,
+            path=getattr(route, "path", "unmatched"),
+            status=str(status)
+        )
+
+
 # 初始化服務
 text_to_sql_service = TextToSQLService()
-db_service = DatabaseService()
+db_service = text_to_sql_service.db_service  # 共用連線池與資料庫結構快取
+# 端點直接使用的非同步服務 (asyncpg 連線池)，等待資料庫時不阻塞事件迴圈
+async_db_service = AsyncDatabaseService(db_service)
+async_history_service = AsyncHistoryService(text_to_sql_service.history_service)
+
+
+@app.on_event("startup")
+async def startup_event():
+    """在執行緒池中連接資料庫並建立非同步連線池，第一個請求不需等待連線"""
+    await run_in_threadpool(db_service.connect)
+    async_db_service.engine  # 第一次存取時建立連線池
+
+
+async def drain_llm_calls(timeout: float) -> None:
+    """等待進行中的 LLM 呼叫完成 (例如批次轉換的背景執行緒)，最多等待 timeout 秒"""
+    deadline = time.monotonic() + timeout
+    in_flight = llm_service.rate_limiter.get_in_flight()
+    if in_flight:
+        logger.info(f"等待 {in_flight} 個進行中的 LLM 呼叫完成")
+    while in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        in_flight = llm_service.rate_limiter.get_in_flight()
+    if in_flight:
+        logger.warning(f"關閉時仍有 {in_flight} 個 LLM 呼叫未完成")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """等待進行中的 LLM 呼叫後，關閉共用的 HTTP 連線池與資料庫連線"""
+    await drain_llm_calls(settings.server_graceful_timeout)
+    close_http_clients()
+    await close_async_http_clients()
+    db_service.close()
+    # 寫完背景佇列中的查詢歷史
+    text_to_sql_service.history_service.close()
+    text_to_sql_service.conversation_manager.close()
+    await async_db_service.close()
+    await async_history_service.close()
 
 
 class QueryRequest(BaseModel):
@@ -45,6 +128,30 @@ class QueryRequest(BaseModel):
     execute: bool = Field(default=False, description="是否執行生成的查詢")
     model: Optional[str] = Field(default=None, description="使用的模型名稱")
     session_id: Optional[str] = Field(default=None, description="會話ID，用於對話上下文管理")
+    confirm_cost: bool = Field(default=False, description="確認執行預估成本超出上限的查詢")
+    
+    @validator('model')
+    def validate_model(cls, v):
+        if v is not None and v not in settings.models:
+            available_models = list(settings.models.keys())
+            raise ValueError(f"未知的模型: {v}。可用模型: {available_models}")
+        return v
+
+
+class BatchQueryRequest(BaseModel):
+    """批次查詢請求模型"""
+    queries: List[str] = Field(..., description="自然語言查詢列表")
+    execute: bool = Field(default=False, description="是否執行生成的查詢")
+    model: Optional[str] = Field(default=None, description="使用的模型名稱")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="並發數，不超過伺服器設定的上限")
+    
+    @validator('queries')
+    def validate_queries(cls, v):
+        if not v:
+            raise ValueError("查詢列表不可為空")
+        if len(v) > settings.batch_max_size:
+            raise ValueError(f"單次批次最多 {settings.batch_max_size} 個查詢")
+        return v
     
     @validator('model')
     def validate_model(cls, v):
@@ -91,21 +198,15 @@ async def convert_text_to_sql(request: QueryRequest):
     try:
         logger.info(f"接收到查詢: {request.query}, execute={request.execute}, model={request.model or settings.default_model}")
         
-        # 臨時設置默認模型
-        original_default = settings.default_model
-        if request.model:
-            settings.default_model = request.model
-            
-        # 執行查詢
-        result = text_to_sql_service.text_to_sql(
+        # 轉換流程 (LLM 呼叫與資料庫查詢) 為同步程式，在執行緒池中執行
+        result = await run_in_threadpool(
+            text_to_sql_service.text_to_sql,
             query=request.query, 
             session_id=request.session_id,
-            execute=request.execute
+            execute=request.execute,
+            model_name=request.model,
+            confirm_cost=request.confirm_cost
         )
-        
-        # 恢復默認模型
-        if request.model:
-            settings.default_model = original_default
             
         return result
     except Exception as e:
@@ -113,22 +214,90 @@ async def convert_text_to_sql(request: QueryRequest):
         raise HTTPException(status_code=500, detail=f"處理查詢時發生錯誤: {str(e)}")
 
 
+@app.post("/api/text-to-sql/batch")
+async def convert_text_to_sql_batch(request: BatchQueryRequest):
+    """
+    批次將自然語言轉換為 SQL 查詢
+    
+    - 以有限並發轉換，相同的查詢只轉換一次
+    - 以 NDJSON 串流回傳，每完成一個查詢輸出一行 {"type": "result", ...}
+    - 最後一行為 {"type": "summary", ...}，包含成功數、失敗數與吞吐量
+    """
+    logger.info(f"接收到批次查詢: {len(request.queries)} 個, execute={request.execute}, model={request.model or settings.default_model}")
+    
+    converter = BatchConverter(text_to_sql_service, max_concurrency=request.concurrency)
+    
+    def generate_lines():
+        for item in converter.convert(request.queries, execute=request.execute, model_name=request.model):
+            line = {"type": "result", **item.model_dump(mode="json")}
+            yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+        summary = {"type": "summary", **converter.summary.model_dump()}
+        yield json.dumps(summary, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
 @app.get("/api/history", response_model=List[QueryHistoryModel])
 async def get_query_history(
-    limit: int = Query(20, description="返回結果數量限制"),
-    offset: int = Query(0, description="偏移量")
+    response: Response,
+    limit: int = Query(20, ge=1, description="返回結果數量限制"),
+    offset: int = Query(0, ge=0, description="偏移量 (已不建議使用，請改用 cursor)"),
+    cursor: Optional[str] = Query(None, description="上一頁回應標頭 X-Next-Cursor 的游標"),
+    conversation_id: Optional[str] = Query(None, description="只返回此對話的查詢"),
+    favorites: bool = Query(False, description="只返回收藏的查詢")
 ):
-    """獲取查詢歷史記錄"""
+    """
+    獲取查詢歷史記錄
+    
+    - 以游標 (keyset) 分頁，依建立時間由新到舊
+    - 還有下一頁時，回應標頭 X-Next-Cursor 為下一頁的游標
+    - offset 只適用於未篩選的歷史，不能與 cursor、conversation_id 或 favorites 同時使用
+    """
+    if offset and (cursor or conversation_id or favorites):
+        raise HTTPException(
+            status_code=400,
+            detail="offset 不能與 cursor、conversation_id 或 favorites 同時使用，請改用 cursor 分頁"
+        )
     try:
-        history = text_to_sql_service.get_history(limit, offset)
+        if offset:
+            return await async_history_service.get_history(limit, offset)
+        history, next_cursor = await async_history_service.get_history_page(
+            limit, cursor=cursor, conversation_id=conversation_id, favorites_only=favorites
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return history
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"獲取查詢歷史時發生錯誤: {e}")
         raise HTTPException(status_code=500, detail=f"獲取查詢歷史時發生錯誤: {str(e)}")
 
 
+@app.get("/api/history/search", response_model=List[QueryHistoryModel])
+async def search_query_history(
+    q: str = Query(..., min_length=1, description="搜尋字串 (比對自然語言問題與 SQL)"),
+    limit: int = Query(20, ge=1, le=200, description="返回結果數量限制")
+):
+    """
+    全文搜尋查詢歷史
+
+    - 比對 user_query 與 generated_sql，完整包含搜尋字串的記錄排在前面，其次由新到舊
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="搜尋字串不可為空白")
+    try:
+        return await async_history_service.search_history(q, limit)
+    except Exception as e:
+        logger.error(f"搜尋查詢歷史時發生錯誤: {e}")
+        raise HTTPException(status_code=500, detail=f"搜尋查詢歷史時發生錯誤: {str(e)}")
+
+
 @app.post("/api/execute-sql")
-async def execute_sql(sql: str = Query(..., description="要執行的 SQL 查詢")):
+async def execute_sql(
+    sql: str = Query(..., description="要執行的 SQL 查詢"),
+    confirm_cost: bool = Query(False, description="確認執行預估成本超出上限的查詢")
+):
     """
     直接執行 SQL 查詢
     
@@ -143,13 +312,19 @@ async def execute_sql(sql: str = Query(..., description="要執行的 SQL 查詢
             raise HTTPException(status_code=400, detail=reason)
         
         # 執行查詢
-        result = text_to_sql_service.execute_sql(sql)
+        result, viz_metadata = await async_db_service.execute_query_with_viz(sql, visualize=True, confirmed=confirm_cost)
+        if viz_metadata:
+            setattr(result, "visualization", viz_metadata)
         
         if result.error:
             logger.error(f"SQL 查詢執行錯誤: {result.error}")
+            content = {"error": result.error}
+            if result.plan_check is not None:
+                # 成本檢查未通過；requires_confirmation 為 true 時可帶 confirm_cost=true 重新送出
+                content["plan_check"] = result.plan_check
             return JSONResponse(
                 status_code=400,
-                content={"error": result.error}
+                content=content
             )
         
         return result.to_dict()
@@ -165,7 +340,7 @@ async def execute_sql(sql: str = Query(..., description="要執行的 SQL 查詢
 async def get_tables():
     """獲取所有表名"""
     try:
-        tables = db_service.get_tables()
+        tables = await async_db_service.get_tables()
         return {"tables": tables}
     except Exception as e:
         logger.error(f"獲取表名時發生錯誤: {e}")
@@ -176,7 +351,7 @@ async def get_tables():
 async def get_table_schema(table_name: str):
     """獲取表結構"""
     try:
-        schema = db_service.get_table_schema(table_name)
+        schema = await async_db_service.get_table_schema(table_name)
         if "error" in schema:
             raise HTTPException(status_code=400, detail=schema["error"])
         return schema
@@ -241,6 +416,54 @@ async def get_model_performance(model_name: Optional[str] = None):
         raise HTTPException(status_code=500, detail=f"獲取模型性能失敗: {str(e)}")
 
 
+@app.get("/api/llm/rate-limits")
+async def get_rate_limit_stats():
+    """獲取 LLM 並發與速率限制的排隊深度和等待時間統計"""
+    try:
+        return llm_service.get_rate_limit_stats()
+    except Exception as e:
+        logger.error(f"獲取速率限制統計失敗: {e}")
+        raise HTTPException(status_code=500, detail=f"獲取速率限制統計失敗: {str(e)}")
+
+
+@app.get("/api/llm/token-usage")
+async def get_token_usage(
+    group_by: Optional[str] = Query(None, description="彙總維度: model / endpoint / session / stage")
+):
+    """獲取 token 用量與費用彙總"""
+    try:
+        return llm_service.get_token_usage(group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/llm/token-usage/sessions/{session_id}")
+async def get_session_token_usage(session_id: str):
+    """獲取單一會話的 token 用量與預算"""
+    sessions = llm_service.get_token_usage("session")["by_session"]
+    budget = settings.session_token_budget or None
+    usage = sessions.get(session_id)
+    used = usage["total_tokens"] if usage else 0
+    return {
+        "session_id": session_id,
+        "usage": usage,
+        "budget": budget,
+        "remaining": budget - used if budget else None
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """以 Prometheus 文字格式匯出延遲直方圖與快取統計"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/traces/slow")
+async def get_slow_traces(limit: int = Query(10, ge=1, description="返回記錄數量")):
+    """獲取最慢的追蹤記錄，包含各階段的時間軸"""
+    return {"traces": slow_traces.get_slowest(limit)}
+
+
 @app.get("/health")
 async def health_check():
     """健康檢查端點"""
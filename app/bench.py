@@ -0,0 +1,393 @@
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from .services.llm_service import LLMProvider, LLMResponse, llm_service
+from .utils import settings, estimate_tokens
+from .utils.config import ModelConfig, ModelProvider
+from .utils.profiling import record_stages
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 報告中的階段順序
+STAGES = ["reference_resolution", "template_match", "similarity_search", "prompt_build", "llm", "execution", "history_write"]
+
+# 模擬提供者註冊使用的模型名稱
+STUB_MODEL_NAME = "bench-stub"
+
+# 建立資料表的順序 (依外鍵相依性)
+SCHEMA_TABLES = [
+    "n8n_booking_businesses",
+    "n8n_booking_users",
+    "n8n_booking_services",
+    "n8n_booking_time_periods",
+    "n8n_booking_staff_services",
+    "n8n_booking_service_period_restrictions",
+    "n8n_booking_staff_availability",
+    "n8n_booking_bookings",
+    "n8n_booking_history",
+]
+SCHEMA_TYPES = ["availability_type", "user_role"]
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+class BenchCase(BaseModel):
+    """基準測試語料中的一筆自然語言查詢與預期 SQL"""
+    query: str = Field(description="自然語言查詢")
+    expected_sql: str = Field(description="預期的 SQL 查詢")
+    parameters: Dict[str, Any] = Field(default_factory=dict, description="預期的 SQL 參數")
+    session_id: Optional[str] = Field(default=None, description="會話ID，用於測試多輪對話")
+
+
+def load_corpus(path: str) -> List[BenchCase]:
+    """
+    載入 JSONL 語料，每行一個 {"query", "expected_sql", "parameters"?, "session_id"?} 物件
+
+    Args:
+        path: 語料檔案路徑
+
+    Returns:
+        測試案例列表
+    """
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                cases.append(BenchCase(**json.loads(line)))
+            except Exception as e:
+                raise ValueError(f"語料第 {line_number} 行格式錯誤: {e}")
+    return cases
+
+
+def normalize_sql(sql: str) -> str:
+    """正規化 SQL 以進行比對 (移除註解、統一空白與大小寫、去除結尾分號)"""
+    sql = re.sub(r'--[^\n]*', ' ', sql or "")
+    sql = re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+    return sql.lower()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """計算百分位數 (線性插值)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_latencies(values: List[float]) -> Dict[str, float]:
+    """彙總延遲分佈 (毫秒)"""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+class StubProvider(LLMProvider):
+    """
+    離線基準測試用的模擬提供者
+
+    根據語料直接回傳預期 SQL，讓基準測試只量測本地處理路徑 (提示建構、歷史寫入等)。
+    """
+
+    def __init__(self, cases: List[BenchCase], latency_ms: float = 0.0):
+        self.answers = {re.sub(r'\s+', ' ', case.query).strip(): case for case in cases}
+        self.latency_ms = latency_ms
+        super().__init__(ModelConfig(
+            provider=ModelProvider.LOCAL,
+            model_name=STUB_MODEL_NAME,
+            api_key_env="DUMMY_KEY",
+            supports_json_mode=True,
+            context_window=128000,
+        ))
+
+    def _setup(self):
+        """模擬提供者不需要客戶端"""
+        pass
+
+    def generate(self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False) -> LLMResponse:
+        """回傳語料中的預期 SQL"""
+        start_time = time.perf_counter()
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        if system_prompt and system_prompt.startswith("你是參考解析專家"):
+            # 參考解析：原樣返回當前查詢
+            match = re.search(r'當前查詢: (.*?)\n\n', prompt, re.S)
+            current_query = match.group(1) if match else prompt
+            content = json.dumps({"resolved_query": current_query, "entity_references": {}}, ensure_ascii=False)
+        else:
+            # 用戶查詢位於提示的第一段，之後可能附加函數建議
+            key = re.sub(r'\s+', ' ', prompt.split("\n\n", 1)[0]).strip()
+            case = self.answers.get(key)
+            if case:
+                content = json.dumps({
+                    "sql": case.expected_sql,
+                    "explanation": "基準測試預期結果",
+                    "parameters": case.parameters,
+                }, ensure_ascii=False)
+            else:
+                content = json.dumps({"sql": "-- 語料中沒有此查詢", "explanation": "", "parameters": {}}, ensure_ascii=False)
+
+        prompt_tokens = estimate_tokens(prompt) + estimate_tokens(system_prompt or "")
+        completion_tokens = estimate_tokens(content)
+        return LLMResponse(
+            content=content,
+            model=self.model_name,
+            token_usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+            latency=(time.perf_counter() - start_time) * 1000,
+        )
+
+
+def setup_database(database_url: str, seed_file: Optional[str] = None) -> None:
+    """
+    在本地 PostgreSQL 建立 n8n_booking_schemas 的資料表、資料庫函數並載入種子資料
+
+    會先刪除既有的同名資料表，僅應用於基準測試專用的資料庫。
+
+    Args:
+        database_url: 資料庫連接 URL
+        seed_file: 種子資料 SQL 檔案路徑
+    """
+    from sqlalchemy import create_engine
+
+    schema_dir = os.path.join(PROJECT_ROOT, "n8n_booking_schemas")
+    function_dir = os.path.join(PROJECT_ROOT, "database_function")
+
+    engine = create_engine(database_url)
+    # 使用原始 DBAPI 游標，避免函數定義中的 % 被當成參數佔位符
+    connection = engine.raw_connection()
+    try:
+        connection.autocommit = True
+        cursor = connection.cursor()
+
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table in reversed(SCHEMA_TABLES):
+            cursor.execute(f"DROP TABLE IF EXISTS public.{table} CASCADE")
+        for type_name in SCHEMA_TYPES:
+            cursor.execute(f"DROP TYPE IF EXISTS public.{type_name} CASCADE")
+
+        for table in SCHEMA_TABLES:
+            with open(os.path.join(schema_dir, f"{table}.sql"), "r", encoding="utf-8") as f:
+                cursor.execute(f.read())
+        logger.info(f"已建立 {len(SCHEMA_TABLES)} 個資料表")
+
+        loaded = 0
+        for filename in sorted(os.listdir(function_dir)):
+            if not filename.endswith(".sql"):
+                continue
+            with open(os.path.join(function_dir, filename), "r", encoding="utf-8") as f:
+                try:
+                    cursor.execute(f.read())
+                    loaded += 1
+                except Exception as e:
+                    logger.warning(f"載入資料庫函數 {filename} 失敗: {e}")
+        logger.info(f"已載入 {loaded} 個資料庫函數檔案")
+
+        if seed_file:
+            with open(seed_file, "r", encoding="utf-8") as f:
+                cursor.execute(f.read())
+            logger.info(f"已載入種子資料: {seed_file}")
+        cursor.close()
+    finally:
+        connection.close()
+        engine.dispose()
+
+
+def _rows_signature(rows: Optional[List[List[Any]]]) -> List[str]:
+    """將結果列轉為與順序無關的可比較形式"""
+    return sorted(json.dumps(row, ensure_ascii=False, default=str) for row in (rows or []))
+
+
+def run_benchmark(service, cases: List[BenchCase], model_name: Optional[str] = None,
+                  execute: bool = False, repeat: int = 1) -> Dict[str, Any]:
+    """
+    重放語料並量測各階段延遲、快取命中率、token 用量與準確率
+
+    Args:
+        service: TextToSQLService 實例
+        cases: 測試案例
+        model_name: 使用的模型名稱
+        execute: 是否執行生成的 SQL，並與預期 SQL 的結果比對
+        repeat: 重複執行語料的次數
+
+    Returns:
+        基準測試報告
+    """
+    stage_latencies: Dict[str, List[float]] = {name: [] for name in STAGES}
+    total_latencies: List[float] = []
+    counters: Dict[str, float] = {}
+    exact_matches = 0
+    execution_checked = 0
+    execution_matches = 0
+    errors = 0
+    failures = []
+    expected_rows_cache: Dict[int, List[str]] = {}
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for session_id in {case.session_id for case in cases if case.session_id}:
+            service.conversation_manager.clear_conversation(session_id)
+
+        for index, case in enumerate(cases):
+            with record_stages() as recorder:
+                query_start = time.perf_counter()
+                result = service.text_to_sql(
+                    query=case.query,
+                    session_id=case.session_id,
+                    execute=execute,
+                    model_name=model_name
+                )
+                total_latencies.append((time.perf_counter() - query_start) * 1000)
+
+            for name, elapsed_ms in recorder.stages.items():
+                stage_latencies.setdefault(name, []).append(elapsed_ms)
+            for name, amount in recorder.counters.items():
+                counters[name] = counters.get(name, 0) + amount
+
+            if result.sql.startswith("--"):
+                errors += 1
+
+            matched = normalize_sql(result.sql) == normalize_sql(case.expected_sql)
+            if matched:
+                exact_matches += 1
+
+            executed_match = None
+            if execute and result.execution_result and not result.execution_result.get("error"):
+                if index not in expected_rows_cache:
+                    expected = service.execute_sql(case.expected_sql, case.parameters, visualize=False)
+                    expected_rows_cache[index] = None if expected.error else _rows_signature(expected.rows)
+                if expected_rows_cache[index] is not None:
+                    execution_checked += 1
+                    executed_match = _rows_signature(result.execution_result.get("rows")) == expected_rows_cache[index]
+                    if executed_match:
+                        execution_matches += 1
+
+            if not matched and executed_match is not True:
+                failures.append({"query": case.query, "expected_sql": case.expected_sql, "generated_sql": result.sql})
+
+    elapsed = time.perf_counter() - start_time
+    total_queries = len(total_latencies)
+
+    cache_names = {name.split(".")[1] for name in counters if name.startswith("cache.")}
+    cache_stats = {}
+    for name in sorted(cache_names):
+        hits = counters.get(f"cache.{name}.hits", 0)
+        misses = counters.get(f"cache.{name}.misses", 0)
+        cache_stats[name] = {
+            "hits": int(hits),
+            "misses": int(misses),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    return {
+        "model": model_name or settings.default_model,
+        "queries": total_queries,
+        "elapsed_seconds": elapsed,
+        "throughput_qps": total_queries / elapsed if elapsed > 0 else 0.0,
+        "total_latency_ms": summarize_latencies(total_latencies),
+        "stages_ms": {name: summarize_latencies(values) for name, values in stage_latencies.items() if values},
+        "cache": cache_stats,
+        "llm": {
+            "calls": int(counters.get("llm.calls", 0)),
+            "total_tokens": int(counters.get("llm.total_tokens", 0)),
+            "tokens_per_query": counters.get("llm.total_tokens", 0) / total_queries if total_queries else 0.0,
+        },
+        "accuracy": {
+            "exact_match": exact_matches / total_queries if total_queries else 0.0,
+            "execution_checked": execution_checked,
+            "execution_match": execution_matches / execution_checked if execution_checked else None,
+            "errors": errors,
+        },
+        "failures": failures,
+    }
+
+
+def run_bench_command(args, console) -> Dict[str, Any]:
+    """
+    執行 CLI 的 bench 指令
+
+    預設使用模擬提供者離線執行，並將查詢歷史寫入暫存檔，不影響正式的歷史記錄。
+    """
+    from rich.table import Table
+
+    if args.database_url:
+        settings.database_url = args.database_url
+
+    if args.setup_db:
+        console.print("[cyan]正在建立基準測試資料庫...[/cyan]")
+        setup_database(settings.database_url, args.seed)
+
+    cases = load_corpus(args.corpus)
+    console.print(f"[cyan]載入 {len(cases)} 筆語料: {args.corpus}[/cyan]")
+
+    model_name = args.model
+    if model_name:
+        if model_name not in settings.models:
+            raise ValueError(f"未知的模型: {model_name}。可用模型: {list(settings.models.keys())}")
+    else:
+        model_name = STUB_MODEL_NAME
+        llm_service.register_provider(STUB_MODEL_NAME, StubProvider(cases, latency_ms=args.llm_latency_ms))
+
+    from .services import TextToSQLService
+    service = TextToSQLService()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        service.history_service.history_file = os.path.join(temp_dir, "bench_history.json")
+        service.conversation_manager.history_service = service.history_service
+        report = run_benchmark(service, cases, model_name=model_name, execute=args.execute, repeat=args.repeat)
+        service.history_service.flush()
+
+    table = Table(title=f"階段延遲 (毫秒) - {report['queries']} 個查詢")
+    table.add_column("階段", style="cyan")
+    for column in ["次數", "平均", "p50", "p95", "p99", "最大"]:
+        table.add_column(column, justify="right")
+    rows = list(report["stages_ms"].items()) + [("總計", report["total_latency_ms"])]
+    for name, stats in rows:
+        table.add_row(
+            name, str(stats["count"]), f"{stats['mean']:.2f}", f"{stats['p50']:.2f}",
+            f"{stats['p95']:.2f}", f"{stats['p99']:.2f}", f"{stats['max']:.2f}"
+        )
+    console.print(table)
+
+    for name, stats in report["cache"].items():
+        console.print(f"快取 {name}: 命中 {stats['hits']} / 未命中 {stats['misses']} (命中率 {stats['hit_rate']:.1%})")
+
+    accuracy = report["accuracy"]
+    console.print(f"LLM 呼叫: {report['llm']['calls']}，每查詢 token: {report['llm']['tokens_per_query']:.1f}")
+    console.print(f"SQL 完全符合率: {accuracy['exact_match']:.1%}，錯誤數: {accuracy['errors']}")
+    if accuracy["execution_match"] is not None:
+        console.print(f"執行結果符合率: {accuracy['execution_match']:.1%} ({accuracy['execution_checked']} 個已比對)")
+    console.print(f"吞吐量: {report['throughput_qps']:.2f} 查詢/秒")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        console.print(f"[green]報告已寫入 {args.output}[/green]")
+
+    return report
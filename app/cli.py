@@ -2,13 +2,10 @@ import argparse
 import sys
 import json
 import os
-from tabulate import tabulate
 from datetime import datetime
-from .services import TextToSQLService, conversation_manager, visualization_service
 import logging
 from dotenv import load_dotenv
 from rich.console import Console
-from rich.syntax import Syntax
 from rich.table import Table
 
 # 設定日誌
@@ -22,6 +19,36 @@ load_dotenv()
 console = Console()
 
 
+class CLIServices:
+    """
+    命令使用的服務，第一次存取時才匯入與建立
+
+    只讀寫查詢歷史的命令 (history、favorite -l、template -l 等) 不載入 LLM 服務、SQLAlchemy 與資料庫連線；
+    其餘屬性 (text_to_sql、execute_sql 等) 轉交給完整的 TextToSQLService，兩者共用同一個歷史紀錄服務。
+    """
+    
+    def __init__(self):
+        self._history_service = None
+        self._text_to_sql = None
+    
+    @property
+    def history_service(self):
+        if self._history_service is None:
+            from .services.history_service import HistoryService
+            self._history_service = HistoryService(use_db=False)  # 與 TextToSQLService 相同，使用 JSON 文件存儲
+        return self._history_service
+    
+    @property
+    def text_to_sql_service(self):
+        if self._text_to_sql is None:
+            from .services.text_to_sql import TextToSQLService
+            self._text_to_sql = TextToSQLService(history_service=self.history_service)
+        return self._text_to_sql
+    
+    def __getattr__(self, name):
+        return getattr(self.text_to_sql_service, name)
+
+
 def format_execution_result(result):
     """格式化執行結果為表格"""
     if not result or not result.get("columns") or not result.get("rows"):
@@ -41,6 +68,7 @@ def format_execution_result(result):
             viz_info += f"圖像保存至: {img_path}\n"
     
     # 使用 tabulate 格式化表格
+    from tabulate import tabulate
     table = tabulate(rows, headers=headers, tablefmt="grid")
     
     # 如果有視覺化數據，添加到輸出中
@@ -50,16 +78,164 @@ def format_execution_result(result):
         return table
 
 
-def print_query_history(service, limit=10):
-    """列印查詢歷史"""
-    history = service.get_history(limit=limit)
+def print_convert_result(result, output_format='text', output_path=None):
+    """
+    輸出轉換結果 (程序內轉換、常駐程序與互動式 shell 共用)
+    
+    Args:
+        result: SQLResult.model_dump(mode="json") 的字典
+        output_format: text 或 json
+        output_path: 寫入的檔案，None 時輸出至終端機
+    """
+    from rich.syntax import Syntax  # 載入 pygments，只在需要語法高亮時匯入
+    
+    execution_result = result.get("execution_result")
+    similar_queries = result.get("similar_queries") or []
+    parameters = result.get("parameters")
+    
+    if output_format == 'json':
+        # JSON 格式輸出
+        output = json.dumps({
+            "sql": result["sql"],
+            "explanation": result["explanation"],
+            "execution_result": execution_result,
+            "query_id": result.get("query_id")
+        }, ensure_ascii=False, indent=2)
+    else:
+        # 文本格式輸出
+        output = f"-- 查詢 ID: {result.get('query_id')}\n\n-- SQL 查詢:\n{result['sql']}\n\n-- 解釋:\n{result['explanation']}"
+        
+        # 如果有相似查詢，添加到輸出
+        if similar_queries:
+            output += "\n\n-- 相似查詢:\n"
+            for i, similar in enumerate(similar_queries):
+                similarity_percent = int(similar["similarity"] * 100)
+                output += f"\n--- 相似查詢 {i+1} (相似度: {similarity_percent}%):\n"
+                output += f"原始查詢: {similar['query']}\n"
+                output += f"SQL: {similar['sql']}\n"
+        
+        # 如果執行了查詢，添加執行結果
+        if execution_result:
+            exec_time = execution_result.get("execution_time", 0)
+            row_count = execution_result.get("row_count", 0)
+            
+            output += f"\n\n-- 執行結果 ({row_count} 行, {exec_time:.2f} ms):\n"
+            if execution_result.get("error"):
+                output += f"錯誤: {execution_result.get('error')}"
+            else:
+                output += format_execution_result(execution_result)
+                
+        # 如果有參數，顯示它們        
+        if parameters:
+            output += f"\n\n-- 參數:\n{json.dumps(parameters, ensure_ascii=False, indent=2)}"
+    
+    # 輸出結果
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as file:
+            file.write(output)
+        console.print(f"[green]結果已寫入 {output_path}[/green]")
+        return
+    
+    # 美化輸出
+    if output_format == 'json':
+        console.print(Syntax(output, "json", theme="monokai", line_numbers=True))
+        return
+    
+    # 語法高亮 SQL
+    console.print("\n[bold cyan]SQL 查詢:[/bold cyan]")
+    console.print(Syntax(result["sql"], "sql", theme="monokai"))
+    
+    console.print("\n[bold green]解釋:[/bold green]")
+    console.print(result["explanation"])
+    
+    # 如果有相似查詢，顯示相似查詢
+    if similar_queries:
+        console.print("\n[bold magenta]相似查詢:[/bold magenta]")
+        
+        for i, similar in enumerate(similar_queries):
+            similarity_percent = int(similar["similarity"] * 100)
+            console.print(f"\n[bold]相似查詢 {i+1} (相似度: {similarity_percent}%):[/bold]")
+            console.print(f"[cyan]原始查詢:[/cyan] {similar['query']}")
+            console.print("\n[cyan]SQL:[/cyan]")
+            console.print(Syntax(similar["sql"], "sql", theme="monokai"))
+    
+    # 如果有參數，顯示它們
+    if parameters:
+        console.print("\n[bold blue]參數:[/bold blue]")
+        console.print(Syntax(json.dumps(parameters, ensure_ascii=False, indent=2), "json", theme="monokai"))
+    
+    # 如果執行了查詢，顯示執行結果
+    if execution_result:
+        exec_time = execution_result.get("execution_time", 0)
+        row_count = execution_result.get("row_count", 0)
+        
+        console.print(f"\n[bold yellow]執行結果 ({row_count} 行, {exec_time:.2f} ms):[/bold yellow]")
+        if execution_result.get("error"):
+            console.print(f"[bold red]錯誤:[/bold red] {execution_result.get('error')}")
+        else:
+            print(format_execution_result(execution_result))
+            
+        # 如果有視覺化圖表，顯示相關信息
+        if "visualization" in execution_result:
+            viz_data = execution_result["visualization"]
+            viz_type = viz_data.get("type", "")
+            img_path = viz_data.get("file_path", "")
+            
+            if viz_type and viz_type != "table" and img_path:
+                console.print(f"\n[bold magenta]視覺化圖表:[/bold magenta]")
+                console.print(f"[green]類型:[/green] {viz_type.upper()}")
+                console.print(f"[green]圖像文件:[/green] {img_path}")
+                console.print("[dim]提示: 使用 'viz' 命令可以自定義圖表類型[/dim]")
+
+
+def print_execute_result(result):
+    """輸出 SQL 執行結果 (QueryResult.to_dict() 的字典)"""
+    if result.get("error"):
+        console.print(f"[bold red]執行錯誤:[/bold red] {result['error']}")
+        plan_check = result.get("plan_check")
+        if plan_check:
+            for hotspot in plan_check["hotspots"]:
+                console.print(f"  - {hotspot}")
+            if plan_check["requires_confirmation"]:
+                console.print("[yellow]確認後可加上 --confirm-cost 重新執行[/yellow]")
+    else:
+        console.print(f"[bold green]執行成功 ({result['row_count']} 行, {result['execution_time']:.2f} ms)[/bold green]")
+        print(format_execution_result(result))
+
+
+def print_query_history(service, limit=10, cursor=None, favorites_only=False):
+    """列印查詢歷史 (游標分頁，最後提示下一頁的指令)"""
+    try:
+        history, next_cursor = service.history_service.get_history_page(
+            limit=limit, cursor=cursor, favorites_only=favorites_only
+        )
+    except ValueError as e:
+        console.print(f"[bold red]錯誤:[/bold red] {str(e)}")
+        sys.exit(1)
     
     if not history:
         console.print("[yellow]沒有查詢歷史記錄[/yellow]")
         return
     
-    # 創建 Rich 表格
-    table = Table(title="查詢歷史")
+    console.print(build_history_table(history, "查詢歷史"))
+    
+    if next_cursor:
+        favorites_flag = " --favorites" if favorites_only else ""
+        console.print(f"[dim]下一頁: text2sql history -l {limit}{favorites_flag} --cursor {next_cursor}[/dim]")
+
+
+def print_history_search(service, text, limit=10):
+    """列印查詢歷史的全文搜尋結果"""
+    history = service.history_service.search_history(text, limit=limit)
+    if not history:
+        console.print(f"[yellow]沒有找到包含 '{text}' 的查詢歷史[/yellow]")
+        return
+    console.print(build_history_table(history, f"查詢歷史搜尋: {text}"))
+
+
+def build_history_table(history, title):
+    """建立查詢歷史的 Rich 表格"""
+    table = Table(title=title)
     table.add_column("ID", style="dim")
     table.add_column("查詢", style="cyan")
     table.add_column("狀態", style="green")
@@ -102,6 +278,214 @@ def print_query_history(service, limit=10):
             date_str
         )
     
+    return table
+
+
+def run_batch_convert(service, args):
+    """批次轉換 JSONL 檔案中的查詢，依完成順序輸出結果"""
+    from .services.batch_service import BatchConverter, parse_batch_lines
+    
+    try:
+        with open(args.batch, 'r', encoding='utf-8') as file:
+            queries = parse_batch_lines(file)
+    except Exception as e:
+        logger.error(f"無法讀取批次檔案: {e}")
+        console.print(f"[bold red]錯誤:[/bold red] {str(e)}")
+        sys.exit(1)
+    
+    if not queries:
+        console.print("[yellow]批次檔案中沒有查詢[/yellow]")
+        return
+    
+    converter = BatchConverter(service.text_to_sql_service, max_concurrency=args.concurrency)
+    output_file = open(args.output, 'w', encoding='utf-8') if args.output else None
+    
+    try:
+        for item in converter.convert(
+            queries,
+            execute=args.execute,
+            find_similar=not args.no_similar,
+            model_name=args.model
+        ):
+            # JSON 輸出或寫入檔案時，每個結果一行 (JSONL)
+            if output_file or args.format == 'json':
+                line = json.dumps(item.model_dump(mode="json"), ensure_ascii=False, default=str)
+                if output_file:
+                    output_file.write(line + "\n")
+                    output_file.flush()
+                else:
+                    print(line, flush=True)
+                continue
+            
+            status = "[red]✗[/red]" if item.error or not item.result or item.result.sql.startswith("--") else "[green]✓[/green]"
+            duplicate = f" [dim](同 #{item.duplicate_of})[/dim]" if item.duplicate_of is not None else ""
+            sql = item.error or (item.result.sql if item.result else "")
+            console.print(f"{status} #{item.index} {item.query[:40]}{duplicate} [dim]{item.latency_ms:.0f} ms[/dim]")
+            console.print(f"    {sql}", markup=False)
+    finally:
+        if output_file:
+            output_file.close()
+    
+    summary = converter.summary
+    console.print(
+        f"\n[bold]批次完成:[/bold] {summary.total} 個查詢 (去重後 {summary.unique} 個)，"
+        f"[green]{summary.succeeded} 成功[/green]，[red]{summary.failed} 失敗[/red]，"
+        f"並發 {summary.concurrency}，耗時 {summary.elapsed_seconds:.2f} 秒，"
+        f"吞吐量 {summary.throughput_qps:.2f} 查詢/秒"
+    )
+    if args.output:
+        console.print(f"[green]結果已寫入 {args.output}[/green]")
+
+
+def forward_to_daemon(args):
+    """
+    設定 CLI_DAEMON_SOCKET 時將 convert / execute 轉交常駐程序，無法連接時改由本程序執行
+    
+    Returns:
+        是否已由常駐程序處理
+    """
+    if not os.getenv("CLI_DAEMON_SOCKET") or getattr(args, 'batch', None):
+        return False
+    from .daemon import DaemonUnavailable, default_socket_path, send_request
+    
+    # 讀取檔案中的查詢或 SQL
+    text = args.query if args.command == 'convert' else args.sql
+    if args.file:
+        try:
+            with open(args.file, 'r', encoding='utf-8') as file:
+                text = file.read().strip()
+        except OSError:
+            return False  # 由本程序輸出錯誤
+    if not text:
+        return False
+    
+    if args.command == 'convert':
+        payload = {
+            "command": "convert",
+            "query": text,
+            "session_id": getattr(args, 'session', None),
+            "execute": args.execute,
+            "find_similar": not getattr(args, 'no_similar', False),
+            "model": getattr(args, 'model', None),
+            "confirm_cost": getattr(args, 'confirm_cost', False),
+        }
+    else:
+        payload = {"command": "execute", "sql": text, "confirm_cost": args.confirm_cost}
+    
+    if payload.get("session_id"):
+        console.print(f"[cyan]使用會話ID: {payload['session_id']}[/cyan]")
+    
+    try:
+        response = send_request(default_socket_path(), payload)
+    except DaemonUnavailable as e:
+        logger.warning(f"無法連接常駐程序 ({e})，改由本程序執行")
+        return False
+    
+    if not response.get("ok"):
+        console.print(f"[bold red]錯誤:[/bold red] {response.get('error')}")
+        sys.exit(1)
+    if args.command == 'convert':
+        print_convert_result(response["result"], args.format, args.output)
+    else:
+        print_execute_result(response["result"])
+    return True
+
+
+def run_daemon_command(args):
+    """啟動、檢查或停止常駐程序"""
+    from .daemon import DaemonUnavailable, default_socket_path, send_request, serve
+    socket_path = args.socket or default_socket_path()
+    
+    if args.status or args.stop:
+        try:
+            response = send_request(socket_path, {"command": "stop" if args.stop else "ping"}, timeout=5)
+        except DaemonUnavailable:
+            console.print(f"[yellow]常駐程序未在 {socket_path} 執行[/yellow]")
+            sys.exit(1)
+        action = "已停止" if args.stop else "執行中"
+        console.print(f"[green]常駐程序{action} (PID {response['result']['pid']}, {socket_path})[/green]")
+        return
+    
+    from .services.token_meter import set_usage_labels
+    set_usage_labels(endpoint="cli:daemon")
+    
+    console.print(f"[cyan]常駐程序監聽 {socket_path}，CLI 設定 CLI_DAEMON_SOCKET={socket_path} 後轉交處理 (Ctrl-C 停止)[/cyan]")
+    try:
+        serve(socket_path, CLIServices())
+    except RuntimeError as e:
+        console.print(f"[bold red]錯誤:[/bold red] {str(e)}")
+        sys.exit(1)
+
+
+def run_history_transfer(service, args):
+    """串流匯出或匯入查詢歷史與模板 (JSONL / Parquet)"""
+    from .services.history_transfer import export_table, import_table
+    
+    if args.action == 'export':
+        source, target = ("資料庫" if args.backend == 'db' else "JSON 文件"), args.path
+    else:
+        source, target = args.path, ("資料庫" if args.backend == 'db' else "JSON 文件")
+    console.print(f"[cyan]{args.table}: {source} → {target}[/cyan]")
+    
+    transfer = export_table if args.action == 'export' else import_table
+    try:
+        with console.status("處理中...") as status:
+            summary = transfer(
+                service.history_service, args.table, args.path,
+                backend=args.backend,
+                fmt=args.format,
+                chunk_size=args.chunk_size,
+                database_url=args.database_url,
+                progress=lambda progress: status.update(f"已處理 {progress.read} 筆 ({progress.records_per_second:.0f} 筆/秒)")
+            )
+    except Exception as e:
+        from rich.markup import escape
+        logger.error(f"{'匯出' if args.action == 'export' else '匯入'}查詢歷史失敗: {e}")
+        console.print(f"[bold red]錯誤:[/bold red] {escape(str(e))}")
+        sys.exit(1)
+    
+    console.print(
+        f"[green]完成: 讀取 {summary.read} 筆，寫入 {summary.written} 筆，略過 {summary.skipped} 筆 (ID 已存在)，"
+        f"耗時 {summary.elapsed_seconds:.1f} 秒 ({summary.records_per_second:.0f} 筆/秒)[/green]"
+    )
+
+
+def print_token_usage(args):
+    """列印 token 用量彙總"""
+    from .services.token_meter import TokenMeter
+    from .utils import settings
+    
+    log_file = args.file or settings.token_usage_file
+    if not log_file:
+        console.print("[yellow]未設定 token 用量記錄檔案，請設定 TOKEN_USAGE_FILE 或使用 --file 指定[/yellow]")
+        return
+    if not os.path.exists(log_file):
+        console.print(f"[yellow]找不到 token 用量記錄檔案: {log_file}[/yellow]")
+        return
+    
+    summary = TokenMeter.from_log(log_file).get_summary(args.by)
+    groups = sorted(summary[f"by_{args.by}"].items(), key=lambda item: item[1]["total_tokens"], reverse=True)
+    
+    table = Table(title=f"Token 用量 (依 {args.by})")
+    table.add_column(args.by, style="cyan")
+    table.add_column("呼叫次數", justify="right")
+    table.add_column("輸入", justify="right")
+    table.add_column("輸出", justify="right")
+    table.add_column("總計", justify="right", style="green")
+    table.add_column("估算次數", justify="right", style="dim")
+    table.add_column("費用 (USD)", justify="right", style="yellow")
+    
+    for name, totals in groups[:args.limit] + [("總計", summary["total"])]:
+        table.add_row(
+            str(name),
+            str(totals["calls"]),
+            str(totals["prompt_tokens"]),
+            str(totals["completion_tokens"]),
+            str(totals["total_tokens"]),
+            str(totals["estimated_calls"]),
+            f"{totals['cost']:.4f}"
+        )
+    
     console.print(table)
 
 
@@ -120,21 +504,36 @@ def main():
     convert_parser.add_argument('-m', '--model', type=str, help='使用的語言模型')
     convert_parser.add_argument('--no-similar', action='store_true', help='禁用相似查詢推薦')
     convert_parser.add_argument('-s', '--session', type=str, help='對話會話ID，用於維持對話上下文')
+    convert_parser.add_argument('--batch', type=str, help='批次轉換 JSONL 檔案中的多個查詢 (每行一個查詢)')
+    convert_parser.add_argument('--concurrency', type=int, help='批次轉換的並發數')
+    convert_parser.add_argument('--confirm-cost', action='store_true', help='確認執行預估成本超出上限的查詢')
     
     # 歷史命令
     history_parser = subparsers.add_parser('history', help='查看查詢歷史')
     history_parser.add_argument('-l', '--limit', type=int, default=10, help='顯示數量限制')
+    history_parser.add_argument('--cursor', type=str, help='從上一頁提示的游標繼續顯示')
+    history_parser.add_argument('--favorites', action='store_true', help='只顯示收藏的查詢')
+    history_parser.add_argument('--search', type=str, help='全文搜尋查詢與 SQL (顯示最相關的結果)')
+    history_parser.add_argument('action', nargs='?', choices=['export', 'import'], help='匯出或匯入查詢歷史與模板')
+    history_parser.add_argument('path', nargs='?', help='匯出或匯入的檔案 (.jsonl 或 .parquet)')
+    history_parser.add_argument('--table', choices=['query_history', 'query_templates'], default='query_history', help='匯出或匯入的資料表')
+    history_parser.add_argument('--backend', choices=['file', 'db'], default='file', help='查詢歷史存儲: file (JSON 文件) 或 db (資料庫)')
+    history_parser.add_argument('--format', choices=['jsonl', 'parquet'], help='檔案格式 (預設依副檔名判斷)')
+    history_parser.add_argument('--chunk-size', type=int, default=10000, help='每個區塊的筆數')
+    history_parser.add_argument('--database-url', type=str, help='覆寫資料庫連接 URL')
     
     # 執行命令
     execute_parser = subparsers.add_parser('execute', help='執行 SQL 查詢')
     execute_parser.add_argument('sql', type=str, nargs='?', help='要執行的 SQL 查詢')
     execute_parser.add_argument('-f', '--file', type=str, help='包含 SQL 的檔案')
+    execute_parser.add_argument('--confirm-cost', action='store_true', help='確認執行預估成本超出上限的查詢')
     
     # 模型命令
     models_parser = subparsers.add_parser('models', help='查看和管理語言模型')
     models_parser.add_argument('-l', '--list', action='store_true', help='列出所有可用模型')
     models_parser.add_argument('-s', '--set-default', type=str, help='設置默認模型')
     models_parser.add_argument('-p', '--performance', action='store_true', help='顯示模型性能統計')
+    models_parser.add_argument('--limits', action='store_true', help='顯示並發與速率限制統計')
     
     # 向量存儲命令
     vector_parser = subparsers.add_parser('vector', help='管理向量存儲')
@@ -175,6 +574,37 @@ def main():
     template_parser.add_argument('-s', '--show', type=str, help='顯示特定模板的詳細信息 (指定模板ID)')
     template_parser.add_argument('-u', '--use', type=str, help='使用模板執行查詢 (指定模板ID)')
     template_parser.add_argument('--delete', type=str, help='刪除模板 (指定模板ID)')
+    template_parser.add_argument('--search', type=str, help='搜尋模板名稱、描述、問題與 SQL (用於列出)')
+    
+    # Token 用量命令
+    tokens_parser = subparsers.add_parser('tokens', help='查看 token 用量與費用')
+    tokens_parser.add_argument('-f', '--file', type=str, help='token 用量記錄檔案 (預設使用 TOKEN_USAGE_FILE)')
+    tokens_parser.add_argument('-b', '--by', choices=['model', 'endpoint', 'session', 'stage'], default='model', help='彙總維度')
+    tokens_parser.add_argument('-l', '--limit', type=int, default=20, help='顯示數量限制')
+    
+    # 基準測試命令
+    bench_parser = subparsers.add_parser('bench', help='重放語料以量測各階段延遲與準確率')
+    bench_parser.add_argument('corpus', type=str, nargs='?', default='benchmarks/corpus.jsonl', help='JSONL 語料檔案 (query / expected_sql)')
+    bench_parser.add_argument('-m', '--model', type=str, help='使用真實的語言模型 (預設使用離線模擬提供者)')
+    bench_parser.add_argument('--llm-latency-ms', type=float, default=0.0, help='模擬提供者的回應延遲 (毫秒)')
+    bench_parser.add_argument('-e', '--execute', action='store_true', help='執行生成的 SQL 並與預期結果比對')
+    bench_parser.add_argument('-r', '--repeat', type=int, default=1, help='重複執行語料的次數')
+    bench_parser.add_argument('--database-url', type=str, help='覆寫資料庫連接 URL')
+    bench_parser.add_argument('--setup-db', action='store_true', help='在資料庫中建立資料表、函數並載入種子資料 (會刪除既有資料表)')
+    bench_parser.add_argument('--seed', type=str, default='benchmarks/seed.sql', help='種子資料 SQL 檔案')
+    bench_parser.add_argument('-o', '--output', type=str, help='將報告寫入 JSON 檔案')
+    
+    # 互動式 shell
+    shell_parser = subparsers.add_parser('shell', help='互動式 shell (服務只載入一次，連續轉換多個問題)')
+    shell_parser.add_argument('-s', '--session', type=str, help='對話會話ID (預設建立新的會話)')
+    shell_parser.add_argument('-m', '--model', type=str, help='使用的語言模型')
+    shell_parser.add_argument('-e', '--execute', action='store_true', help='執行生成的 SQL')
+    
+    # 常駐程序
+    daemon_parser = subparsers.add_parser('daemon', help='啟動常駐程序，設定 CLI_DAEMON_SOCKET 後 convert / execute 轉交常駐程序處理')
+    daemon_parser.add_argument('--socket', type=str, help='socket 路徑 (預設 CLI_DAEMON_SOCKET 或暫存目錄)')
+    daemon_parser.add_argument('--status', action='store_true', help='檢查常駐程序是否在執行')
+    daemon_parser.add_argument('--stop', action='store_true', help='停止常駐程序')
     
     # 解析參數
     args = parser.parse_args()
@@ -188,23 +618,60 @@ def main():
             args.output = None
             args.execute = False
             args.format = 'text'
+            args.batch = None
         else:
             parser.print_help()
             sys.exit(1)
     
-    # 初始化服務
-    service = TextToSQLService()
+    # 常駐程序在執行時轉交處理，本程序不載入服務
+    if args.command in ('convert', 'execute') and forward_to_daemon(args):
+        return
+    
+    if args.command == 'daemon':
+        run_daemon_command(args)
+        return
+    
+    # 標記此程序產生的 token 用量來源
+    from .services.token_meter import set_usage_labels
+    set_usage_labels(endpoint=f"cli:{args.command}")
+    
+    if args.command == 'tokens':
+        print_token_usage(args)
+        return
+    
+    # 基準測試自行建立服務 (可能需要先覆寫資料庫設定)
+    if args.command == 'bench':
+        from .bench import run_bench_command
+        try:
+            run_bench_command(args, console)
+        except Exception as e:
+            console.print(f"[red]基準測試失敗: {e}[/red]")
+            sys.exit(1)
+        return
     
-    # 確保服務使用全局 conversation_manager
-    service.conversation_manager = conversation_manager
+    # 初始化服務 (各命令第一次使用時才建立)
+    service = CLIServices()
     
     # 執行對應的命令
     if args.command == 'convert':
         # 檢查是否有查詢
-        if not args.query and not args.file:
+        if not args.query and not args.file and not getattr(args, 'batch', None):
             convert_parser.print_help()
             sys.exit(1)
         
+        # 檢查模型是否存在
+        from .utils import settings
+        if getattr(args, 'model', None) and args.model not in settings.models:
+            available_models = list(settings.models.keys())
+            console.print(f"[bold red]錯誤: 未知的模型 '{args.model}'[/bold red]")
+            console.print(f"可用模型: {', '.join(available_models)}")
+            sys.exit(1)
+        
+        # 批次轉換
+        if getattr(args, 'batch', None):
+            run_batch_convert(service, args)
+            return
+        
         # 獲取查詢
         query = args.query
         if args.file:
@@ -216,21 +683,6 @@ def main():
                 sys.exit(1)
         
         try:
-            # 轉換查詢
-            # 如果指定了模型，設置默認模型
-            from .utils import settings
-            original_default = settings.default_model
-            
-            if hasattr(args, 'model') and args.model:
-                # 檢查模型是否存在
-                if args.model not in settings.models:
-                    available_models = list(settings.models.keys())
-                    console.print(f"[bold red]錯誤: 未知的模型 '{args.model}'[/bold red]")
-                    console.print(f"可用模型: {', '.join(available_models)}")
-                    sys.exit(1)
-                
-                settings.default_model = args.model
-                
             # 判斷是否啟用相似查詢推薦
             find_similar = not getattr(args, 'no_similar', False)
             
@@ -243,114 +695,33 @@ def main():
                 query=query, 
                 session_id=session_id,
                 execute=args.execute,
-                find_similar=find_similar
+                find_similar=find_similar,
+                model_name=getattr(args, 'model', None),
+                confirm_cost=args.confirm_cost
             )
             
-            # 恢復默認模型
-            if hasattr(args, 'model') and args.model:
-                settings.default_model = original_default
-            
-            # 處理輸出
-            if args.format == 'json':
-                # JSON 格式輸出
-                output = json.dumps({
-                    "sql": result.sql,
-                    "explanation": result.explanation,
-                    "execution_result": result.execution_result,
-                    "query_id": result.query_id
-                }, ensure_ascii=False, indent=2)
-            else:
-                # 文本格式輸出
-                output = f"-- 查詢 ID: {result.query_id}\n\n-- SQL 查詢:\n{result.sql}\n\n-- 解釋:\n{result.explanation}"
-                
-                # 如果有相似查詢，添加到輸出
-                if result.similar_queries:
-                    output += "\n\n-- 相似查詢:\n"
-                    for i, similar in enumerate(result.similar_queries):
-                        similarity_percent = int(similar.similarity * 100)
-                        output += f"\n--- 相似查詢 {i+1} (相似度: {similarity_percent}%):\n"
-                        output += f"原始查詢: {similar.query}\n"
-                        output += f"SQL: {similar.sql}\n"
-                
-                # 如果執行了查詢，添加執行結果
-                if result.execution_result:
-                    exec_time = result.execution_result.get("execution_time", 0)
-                    row_count = result.execution_result.get("row_count", 0)
-                    
-                    output += f"\n\n-- 執行結果 ({row_count} 行, {exec_time:.2f} ms):\n"
-                    if result.execution_result.get("error"):
-                        output += f"錯誤: {result.execution_result.get('error')}"
-                    else:
-                        output += format_execution_result(result.execution_result)
-                        
-                # 如果有參數，顯示它們        
-                if result.parameters:
-                    output += f"\n\n-- 參數:\n{json.dumps(result.parameters, ensure_ascii=False, indent=2)}"
-            
-            # 輸出結果
-            if args.output:
-                with open(args.output, 'w', encoding='utf-8') as file:
-                    file.write(output)
-                console.print(f"[green]結果已寫入 {args.output}[/green]")
-            else:
-                # 美化輸出
-                if args.format == 'json':
-                    console.print(Syntax(output, "json", theme="monokai", line_numbers=True))
-                else:
-                    # 語法高亮 SQL
-                    console.print("\n[bold cyan]SQL 查詢:[/bold cyan]")
-                    console.print(Syntax(result.sql, "sql", theme="monokai"))
-                    
-                    console.print("\n[bold green]解釋:[/bold green]")
-                    console.print(result.explanation)
-                    
-                    # 如果有相似查詢，顯示相似查詢
-                    if result.similar_queries:
-                        console.print("\n[bold magenta]相似查詢:[/bold magenta]")
-                        
-                        for i, similar in enumerate(result.similar_queries):
-                            similarity_percent = int(similar.similarity * 100)
-                            console.print(f"\n[bold]相似查詢 {i+1} (相似度: {similarity_percent}%):[/bold]")
-                            console.print(f"[cyan]原始查詢:[/cyan] {similar.query}")
-                            console.print("\n[cyan]SQL:[/cyan]")
-                            console.print(Syntax(similar.sql, "sql", theme="monokai"))
-                    
-                    # 如果有參數，顯示它們
-                    if result.parameters:
-                        console.print("\n[bold blue]參數:[/bold blue]")
-                        console.print(Syntax(json.dumps(result.parameters, ensure_ascii=False, indent=2), "json", theme="monokai"))
-                    
-                    # 如果執行了查詢，顯示執行結果
-                    if result.execution_result:
-                        exec_time = result.execution_result.get("execution_time", 0)
-                        row_count = result.execution_result.get("row_count", 0)
-                        
-                        console.print(f"\n[bold yellow]執行結果 ({row_count} 行, {exec_time:.2f} ms):[/bold yellow]")
-                        if result.execution_result.get("error"):
-                            console.print(f"[bold red]錯誤:[/bold red] {result.execution_result.get('error')}")
-                        else:
-                            print(format_execution_result(result.execution_result))
-                            
-                        # 如果有視覺化圖表，顯示相關信息
-                        if "visualization" in result.execution_result:
-                            viz_data = result.execution_result["visualization"]
-                            viz_type = viz_data.get("type", "")
-                            img_path = viz_data.get("file_path", "")
-                            
-                            if viz_type and viz_type != "table" and img_path:
-                                console.print(f"\n[bold magenta]視覺化圖表:[/bold magenta]")
-                                console.print(f"[green]類型:[/green] {viz_type.upper()}")
-                                console.print(f"[green]圖像文件:[/green] {img_path}")
-                                console.print("[dim]提示: 使用 'viz' 命令可以自定義圖表類型[/dim]")
+            print_convert_result(result.model_dump(mode="json"), args.format, args.output)
             
         except Exception as e:
             logger.error(f"轉換查詢時發生錯誤: {e}")
             console.print(f"[bold red]錯誤:[/bold red] {str(e)}")
             sys.exit(1)
     
+    elif args.command == 'shell':
+        from .shell import run_shell
+        run_shell(service, args, console)
+    
     elif args.command == 'history':
-        # 顯示查詢歷史
-        print_query_history(service, args.limit)
+        # 匯出、匯入、搜尋或顯示查詢歷史
+        if args.action:
+            if not args.path:
+                history_parser.print_help()
+                sys.exit(1)
+            run_history_transfer(service, args)
+        elif args.search:
+            print_history_search(service, args.search, args.limit)
+        else:
+            print_query_history(service, args.limit, cursor=args.cursor, favorites_only=args.favorites)
     
     elif args.command == 'execute':
         # 檢查是否有 SQL
@@ -370,14 +741,9 @@ def main():
         
         try:
             # 執行查詢
-            result = service.execute_sql(sql)
+            result = service.execute_sql(sql, confirmed=args.confirm_cost)
             
-            # 輸出結果
-            if result.error:
-                console.print(f"[bold red]執行錯誤:[/bold red] {result.error}")
-            else:
-                console.print(f"[bold green]執行成功 ({result.row_count} 行, {result.execution_time:.2f} ms)[/bold green]")
-                print(format_execution_result(result.to_dict()))
+            print_execute_result(result.to_dict())
         
         except Exception as e:
             logger.error(f"執行查詢時發生錯誤: {e}")
@@ -434,6 +800,32 @@ def main():
             
             console.print(table)
         
+        # 顯示並發與速率限制統計
+        elif args.limits:
+            stats = llm_service.get_rate_limit_stats()
+            
+            # 創建表格
+            table = Table(title="並發與速率限制")
+            table.add_column("對象", style="cyan")
+            table.add_column("進行中", style="green")
+            table.add_column("排隊深度", style="yellow")
+            table.add_column("平均等待 (ms)", style="magenta")
+            table.add_column("P95 等待 (ms)", style="magenta")
+            table.add_column("逾時次數", style="red")
+            
+            for scope, label in (("providers", "提供者"), ("models", "模型")):
+                for name, item in stats.get(scope, {}).items():
+                    table.add_row(
+                        f"{label}: {name}",
+                        str(item["in_flight"]),
+                        f"{item['queue_depth']} (最高 {item['max_queue_depth']})",
+                        f"{item['avg_wait_ms']:.1f}",
+                        f"{item['p95_wait_ms']:.1f}",
+                        str(item["total_timeouts"])
+                    )
+            
+            console.print(table)
+        
         # 設置默認模型
         elif args.set_default:
             model_name = args.set_default
@@ -471,6 +863,8 @@ def main():
                 sys.exit(1)
         
         try:
+            from .services.visualization_service import visualization_service
+            
             # 準備可視化服務並設置輸出目錄
             if args.output:
                 visualization_service.output_dir = args.output
@@ -478,7 +872,6 @@ def main():
                 console.print(f"[cyan]將視覺化輸出至: {args.output}[/cyan]")
             
             # 執行查詢
-            service = TextToSQLService()
             result = service.execute_sql(sql)
             
             if result.error:
@@ -526,7 +919,7 @@ def main():
             sys.exit(1)
             
     elif args.command == 'conversation':
-        from .services import conversation_manager
+        from .services.conversation_service import conversation_manager
         
         # 列出所有活躍對話
         if args.list:
@@ -543,7 +936,9 @@ def main():
             table.add_column("最後更新", style="magenta")
             
             for conv_id in conversations:
-                context = conversation_manager.get_or_create_conversation(conv_id)
+                context = conversation_manager.get_conversation(conv_id)
+                if context is None:
+                    continue
                 
                 # 格式化日期
                 last_updated = context.last_updated.strftime("%Y-%m-%d %H:%M:%S") if context.last_updated else "未知"
@@ -613,6 +1008,7 @@ def main():
             conversation_parser.print_help()
     
     elif args.command == 'vector':
+        from rich.syntax import Syntax
         from .services import vector_store
         
         # 顯示統計信息
@@ -659,9 +1055,6 @@ def main():
             vector_parser.print_help()
             
     elif args.command == 'favorite':
-        from .services import TextToSQLService
-        service = TextToSQLService()
-        
         # 列出收藏的查詢
         if args.list:
             try:
@@ -769,9 +1162,7 @@ def main():
             fav_parser.print_help()
             
     elif args.command == 'template':
-        from .services import TextToSQLService
-        service = TextToSQLService()
-        
+        from rich.syntax import Syntax
         # 列出所有模板
         if args.list:
             try:
@@ -780,10 +1171,12 @@ def main():
                 if args.tags:
                     tag = args.tags.split(',')[0].strip()  # 只使用第一個標籤進行過濾
                 
-                templates = service.history_service.get_templates(tag=tag)
+                templates = service.history_service.get_templates(tag=tag, search=args.search)
                 
                 if not templates:
-                    if tag:
+                    if args.search:
+                        console.print(f"[yellow]沒有找到包含 '{args.search}' 的模板[/yellow]")
+                    elif tag:
                         console.print(f"[yellow]沒有找到標籤為 '{tag}' 的模板[/yellow]")
                     else:
                         console.print("[yellow]沒有查詢模板[/yellow]")
@@ -793,6 +1186,8 @@ def main():
                 title_text = "查詢模板"
                 if tag:
                     title_text += f" (標籤: {tag})"
+                if args.search:
+                    title_text += f" (搜尋: {args.search})"
                     
                 table = Table(title=title_text)
                 table.add_column("ID", style="dim")
@@ -0,0 +1,191 @@
+"""
+CLI 常駐程序
+
+在背景保留一個已載入的 TextToSQLService (LLM 服務、schema 目錄、模板比對與資料庫連線池)，
+以 Unix socket 接收 convert / execute 請求。設定 CLI_DAEMON_SOCKET 後，CLI 會先嘗試轉交常駐程序，
+在迴圈中逐一轉換問題的腳本只需付出一次啟動成本。
+
+協定為每行一個 JSON 物件 (同一連線可連續送出多個請求):
+    請求: {"command": "convert" | "execute" | "ping" | "stop", ...}
+    回應: {"ok": true, "result": {...}} 或 {"ok": false, "error": "..."}
+
+本模組在 CLI 轉交時匯入，頂層只使用標準函式庫；服務由呼叫端建立後傳入 serve()。
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+
+def default_socket_path() -> str:
+    """常駐程序的 socket 路徑: CLI_DAEMON_SOCKET，未設定時使用暫存目錄下的使用者專屬檔案"""
+    return os.getenv("CLI_DAEMON_SOCKET") or os.path.join(tempfile.gettempdir(), f"text2sql-{os.getuid()}.sock")
+
+
+class DaemonUnavailable(Exception):
+    """無法連接常駐程序 (未啟動、socket 已失效或連線中斷)"""
+
+
+def send_request(socket_path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    傳送一個請求給常駐程序並等待回應
+
+    Args:
+        socket_path: 常駐程序的 socket 路徑
+        payload: 請求內容
+        timeout: 等待秒數，None 表示等到 LLM 回應為止
+
+    Returns:
+        常駐程序的回應
+
+    Raises:
+        DaemonUnavailable: 無法連接或連線中斷
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as reader:
+                line = reader.readline()
+    except OSError as e:
+        raise DaemonUnavailable(str(e)) from e
+    if not line:
+        raise DaemonUnavailable("常駐程序未返回回應即關閉連線")
+    return json.loads(line)
+
+
+def handle_request(service, request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    執行一個請求
+
+    Args:
+        service: 已建立的 TextToSQLService
+        request: 請求內容
+
+    Returns:
+        回應內容
+    """
+    from .services.token_meter import usage_context
+    from .utils import settings
+
+    command = request.get("command")
+    if command == "ping":
+        return {"ok": True, "result": {"pid": os.getpid()}}
+
+    with usage_context(endpoint=f"daemon:{command}", session=request.get("session_id")):
+        if command == "convert":
+            model_name = request.get("model")
+            if model_name and model_name not in settings.models:
+                return {"ok": False, "error": f"未知的模型 '{model_name}'，可用模型: {', '.join(settings.models)}"}
+            result = service.text_to_sql(
+                query=request["query"],
+                session_id=request.get("session_id"),
+                execute=bool(request.get("execute")),
+                find_similar=request.get("find_similar", True),
+                model_name=model_name,
+                confirm_cost=bool(request.get("confirm_cost"))
+            )
+            return {"ok": True, "result": result.model_dump(mode="json")}
+
+        if command == "execute":
+            result = service.execute_sql(request["sql"], confirmed=bool(request.get("confirm_cost")))
+            return {"ok": True, "result": result.to_dict()}
+
+    return {"ok": False, "error": f"不支援的命令: {command}"}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """逐行讀取請求，依序寫回回應"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if request.get("command") == "stop":
+                    response = {"ok": True, "result": {"pid": os.getpid()}}
+                    # shutdown() 會等待 serve_forever 結束，不能在處理請求的執行緒中直接呼叫
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                else:
+                    response = handle_request(self.server.service, request)
+            except Exception as e:
+                logger.error(f"處理常駐程序請求時發生錯誤: {e}")
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """每個連線一個執行緒，共用同一個 TextToSQLService"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service):
+        _remove_stale_socket(socket_path)
+        self.service = service
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o600)  # 只允許同一使用者連線
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    """移除上次未正常結束留下的 socket 檔案；已有常駐程序在監聽時拋出錯誤"""
+    if not os.path.exists(socket_path):
+        return
+    try:
+        send_request(socket_path, {"command": "ping"}, timeout=2)
+    except DaemonUnavailable:
+        os.unlink(socket_path)
+        return
+    raise RuntimeError(f"已有常駐程序在 {socket_path} 監聽")
+
+
+def warm_up(service) -> None:
+    """預先載入 schema 目錄、模板與資料庫連線池，第一個請求不需等待初始化"""
+    from .schema import get_catalog
+    from .utils import settings
+
+    text_to_sql = service.text_to_sql_service
+    get_catalog()
+    text_to_sql.db_service.is_connected()
+    if settings.template_match_enabled:
+        text_to_sql.template_matcher.preload()
+
+
+def serve(socket_path: str, service) -> None:
+    """
+    啟動常駐程序並處理請求，直到收到 SIGTERM / SIGINT 或 stop 請求
+
+    Args:
+        socket_path: 監聽的 socket 路徑
+        service: CLIServices，轉換與執行使用其中的 TextToSQLService
+    """
+    server = DaemonServer(socket_path, service.text_to_sql_service)
+    # 預熱完成前的連線在 socket 佇列中等待
+    warm_up(service)
+
+    def _stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    logger.info(f"常駐程序已啟動 (PID {os.getpid()})，監聽 {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # 寫完背景佇列中的查詢歷史
+        service.history_service.close()
+        logger.info("常駐程序已停止")
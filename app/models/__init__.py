@@ -1,29 +1,49 @@
-from .base import BaseDBModel
-from .businesses import BusinessModel
-from .users import UserModel, UserRole
-from .services import ServiceModel
-from .time_periods import TimePeriodModel, WeekDay
-from .bookings import BookingModel, BookingStatus, BookingHistoryModel
-from .query_history import QueryHistoryModel, QueryTemplateModel
-from .staff_services import StaffServiceModel
-from .staff_availability import StaffAvailabilityModel, AvailabilityType
-from .service_period_restrictions import ServicePeriodRestrictionModel
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = [
-    "BaseDBModel",
-    "BusinessModel",
-    "UserModel",
-    "UserRole",
-    "ServiceModel",
-    "TimePeriodModel",
-    "WeekDay",
-    "BookingModel",
-    "BookingStatus",
-    "BookingHistoryModel",
-    "QueryHistoryModel",
-    "QueryTemplateModel",
-    "StaffServiceModel",
-    "StaffAvailabilityModel",
-    "AvailabilityType",
-    "ServicePeriodRestrictionModel"
-]
\ No newline at end of file
+# 名稱 -> 所在模組；第一次存取時才匯入 (PEP 562)，只用到查詢歷史模型時不載入其他資料表模型
+_EXPORTS = {
+    "BaseDBModel": "base",
+    "BusinessModel": "businesses",
+    "UserModel": "users",
+    "UserRole": "users",
+    "ServiceModel": "services",
+    "TimePeriodModel": "time_periods",
+    "WeekDay": "time_periods",
+    "BookingModel": "bookings",
+    "BookingStatus": "bookings",
+    "BookingHistoryModel": "bookings",
+    "QueryHistoryModel": "query_history",
+    "QueryTemplateModel": "query_history",
+    "StaffServiceModel": "staff_services",
+    "StaffAvailabilityModel": "staff_availability",
+    "AvailabilityType": "staff_availability",
+    "ServicePeriodRestrictionModel": "service_period_restrictions",
+}
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .base import BaseDBModel
+    from .businesses import BusinessModel
+    from .users import UserModel, UserRole
+    from .services import ServiceModel
+    from .time_periods import TimePeriodModel, WeekDay
+    from .bookings import BookingModel, BookingStatus, BookingHistoryModel
+    from .query_history import QueryHistoryModel, QueryTemplateModel
+    from .staff_services import StaffServiceModel
+    from .staff_availability import StaffAvailabilityModel, AvailabilityType
+    from .service_period_restrictions import ServicePeriodRestrictionModel
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value  # 之後直接從模組字典取得
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -12,4 +12,6 @@ class BaseDBModel(BaseModel):
     updated_at: Optional[datetime] = Field(default=None, description="更新時間")
     
     class Config:
-        from_attributes = True  # 允許從ORM模型建立
\ No newline at end of file
+        from_attributes = True  # 允許從ORM模型建立
+        # 第一次驗證時才建立驗證器：只用到部分模型的命令 (例如 text2sql history) 不需建立所有模型的 schema
+        defer_build = True
\ No newline at end of file
@@ -1,3 +1,26 @@
-from .schema import get_table_schema_description, schema_definitions, db_functions
+from .schema import (
+    get_table_schema_description,
+    get_schema_fragments,
+    build_schema_description
+)
+from .catalog import SchemaCatalog, get_catalog, reload_catalog
 
-__all__ = ["get_table_schema_description", "schema_definitions", "db_functions"]
\ No newline at end of file
+
+def __getattr__(name):
+    # schema_definitions 與 db_functions 在第一次存取時才載入目錄
+    if name in ("schema_definitions", "db_functions"):
+        from . import schema
+        return getattr(schema, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = [
+    "get_table_schema_description",
+    "get_schema_fragments",
+    "build_schema_description",
+    "schema_definitions",
+    "db_functions",
+    "SchemaCatalog",
+    "get_catalog",
+    "reload_catalog"
+]
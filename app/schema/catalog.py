@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 快取格式版本，解析或片段格式變更時遞增以使舊快取失效
+CATALOG_VERSION = 1
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+SCHEMA_DIR = os.path.join(PROJECT_ROOT, 'n8n_booking_schemas')
+FUNCTION_DIR = os.path.join(PROJECT_ROOT, 'database_function')
+DEFAULT_CACHE_FILE = os.path.join(PROJECT_ROOT, '.cache', 'schema_catalog.json')
+
+_IDENTIFIER_PATTERN = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+_WRITE_PATTERN = re.compile(r"\b(INSERT\s+INTO|UPDATE\s+\w+\s+SET|DELETE\s+FROM|TRUNCATE)\b", re.IGNORECASE)
+
+
+def _list_sql_files(directory: str) -> List[str]:
+    """列出目錄中的 SQL 檔案 (依檔名排序)"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.sql')
+    )
+
+
+def _file_hash(path: str) -> str:
+    """計算檔案內容的 SHA-256"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class SchemaCatalog:
+    """
+    資料表與資料庫函數目錄
+
+    解析 n8n_booking_schemas 與 database_function 一次，預先建立提示詞片段、完整 schema 描述
+    以及資料表 / 欄位 / 函數的記憶體索引。解析結果快取至磁碟，以檔案修改時間與內容雜湊作為鍵。
+    """
+
+    def __init__(self, tables: Dict[str, Any], functions: Dict[str, Any], manifest: Optional[Dict[str, Any]] = None):
+        from .schema import build_schema_description, get_schema_fragments
+
+        self.tables = tables
+        self.functions = functions
+        self.manifest = manifest or {}
+
+        # 預先建立的提示詞片段與完整描述
+        self.fragments = get_schema_fragments(functions, tables)
+        self.description = build_schema_description(self.fragments)
+
+        # 記憶體索引
+        self.column_index: Dict[str, List[str]] = {}
+        for table_name, table_def in tables.items():
+            for column in table_def['columns']:
+                self.column_index.setdefault(column['name'].lower(), []).append(table_name)
+        self.table_index = {name.lower(): name for name in tables}
+        self.function_index = {name.lower(): name for name in functions}
+
+        # 各資料庫函數讀取的資料表 (依函數程式碼中出現的表名)
+        self.function_tables: Dict[str, Set[str]] = {
+            name: self._known_tables(_IDENTIFIER_PATTERN.findall(info.get('code', '')))
+            for name, info in functions.items()
+        }
+        # 會修改資料的函數 (程式碼中含 INSERT / UPDATE / DELETE / TRUNCATE)
+        self.writing_functions: Set[str] = {
+            name for name, info in functions.items() if _WRITE_PATTERN.search(info.get('code', ''))
+        }
+
+    def _known_tables(self, identifiers: Iterable[str]) -> Set[str]:
+        """篩選出目錄中存在的資料表名稱"""
+        return {self.table_index[name.lower()] for name in identifiers if name.lower() in self.table_index}
+
+    def get_table(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """獲取資料表定義 (不分大小寫)"""
+        name = self.table_index.get(table_name.lower())
+        return self.tables[name] if name else None
+
+    def get_function(self, function_name: str) -> Optional[Dict[str, Any]]:
+        """獲取資料庫函數定義 (不分大小寫)"""
+        name = self.function_index.get(function_name.lower())
+        return self.functions[name] if name else None
+
+    def has_table(self, table_name: str) -> bool:
+        """資料表是否存在於目錄中"""
+        return table_name.lower() in self.table_index
+
+    def has_function(self, function_name: str) -> bool:
+        """資料庫函數是否存在於目錄中"""
+        return function_name.lower() in self.function_index
+
+    def is_writing_function(self, function_name: str) -> bool:
+        """資料庫函數是否會修改資料"""
+        name = self.function_index.get(function_name.lower())
+        return name in self.writing_functions if name else False
+
+    def tables_with_column(self, column_name: str) -> List[str]:
+        """獲取包含指定欄位的資料表"""
+        return list(self.column_index.get(column_name.lower(), []))
+
+    def expand_tables(self, tables: Iterable[str], functions: Iterable[str] = ()) -> Set[str]:
+        """
+        獲取查詢直接讀取的資料表加上所呼叫資料庫函數內部讀取的資料表
+
+        Args:
+            tables: SQL 中直接引用的資料表
+            functions: SQL 中呼叫的函數名稱
+        """
+        result = set(tables)
+        for name in functions:
+            function_name = self.function_index.get(name.lower())
+            if function_name:
+                result |= self.function_tables[function_name]
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為可快取的字典"""
+        return {
+            'version': CATALOG_VERSION,
+            'manifest': self.manifest,
+            'tables': self.tables,
+            'functions': self.functions,
+        }
+
+    @staticmethod
+    def build_manifest(previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        建立來源檔案清單 {路徑: {"mtime_ns", "size", "sha256"}}
+
+        修改時間與大小都未變的檔案沿用先前的雜湊，其餘重新計算。
+        """
+        previous = previous or {}
+        manifest = {}
+        for path in _list_sql_files(SCHEMA_DIR) + _list_sql_files(FUNCTION_DIR):
+            stat = os.stat(path)
+            key = os.path.relpath(path, PROJECT_ROOT)
+            entry = previous.get(key)
+            if entry and entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+                manifest[key] = entry
+            else:
+                manifest[key] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': _file_hash(path)}
+        return manifest
+
+    @classmethod
+    def build(cls, manifest: Optional[Dict[str, Any]] = None) -> 'SchemaCatalog':
+        """重新解析所有 SQL 檔案建立目錄"""
+        from .schema import load_schema_from_sql_files, load_database_functions
+
+        tables = load_schema_from_sql_files(SCHEMA_DIR)
+        functions = load_database_functions()
+        return cls(tables, functions, manifest if manifest is not None else cls.build_manifest())
+
+    @classmethod
+    def load(cls, cache_file: Optional[str] = DEFAULT_CACHE_FILE) -> 'SchemaCatalog':
+        """
+        載入目錄，來源檔案未變更時使用磁碟快取
+
+        Args:
+            cache_file: 快取檔案路徑，None 表示不使用磁碟快取
+        """
+        if not cache_file:
+            return cls.build()
+
+        cached = None
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取 schema 目錄快取失敗: {e}")
+
+        previous = cached.get('manifest') if cached and cached.get('version') == CATALOG_VERSION else None
+        manifest = cls.build_manifest(previous)
+
+        # 以內容雜湊比對，僅修改時間變更 (例如重新 checkout) 也能沿用快取
+        if previous is not None and {
+            key: entry['sha256'] for key, entry in manifest.items()
+        } == {
+            key: entry['sha256'] for key, entry in previous.items()
+        }:
+            logger.debug(f"使用 schema 目錄快取: {cache_file}")
+            catalog = cls(cached['tables'], cached['functions'], manifest)
+            if manifest != previous:
+                catalog.save(cache_file)
+            return catalog
+
+        logger.info("schema 或資料庫函數已變更，重新建立目錄")
+        catalog = cls.build(manifest)
+        catalog.save(cache_file)
+        return catalog
+
+    def save(self, cache_file: str) -> None:
+        """寫入磁碟快取 (先寫暫存檔再取代，避免並行程序讀到不完整的檔案)"""
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            temp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False)
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            logger.warning(f"寫入 schema 目錄快取失敗: {e}")
+
+
+_catalog: Optional[SchemaCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def _cache_file() -> Optional[str]:
+    """取得磁碟快取路徑 (SCHEMA_CATALOG_CACHE，相對路徑以專案根目錄為基準；空字串表示停用)"""
+    cache_file = os.getenv('SCHEMA_CATALOG_CACHE', DEFAULT_CACHE_FILE)
+    if not cache_file:
+        return None
+    return os.path.join(PROJECT_ROOT, cache_file)
+
+
+def get_catalog() -> SchemaCatalog:
+    """獲取程序共用的 schema 目錄 (首次呼叫時載入)"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = SchemaCatalog.load(_cache_file())
+    return _catalog
+
+
+def reload_catalog() -> SchemaCatalog:
+    """重新載入 schema 目錄 (來源檔案變更後使用)"""
+    global _catalog
+    from ..utils.sql_parser import clear_analysis_cache
+
+    with _catalog_lock:
+        _catalog = SchemaCatalog.load(_cache_file())
+    # 只讀檢查依目錄中會修改資料的函數判斷
+    clear_analysis_cache()
+    return _catalog
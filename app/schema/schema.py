@@ -1,11 +1,7 @@
-from sqlalchemy import MetaData, Table, Column, String, Integer, Float, Boolean, DateTime, Date, Time, Text, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID, JSONB
 import os
 import glob
 import re
 
-metadata = MetaData()
-
 # 讀取 SQL 檔案創建 schema 定義
 def load_schema_from_sql_files(schema_dir):
     """從 SQL 檔案讀取資料表定義並創建 schema 定義"""
@@ -72,9 +68,7 @@ def load_schema_from_sql_files(schema_dir):
     return schema_definitions
 
 
-# 從 SQL 文件加載 schema 定義
 schema_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../n8n_booking_schemas'))
-schema_definitions = load_schema_from_sql_files(schema_dir)
 
 
 def load_database_functions():
@@ -157,22 +151,8 @@ def load_database_functions():
     return functions
 
 
-def get_table_schema_description():
-    """取得所有資料表的 schema 描述，用於 AI 生成 SQL 查詢"""
-    description = "資料庫結構:\n\n"
-    
-    for table_name, table_def in schema_definitions.items():
-        description += f"表名: {table_name}\n"
-        description += f"描述: {table_def['comment']}\n"
-        description += "欄位:\n"
-        
-        for column in table_def['columns']:
-            description += f"  - {column['name']}: {column['type']}\n"
-        
-        description += "\n"
-    
-    # 添加一些關聯關係描述
-    description += """
+# 資料表之間的關聯關係說明
+RELATIONSHIPS_DESCRIPTION = """
 關聯關係:
 - n8n_booking_businesses 是主表，包含商家基本資訊
 - n8n_booking_users 通過 business_id 關聯到 n8n_booking_businesses
@@ -184,32 +164,110 @@ def get_table_schema_description():
 - n8n_booking_bookings 是預約記錄，關聯到客戶、服務、時段和員工
 - n8n_booking_history 記錄預約狀態的變更歷史
 """
+
+
+def describe_table(table_name, table_def):
+    """產生單一資料表的描述片段"""
+    description = f"表名: {table_name}\n"
+    description += f"描述: {table_def['comment']}\n"
+    description += "欄位:\n"
+    
+    for column in table_def['columns']:
+        description += f"  - {column['name']}: {column['type']}\n"
+    
+    description += "\n"
+    return description
+
+
+def describe_function(func_name, func_info):
+    """產生單一資料庫函數的描述片段"""
+    # 檢查函數是否有解析錯誤
+    if func_info.get('has_parse_error', False):
+        description = f"函數名: {func_name} (此函數可能不可用)\n"
+        description += f"錯誤: {func_info.get('error', '解析錯誤')}\n"
+        description += "\n"
+        return description
+        
+    description = f"函數名: {func_name}\n"
+    description += f"描述: {func_info.get('description', '無描述')}\n"
+    description += f"參數: {func_info.get('parameters', '無參數')}\n"
+    description += f"返回類型: {func_info.get('return_type', '無返回類型')}\n"
+    
+    if func_info.get('param_comments'):
+        description += "參數說明:\n"
+        for param in func_info['param_comments']:
+            description += f"  - {param}\n"
+    description += "\n"
+    return description
+
+
+def get_schema_fragments(functions=None, tables=None):
+    """
+    取得資料表與資料庫函數的描述片段
+    
+    每個片段為 {"kind": "table" | "function", "name", "text", "keywords"}，
+    keywords 包含名稱、說明與欄位名稱，用於評估片段與查詢的相關性。
+    未指定 functions 與 tables 時返回目錄中預先建立的片段。
+    """
+    if functions is None and tables is None:
+        return list(get_catalog().fragments)
+    if functions is None:
+        functions = get_catalog().functions
+    if tables is None:
+        tables = get_catalog().tables
+    
+    fragments = []
+    for table_name, table_def in tables.items():
+        keywords = [table_name, table_def['comment']] + [column['name'] for column in table_def['columns']]
+        fragments.append({
+            'kind': 'table',
+            'name': table_name,
+            'text': describe_table(table_name, table_def),
+            'keywords': " ".join(keywords)
+        })
+    
+    for func_name, func_info in functions.items():
+        keywords = [func_name, func_info.get('description', '')] + list(func_info.get('param_comments', []))
+        fragments.append({
+            'kind': 'function',
+            'name': func_name,
+            'text': describe_function(func_name, func_info),
+            'keywords': " ".join(keywords)
+        })
+    
+    return fragments
+
+
+def build_schema_description(fragments):
+    """由描述片段組合 schema 描述 (片段可為經過篩選的子集)"""
+    description = "資料庫結構:\n\n"
+    description += "".join(fragment['text'] for fragment in fragments if fragment['kind'] == 'table')
+    
+    # 添加一些關聯關係描述
+    description += RELATIONSHIPS_DESCRIPTION
     
     # 添加資料庫函數說明
-    functions = load_database_functions()
-    if functions:
+    function_texts = [fragment['text'] for fragment in fragments if fragment['kind'] == 'function']
+    if function_texts:
         description += "\n資料庫函數:\n\n"
-        for func_name, func_info in functions.items():
-            # 檢查函數是否有解析錯誤
-            if func_info.get('has_parse_error', False):
-                description += f"函數名: {func_name} (此函數可能不可用)\n"
-                description += f"錯誤: {func_info.get('error', '解析錯誤')}\n"
-                description += "\n"
-                continue
-                
-            description += f"函數名: {func_name}\n"
-            description += f"描述: {func_info.get('description', '無描述')}\n"
-            description += f"參數: {func_info.get('parameters', '無參數')}\n"
-            description += f"返回類型: {func_info.get('return_type', '無返回類型')}\n"
-            
-            if func_info.get('param_comments'):
-                description += "參數說明:\n"
-                for param in func_info['param_comments']:
-                    description += f"  - {param}\n"
-            description += "\n"
+        description += "".join(function_texts)
     
     return description
 
 
-# 載入資料庫函數定義
-db_functions = load_database_functions()
\ No newline at end of file
+def get_table_schema_description():
+    """取得所有資料表的 schema 描述，用於 AI 生成 SQL 查詢"""
+    return get_catalog().description
+
+
+# 從目錄載入 schema 與資料庫函數定義 (每個程序只解析一次，來源未變更時使用磁碟快取)
+from .catalog import get_catalog  # noqa: E402
+
+
+def __getattr__(name):
+    # schema_definitions 與 db_functions 在第一次存取時才載入目錄，匯入模組時不讀取 SQL 檔案
+    if name == "schema_definitions":
+        return get_catalog().tables
+    if name == "db_functions":
+        return get_catalog().functions
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,22 +1,64 @@
-from .conversation_service import ConversationManager, ConversationContext
-from .database_service import DatabaseService, QueryResult
-from .history_service import HistoryService
-from .llm_service import LLMService, LLMResponse, llm_service
-from .text_to_sql import TextToSQLService, SQLResult
-# 暫時註解掉 vector_store 以便應用可以啟動
-# from .vector_store import VectorStore, vector_store
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = [
-    "ConversationManager",
-    "ConversationContext",
-    "DatabaseService",
-    "QueryResult",
-    "HistoryService",
-    "LLMService",
-    "LLMResponse",
-    "llm_service",
-    "TextToSQLService",
-    "SQLResult",
-    # "VectorStore",
-    # "vector_store",
-]
\ No newline at end of file
+# 名稱 -> 所在模組；第一次存取時才匯入 (PEP 562)，
+# 只使用查詢歷史的命令不需載入 SQLAlchemy、資料庫服務與 LLM 服務
+_EXPORTS = {
+    "ConversationManager": "conversation_service",
+    "ConversationContext": "conversation_store",
+    "ConversationTurn": "conversation_store",
+    "ConversationStore": "conversation_store",
+    "MemoryConversationStore": "conversation_store",
+    "SQLConversationStore": "conversation_store",
+    "RedisConversationStore": "conversation_store",
+    "create_conversation_store": "conversation_store",
+    "DatabaseService": "database_service",
+    "QueryResult": "database_service",
+    "HistoryService": "history_service",
+    "AsyncDatabaseService": "async_database",
+    "AsyncHistoryService": "async_history_service",
+    "LLMService": "llm_service",
+    "LLMResponse": "llm_service",
+    "llm_service": "llm_service",
+    "get_llm_service": "llm_service",
+    "TemplateMatcher": "template_matcher",
+    "TemplateMatch": "template_matcher",
+    "TextToSQLService": "text_to_sql",
+    "SQLResult": "text_to_sql",
+    "BatchConverter": "batch_service",
+    "BatchItemResult": "batch_service",
+    "BatchSummary": "batch_service",
+    # 暫時註解掉 vector_store 以便應用可以啟動
+    # "VectorStore": "vector_store",
+    # "vector_store": "vector_store",
+}
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .conversation_service import ConversationManager
+    from .conversation_store import (
+        ConversationContext, ConversationTurn, ConversationStore, MemoryConversationStore, SQLConversationStore,
+        RedisConversationStore, create_conversation_store
+    )
+    from .database_service import DatabaseService, QueryResult
+    from .history_service import HistoryService
+    from .async_database import AsyncDatabaseService
+    from .async_history_service import AsyncHistoryService
+    from .llm_service import LLMService, LLMResponse, llm_service, get_llm_service
+    from .template_matcher import TemplateMatcher, TemplateMatch
+    from .text_to_sql import TextToSQLService, SQLResult
+    from .batch_service import BatchConverter, BatchItemResult, BatchSummary
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value  # 之後直接從模組字典取得
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
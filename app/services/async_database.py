@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import exc, text
+from sqlalchemy.engine import URL, make_url
+
+from ..utils import settings
+from ..utils.profiling import stage
+from .cost_gate import PlanCheck
+from .database_service import DatabaseService, QueryResult
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# asyncpg 依參數宣告的類型嚴格檢查 (例如日期欄位傳入字串)，psycopg2 則交由伺服器推斷
+_ARGUMENT_TYPE_ERROR = "invalid input for query argument"
+
+# 可轉換為原生類型的參數字串 (ISO 8601 日期時間與數字)
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+_DATETIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}(:?\d{2})?)?")
+_TIME_PATTERN = re.compile(r"\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?")
+_INTEGER_PATTERN = re.compile(r"-?\d{1,18}")
+_DECIMAL_PATTERN = re.compile(r"-?\d+\.\d+")
+
+
+def coerce_param(value: Any) -> Any:
+    """將 ISO 8601 日期、時間與數字字串轉換為對應的 Python 類型，其他值原樣返回"""
+    if not isinstance(value, str):
+        return value
+    try:
+        if _DATE_PATTERN.fullmatch(value):
+            return date.fromisoformat(value)
+        if _DATETIME_PATTERN.fullmatch(value):
+            return datetime.fromisoformat(value)
+        if _TIME_PATTERN.fullmatch(value):
+            return dt_time.fromisoformat(value)
+    except ValueError:
+        # 例如 2025-02-30
+        return value
+    if _INTEGER_PATTERN.fullmatch(value):
+        return int(value)
+    if _DECIMAL_PATTERN.fullmatch(value):
+        return Decimal(value)
+    return value
+
+
+def coerce_params(params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    轉換查詢參數中的日期與數字字串 (asyncpg 依參數宣告的類型檢查，不接受字串)
+
+    Returns:
+        轉換後的參數；沒有可轉換的值時返回原物件
+    """
+    if not params:
+        return params
+    coerced = {name: coerce_param(value) for name, value in params.items()}
+    if all(coerced[name] is value for name, value in params.items()):
+        return params
+    return coerced
+
+
+def to_async_url(database_url: str) -> URL:
+    """
+    將資料庫 URL 轉換為 asyncpg 驅動 (postgresql+asyncpg://)
+
+    asyncpg 會在每個連線上自動快取預備語句，數量上限沿用 PREPARED_STATEMENT_CACHE_SIZE。
+    """
+    url = make_url(database_url).set(drivername="postgresql+asyncpg")
+    query = {"prepared_statement_cache_size": str(settings.prepared_statement_cache_size)}
+    # asyncpg 以 ssl 參數取代 libpq 的 sslmode (接受相同的值，例如 require、verify-full)
+    if "sslmode" in url.query:
+        query["ssl"] = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"])
+    return url.update_query_dict(query)
+
+
+def create_async_db_engine():
+    """
+    建立 asyncpg 非同步引擎 (連線池，建立時不連接資料庫)
+
+    Returns:
+        SQLAlchemy 非同步引擎；未安裝 asyncpg 或 SQLAlchemy 非同步擴充 (greenlet) 時返回 None
+    """
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        import asyncpg  # noqa: F401
+    except ImportError as e:
+        logger.warning(f"未安裝非同步資料庫驅動，改在執行緒池中執行同步查詢: {e}")
+        return None
+
+    return create_async_engine(
+        to_async_url(settings.database_url),
+        pool_size=settings.async_db_pool_size,
+        max_overflow=settings.async_db_max_overflow,
+        pool_pre_ping=True
+    )
+
+
+class AsyncDatabaseService:
+    """
+    非同步資料庫服務
+
+    以 asyncpg 連線池執行查詢，等待資料庫時不阻塞 FastAPI 事件迴圈。
+    安全檢查、結果快取、成本檢查與資料庫結構快取與同步的 DatabaseService 共用，
+    變更通知的監聽也沿用同步服務；無法使用 asyncpg 時改在執行緒池中呼叫同步服務。
+    """
+
+    def __init__(self, db_service: DatabaseService):
+        """
+        Args:
+            db_service: 同步資料庫服務 (共用快取與連線狀態)
+        """
+        self.db_service = db_service
+        self._engine = None
+        self._engine_ready = False
+
+    @property
+    def engine(self):
+        """非同步連線池 (第一次使用時建立；未啟用 asyncpg 或未連接資料庫時為 None)"""
+        if not self._engine_ready:
+            if settings.async_db_enabled and self.db_service.is_connected():
+                self._engine = create_async_db_engine()
+            self._engine_ready = True
+        return self._engine
+
+    def is_connected(self) -> bool:
+        """檢查是否連接到資料庫"""
+        return self.db_service.is_connected()
+
+    async def check_query_cost(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[PlanCheck]:
+        """
+        以 EXPLAIN 檢查查詢的預估成本 (以獨立連線執行，失敗不影響後續查詢)
+
+        Returns:
+            檢查結果；未啟用成本檢查、SQL 不是單一只讀語句或無法取得執行計畫時返回 None
+        """
+        cost_gate = self.db_service.cost_gate
+        if cost_gate is None or not cost_gate.can_explain(sql):
+            return None
+
+        try:
+            with stage("sql_explain"):
+                async with self.engine.connect() as conn:
+                    return await cost_gate.check_async(conn, sql, params)
+        except Exception as e:
+            # 無法取得執行計畫 (例如 SQL 有錯誤) 時交由實際執行回報錯誤
+            logger.debug(f"取得執行計畫失敗: {e}")
+            return None
+
+    async def execute_query(self, sql: str, params: Optional[Dict[str, Any]] = None,
+                            confirmed: bool = False) -> QueryResult:
+        """
+        執行 SQL 查詢
+
+        Args:
+            sql: SQL 查詢語句
+            params: 查詢參數
+            confirmed: 用戶已確認執行超出成本上限的查詢 (EXPLAIN_ACTION=confirm 時)
+
+        Returns:
+            查詢結果
+        """
+        db_service = self.db_service
+        if not db_service.is_connected():
+            return QueryResult.from_error("未連接到資料庫")
+        if self.engine is None:
+            return await asyncio.to_thread(db_service.execute_query, sql, params, confirmed)
+
+        start_time = time.perf_counter()
+        analysis, cache_key, table_versions, early_result = db_service.prepare_execution(sql, params, start_time)
+        if early_result is not None:
+            return early_result
+
+        # 執行前檢查預估成本
+        rejection = db_service.cost_rejection(await self.check_query_cost(sql, params), confirmed)
+        if rejection is not None:
+            return rejection
+
+        try:
+            try:
+                with stage("sql_execute"):
+                    columns, rows = await self._fetch_rows(sql, params)
+
+                return db_service.finish_execution(columns, rows, start_time, cache_key, table_versions)
+
+            except exc.DBAPIError as e:
+                # 處理特定的函數不存在錯誤
+                missing = db_service.missing_function_result(e, analysis)
+                if missing is None:
+                    raise
+                return missing
+
+        except exc.SQLAlchemyError as e:
+            logger.error(f"SQL 查詢執行錯誤: {e}")
+            return QueryResult.from_error(str(e))
+        except Exception as e:
+            logger.error(f"執行查詢時發生未知錯誤: {e}")
+            return QueryResult.from_error(f"未知錯誤: {str(e)}")
+
+    async def _fetch_rows_async(self, sql: str, params: Optional[Dict[str, Any]]) -> Tuple[List[str], List[List[Any]]]:
+        """以 asyncpg 執行查詢並讀取結果"""
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(sql), params or {})
+            return list(result.keys()), [list(row) for row in result.fetchall()]
+
+    async def _fetch_rows(self, sql: str, params: Optional[Dict[str, Any]]) -> Tuple[List[str], List[List[Any]]]:
+        """
+        執行查詢並讀取結果 (安全檢查、結果快取與成本檢查已由呼叫端完成)
+
+        asyncpg 不接受參數類型時 (例如日期欄位傳入字串)，先將日期與數字字串轉換為原生類型重試；
+        仍無法轉換時 (例如文字欄位傳入數字字串) 才在執行緒池中以同步驅動執行同一查詢。
+
+        Returns:
+            (列名, 行數據) 的元組
+        """
+        try:
+            return await self._fetch_rows_async(sql, params)
+        except exc.DBAPIError as e:
+            if _ARGUMENT_TYPE_ERROR not in str(e):
+                raise
+            error = e
+
+        coerced = coerce_params(params)
+        if coerced is not params:
+            try:
+                return await self._fetch_rows_async(sql, coerced)
+            except exc.DBAPIError as e:
+                if _ARGUMENT_TYPE_ERROR not in str(e):
+                    raise
+                error = e
+
+        logger.debug(f"asyncpg 無法轉換查詢參數，改以同步驅動執行: {error}")
+        return await asyncio.to_thread(self.db_service.fetch_rows, sql, params)
+
+    async def execute_query_with_viz(self, sql: str, params: Optional[Dict[str, Any]] = None, visualize: bool = False,
+                                     confirmed: bool = False) -> Tuple[QueryResult, Optional[Dict]]:
+        """
+        執行 SQL 查詢並生成視覺化 (繪圖在執行緒池中進行)
+
+        Returns:
+            (查詢結果, 視覺化元數據) 的元組
+        """
+        result = await self.execute_query(sql, params, confirmed=confirmed)
+        if visualize:
+            return result, await asyncio.to_thread(self.db_service.visualize_result, sql, result)
+        return result, None
+
+    async def _get_schema(self) -> Dict[str, Dict[str, Any]]:
+        """獲取所有資料表結構 (與同步服務共用結構快取)"""
+        schema_cache = self.db_service.schema_cache
+        if self.engine is None:
+            return await asyncio.to_thread(schema_cache.get_all)
+        return await schema_cache.get_all_async(self.engine)
+
+    async def get_tables(self) -> List[str]:
+        """獲取所有表名"""
+        if not self.is_connected():
+            return []
+
+        try:
+            return sorted(await self._get_schema())
+        except Exception as e:
+            logger.error(f"獲取表名失敗: {e}")
+            return []
+
+    async def get_table_schema(self, table_name: str) -> Dict[str, Any]:
+        """
+        獲取表結構
+
+        Args:
+            table_name: 表名
+
+        Returns:
+            表結構信息
+        """
+        if not self.is_connected():
+            return {"error": "未連接到資料庫"}
+
+        try:
+            tables = await self._get_schema()
+            return DatabaseService.format_table_schema(table_name, tables.get(table_name))
+        except Exception as e:
+            logger.error(f"獲取表結構失敗: {e}")
+            return {"error": str(e)}
+
+    async def close(self) -> None:
+        """釋放非同步連線池"""
+        if self._engine is not None:
+            await self._engine.dispose()
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..models import QueryHistoryModel, QueryTemplateModel
+from .async_database import create_async_db_engine
+from .history_db import QueryHistory, db_record_to_model, keyset_condition
+from .history_service import HistoryService, decode_cursor, encode_cursor
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+
+def _apply_model(record: QueryHistory, query: QueryHistoryModel) -> None:
+    """將 Pydantic 模型的可更新欄位寫入 SQLAlchemy 記錄"""
+    record.user_query = query.user_query
+    record.generated_sql = query.generated_sql
+    record.explanation = query.explanation
+    record.executed = query.executed
+    record.execution_time = query.execution_time
+    record.error_message = query.error_message
+    record.conversation_id = query.conversation_id
+    record.references_query_id = query.references_query_id
+    record.resolved_query = query.resolved_query
+    record.entity_references = query.entity_references
+    record.parameters = query.parameters
+    record.is_favorite = query.is_favorite
+    record.is_template = query.is_template
+    record.template_name = query.template_name
+    record.template_description = query.template_description
+    record.template_tags = query.template_tags if query.template_tags else None
+
+
+class AsyncHistoryService:
+    """
+    非同步查詢歷史服務
+
+    包裝同步的 HistoryService：使用資料庫存儲時，歷史記錄的新增、查詢與更新以 asyncpg 連線池執行；
+    JSON 文件存儲與模板等其他操作在執行緒池中呼叫同步版本，都不會阻塞事件迴圈。
+    啟用背景批次寫入 (HISTORY_WRITE_BEHIND) 時，新增與更新交由同步服務的寫入佇列。
+    """
+
+    def __init__(self, history_service: HistoryService):
+        """
+        Args:
+            history_service: 同步查詢歷史服務 (決定存儲方式與文件路徑)
+        """
+        self.history_service = history_service
+        self.engine = None
+        self.Session = None
+        if history_service.use_db:
+            self.engine = create_async_db_engine()
+            if self.engine is not None:
+                from sqlalchemy.ext.asyncio import async_sessionmaker
+                self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def _run_sync(self, method_name: str, *args, **kwargs):
+        """在執行緒池中呼叫同步服務的方法"""
+        return await asyncio.to_thread(getattr(self.history_service, method_name), *args, **kwargs)
+
+    async def add_query(self, query_model: QueryHistoryModel) -> QueryHistoryModel:
+        """添加查詢歷史記錄"""
+        if self.history_service.get_writer() is not None:
+            # 背景批次寫入時只放入佇列，不需等待
+            return self.history_service.add_query(query_model)
+        if self.Session is None:
+            return await self._run_sync("add_query", query_model)
+
+        try:
+            async with self.Session() as session:
+                record = QueryHistory(id=query_model.id, created_at=datetime.now())
+                _apply_model(record, query_model)
+                session.add(record)
+                await session.commit()
+                return query_model
+        except Exception as e:
+            logger.error(f"保存查詢歷史到資料庫失敗: {e}")
+            # 失敗時改用文件存儲
+            return await self._run_sync("_add_query_to_file", query_model)
+
+    async def _flush(self) -> None:
+        """寫完背景佇列中的變更 (讀取列表前呼叫)"""
+        writer = self.history_service.writer
+        if writer is not None and writer.has_pending():
+            await asyncio.to_thread(writer.flush)
+
+    async def get_history(self, limit: int = 20, offset: int = 0) -> List[QueryHistoryModel]:
+        """獲取查詢歷史記錄"""
+        if self.Session is None:
+            return await self._run_sync("get_history", limit, offset)
+        await self._flush()
+
+        try:
+            async with self.Session() as session:
+                records = await session.scalars(
+                    select(QueryHistory).order_by(QueryHistory.created_at.desc()).limit(limit).offset(offset)
+                )
+                return [db_record_to_model(record) for record in records]
+        except Exception as e:
+            logger.error(f"從資料庫獲取查詢歷史失敗: {e}")
+            # 失敗時改用文件讀取
+            return await self._run_sync("_get_history_from_file", limit, offset)
+
+    async def get_history_page(self, limit: int = 20, cursor: Optional[str] = None,
+                               conversation_id: Optional[str] = None,
+                               favorites_only: bool = False) -> Tuple[List[QueryHistoryModel], Optional[str]]:
+        """
+        以游標 (keyset) 分頁獲取查詢歷史
+
+        Returns:
+            (查詢歷史記錄列表, 下一頁的游標)
+
+        Raises:
+            ValueError: 游標格式錯誤
+        """
+        if self.Session is None:
+            return await self._run_sync("get_history_page", limit, cursor, conversation_id, favorites_only)
+        before = decode_cursor(cursor) if cursor else None
+        await self._flush()
+
+        try:
+            statement = select(QueryHistory)
+            if conversation_id:
+                statement = statement.where(QueryHistory.conversation_id == conversation_id)
+            if favorites_only:
+                statement = statement.where(QueryHistory.is_favorite == True)
+            if before is not None:
+                statement = statement.where(keyset_condition(before))
+            statement = statement.order_by(QueryHistory.created_at.desc(), QueryHistory.id.desc()).limit(limit + 1)
+            async with self.Session() as session:
+                records = list(await session.scalars(statement))
+        except Exception as e:
+            logger.error(f"從資料庫獲取查詢歷史失敗: {e}")
+            # 失敗時改用文件讀取
+            return await self._run_sync("_get_history_page_from_file", limit, before, conversation_id, favorites_only)
+
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = encode_cursor(records[-1].created_at, records[-1].id)
+        return [db_record_to_model(record) for record in records], next_cursor
+
+    async def search_history(self, text_value: str, limit: int = 20) -> List[QueryHistoryModel]:
+        """全文搜尋查詢歷史 (在執行緒池中執行，查詢與索引同步版本)"""
+        return await self._run_sync("search_history", text_value, limit)
+
+    async def get_query_by_id(self, query_id: str) -> Optional[QueryHistoryModel]:
+        """根據 ID 獲取查詢歷史"""
+        if self.history_service.writer is not None:
+            pending = self.history_service.writer.get_pending(query_id)
+            if pending is not None:
+                return pending
+        if self.Session is None:
+            return await self._run_sync("get_query_by_id", query_id)
+
+        try:
+            async with self.Session() as session:
+                record = await session.get(QueryHistory, query_id)
+                return db_record_to_model(record) if record else None
+        except Exception as e:
+            logger.error(f"從資料庫獲取查詢歷史失敗: {e}")
+            return None
+
+    async def get_history_by_conversation(self, conversation_id: str, limit: int = 20) -> List[QueryHistoryModel]:
+        """獲取對話相關的查詢歷史"""
+        if self.Session is None:
+            return await self._run_sync("get_history_by_conversation", conversation_id, limit)
+        await self._flush()
+
+        try:
+            async with self.Session() as session:
+                records = await session.scalars(
+                    select(QueryHistory)
+                    .where(QueryHistory.conversation_id == conversation_id)
+                    .order_by(QueryHistory.created_at.desc())
+                    .limit(limit)
+                )
+                return [db_record_to_model(record) for record in records]
+        except Exception as e:
+            logger.error(f"從資料庫獲取對話歷史失敗: {e}")
+            return []
+
+    async def update_query(self, query: QueryHistoryModel) -> bool:
+        """更新查詢歷史"""
+        if self.history_service.get_writer() is not None:
+            return self.history_service.update_query(query)
+        if self.Session is None:
+            return await self._run_sync("update_query", query)
+
+        try:
+            async with self.Session() as session:
+                record = await session.get(QueryHistory, query.id)
+                if not record:
+                    return False
+                _apply_model(record, query)
+                record.updated_at = datetime.now()
+                await session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"更新資料庫中的查詢歷史失敗: {e}")
+            return False
+
+    async def toggle_favorite(self, query_id: str) -> bool:
+        """切換查詢的收藏狀態"""
+        query = await self.get_query_by_id(query_id)
+        if not query:
+            return False
+        query.is_favorite = not query.is_favorite
+        return await self.update_query(query)
+
+    async def get_favorites(self, limit: int = 20, offset: int = 0) -> List[QueryHistoryModel]:
+        """獲取收藏的查詢"""
+        return await self._run_sync("get_favorites", limit, offset)
+
+    async def save_as_template(self, query_id: str, name: str, description: Optional[str] = None,
+                               tags: Optional[List[str]] = None) -> Optional[QueryTemplateModel]:
+        """將查詢保存為模板"""
+        return await self._run_sync("save_as_template", query_id, name, description, tags)
+
+    async def get_templates(self, limit: int = 20, offset: int = 0, tag: Optional[str] = None,
+                            search: Optional[str] = None) -> List[QueryTemplateModel]:
+        """獲取查詢模板"""
+        return await self._run_sync("get_templates", limit, offset, tag, search)
+
+    async def get_template_by_id(self, template_id: str) -> Optional[QueryTemplateModel]:
+        """根據 ID 獲取模板"""
+        return await self._run_sync("get_template_by_id", template_id)
+
+    async def update_template(self, template: QueryTemplateModel) -> bool:
+        """更新模板"""
+        return await self._run_sync("update_template", template)
+
+    async def delete_template(self, template_id: str) -> bool:
+        """刪除模板"""
+        return await self._run_sync("delete_template", template_id)
+
+    async def increment_template_usage(self, template_id: str) -> bool:
+        """增加模板使用次數"""
+        return await self._run_sync("increment_template_usage", template_id)
+
+    async def close(self) -> None:
+        """釋放非同步連線池"""
+        if self.engine is not None:
+            await self.engine.dispose()
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from pydantic import BaseModel, Field
+from ..utils import settings
+from .text_to_sql import SQLResult
+import json
+import logging
+import re
+import time
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+
+class BatchItemResult(BaseModel):
+    """批次轉換中單一查詢的結果"""
+    index: int = Field(description="查詢在輸入中的位置 (從 0 開始)")
+    query: str = Field(description="自然語言查詢")
+    result: Optional[SQLResult] = Field(default=None, description="轉換結果")
+    error: Optional[str] = Field(default=None, description="錯誤訊息")
+    latency_ms: float = Field(default=0.0, description="轉換耗時 (毫秒)")
+    duplicate_of: Optional[int] = Field(default=None, description="重複查詢時，實際轉換的查詢位置")
+
+
+class BatchSummary(BaseModel):
+    """批次轉換統計"""
+    total: int = Field(default=0, description="輸入查詢數")
+    unique: int = Field(default=0, description="去重後實際轉換的查詢數")
+    succeeded: int = Field(default=0, description="成功數")
+    failed: int = Field(default=0, description="失敗數")
+    concurrency: int = Field(default=1, description="並發數")
+    elapsed_seconds: float = Field(default=0.0, description="總耗時 (秒)")
+    throughput_qps: float = Field(default=0.0, description="吞吐量 (每秒完成的輸入查詢數)")
+
+
+def normalize_batch_query(query: str) -> str:
+    """正規化查詢文字作為去重鍵"""
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+class BatchConverter:
+    """批次自然語言轉 SQL 服務"""
+
+    def __init__(self, service, max_concurrency: Optional[int] = None):
+        """
+        初始化批次轉換器
+
+        Args:
+            service: TextToSQLService 實例
+            max_concurrency: 最大並發數，默認使用設定值
+        """
+        self.service = service
+        self.max_concurrency = max(1, min(
+            max_concurrency or settings.batch_max_concurrency,
+            settings.batch_max_concurrency
+        ))
+        self.summary = BatchSummary()
+
+    def convert(self, queries: Iterable[str], execute: bool = False, find_similar: bool = True,
+                model_name: Optional[str] = None) -> Iterator[BatchItemResult]:
+        """
+        以有限並發轉換多個查詢，依完成順序逐一產出結果
+
+        相同 (正規化後) 的查詢只會轉換一次，重複項目在該查詢完成時一併產出。
+        迭代結束後可從 self.summary 取得統計。
+
+        Args:
+            queries: 自然語言查詢列表
+            execute: 是否執行生成的 SQL 查詢
+            find_similar: 是否查找相似查詢
+            model_name: 使用的模型名稱
+
+        Yields:
+            單一查詢的轉換結果
+        """
+        queries = list(queries)
+
+        # 去重：正規化查詢 -> 輸入位置列表
+        groups: Dict[str, List[int]] = {}
+        for index, query in enumerate(queries):
+            groups.setdefault(normalize_batch_query(query), []).append(index)
+
+        self.summary = BatchSummary(
+            total=len(queries),
+            unique=len(groups),
+            concurrency=min(self.max_concurrency, len(groups)) or 1
+        )
+        logger.info(f"批次轉換 {len(queries)} 個查詢 (去重後 {len(groups)} 個)，並發數 {self.summary.concurrency}")
+
+        start_time = time.perf_counter()
+
+        # 提前結束迭代 (例如用戶端斷線) 時取消尚未開始的轉換
+        executor = ThreadPoolExecutor(max_workers=self.summary.concurrency)
+        try:
+            # 在工作執行緒中保留呼叫端的 context (例如 token 計量的端點標籤)
+            futures = {
+                executor.submit(copy_context().run, self._convert_one, queries[indexes[0]], execute, find_similar, model_name): indexes
+                for indexes in groups.values()
+            }
+
+            for future in as_completed(futures):
+                indexes = futures[future]
+                result, error, latency_ms = future.result()
+
+                for index in indexes:
+                    if error or (result and result.sql.startswith("--")):
+                        self.summary.failed += 1
+                    else:
+                        self.summary.succeeded += 1
+
+                    yield BatchItemResult(
+                        index=index,
+                        query=queries[index],
+                        result=result,
+                        error=error,
+                        latency_ms=latency_ms,
+                        duplicate_of=None if index == indexes[0] else indexes[0]
+                    )
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self.summary.elapsed_seconds = time.perf_counter() - start_time
+        if self.summary.elapsed_seconds > 0:
+            self.summary.throughput_qps = self.summary.total / self.summary.elapsed_seconds
+        logger.info(
+            f"批次轉換完成: {self.summary.succeeded} 成功, {self.summary.failed} 失敗, "
+            f"{self.summary.throughput_qps:.2f} 查詢/秒"
+        )
+
+    def _convert_one(self, query: str, execute: bool, find_similar: bool, model_name: Optional[str]):
+        """轉換單一查詢，返回 (結果, 錯誤, 耗時毫秒)"""
+        start_time = time.perf_counter()
+        try:
+            result = self.service.text_to_sql(
+                query=query,
+                execute=execute,
+                find_similar=find_similar,
+                model_name=model_name
+            )
+            return result, None, (time.perf_counter() - start_time) * 1000
+        except Exception as e:
+            logger.error(f"批次轉換查詢失敗: {e}")
+            return None, str(e), (time.perf_counter() - start_time) * 1000
+
+
+def parse_batch_lines(lines: Iterable[str]) -> List[str]:
+    """
+    解析 JSONL 批次輸入
+
+    每行可以是包含 "query" 欄位的 JSON 物件、JSON 字串，或純文字查詢；空行會被略過。
+
+    Args:
+        lines: 輸入行
+
+    Returns:
+        查詢列表
+    """
+    queries = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item: Any = json.loads(line)
+        except json.JSONDecodeError:
+            item = line
+
+        if isinstance(item, dict):
+            query = item.get("query")
+            if not query:
+                raise ValueError(f"批次輸入缺少 query 欄位: {line}")
+            queries.append(str(query))
+        else:
+            queries.append(str(item))
+    return queries
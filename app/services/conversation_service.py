@@ -1,38 +1,51 @@
 from typing import List, Dict, Any, Optional
-from uuid import uuid4
 from datetime import datetime
-from pydantic import BaseModel, Field
+import threading
 from ..models.query_history import QueryHistoryModel
+from ..utils import settings
+from .conversation_store import ConversationContext, ConversationStore, ConversationTurn, create_conversation_store
 import logging
 
 # 設定日誌
 logger = logging.getLogger(__name__)
 
-class ConversationContext(BaseModel):
-    """對話上下文模型"""
-    conversation_id: str = Field(default_factory=lambda: str(uuid4()), description="對話ID")
-    queries: List[str] = Field(default_factory=list, description="查詢ID列表")
-    context_variables: Dict[str, Any] = Field(default_factory=dict, description="上下文變數")
-    created_at: datetime = Field(default_factory=datetime.now, description="創建時間")
-    last_updated: datetime = Field(default_factory=datetime.now, description="最後更新時間")
-    
-    class Config:
-        arbitrary_types_allowed = True
-
 
 class ConversationManager:
     """對話管理服務"""
     
-    def __init__(self, history_service=None):
+    def __init__(self, history_service=None, store: Optional[ConversationStore] = None):
         """
         初始化對話管理器
         
         Args:
             history_service: 歷史紀錄服務實例
+            store: 對話上下文存儲，None 表示第一次使用時依 CONVERSATION_STORE 建立
         """
-        self.active_conversations = {}  # session_id -> ConversationContext
+        self._store = store
+        self._store_lock = threading.Lock()
         self.history_service = history_service
         self.logger = logging.getLogger(__name__)
+    
+    @property
+    def store(self) -> ConversationStore:
+        """對話上下文存儲 (第一次使用時建立，匯入模組時不連接共享存儲)"""
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = create_conversation_store()
+        return self._store
+    
+    def get_conversation(self, session_id: str) -> Optional[ConversationContext]:
+        """
+        獲取對話上下文
+        
+        Args:
+            session_id: 會話ID
+            
+        Returns:
+            對話上下文；不存在或已閒置過期時返回 None
+        """
+        return self.store.get(session_id)
         
     def get_or_create_conversation(self, session_id: str) -> ConversationContext:
         """
@@ -44,11 +57,13 @@ class ConversationManager:
         Returns:
             對話上下文
         """
-        if session_id not in self.active_conversations:
-            self.active_conversations[session_id] = ConversationContext()
+        context = self.store.get(session_id)
+        if context is None:
+            context = ConversationContext()
+            self.store.put(session_id, context)
             self.logger.info(f"創建新對話: {session_id}")
         
-        return self.active_conversations[session_id]
+        return context
     
     def add_query_to_conversation(self, session_id: str, query: QueryHistoryModel):
         """
@@ -59,8 +74,15 @@ class ConversationManager:
             query: 查詢歷史模型
         """
         context = self.get_or_create_conversation(session_id)
-        context.queries.append(query.id)
+        context.queries.append(str(query.id))
+        # 只保留最近的查詢ID，限制每個會話的大小
+        if settings.conversation_max_queries and len(context.queries) > settings.conversation_max_queries:
+            del context.queries[:-settings.conversation_max_queries]
+        # 附加到最近幾輪的窗口並合併實體引用，之後建構提示詞不需重新讀取查詢歷史
+        context.append_turn(ConversationTurn.from_query(query), query.entity_references,
+                            window=settings.conversation_window)
         context.last_updated = datetime.now()
+        self.store.put(session_id, context)
         
         # 更新查詢模型中的對話ID
         if self.history_service:
@@ -80,9 +102,9 @@ class ConversationManager:
         Returns:
             查詢歷史列表
         """
-        context = self.get_or_create_conversation(session_id)
+        context = self.get_conversation(session_id)
         
-        if not context.queries:
+        if context is None or not context.queries:
             return []
         
         # 取最近的查詢ID列表
@@ -99,6 +121,46 @@ class ConversationManager:
         
         return []
     
+    def get_conversation_turns(self, session_id: str, limit: int = 5) -> List[ConversationTurn]:
+        """
+        獲取對話最近幾輪 (由舊到新)
+        
+        直接使用上下文中保留的窗口；舊版本建立、沒有窗口的上下文從歷史服務重建一次。
+        
+        Args:
+            session_id: 會話ID
+            limit: 返回輪數限制
+            
+        Returns:
+            對話輪次列表
+        """
+        context = self.get_conversation(session_id)
+        
+        if context is None or not context.queries:
+            return []
+        
+        if not context.turns and self.history_service:
+            window = max(limit, settings.conversation_window)
+            for query in self.get_conversation_history(session_id, limit=window):
+                context.append_turn(ConversationTurn.from_query(query), query.entity_references, window=window)
+            if context.turns:
+                self.store.put(session_id, context)
+        
+        return context.turns[-limit:] if limit else list(context.turns)
+    
+    def get_entities(self, session_id: str) -> Dict[str, Any]:
+        """
+        獲取對話中已解析的實體引用
+        
+        Args:
+            session_id: 會話ID
+            
+        Returns:
+            實體引用字典
+        """
+        context = self.get_conversation(session_id)
+        return dict(context.entities) if context is not None else {}
+    
     def update_context_variables(self, session_id: str, variables: Dict[str, Any]):
         """
         更新對話上下文變數
@@ -109,6 +171,8 @@ class ConversationManager:
         """
         context = self.get_or_create_conversation(session_id)
         context.context_variables.update(variables)
+        context.last_updated = datetime.now()
+        self.store.put(session_id, context)
     
     def get_context_variable(self, session_id: str, key: str, default=None) -> Any:
         """
@@ -122,8 +186,8 @@ class ConversationManager:
         Returns:
             變數值
         """
-        context = self.get_or_create_conversation(session_id)
-        return context.context_variables.get(key, default)
+        context = self.get_conversation(session_id)
+        return context.context_variables.get(key, default) if context is not None else default
     
     def clear_conversation(self, session_id: str):
         """
@@ -132,9 +196,8 @@ class ConversationManager:
         Args:
             session_id: 會話ID
         """
-        if session_id in self.active_conversations:
-            del self.active_conversations[session_id]
-            self.logger.info(f"清除對話: {session_id}")
+        self.store.delete(session_id)
+        self.logger.info(f"清除對話: {session_id}")
     
     def get_conversation_ids(self) -> List[str]:
         """
@@ -143,7 +206,12 @@ class ConversationManager:
         Returns:
             對話ID列表
         """
-        return list(self.active_conversations.keys())
+        return self.store.session_ids()
+    
+    def close(self):
+        """釋放對話存儲的連線"""
+        if self._store is not None:
+            self._store.close()
 
 
 # 創建全局對話管理器實例
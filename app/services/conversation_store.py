@@ -0,0 +1,445 @@
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from ..utils import settings
+from ..utils.metrics import metrics
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+CONVERSATIONS_EVICTED = metrics.counter(
+    "texttosql_conversations_evicted_total", "移除的對話上下文數 (reason: idle 閒置過期、capacity 超過數量上限)",
+    labelnames=("reason",)
+)
+
+# 共享存儲的鍵前綴 (Redis) 與資料表名稱 (SQL)
+REDIS_KEY_PREFIX = "texttosql:conversation:"
+SQL_TABLE_NAME = "conversation_sessions"
+
+# 每個會話保留的實體引用數上限
+MAX_ENTITIES = 50
+
+
+class ConversationTurn:
+    """
+    對話中的一輪 (查詢與生成的 SQL)
+
+    提示詞使用的文字在第一次需要時渲染並保留，之後每輪只需加上編號。
+    """
+
+    __slots__ = ("query_id", "user_query", "resolved_query", "generated_sql", "_context_block", "_reference_block")
+
+    def __init__(self, query_id: str, user_query: str, resolved_query: Optional[str], generated_sql: str):
+        self.query_id = query_id
+        self.user_query = user_query
+        self.resolved_query = resolved_query
+        self.generated_sql = generated_sql
+        self._context_block: Optional[str] = None
+        self._reference_block: Optional[str] = None
+
+    @classmethod
+    def from_query(cls, query) -> "ConversationTurn":
+        """從查詢歷史模型建立"""
+        return cls(str(query.id), query.user_query, query.resolved_query, query.generated_sql)
+
+    def _resolved_line(self) -> str:
+        if self.resolved_query and self.resolved_query != self.user_query:
+            return f"解析後問題: {self.resolved_query}\n"
+        return ""
+
+    @property
+    def context_block(self) -> str:
+        """對話上下文提示詞中的一輪 (不含「查詢 N:」標題)"""
+        if self._context_block is None:
+            self._context_block = f"用戶問題: {self.user_query}\n{self._resolved_line()}生成SQL: {self.generated_sql}\n\n"
+        return self._context_block
+
+    @property
+    def reference_block(self) -> str:
+        """參考解析提示詞中一輪的其餘部分 (「用戶問題 N:」之後)"""
+        if self._reference_block is None:
+            self._reference_block = f"{self._resolved_line()}SQL: {self.generated_sql}\n\n"
+        return self._reference_block
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為可 JSON 序列化的字典 (不含渲染結果)"""
+        return {
+            "query_id": self.query_id,
+            "user_query": self.user_query,
+            "resolved_query": self.resolved_query,
+            "generated_sql": self.generated_sql,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationTurn":
+        """從 to_dict() 的結果建立"""
+        return cls(data.get("query_id"), data.get("user_query") or "", data.get("resolved_query"),
+                   data.get("generated_sql") or "")
+
+
+class ConversationContext:
+    """
+    對話上下文
+
+    除查詢ID外，保留最近幾輪的查詢與 SQL (turns) 以及累積的實體引用 (entities)，
+    新的一輪直接附加，建構提示詞時不需重新讀取查詢歷史。
+    使用 __slots__ 減少每個會話的記憶體用量；共享存儲以 to_dict() / from_dict() 序列化。
+    """
+
+    __slots__ = ("conversation_id", "queries", "context_variables", "created_at", "last_updated", "turns", "entities")
+
+    def __init__(self, conversation_id: Optional[str] = None, queries: Optional[List[str]] = None,
+                 context_variables: Optional[Dict[str, Any]] = None, created_at: Optional[datetime] = None,
+                 last_updated: Optional[datetime] = None, turns: Optional[List[ConversationTurn]] = None,
+                 entities: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            conversation_id: 對話ID，預設自動產生
+            queries: 查詢ID列表 (由舊到新)
+            context_variables: 上下文變數
+            created_at: 創建時間
+            last_updated: 最後更新時間
+            turns: 最近幾輪的查詢 (由舊到新)
+            entities: 已解析的實體引用 (較新的覆蓋較舊的)
+        """
+        self.conversation_id = conversation_id or str(uuid4())
+        self.queries: List[str] = queries if queries is not None else []
+        self.context_variables: Dict[str, Any] = context_variables if context_variables is not None else {}
+        self.created_at = created_at or datetime.now()
+        self.last_updated = last_updated or self.created_at
+        self.turns: List[ConversationTurn] = turns if turns is not None else []
+        self.entities: Dict[str, Any] = entities if entities is not None else {}
+
+    def append_turn(self, turn: ConversationTurn, entity_references: Optional[Dict[str, Any]] = None,
+                    window: int = 5) -> None:
+        """
+        附加一輪並合併實體引用
+
+        Args:
+            turn: 新的一輪
+            entity_references: 此輪解析出的實體引用
+            window: 保留的輪數
+        """
+        self.turns.append(turn)
+        if window and len(self.turns) > window:
+            del self.turns[:-window]
+        for name, value in (entity_references or {}).items():
+            # 重新插入讓較新的實體排在後面，超過上限時移除最舊的
+            self.entities.pop(name, None)
+            self.entities[name] = value
+        while len(self.entities) > MAX_ENTITIES:
+            del self.entities[next(iter(self.entities))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為可 JSON 序列化的字典"""
+        return {
+            "conversation_id": self.conversation_id,
+            "queries": [str(query_id) for query_id in self.queries],
+            "context_variables": self.context_variables,
+            "created_at": self.created_at.isoformat(),
+            "last_updated": self.last_updated.isoformat(),
+            "turns": [turn.to_dict() for turn in self.turns],
+            "entities": self.entities,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationContext":
+        """從 to_dict() 的結果建立"""
+        return cls(
+            conversation_id=data.get("conversation_id"),
+            queries=list(data.get("queries") or []),
+            context_variables=dict(data.get("context_variables") or {}),
+            created_at=datetime.fromisoformat(data["created_at"]) if data.get("created_at") else None,
+            last_updated=datetime.fromisoformat(data["last_updated"]) if data.get("last_updated") else None,
+            turns=[ConversationTurn.from_dict(turn) for turn in data.get("turns") or []],
+            entities=dict(data.get("entities") or {}),
+        )
+
+
+class ConversationStore(ABC):
+    """
+    對話上下文存儲介面
+
+    get() 取得的上下文修改後需以 put() 寫回 (共享存儲每次返回新的物件)。
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[ConversationContext]:
+        """獲取會話的上下文，不存在或已閒置過期時返回 None"""
+        pass
+
+    @abstractmethod
+    def put(self, session_id: str, context: ConversationContext) -> None:
+        """保存會話的上下文 (並重新計算閒置時間)"""
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """刪除會話的上下文"""
+        pass
+
+    @abstractmethod
+    def session_ids(self) -> List[str]:
+        """所有未過期的會話ID"""
+        pass
+
+    def close(self) -> None:
+        """釋放連線"""
+
+
+class MemoryConversationStore(ConversationStore):
+    """
+    程序內的對話存儲 (LRU + 閒置 TTL)
+
+    依最後存取時間排序，超過 max_sessions 時移除最久未使用的會話，閒置超過 idle_ttl 秒的會話在存取或寫入時移除。
+    查詢、寫入與淘汰都是 O(1)；只在單一程序內共享，多個 worker 請使用共享存儲。
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 3600):
+        """
+        Args:
+            max_sessions: 保留的會話數上限，0 表示不限制
+            idle_ttl: 閒置秒數上限，0 表示不過期
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # session_id -> (上下文, 最後存取時間)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, accessed_at: float, now: float) -> bool:
+        return bool(self.idle_ttl) and now - accessed_at > self.idle_ttl
+
+    def _evict(self, now: float) -> None:
+        """移除過期與超過上限的會話 (呼叫端需持有鎖)；最久未使用的在最前面，遇到未過期的即停止"""
+        while self._entries:
+            session_id, (_, accessed_at) = next(iter(self._entries.items()))
+            if self._expired(accessed_at, now):
+                reason = "idle"
+            elif self.max_sessions and len(self._entries) > self.max_sessions:
+                reason = "capacity"
+            else:
+                break
+            del self._entries[session_id]
+            CONVERSATIONS_EVICTED.inc(reason=reason)
+
+    def get(self, session_id: str) -> Optional[ConversationContext]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if self._expired(entry[1], now):
+                del self._entries[session_id]
+                CONVERSATIONS_EVICTED.inc(reason="idle")
+                return None
+            self._entries[session_id] = (entry[0], now)
+            self._entries.move_to_end(session_id)
+            return entry[0]
+
+    def put(self, session_id: str, context: ConversationContext) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[session_id] = (context, now)
+            self._entries.move_to_end(session_id)
+            self._evict(now)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def session_ids(self) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            return list(self._entries)
+
+
+class SQLConversationStore(ConversationStore):
+    """
+    SQL 資料庫的共享對話存儲 (SQLite 或 PostgreSQL)
+
+    以 session_id 為主鍵查詢與 upsert，同一主機的多個 worker 可共用 SQLite 文件 (WAL 模式)，
+    多台主機則使用 PostgreSQL。過期的會話在讀取時忽略，並每 purge_every 次寫入時批次刪除。
+    """
+
+    def __init__(self, url: str, idle_ttl: float = 3600, purge_every: int = 500):
+        """
+        Args:
+            url: SQLAlchemy 資料庫 URL (例如 sqlite:///conversations.db、postgresql://...)
+            idle_ttl: 閒置秒數上限，0 表示不過期
+            purge_every: 每幾次寫入刪除一次過期會話
+        """
+        from sqlalchemy import (
+            Column,
+            Float,
+            MetaData,
+            String,
+            Table,
+            Text,
+            create_engine,
+            event,
+        )
+
+        self.idle_ttl = idle_ttl
+        self.purge_every = max(1, purge_every)
+        self._writes = 0
+        self.engine = create_engine(url, pool_pre_ping=True)
+        if self.engine.dialect.name == "sqlite":
+            @event.listens_for(self.engine, "connect")
+            def _set_sqlite_pragma(dbapi_connection, _):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.close()
+
+        metadata = MetaData()
+        self.table = Table(
+            SQL_TABLE_NAME, metadata,
+            Column("session_id", String, primary_key=True),
+            Column("data", Text, nullable=False),
+            Column("updated_at", Float, nullable=False, index=True),  # UNIX 時間，供閒置過期判斷
+        )
+        metadata.create_all(self.engine)
+
+    def _cutoff(self) -> Optional[float]:
+        return time.time() - self.idle_ttl if self.idle_ttl else None
+
+    def get(self, session_id: str) -> Optional[ConversationContext]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.table.c.data, self.table.c.updated_at).where(self.table.c.session_id == session_id)
+            ).first()
+        if row is None:
+            return None
+        cutoff = self._cutoff()
+        if cutoff is not None and row.updated_at < cutoff:
+            return None
+        return ConversationContext.from_dict(json.loads(row.data))
+
+    def _upsert(self, values: Dict[str, Any]):
+        """依方言建立 INSERT ... ON CONFLICT DO UPDATE"""
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(self.table).values(**values)
+        return statement.on_conflict_do_update(
+            index_elements=[self.table.c.session_id],
+            set_={"data": statement.excluded.data, "updated_at": statement.excluded.updated_at}
+        )
+
+    def put(self, session_id: str, context: ConversationContext) -> None:
+        values = {
+            "session_id": session_id,
+            "data": json.dumps(context.to_dict(), ensure_ascii=False, default=str),
+            "updated_at": time.time(),
+        }
+        with self.engine.begin() as conn:
+            conn.execute(self._upsert(values))
+            self._writes += 1
+            cutoff = self._cutoff()
+            if cutoff is not None and self._writes % self.purge_every == 0:
+                result = conn.execute(self.table.delete().where(self.table.c.updated_at < cutoff))
+                if result.rowcount:
+                    CONVERSATIONS_EVICTED.inc(result.rowcount, reason="idle")
+
+    def delete(self, session_id: str) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.session_id == session_id))
+
+    def session_ids(self) -> List[str]:
+        from sqlalchemy import select
+
+        statement = select(self.table.c.session_id).order_by(self.table.c.updated_at.desc())
+        cutoff = self._cutoff()
+        if cutoff is not None:
+            statement = statement.where(self.table.c.updated_at >= cutoff)
+        with self.engine.connect() as conn:
+            return [row.session_id for row in conn.execute(statement)]
+
+    def close(self) -> None:
+        self.engine.dispose()
+
+
+class RedisConversationStore(ConversationStore):
+    """
+    Redis 的共享對話存儲 (也適用 Valkey、KeyDB 等相容伺服器)
+
+    每個會話一個鍵，閒置 TTL 交由 Redis 的 EXPIRE 處理，讀取時以 GETEX 重新計算。
+    """
+
+    def __init__(self, url: str, idle_ttl: float = 3600):
+        """
+        Args:
+            url: Redis URL (例如 redis://localhost:6379/0)
+            idle_ttl: 閒置秒數上限，0 表示不過期
+
+        Raises:
+            ImportError: 未安裝 redis 套件
+        """
+        import redis
+
+        self.idle_ttl = int(idle_ttl) if idle_ttl else None
+        self.client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"{REDIS_KEY_PREFIX}{session_id}"
+
+    def get(self, session_id: str) -> Optional[ConversationContext]:
+        key = self._key(session_id)
+        data = self.client.getex(key, ex=self.idle_ttl) if self.idle_ttl else self.client.get(key)
+        if data is None:
+            return None
+        return ConversationContext.from_dict(json.loads(data))
+
+    def put(self, session_id: str, context: ConversationContext) -> None:
+        data = json.dumps(context.to_dict(), ensure_ascii=False, default=str)
+        self.client.set(self._key(session_id), data, ex=self.idle_ttl)
+
+    def delete(self, session_id: str) -> None:
+        self.client.delete(self._key(session_id))
+
+    def session_ids(self) -> List[str]:
+        prefix_length = len(REDIS_KEY_PREFIX)
+        return [
+            (key.decode("utf-8") if isinstance(key, bytes) else key)[prefix_length:]
+            for key in self.client.scan_iter(match=f"{REDIS_KEY_PREFIX}*")
+        ]
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def create_conversation_store(url: Optional[str] = None) -> ConversationStore:
+    """
+    依 CONVERSATION_STORE 建立對話存儲
+
+    Args:
+        url: memory (預設)、redis://...、rediss://...，或 SQLAlchemy 資料庫 URL (sqlite:///...、postgresql://...)
+
+    Returns:
+        對話存儲；共享存儲無法建立時 (例如未安裝 redis 套件、無法連接資料庫) 改用程序內存儲
+    """
+    url = url if url is not None else settings.conversation_store
+    idle_ttl = settings.conversation_idle_ttl
+    if url and url != "memory":
+        try:
+            if url.startswith(("redis://", "rediss://", "unix://")):
+                return RedisConversationStore(url, idle_ttl=idle_ttl)
+            return SQLConversationStore(url, idle_ttl=idle_ttl)
+        except Exception as e:
+            logger.warning(f"無法建立共享對話存儲，改用程序內存儲: {e}")
+    return MemoryConversationStore(max_sessions=settings.conversation_max_sessions, idle_ttl=idle_ttl)
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from ..utils.profiling import record_cache_access
+from ..utils.sql_parser import analyze_sql
+from .prepared_statements import normalize_sql
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+
+class PlanCheck:
+    """執行計畫檢查結果"""
+
+    __slots__ = ("allowed", "requires_confirmation", "total_cost", "plan_rows", "reason", "hotspots")
+
+    def __init__(self, allowed: bool, total_cost: float, plan_rows: float, reason: str = "",
+                 requires_confirmation: bool = False, hotspots: Optional[List[str]] = None):
+        self.allowed = allowed
+        self.requires_confirmation = requires_confirmation
+        self.total_cost = total_cost
+        self.plan_rows = plan_rows
+        self.reason = reason
+        self.hotspots = hotspots or []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為字典"""
+        return {
+            "allowed": self.allowed,
+            "requires_confirmation": self.requires_confirmation,
+            "total_cost": self.total_cost,
+            "plan_rows": self.plan_rows,
+            "reason": self.reason,
+            "hotspots": self.hotspots,
+        }
+
+
+def _walk_plan(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """依序走訪執行計畫的所有節點"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk_plan(child)
+
+
+def describe_hotspots(plan: Dict[str, Any], limit: int = 3) -> List[str]:
+    """
+    找出執行計畫中成本最高的節點並描述可能的問題
+
+    例如沒有連接條件的 Nested Loop (笛卡兒積) 或大量列的循序掃描。
+    """
+    nodes = sorted(_walk_plan(plan), key=lambda node: node.get("Total Cost", 0), reverse=True)
+    hotspots = []
+    for node in nodes[:limit]:
+        node_type = node.get("Node Type", "Unknown")
+        relation = node.get("Relation Name")
+        description = f"{node_type}{f' on {relation}' if relation else ''}: 成本 {node.get('Total Cost', 0):.0f}，預估 {node.get('Plan Rows', 0):.0f} 列"
+        if node_type == "Nested Loop" and not node.get("Join Filter") and not any(
+            "Index Cond" in child for child in node.get("Plans", [])
+        ):
+            description += " (沒有連接條件，可能是笛卡兒積)"
+        elif node_type == "Seq Scan" and not node.get("Filter"):
+            description += " (全表掃描且沒有篩選條件)"
+        hotspots.append(description)
+    return hotspots
+
+
+class CostGate:
+    """
+    執行前以 EXPLAIN (FORMAT JSON) 檢查查詢成本
+
+    預估成本或列數超過上限時拒絕執行 (action=reject)，或要求用戶確認 (action=confirm)。
+    執行計畫依正規化 SQL 與參數快取，資料庫結構變更時清除。
+    """
+
+    def __init__(self, max_cost: float, max_rows: float, action: str = "reject", cache_size: int = 512):
+        """
+        Args:
+            max_cost: 預估總成本上限，0 表示不限制
+            max_rows: 預估返回列數上限，0 表示不限制
+            action: 超出上限時: reject (拒絕) 或 confirm (需確認後才執行)
+            cache_size: 快取的執行計畫數量上限
+        """
+        if action not in ("reject", "confirm"):
+            raise ValueError(f"未知的成本檢查動作: {action}，可用: reject, confirm")
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.action = action
+        self.cache_size = cache_size
+        self._plans: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        查詢快取的執行計畫
+
+        Returns:
+            (快取鍵, 執行計畫的根節點)；未快取時執行計畫為 None
+        """
+        payload = json.dumps([normalize_sql(sql), params or {}], sort_keys=True, ensure_ascii=False, default=str)
+        key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+        record_cache_access("query_plan", plan is not None)
+        return key, plan
+
+    @staticmethod
+    def can_explain(sql: str) -> bool:
+        """
+        是否可以 EXPLAIN 此查詢 (可解析的單一只讀語句)
+
+        EXPLAIN 會把整段文字送到資料庫：psycopg2 會執行多語句文字中的每個語句，
+        例如 "SELECT 1; DELETE FROM ..." 的 DELETE，因此未通過只讀檢查的 SQL 不可送出。
+        """
+        analysis = analyze_sql(sql)
+        return analysis.parse_error is None and analysis.is_read_only and len(analysis.statement_types) == 1
+
+    @staticmethod
+    def explain_sql(sql: str) -> str:
+        """產生 EXPLAIN 語句"""
+        return f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"
+
+    def store(self, key: str, row) -> Dict[str, Any]:
+        """由 EXPLAIN 的結果列取出執行計畫的根節點並快取"""
+        document = row[0] if not isinstance(row[0], str) else json.loads(row[0])
+        plan = document[0]["Plan"]
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.cache_size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _explain(self, conn, sql: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """取得執行計畫的根節點 (依 SQL 與參數快取)"""
+        self._require_explainable(sql)
+        key, plan = self.lookup(sql, params)
+        if plan is not None:
+            return plan
+        row = conn.execute(text(self.explain_sql(sql)), params or {}).fetchone()
+        return self.store(key, row)
+
+    def _require_explainable(self, sql: str) -> None:
+        """不是單一只讀語句時拋出 ValueError (呼叫端應先以 can_explain 檢查)"""
+        if not self.can_explain(sql):
+            raise ValueError("只能以 EXPLAIN 檢查單一只讀查詢的成本")
+
+    def check(self, conn, sql: str, params: Optional[Dict[str, Any]] = None) -> PlanCheck:
+        """
+        檢查查詢的預估成本
+
+        Args:
+            conn: SQLAlchemy 連線
+            sql: SQL 查詢語句 (必須是單一只讀語句)
+            params: 查詢參數
+
+        Returns:
+            檢查結果
+
+        Raises:
+            ValueError: SQL 不是單一只讀語句
+        """
+        return self.evaluate(self._explain(conn, sql, params))
+
+    async def check_async(self, conn, sql: str, params: Optional[Dict[str, Any]] = None) -> PlanCheck:
+        """
+        檢查查詢的預估成本 (非同步版本，與 check() 共用執行計畫快取)
+
+        Args:
+            conn: SQLAlchemy 非同步連線
+            sql: SQL 查詢語句 (必須是單一只讀語句)
+            params: 查詢參數
+
+        Returns:
+            檢查結果
+
+        Raises:
+            ValueError: SQL 不是單一只讀語句
+        """
+        self._require_explainable(sql)
+        key, plan = self.lookup(sql, params)
+        if plan is None:
+            result = await conn.execute(text(self.explain_sql(sql)), params or {})
+            plan = self.store(key, result.fetchone())
+        return self.evaluate(plan)
+
+    def evaluate(self, plan: Dict[str, Any]) -> PlanCheck:
+        """依上限判斷執行計畫是否允許執行"""
+        total_cost = float(plan.get("Total Cost", 0))
+        plan_rows = float(plan.get("Plan Rows", 0))
+
+        problems = []
+        if self.max_cost and total_cost > self.max_cost:
+            problems.append(f"預估成本 {total_cost:.0f} 超過上限 {self.max_cost:.0f}")
+        if self.max_rows and plan_rows > self.max_rows:
+            problems.append(f"預估返回 {plan_rows:.0f} 列，超過上限 {self.max_rows:.0f}")
+        if not problems:
+            return PlanCheck(True, total_cost, plan_rows)
+
+        hotspots = describe_hotspots(plan)
+        reason = "；".join(problems)
+        logger.warning(f"查詢成本超出上限: {reason}")
+        return PlanCheck(
+            False, total_cost, plan_rows, reason,
+            requires_confirmation=self.action == "confirm",
+            hotspots=hotspots
+        )
+
+    def clear(self, payload: Optional[str] = None) -> None:
+        """清除快取的執行計畫 (可直接作為結構變更通知的回呼)"""
+        with self._lock:
+            self._plans.clear()
@@ -1,8 +1,17 @@
 from typing import List, Dict, Any, Optional, Tuple
 import time
 import logging
+import threading
 from sqlalchemy import create_engine, text, exc
 from ..utils import settings
+from ..utils.profiling import stage
+from ..utils.sql_parser import SQLAnalysis, analyze_sql
+from ..schema import get_catalog
+from .db_notifications import DatabaseListener
+from .schema_cache import LiveSchemaCache
+from .prepared_statements import PreparedStatementCache
+from .result_cache import QueryResultCache
+from .cost_gate import CostGate, PlanCheck
 import json
 import re
 from typing import Tuple
@@ -14,22 +23,27 @@ logger = logging.getLogger(__name__)
 class QueryResult:
     """SQL 查詢結果"""
     
-    def __init__(self, columns: List[str], rows: List[List[Any]], row_count: int, execution_time: float, error: Optional[str] = None):
+    def __init__(self, columns: List[str], rows: List[List[Any]], row_count: int, execution_time: float, error: Optional[str] = None,
+                 plan_check: Optional[Dict[str, Any]] = None):
         self.columns = columns
         self.rows = rows
         self.row_count = row_count
         self.execution_time = execution_time
         self.error = error
+        self.plan_check = plan_check  # 成本檢查未通過時的檢查結果
     
     def to_dict(self) -> Dict[str, Any]:
         """將查詢結果轉換為字典"""
-        return {
+        result = {
             "columns": self.columns,
             "rows": self.rows,
             "row_count": self.row_count,
             "execution_time": self.execution_time,
             "error": self.error
         }
+        if self.plan_check is not None:
+            result["plan_check"] = self.plan_check
+        return result
     
     def to_json(self) -> str:
         """將查詢結果轉換為 JSON 字符串"""
@@ -45,59 +59,111 @@ class DatabaseService:
     """資料庫服務"""
     
     def __init__(self):
-        """初始化資料庫服務"""
+        """初始化資料庫服務 (不連接資料庫，第一次需要連線時才建立連線池)"""
         self.connected = False
         self.engine = None
+        self.schema_cache = None
+        self.listener = None
+        self._connect_attempted = False
+        self._connect_lock = threading.Lock()
+        self.prepared_statements = PreparedStatementCache(settings.prepared_statement_cache_size)
+        self.result_cache = QueryResultCache(settings.query_cache_ttl, settings.query_cache_max_entries)
+        self.cost_gate = None
+        if settings.explain_gate_enabled:
+            self.cost_gate = CostGate(settings.explain_max_cost, settings.explain_max_rows, settings.explain_action)
+    
+    def connect(self) -> bool:
+        """
+        建立連線池並測試連接 (只嘗試一次)，連接後啟動結構快取與資料庫通知監聽
         
-        try:
-            self.engine = create_engine(settings.database_url)
-            # 測試連接
-            with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-            self.connected = True
-            logger.info("資料庫連接成功")
-        except Exception as e:
-            logger.error(f"資料庫連接失敗: {e}")
+        Returns:
+            是否已連接
+        """
+        if self._connect_attempted:
+            return self.connected
+        
+        with self._connect_lock:
+            if self._connect_attempted:
+                return self.connected
+            
+            try:
+                self.engine = create_engine(settings.database_url)
+                # 測試連接
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                self.connected = True
+                logger.info("資料庫連接成功")
+            except Exception as e:
+                logger.error(f"資料庫連接失敗: {e}")
+            
+            if self.connected:
+                self.schema_cache = LiveSchemaCache(self.engine, ttl=settings.schema_cache_ttl)
+                
+                # 結構變更 (migrations/001_schema_change_notify.sql) 與資料表變更
+                # (migrations/002_table_change_notify.sql) 通知分別使結構快取與查詢結果快取失效
+                self.listener = DatabaseListener(self.engine)
+                if settings.schema_notify_channel:
+                    self.listener.subscribe(settings.schema_notify_channel, self.schema_cache.invalidate)
+                    if self.cost_gate is not None:
+                        self.listener.subscribe(settings.schema_notify_channel, self.cost_gate.clear)
+                if settings.table_notify_channel and self.result_cache.enabled:
+                    self.listener.subscribe(settings.table_notify_channel, self.result_cache.invalidate_table)
+                self.listener.start()
+            
+            self._connect_attempted = True
+        return self.connected
     
     def is_connected(self) -> bool:
-        """檢查是否連接到資料庫"""
-        return self.connected
+        """檢查是否連接到資料庫 (第一次呼叫時連接)"""
+        return self.connect()
     
     def is_safe_query(self, sql: str) -> Tuple[bool, str]:
         """
         檢查 SQL 查詢是否安全（只讀查詢）
         
+        以語法樹檢查每個語句，字串常值中的關鍵字 (例如 LIKE '%update%') 不會誤判。
+        
         Args:
             sql: SQL 查詢
             
         Returns:
             是否安全，以及不安全的原因（如果不安全）
         """
-        # 移除註釋
-        sql = re.sub(r'--.*?(\n|$)', ' ', sql)
-        sql = re.sub(r'/\*.*?\*/', ' ', sql, flags=re.DOTALL)
-        sql = sql.strip()
-        
-        # 檢查 SQL 是否為只讀查詢
-        dangerous_keywords = [
-            r'\bINSERT\b', r'\bUPDATE\b', r'\bDELETE\b', r'\bDROP\b', 
-            r'\bCREATE\b', r'\bALTER\b', r'\bTRUNCATE\b', r'\bRENAME\b', 
-            r'\bGRANT\b', r'\bREVOKE\b'
-        ]
+        analysis = analyze_sql(sql)
+        return analysis.is_read_only, analysis.reason
+    
+    def check_query_cost(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Optional[PlanCheck]:
+        """
+        以 EXPLAIN 檢查查詢的預估成本
         
-        for keyword in dangerous_keywords:
-            if re.search(keyword, sql, re.IGNORECASE):
-                return False, f"不允許執行包含 '{re.search(keyword, sql, re.IGNORECASE).group(0)}' 的查詢"
+        Args:
+            sql: SQL 查詢語句
+            params: 查詢參數
+            
+        Returns:
+            檢查結果；未啟用成本檢查、SQL 不是單一只讀語句、未連接或無法取得執行計畫時返回 None
+        """
+        # 只讀檢查必須在 EXPLAIN 之前：不安全的 SQL 不送到資料庫
+        if self.cost_gate is None or not self.cost_gate.can_explain(sql) or not self.is_connected():
+            return None
         
-        return True, ""
+        try:
+            with stage("sql_explain"):
+                with self.engine.connect() as conn:
+                    return self.cost_gate.check(conn, sql, params)
+        except Exception as e:
+            # 無法取得執行計畫 (例如 SQL 有錯誤) 時交由實際執行回報錯誤
+            logger.debug(f"取得執行計畫失敗: {e}")
+            return None
     
-    def execute_query(self, sql: str, params: Optional[Dict[str, Any]] = None) -> QueryResult:
+    def execute_query(self, sql: str, params: Optional[Dict[str, Any]] = None, confirmed: bool = False) -> QueryResult:
         """
         執行 SQL 查詢
         
         Args:
             sql: SQL 查詢語句
             params: 查詢參數
+            confirmed: 用戶已確認執行超出成本上限的查詢 (EXPLAIN_ACTION=confirm 時)
             
         Returns:
             查詢結果
@@ -105,60 +171,29 @@ class DatabaseService:
         if not self.is_connected():
             return QueryResult.from_error("未連接到資料庫")
         
-        # 檢查查詢安全性
-        is_safe, reason = self.is_safe_query(sql)
-        if not is_safe:
-            return QueryResult.from_error(f"不安全的查詢: {reason}")
+        start_time = time.perf_counter()
+        analysis, cache_key, table_versions, early_result = self.prepare_execution(sql, params, start_time)
+        if early_result is not None:
+            return early_result
+        
+        # 執行前檢查預估成本
+        rejection = self.cost_rejection(self.check_query_cost(sql, params), confirmed)
+        if rejection is not None:
+            return rejection
         
         try:
-            start_time = time.time()
-            
-            # 檢查是否是函數調用
-            is_function_call = False
-            function_name = None
-            
-            # 簡單的函數調用檢測（更複雜的邏輯可能需要SQL解析器）
-            if "FROM" in sql.upper() and "(" in sql and ")" in sql:
-                # 提取 FROM 後的函數名
-                from_parts = sql.upper().split("FROM")[1].strip().split()
-                if from_parts and "(" in from_parts[0]:
-                    function_parts = from_parts[0].split("(")[0].strip()
-                    if function_parts:
-                        is_function_call = True
-                        function_name = function_parts.lower()
-            
-            with self.engine.connect() as conn:
-                try:
-                    # 執行查詢
-                    result = conn.execute(text(sql), params or {})
-                    
-                    # 獲取列名
-                    columns = result.keys()
-                    
-                    # 獲取行數據
-                    rows = [list(row) for row in result.fetchall()]
-                    
-                    # 計算執行時間
-                    execution_time = (time.time() - start_time) * 1000  # 轉換為毫秒
-                    
-                    return QueryResult(
-                        columns=columns,
-                        rows=rows,
-                        row_count=len(rows),
-                        execution_time=execution_time
-                    )
-                    
-                except exc.ProgrammingError as e:
-                    # 處理特定的函數不存在錯誤
-                    if is_function_call and "function does not exist" in str(e).lower():
-                        logger.error(f"資料庫函數不存在: {function_name}")
-                        
-                        # 記錄此函數錯誤，後續可以更新 db_functions 中的狀態
-                        return QueryResult.from_error(
-                            f"函數 '{function_name}' 不存在或未正確安裝到資料庫。請使用直接查詢替代此函數調用。"
-                        )
-                    else:
-                        raise
+            try:
+                with stage("sql_execute"):
+                    columns, rows = self.fetch_rows(sql, params)
+                
+                return self.finish_execution(columns, rows, start_time, cache_key, table_versions)
+                
+            except exc.ProgrammingError as e:
+                # 處理特定的函數不存在錯誤
+                missing = self.missing_function_result(e, analysis)
+                if missing is None:
+                    raise
+                return missing
                 
         except exc.SQLAlchemyError as e:
             logger.error(f"SQL 查詢執行錯誤: {e}")
@@ -166,8 +201,102 @@ class DatabaseService:
         except Exception as e:
             logger.error(f"執行查詢時發生未知錯誤: {e}")
             return QueryResult.from_error(f"未知錯誤: {str(e)}")
+    
+    def fetch_rows(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[List[str], List[List[Any]]]:
+        """
+        只執行查詢並讀取結果 (不做安全檢查、結果快取與成本檢查，呼叫端須已完成)
+        
+        Returns:
+            (列名, 行數據) 的元組
+        """
+        with self.engine.connect() as conn:
+            result = self.prepared_statements.execute(conn, sql, params)
+            return list(result.keys()), [list(row) for row in result.fetchall()]
+    
+    def prepare_execution(self, sql: str, params: Optional[Dict[str, Any]], start_time: float
+                          ) -> Tuple[SQLAnalysis, Optional[str], Dict[str, int], Optional[QueryResult]]:
+        """
+        執行前的安全檢查與結果快取查詢 (同步與非同步執行共用)
+        
+        Args:
+            sql: SQL 查詢語句
+            params: 查詢參數
+            start_time: 開始時間 (time.perf_counter())
+            
+        Returns:
+            (解析結果, 結果快取鍵, 依賴資料表的版本, 不需執行即可返回的結果)；
+            快取鍵為 None 表示結果不快取，最後一項不為 None 時 (不安全或命中快取) 直接返回
+        """
+        # 檢查查詢安全性 (解析結果同時供函數偵測與結果快取使用)
+        with stage("sql_safety_check"):
+            analysis = analyze_sql(sql)
+        if not analysis.is_read_only:
+            return analysis, None, {}, QueryResult.from_error(f"不安全的查詢: {analysis.reason}")
+        
+        # 只讀查詢優先使用快取的結果
+        catalog = get_catalog()
+        called_functions = [name for name in analysis.functions if catalog.has_function(name)]
+        writing_functions = [name for name in called_functions if catalog.is_writing_function(name)]
+        if not self.result_cache.enabled or writing_functions or not self.result_cache.is_cacheable(sql, analysis):
+            return analysis, None, {}, None
+        
+        cache_key = self.result_cache.make_key(sql, params)
+        # 執行前記錄依賴資料表的版本，執行期間發生的變更會使這次的結果直接失效
+        table_versions = self.result_cache.get_versions(catalog.expand_tables(analysis.tables, called_functions))
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return analysis, cache_key, table_versions, QueryResult(
+                columns=cached.columns,
+                rows=cached.rows,
+                row_count=cached.row_count,
+                execution_time=(time.perf_counter() - start_time) * 1000
+            )
+        return analysis, cache_key, table_versions, None
+    
+    @staticmethod
+    def cost_rejection(plan_check: Optional[PlanCheck], confirmed: bool) -> Optional[QueryResult]:
+        """成本檢查未通過 (且未經確認) 時返回錯誤結果，否則返回 None"""
+        if plan_check is None or plan_check.allowed or (plan_check.requires_confirmation and confirmed):
+            return None
+        if plan_check.requires_confirmation:
+            message = f"查詢成本過高，需確認後才執行: {plan_check.reason}"
+        else:
+            message = f"查詢成本過高，已拒絕執行: {plan_check.reason}"
+        return QueryResult(columns=[], rows=[], row_count=0, execution_time=0, error=message,
+                           plan_check=plan_check.to_dict())
+    
+    def finish_execution(self, columns: List[str], rows: List[List[Any]], start_time: float,
+                         cache_key: Optional[str], table_versions: Dict[str, int]) -> QueryResult:
+        """建立查詢結果並保存到結果快取"""
+        # 計算執行時間
+        execution_time = (time.perf_counter() - start_time) * 1000  # 轉換為毫秒
+        
+        query_result = QueryResult(
+            columns=columns,
+            rows=rows,
+            row_count=len(rows),
+            execution_time=execution_time
+        )
+        if cache_key is not None:
+            self.result_cache.set(cache_key, query_result, table_versions)
+        return query_result
+    
+    @staticmethod
+    def missing_function_result(error: Exception, analysis: SQLAnalysis) -> Optional[QueryResult]:
+        """查詢呼叫的資料庫函數不存在時返回說明的錯誤結果，其他錯誤返回 None"""
+        missing = re.search(r'function ([\w.]+)\(.*?\) does not exist', str(error), re.IGNORECASE)
+        if not analysis.functions or not missing:
+            return None
+        function_name = missing.group(1).lower()
+        logger.error(f"資料庫函數不存在: {function_name}")
+        
+        # 記錄此函數錯誤，後續可以更新 db_functions 中的狀態
+        return QueryResult.from_error(
+            f"函數 '{function_name}' 不存在或未正確安裝到資料庫。請使用直接查詢替代此函數調用。"
+        )
             
-    def execute_query_with_viz(self, sql: str, params: Optional[Dict[str, Any]] = None, visualize: bool = False) -> Tuple[QueryResult, Optional[Dict]]:
+    def execute_query_with_viz(self, sql: str, params: Optional[Dict[str, Any]] = None, visualize: bool = False,
+                               confirmed: bool = False) -> Tuple[QueryResult, Optional[Dict]]:
         """
         執行 SQL 查詢並生成視覺化
         
@@ -175,17 +304,33 @@ class DatabaseService:
             sql: SQL 查詢語句
             params: 查詢參數
             visualize: 是否生成視覺化
+            confirmed: 用戶已確認執行超出成本上限的查詢
             
         Returns:
             (查詢結果, 視覺化元數據) 的元組
         """
-        from .visualization_service import visualization_service
-        
         # 執行查詢
-        result = self.execute_query(sql, params)
+        result = self.execute_query(sql, params, confirmed=confirmed)
         
-        # 如果需要視覺化且查詢成功
-        if visualize and not result.error and result.columns and result.rows:
+        if visualize:
+            return result, self.visualize_result(sql, result)
+        return result, None
+    
+    def visualize_result(self, sql: str, result: QueryResult) -> Optional[Dict]:
+        """
+        為查詢結果生成視覺化 (同步與非同步執行共用)
+        
+        Args:
+            sql: SQL 查詢語句
+            result: 查詢結果
+            
+        Returns:
+            視覺化元數據；查詢失敗、沒有資料或不適合視覺化時返回 None
+        """
+        # 如果查詢成功
+        if not result.error and result.columns and result.rows:
+            from .visualization_service import visualization_service
+            
             # 檢查查詢是否適合視覺化
             should_visualize = visualization_service.detect_visualization_query(sql)
             
@@ -210,15 +355,16 @@ class DatabaseService:
                         pass
                 
                 # 生成視覺化
-                viz_path, viz_metadata = visualization_service.create_visualization(
-                    columns=result.columns,
-                    rows=result.rows,
-                    title=title
-                )
+                with stage("visualization"):
+                    viz_path, viz_metadata = visualization_service.create_visualization(
+                        columns=result.columns,
+                        rows=result.rows,
+                        title=title
+                    )
                 
-                return result, viz_metadata
+                return viz_metadata
         
-        return result, None
+        return None
     
     def get_tables(self) -> List[str]:
         """獲取所有表名"""
@@ -226,16 +372,7 @@ class DatabaseService:
             return []
         
         try:
-            with self.engine.connect() as conn:
-                # PostgreSQL 特定查詢，獲取所有公共表
-                result = conn.execute(text("""
-                    SELECT table_name 
-                    FROM information_schema.tables 
-                    WHERE table_schema = 'public'
-                    ORDER BY table_name
-                """))
-                
-                return [row[0] for row in result.fetchall()]
+            return self.schema_cache.get_tables()
         except Exception as e:
             logger.error(f"獲取表名失敗: {e}")
             return []
@@ -254,63 +391,32 @@ class DatabaseService:
             return {"error": "未連接到資料庫"}
         
         try:
-            with self.engine.connect() as conn:
-                # 獲取列信息
-                columns_result = conn.execute(text("""
-                    SELECT column_name, data_type, is_nullable, column_default
-                    FROM information_schema.columns
-                    WHERE table_schema = 'public' AND table_name = :table_name
-                    ORDER BY ordinal_position
-                """), {"table_name": table_name})
-                
-                columns = [{
-                    "name": row[0],
-                    "type": row[1],
-                    "nullable": row[2] == "YES",
-                    "default": row[3]
-                } for row in columns_result.fetchall()]
-                
-                # 獲取主鍵信息
-                pk_result = conn.execute(text("""
-                    SELECT c.column_name
-                    FROM information_schema.table_constraints tc
-                    JOIN information_schema.constraint_column_usage AS ccu USING (constraint_schema, constraint_name)
-                    JOIN information_schema.columns AS c ON c.table_schema = tc.constraint_schema
-                        AND tc.table_name = c.table_name AND ccu.column_name = c.column_name
-                    WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_name = :table_name
-                """), {"table_name": table_name})
-                
-                primary_keys = [row[0] for row in pk_result.fetchall()]
-                
-                # 獲取外鍵信息
-                fk_result = conn.execute(text("""
-                    SELECT
-                        kcu.column_name,
-                        ccu.table_name AS foreign_table_name,
-                        ccu.column_name AS foreign_column_name
-                    FROM information_schema.table_constraints AS tc
-                    JOIN information_schema.key_column_usage AS kcu
-                      ON tc.constraint_name = kcu.constraint_name
-                      AND tc.table_schema = kcu.table_schema
-                    JOIN information_schema.constraint_column_usage AS ccu
-                      ON ccu.constraint_name = tc.constraint_name
-                      AND ccu.table_schema = tc.table_schema
-                    WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_name = :table_name
-                """), {"table_name": table_name})
-                
-                foreign_keys = [{
-                    "column": row[0],
-                    "reference_table": row[1],
-                    "reference_column": row[2]
-                } for row in fk_result.fetchall()]
-                
-                return {
-                    "table_name": table_name,
-                    "columns": columns,
-                    "primary_keys": primary_keys,
-                    "foreign_keys": foreign_keys
-                }
-                
+            return self.format_table_schema(table_name, self.schema_cache.get_table(table_name))
         except Exception as e:
             logger.error(f"獲取表結構失敗: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
+    
+    @staticmethod
+    def format_table_schema(table_name: str, table: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """將結構快取中的資料表轉換為回應格式 (複製內容，避免呼叫端修改快取)"""
+        if table is None:
+            return {
+                "table_name": table_name,
+                "columns": [],
+                "primary_keys": [],
+                "foreign_keys": []
+            }
+        
+        return {
+            "table_name": table_name,
+            "columns": [dict(column) for column in table["columns"]],
+            "primary_keys": list(table["primary_keys"]),
+            "foreign_keys": [dict(fk) for fk in table["foreign_keys"]]
+        }
+    
+    def close(self) -> None:
+        """停止資料庫通知監聽並釋放連線池"""
+        if self.listener is not None:
+            self.listener.stop()
+        if self.engine is not None:
+            self.engine.dispose()
@@ -0,0 +1,114 @@
+import logging
+import re
+import select
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+_CHANNEL_PATTERN = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+
+# 通知回呼，參數為通知內容；重新連線後以 None 呼叫，表示期間可能遺漏通知
+NotificationCallback = Callable[[Optional[str]], None]
+
+
+class DatabaseListener:
+    """
+    以單一連線監聽 PostgreSQL NOTIFY 並分派給訂閱者
+
+    在背景執行緒中執行 LISTEN，連線中斷時以遞增間隔重新連線。
+    支援 psycopg2 與 psycopg 3。
+    """
+
+    def __init__(self, engine, poll_interval: float = 5.0):
+        """
+        Args:
+            engine: SQLAlchemy 引擎
+            poll_interval: 等待通知的逾時秒數 (檢查是否停止的間隔)
+        """
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, List[NotificationCallback]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def subscribe(self, channel: str, callback: NotificationCallback) -> None:
+        """訂閱頻道 (需在 start() 之前呼叫)"""
+        if not _CHANNEL_PATTERN.match(channel):
+            raise ValueError(f"無效的通知頻道名稱: {channel}")
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def start(self) -> None:
+        """啟動監聽執行緒"""
+        if not self._subscribers or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._listen, name="db-notification-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止監聽執行緒"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 2)
+            self._thread = None
+
+    def _dispatch(self, channel: str, payload: Optional[str]) -> None:
+        """呼叫頻道的所有訂閱者"""
+        for callback in self._subscribers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"處理資料庫通知失敗 ({channel}): {e}")
+
+    def _listen(self) -> None:
+        """監聽迴圈"""
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            raw = None
+            try:
+                raw = self.engine.raw_connection()
+                connection = getattr(raw, "driver_connection", None) or raw.connection
+                connection.autocommit = True
+                cursor = connection.cursor()
+                for channel in self._subscribers:
+                    cursor.execute(f"LISTEN {channel}")
+                cursor.close()
+                logger.info(f"開始監聽資料庫通知: {', '.join(self._subscribers)}")
+                # 連線中斷期間可能遺漏通知
+                for channel in self._subscribers:
+                    self._dispatch(channel, None)
+                backoff = 1.0
+
+                while not self._stop_event.is_set():
+                    for channel, payload in self._wait_for_notifies(connection, self.poll_interval):
+                        self._dispatch(channel, payload)
+            except Exception as e:
+                logger.warning(f"監聽資料庫通知失敗，{backoff:.0f} 秒後重試: {e}")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    @staticmethod
+    def _wait_for_notifies(connection, timeout: float) -> Iterator[Tuple[str, Optional[str]]]:
+        """等待通知，逐一產生 (頻道, 內容)，最多等待 timeout 秒"""
+        if callable(getattr(connection, "notifies", None)):
+            # psycopg 3: notifies() 為產生器，timeout 後結束
+            for notify in connection.notifies(timeout=timeout):
+                yield notify.channel, notify.payload
+            return
+
+        # psycopg2: 等待 socket 可讀後 poll()，通知累積在 connection.notifies
+        if select.select([connection], [], [], timeout) == ([], [], []):
+            return
+        connection.poll()
+        received = list(connection.notifies)
+        connection.notifies.clear()
+        for notify in received:
+            yield notify.channel, notify.payload
@@ -0,0 +1,101 @@
+from datetime import datetime
+from typing import Tuple
+from uuid import UUID as UUIDValue, uuid4
+from sqlalchemy import Column, String, Boolean, Float, DateTime, Text, Integer, Index, literal, text, tuple_
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
+from ..models import QueryHistoryModel
+
+# SQLAlchemy ORM 定義 (只在使用資料庫存儲時由 history_service 匯入，JSON 文件存儲不需載入 SQLAlchemy)
+Base = declarative_base()
+
+
+class QueryHistory(Base):
+    """查詢歷史 SQLAlchemy 模型"""
+    __tablename__ = "query_history"
+    
+    id = Column(UUID, primary_key=True, default=uuid4)
+    user_query = Column(Text, nullable=False)
+    generated_sql = Column(Text, nullable=False)
+    explanation = Column(Text, nullable=False)
+    executed = Column(Boolean, default=False)
+    execution_time = Column(Float, nullable=True)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, nullable=True, onupdate=datetime.now)
+    
+    # 對話支持欄位
+    conversation_id = Column(String, nullable=True)
+    references_query_id = Column(String, nullable=True)
+    resolved_query = Column(Text, nullable=True)
+    entity_references = Column(JSONB, nullable=True)
+    
+    # 參數化查詢
+    parameters = Column(JSONB, nullable=True)
+    
+    # 收藏與模板支持
+    is_favorite = Column(Boolean, default=False)
+    is_template = Column(Boolean, default=False)
+    template_name = Column(String, nullable=True)
+    template_description = Column(Text, nullable=True)
+    template_tags = Column(ARRAY(String), nullable=True)
+    
+    # 游標分頁的排序鍵為 (created_at, id)，與 migrations/003_query_history_indexes.sql 相同
+    __table_args__ = (
+        Index("idx_query_history_created_at", "created_at", "id"),
+        Index("idx_query_history_conversation", "conversation_id", "created_at", "id"),
+        Index("idx_query_history_favorites", "created_at", "id", postgresql_where=text("is_favorite")),
+        Index("idx_query_history_templates", "created_at", "id", postgresql_where=text("is_template")),
+        # 全文搜尋的 tsvector 與 pg_trgm 索引需要 pg_trgm 擴充，只由 migrations/004_query_history_search.sql 建立
+    )
+
+
+def keyset_condition(before: Tuple[str, str]):
+    """資料庫的游標條件 (created_at, id) < (游標)，參數帶入欄位類型"""
+    created_at, query_id = before
+    return tuple_(QueryHistory.created_at, QueryHistory.id) < tuple_(
+        literal(datetime.fromisoformat(created_at), QueryHistory.created_at.type),
+        literal(UUIDValue(query_id), QueryHistory.id.type)
+    )
+
+
+def db_record_to_model(record: "QueryHistory") -> QueryHistoryModel:
+    """將 SQLAlchemy 記錄轉換為 Pydantic 模型"""
+    return QueryHistoryModel(
+        id=record.id,
+        user_query=record.user_query,
+        generated_sql=record.generated_sql,
+        explanation=record.explanation,
+        executed=record.executed,
+        execution_time=record.execution_time,
+        error_message=record.error_message,
+        created_at=record.created_at,
+        updated_at=record.updated_at,
+        conversation_id=record.conversation_id,
+        references_query_id=record.references_query_id,
+        resolved_query=record.resolved_query,
+        entity_references=record.entity_references or {},
+        parameters=record.parameters or {},
+        is_favorite=record.is_favorite or False,
+        is_template=record.is_template or False,
+        template_name=record.template_name,
+        template_description=record.template_description,
+        template_tags=record.template_tags or []
+    )
+
+
+class QueryTemplate(Base):
+    """查詢模板 SQLAlchemy 模型"""
+    __tablename__ = "query_templates"
+    
+    id = Column(UUID, primary_key=True, default=uuid4)
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    user_query = Column(Text, nullable=False)
+    generated_sql = Column(Text, nullable=False)
+    explanation = Column(Text, nullable=True)
+    parameters = Column(JSONB, nullable=True)
+    tags = Column(ARRAY(String), nullable=True)
+    usage_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, nullable=True, onupdate=datetime.now)
@@ -0,0 +1,218 @@
+import bisect
+import heapq
+import json
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .history_search import InvertedIndex
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 排序鍵 (created_at, id)，與資料庫的 ORDER BY created_at DESC, id DESC 相同
+SortKey = Tuple[str, str]
+
+# 搜尋符合的記錄不超過此數時全部排序，否則由新到舊走訪
+SEARCH_RANK_ALL_LIMIT = 5000
+
+# 索引名稱
+ALL = "all"
+FAVORITES = "favorites"
+TEMPLATES = "templates"
+
+
+def conversation_index(conversation_id: str) -> str:
+    """對話歷史的索引名稱"""
+    return f"conversation:{conversation_id}"
+
+
+def sort_key(record: Dict[str, Any]) -> SortKey:
+    """記錄的排序鍵"""
+    return (record.get("created_at") or "", str(record.get("id")))
+
+
+def search_fields(record: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """全文搜尋的欄位 (與資料庫索引相同: user_query、generated_sql)"""
+    return record.get("user_query"), record.get("generated_sql")
+
+
+class FileHistoryIndex:
+    """
+    JSON 文件查詢歷史的記憶體索引
+
+    依 (created_at, id) 遞增排序保存全部記錄、收藏、模板與各對話的排序鍵，
+    分頁以二分搜尋定位游標，不需每次讀取整個文件再排序。
+    文件的修改時間或大小與索引不符 (例如其他程序寫入) 時重新載入；背景批次寫入後以 apply() 直接更新。
+    全文搜尋的倒排索引在第一次搜尋時建立，之後隨記錄增量更新。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path: Optional[str] = None
+        self._signature: Optional[Tuple[int, int]] = None
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._indexes: Dict[str, List[SortKey]] = {}
+        self._search_index: Optional["InvertedIndex"] = None
+
+    @staticmethod
+    def signature(path: str) -> Optional[Tuple[int, int]]:
+        """文件的修改時間與大小，文件不存在時返回 None"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _index_names(record: Dict[str, Any]) -> List[str]:
+        """記錄所屬的索引"""
+        names = [ALL]
+        if record.get("is_favorite"):
+            names.append(FAVORITES)
+        if record.get("is_template"):
+            names.append(TEMPLATES)
+        if record.get("conversation_id"):
+            names.append(conversation_index(record["conversation_id"]))
+        return names
+
+    def _add(self, record: Dict[str, Any]) -> None:
+        """加入記錄 (呼叫端需持有鎖)"""
+        key = sort_key(record)
+        self._records[key[1]] = record
+        for name in self._index_names(record):
+            bisect.insort(self._indexes.setdefault(name, []), key)
+        if self._search_index is not None:
+            self._search_index.add(key[1], search_fields(record))
+
+    def _remove(self, record_id: str) -> None:
+        """移除記錄 (呼叫端需持有鎖)"""
+        record = self._records.pop(record_id, None)
+        if record is None:
+            return
+        if self._search_index is not None:
+            self._search_index.remove(record_id)
+        key = sort_key(record)
+        for name in self._index_names(record):
+            keys = self._indexes.get(name, [])
+            position = bisect.bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                del keys[position]
+
+    def _ensure_loaded(self, path: str) -> None:
+        """文件與索引不符時重新載入 (呼叫端需持有鎖)"""
+        signature = self.signature(path)
+        if path == self._path and signature == self._signature:
+            return
+
+        history: List[Dict[str, Any]] = []
+        if signature is not None:
+            with open(path, "r", encoding="utf-8") as f:
+                history = json.load(f)
+        self._records = {}
+        self._indexes = {}
+        self._search_index = None
+        for record in history:
+            self._remove(str(record.get("id")))
+            self._add(record)
+        self._path = path
+        self._signature = signature
+        logger.debug(f"已載入查詢歷史索引: {len(self._records)} 筆")
+
+    def get(self, path: str, record_id: str) -> Optional[Dict[str, Any]]:
+        """依 ID 獲取記錄"""
+        with self._lock:
+            self._ensure_loaded(path)
+            return self._records.get(str(record_id))
+
+    def page(self, path: str, index: str, limit: int, before: Optional[SortKey] = None,
+             offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        依 created_at 由新到舊獲取一頁記錄
+
+        Args:
+            path: 歷史記錄文件
+            index: 索引名稱 (ALL、FAVORITES、TEMPLATES 或 conversation_index())
+            limit: 返回數量限制
+            before: 游標，只返回排序鍵小於此值的記錄
+            offset: 略過的記錄數 (相容舊的偏移量分頁)
+
+        Returns:
+            記錄列表
+        """
+        with self._lock:
+            self._ensure_loaded(path)
+            keys = self._indexes.get(index, [])
+            end = bisect.bisect_left(keys, before) if before is not None else len(keys)
+            end = max(0, end - offset)
+            start = max(0, end - limit)
+            return [self._records[key[1]] for key in reversed(keys[start:end])]
+
+    def search(self, path: str, text: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        全文搜尋 user_query 與 generated_sql
+
+        以倒排索引找出包含所有查詢詞的記錄，完整包含搜尋字串的記錄排在前面，其次由新到舊。
+
+        Args:
+            path: 歷史記錄文件
+            text: 搜尋字串
+            limit: 返回數量限制
+
+        Returns:
+            記錄列表
+        """
+        needle = text.strip().lower()
+
+        def is_exact(record: Dict[str, Any]) -> bool:
+            return any(needle in (field or "").lower() for field in search_fields(record))
+
+        with self._lock:
+            self._ensure_loaded(path)
+            if self._search_index is None:
+                from .history_search import InvertedIndex  # 第一次搜尋時才編譯分詞規則
+
+                self._search_index = InvertedIndex()
+                for record_id, record in self._records.items():
+                    self._search_index.add(record_id, search_fields(record))
+                logger.debug(f"已建立查詢歷史搜尋索引: {len(self._search_index)} 筆")
+            matched_ids = self._search_index.search(needle)
+
+            if len(matched_ids) <= SEARCH_RANK_ALL_LIMIT:
+                matches = [self._records[record_id] for record_id in matched_ids]
+                return heapq.nlargest(limit, matches, key=lambda record: (is_exact(record), sort_key(record)))
+
+            # 符合的記錄很多時 (常見的詞) 由新到舊走訪排序索引，湊滿完整包含搜尋字串的記錄即停止
+            exact: List[Dict[str, Any]] = []
+            partial: List[Dict[str, Any]] = []
+            for key in reversed(self._indexes.get(ALL, [])):
+                if key[1] not in matched_ids:
+                    continue
+                record = self._records[key[1]]
+                if is_exact(record):
+                    exact.append(record)
+                    if len(exact) >= limit:
+                        break
+                elif len(partial) < limit:
+                    partial.append(record)
+            return (exact + partial)[:limit]
+
+    def apply(self, path: str, records: Iterable[Dict[str, Any]], previous_signature: Optional[Tuple[int, int]]) -> None:
+        """
+        以剛寫入文件的記錄更新索引
+
+        Args:
+            path: 歷史記錄文件
+            records: 新增或更新的記錄
+            previous_signature: 寫入前讀取文件時的簽章；與索引不符時 (索引已過期) 改為下次讀取時重新載入
+        """
+        with self._lock:
+            if path != self._path or previous_signature != self._signature:
+                self._path = None
+                return
+            for record in records:
+                self._remove(str(record.get("id")))
+                self._add(record)
+            self._signature = self.signature(path)
@@ -0,0 +1,159 @@
+import bisect
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+# CJK 字元 (中日韓統一表意文字、擴充 A、相容表意文字、假名、韓文音節)
+_CJK_CHARS = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿"
+_CJK_PATTERN = re.compile(f"[{_CJK_CHARS}]")
+# 一次切出 CJK 連續字元 (第一組) 與其他單字 (第二組，英文、數字、底線，例如 SQL 識別字)
+_RUN_PATTERN = re.compile(f"([{_CJK_CHARS}]+)|([0-9a-z_]+)")
+
+# 前綴展開的詞彙數上限，避免極短的前綴 (例如 "a") 合併過多索引
+MAX_PREFIX_EXPANSION = 200
+
+
+def tokenize(text: Optional[str]) -> Set[str]:
+    """
+    將文字切為索引詞
+
+    CJK 沒有空白分詞，連續字元以二元組 (bigram) 索引，例如 "預約服務" -> 預約、約服、服務 (單獨一個字時為該字)；
+    其他文字以單字索引，含底線的識別字另外索引各段 (例如 n8n_booking_services 也可用 booking 找到)。
+    """
+    if not text:
+        return set()
+    tokens: Set[str] = set()
+    for cjk, word in _RUN_PATTERN.findall(text.lower()):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.add(cjk)
+            else:
+                tokens.update([cjk[i:i + 2] for i in range(len(cjk) - 1)])
+        else:
+            tokens.add(word)
+            if "_" in word:
+                tokens.update([part for part in word.split("_") if part])
+    return tokens
+
+
+def query_terms(text: str) -> List[str]:
+    """
+    將搜尋字串切為查詢詞
+
+    Returns:
+        必須全部符合的查詢詞；CJK 連續字元取每個二元組 (單一字元時為該字，比對所有包含它的二元組)，
+        其他單字以前綴比對 (例如 book 可找到 booking)，含底線的單字拆為各段
+    """
+    terms: List[str] = []
+    for cjk, word in _RUN_PATTERN.findall(text.lower()):
+        if cjk:
+            terms.extend([cjk] if len(cjk) == 1 else [cjk[i:i + 2] for i in range(len(cjk) - 1)])
+        else:
+            terms.extend([part for part in word.split("_") if part])
+    return terms
+
+
+def is_cjk(term: str) -> bool:
+    """查詢詞是否為 CJK (不做前綴展開)"""
+    return bool(_CJK_PATTERN.match(term))
+
+
+class InvertedIndex:
+    """
+    記憶體倒排索引
+
+    每個索引詞對應包含它的文件 ID；搜尋時取所有查詢詞的交集 (由最小的集合開始)，
+    不需逐筆掃描文字。非 CJK 的查詢詞以排序詞彙的二分搜尋做前綴展開，
+    單一 CJK 字元則合併所有包含它的二元組。
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._documents: Dict[str, Set[str]] = {}
+        self._vocabulary: List[str] = []  # 排序的非 CJK 詞彙，供前綴展開
+        self._vocabulary_dirty = False
+        self._cjk_vocabulary: List[str] = []  # CJK 詞彙，供單字查詢展開
+        self._cjk_vocabulary_dirty = False
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, doc_id: str, texts: Iterable[Optional[str]]) -> None:
+        """加入 (或取代) 文件"""
+        self.remove(doc_id)
+        tokens: Set[str] = set()
+        for text in texts:
+            tokens |= tokenize(text)
+        self._documents[doc_id] = tokens
+        postings = self._postings
+        vocabulary_size = len(postings)
+        for token in tokens:
+            postings[token].add(doc_id)
+        if len(postings) != vocabulary_size:
+            self._vocabulary_dirty = True
+            self._cjk_vocabulary_dirty = True
+
+    def remove(self, doc_id: str) -> None:
+        """移除文件"""
+        tokens = self._documents.pop(doc_id, None)
+        if not tokens:
+            return
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(doc_id)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary_dirty = True
+                self._cjk_vocabulary_dirty = True
+
+    def _expand(self, word: str) -> Set[str]:
+        """以前綴展開非 CJK 查詢詞，返回符合的文件 ID"""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(token for token in self._postings if not is_cjk(token))
+            self._vocabulary_dirty = False
+        matched: Set[str] = set(self._postings.get(word) or ())
+        start = bisect.bisect_left(self._vocabulary, word)
+        for token in self._vocabulary[start:start + MAX_PREFIX_EXPANSION]:
+            if not token.startswith(word):
+                break
+            matched |= self._postings[token]
+        return matched
+
+    def _expand_cjk(self, char: str) -> Set[str]:
+        """單一 CJK 字元合併所有包含它的索引詞，返回符合的文件 ID"""
+        if self._cjk_vocabulary_dirty:
+            self._cjk_vocabulary = [token for token in self._postings if is_cjk(token)]
+            self._cjk_vocabulary_dirty = False
+        matched: Set[str] = set()
+        for token in self._cjk_vocabulary:
+            if char in token:
+                matched |= self._postings[token]
+        return matched
+
+    def search(self, text: str) -> Set[str]:
+        """
+        搜尋包含所有查詢詞的文件
+
+        Returns:
+            符合的文件 ID；搜尋字串沒有可用的查詢詞時返回空集合
+        """
+        candidate_sets = []
+        for term in query_terms(text):
+            if is_cjk(term):
+                if len(term) == 1:
+                    candidate_sets.append(self._expand_cjk(term))
+                else:
+                    candidate_sets.append(self._postings.get(term) or set())
+            else:
+                candidate_sets.append(self._expand(term))
+        if not candidate_sets:
+            return set()
+        candidate_sets.sort(key=len)
+        result = set(candidate_sets[0])
+        for candidates in candidate_sets[1:]:
+            if not result:
+                break
+            result &= candidates
+        return result
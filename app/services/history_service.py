@@ -1,87 +1,125 @@
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
+import base64
 import json
 import os
-from uuid import uuid4
+from uuid import UUID as UUIDValue, uuid4
 from ..models import QueryHistoryModel, QueryTemplateModel
 import logging
-from sqlalchemy import create_engine, Column, String, Boolean, Float, DateTime, Text, Integer
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
-from sqlalchemy.orm import sessionmaker, Session
-from ..utils import settings
+import threading
+from .history_writer import HistoryWriter
+from .history_index import FileHistoryIndex, ALL, FAVORITES, conversation_index, sort_key
 
 # 設定日誌
 logger = logging.getLogger(__name__)
 
-# SQLAlchemy ORM 定義
-Base = declarative_base()
+def encode_cursor(created_at: Any, query_id: Any) -> str:
+    """將頁面最後一筆記錄的 (created_at, id) 編碼為游標"""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    payload = json.dumps([created_at or "", str(query_id)])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
 
 
-class QueryHistory(Base):
-    """查詢歷史 SQLAlchemy 模型"""
-    __tablename__ = "query_history"
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    解碼游標
     
-    id = Column(UUID, primary_key=True, default=uuid4)
-    user_query = Column(Text, nullable=False)
-    generated_sql = Column(Text, nullable=False)
-    explanation = Column(Text, nullable=False)
-    executed = Column(Boolean, default=False)
-    execution_time = Column(Float, nullable=True)
-    error_message = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, nullable=True, onupdate=datetime.now)
-    
-    # 對話支持欄位
-    conversation_id = Column(String, nullable=True)
-    references_query_id = Column(String, nullable=True)
-    resolved_query = Column(Text, nullable=True)
-    entity_references = Column(JSONB, nullable=True)
-    
-    # 參數化查詢
-    parameters = Column(JSONB, nullable=True)
-    
-    # 收藏與模板支持
-    is_favorite = Column(Boolean, default=False)
-    is_template = Column(Boolean, default=False)
-    template_name = Column(String, nullable=True)
-    template_description = Column(Text, nullable=True)
-    template_tags = Column(ARRAY(String), nullable=True)
+    Returns:
+        (created_at, id)
+        
+    Raises:
+        ValueError: 游標格式錯誤
+    """
+    try:
+        created_at, query_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        datetime.fromisoformat(created_at)
+        UUIDValue(query_id)
+        return created_at, query_id
+    except Exception:
+        raise ValueError(f"無效的分頁游標: {cursor}")
+
+
+# 全文搜尋的文件運算式，須與 migrations/004_query_history_search.sql 的運算式索引完全相同才會使用索引
+SEARCH_DOCUMENT = "to_tsvector('simple', coalesce(user_query, '') || ' ' || coalesce(generated_sql, ''))"
+
 
+def like_pattern(text_value: str) -> str:
+    """轉換為 ILIKE 的包含比對樣式 (跳脫 %、_ 與反斜線)"""
+    escaped = text_value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
 
-class QueryTemplate(Base):
-    """查詢模板 SQLAlchemy 模型"""
-    __tablename__ = "query_templates"
+
+def _template_matches(template: Dict[str, Any], search: str) -> bool:
+    """模板文件記錄是否包含所有查詢詞"""
+    from .history_search import query_terms, tokenize
     
-    id = Column(UUID, primary_key=True, default=uuid4)
-    name = Column(String, nullable=False)
-    description = Column(Text, nullable=True)
-    user_query = Column(Text, nullable=False)
-    generated_sql = Column(Text, nullable=False)
-    explanation = Column(Text, nullable=True)
-    parameters = Column(JSONB, nullable=True)
-    tags = Column(ARRAY(String), nullable=True)
-    usage_count = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, nullable=True, onupdate=datetime.now)
+    tokens = set()
+    for field in ("name", "description", "user_query", "generated_sql"):
+        tokens |= tokenize(template.get(field))
+    return all(term in tokens or any(token.startswith(term) for token in tokens) for term in query_terms(search))
+
+
+def _file_record_to_model(record: Dict[str, Any]) -> QueryHistoryModel:
+    """將 JSON 文件中的記錄轉換為 Pydantic 模型"""
+    return QueryHistoryModel(
+        id=record.get("id"),
+        user_query=record.get("user_query"),
+        generated_sql=record.get("generated_sql"),
+        explanation=record.get("explanation"),
+        executed=record.get("executed", False),
+        execution_time=record.get("execution_time"),
+        error_message=record.get("error_message"),
+        created_at=record.get("created_at"),
+        conversation_id=record.get("conversation_id"),
+        references_query_id=record.get("references_query_id"),
+        resolved_query=record.get("resolved_query"),
+        entity_references=record.get("entity_references", {}),
+        parameters=record.get("parameters", {}),
+        is_favorite=record.get("is_favorite", False),
+        is_template=record.get("is_template", False),
+        template_name=record.get("template_name"),
+        template_description=record.get("template_description"),
+        template_tags=record.get("template_tags", [])
+    )
+
+
+def __getattr__(name: str):
+    # 資料表定義移至 history_db，只在使用資料庫存儲時才載入 SQLAlchemy
+    if name in ("Base", "QueryHistory", "QueryTemplate", "db_record_to_model", "keyset_condition"):
+        from . import history_db
+        return getattr(history_db, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class HistoryService:
     """查詢歷史服務"""
     
-    def __init__(self, use_db=True):
+    def __init__(self, use_db=True, write_behind: Optional[bool] = None):
         """
         初始化查詢歷史服務
         
         Args:
             use_db (bool): 是否使用資料庫存儲歷史記錄，如果為 False 則使用 JSON 文件
+            write_behind: 是否在背景批次寫入新增與更新，None 表示依 HISTORY_WRITE_BEHIND 設定
         """
         self.use_db = use_db
+        self.writer = None
+        self._write_behind = write_behind
+        self._writer_ready = False
+        self._writer_lock = threading.Lock()
+        self._file_index = FileHistoryIndex()  # JSON 文件存儲的排序索引
+        self.templates_version = 0  # 模板新增、修改或刪除時遞增 (不含使用次數)，供模板比對判斷是否重新載入
         self.history_file = os.path.join(os.path.dirname(__file__), "../../query_history.json")
         self.templates_file = os.path.join(os.path.dirname(__file__), "../../query_templates.json")
         
         if use_db:
             try:
+                from sqlalchemy import create_engine
+                from sqlalchemy.orm import sessionmaker
+                from .history_db import Base
+                from ..utils import settings
+                
                 self.engine = create_engine(settings.database_url)
                 Base.metadata.create_all(self.engine)
                 self.Session = sessionmaker(bind=self.engine)
@@ -91,6 +129,40 @@ class HistoryService:
                 self.use_db = False
                 logger.info("改用 JSON 文件存儲歷史記錄")
     
+    def get_writer(self) -> Optional[HistoryWriter]:
+        """
+        背景寫入器 (第一次新增或更新時建立)
+        
+        只讀取歷史的命令 (例如 text2sql history) 因此不載入設定，也不啟動背景執行緒。
+        """
+        if not self._writer_ready:
+            with self._writer_lock:
+                if not self._writer_ready:
+                    from ..utils import settings
+                    
+                    write_behind = self._write_behind
+                    if settings.history_write_behind if write_behind is None else write_behind:
+                        writer = HistoryWriter(
+                            self.write_batch,
+                            batch_size=settings.history_batch_size,
+                            flush_interval=settings.history_flush_interval,
+                            max_pending=settings.history_max_pending
+                        )
+                        writer.start()
+                        self.writer = writer
+                    self._writer_ready = True
+        return self.writer
+    
+    def flush(self) -> None:
+        """寫入背景佇列中尚未寫入的新增與更新 (讀取列表前呼叫，確保讀得到自己的寫入)"""
+        if self.writer is not None:
+            self.writer.flush()
+    
+    def close(self) -> None:
+        """停止背景寫入並寫完所有變更"""
+        if self.writer is not None:
+            self.writer.close()
+    
     def add_query(self, query_model: QueryHistoryModel) -> QueryHistoryModel:
         """
         添加查詢歷史記錄
@@ -101,6 +173,10 @@ class HistoryService:
         Returns:
             保存的查詢歷史模型
         """
+        writer = self.get_writer()
+        if writer is not None:
+            writer.enqueue(query_model, is_new=True)
+            return query_model
         if self.use_db:
             return self._add_query_to_db(query_model)
         else:
@@ -108,6 +184,7 @@ class HistoryService:
     
     def _add_query_to_db(self, query_model: QueryHistoryModel) -> QueryHistoryModel:
         """使用資料庫存儲查詢歷史"""
+        from .history_db import QueryHistory
         try:
             with self.Session() as session:
                 # 將 Pydantic 模型轉換為 SQLAlchemy 模型
@@ -192,56 +269,158 @@ class HistoryService:
         Returns:
             查詢歷史記錄列表
         """
+        self.flush()
         if self.use_db:
             return self._get_history_from_db(limit, offset)
         else:
             return self._get_history_from_file(limit, offset)
     
+    def get_history_page(self, limit: int = 20, cursor: Optional[str] = None, conversation_id: Optional[str] = None,
+                         favorites_only: bool = False) -> Tuple[List[QueryHistoryModel], Optional[str]]:
+        """
+        以游標 (keyset) 分頁獲取查詢歷史，依建立時間由新到舊
+        
+        與偏移量分頁不同，翻到越後面的頁面也只讀取一頁的資料 (資料庫使用 (created_at, id) 索引)。
+        
+        Args:
+            limit: 返回數量限制
+            cursor: 上一頁返回的游標，None 表示第一頁
+            conversation_id: 只返回此對話的查詢
+            favorites_only: 只返回收藏的查詢
+            
+        Returns:
+            (查詢歷史記錄列表, 下一頁的游標)；沒有下一頁時游標為 None
+            
+        Raises:
+            ValueError: 游標格式錯誤
+        """
+        before = decode_cursor(cursor) if cursor else None
+        self.flush()
+        if self.use_db:
+            try:
+                return self._get_history_page_from_db(limit, before, conversation_id, favorites_only)
+            except Exception as e:
+                logger.error(f"從資料庫獲取查詢歷史失敗: {e}")
+                # 失敗時改用文件讀取
+        return self._get_history_page_from_file(limit, before, conversation_id, favorites_only)
+    
+    def _get_history_page_from_db(self, limit: int, before: Optional[Tuple[str, str]], conversation_id: Optional[str],
+                                  favorites_only: bool) -> Tuple[List[QueryHistoryModel], Optional[str]]:
+        """從資料庫以游標分頁獲取查詢歷史"""
+        from .history_db import QueryHistory, db_record_to_model, keyset_condition
+        with self.Session() as session:
+            query = session.query(QueryHistory)
+            if conversation_id:
+                query = query.filter(QueryHistory.conversation_id == conversation_id)
+            if favorites_only:
+                query = query.filter(QueryHistory.is_favorite == True)
+            if before is not None:
+                query = query.filter(keyset_condition(before))
+            # 多取一筆判斷是否還有下一頁
+            records = query.order_by(
+                QueryHistory.created_at.desc(), QueryHistory.id.desc()
+            ).limit(limit + 1).all()
+            
+            next_cursor = None
+            if len(records) > limit:
+                records = records[:limit]
+                next_cursor = encode_cursor(records[-1].created_at, records[-1].id)
+            return [db_record_to_model(record) for record in records], next_cursor
+    
+    def _get_history_page_from_file(self, limit: int, before: Optional[Tuple[str, str]], conversation_id: Optional[str],
+                                    favorites_only: bool) -> Tuple[List[QueryHistoryModel], Optional[str]]:
+        """從文件的排序索引以游標分頁獲取查詢歷史"""
+        if conversation_id:
+            index = conversation_index(conversation_id)
+        else:
+            index = FAVORITES if favorites_only else ALL
+        # 對話索引另需篩選收藏時，繼續往後讀取直到湊滿一頁 (多取一筆判斷是否還有下一頁)
+        needs_filter = bool(conversation_id) and favorites_only
+        records: List[Dict[str, Any]] = []
+        while len(records) <= limit:
+            batch = self._file_index.page(self.history_file, index, limit + 1, before=before)
+            records.extend(record for record in batch if not needs_filter or record.get("is_favorite"))
+            if len(batch) <= limit:
+                break
+            before = sort_key(batch[-1])
+        records = records[:limit + 1]
+        
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = encode_cursor(records[-1].get("created_at"), records[-1].get("id"))
+        return [_file_record_to_model(record) for record in records], next_cursor
+    
+    def search_history(self, text_value: str, limit: int = 20) -> List[QueryHistoryModel]:
+        """
+        全文搜尋查詢歷史的 user_query 與 generated_sql
+        
+        資料庫使用 tsvector 與 pg_trgm 索引 (migrations/004_query_history_search.sql)，
+        JSON 文件使用記憶體倒排索引 (CJK 以二元組切詞)，都不需逐筆掃描。
+        完整包含搜尋字串的記錄排在前面，其次由新到舊。
+        
+        Args:
+            text_value: 搜尋字串
+            limit: 返回數量限制
+            
+        Returns:
+            查詢歷史記錄列表
+        """
+        text_value = text_value.strip()
+        if not text_value:
+            return []
+        self.flush()
+        if self.use_db:
+            try:
+                return self._search_history_in_db(text_value, limit)
+            except Exception as e:
+                logger.error(f"從資料庫搜尋查詢歷史失敗: {e}")
+                # 失敗時改用文件搜尋
+        return self._search_history_in_file(text_value, limit)
+    
+    def _search_history_in_db(self, text_value: str, limit: int) -> List[QueryHistoryModel]:
+        """以 tsvector 全文檢索與 pg_trgm 包含比對搜尋資料庫"""
+        from sqlalchemy import text
+        from .history_db import QueryHistory, db_record_to_model
+        with self.Session() as session:
+            # tsvector 以完整單字比對；ILIKE 由 pg_trgm 的 GIN 索引支援任意子字串 (包含中文)
+            records = session.query(QueryHistory).filter(text(
+                f"{SEARCH_DOCUMENT} @@ plainto_tsquery('simple', :search_text)"
+                " OR user_query ILIKE :search_pattern"
+                " OR generated_sql ILIKE :search_pattern"
+            )).order_by(
+                text("(user_query ILIKE :search_pattern OR generated_sql ILIKE :search_pattern) DESC"),
+                QueryHistory.created_at.desc(),
+                QueryHistory.id.desc()
+            ).params(
+                search_text=text_value,
+                search_pattern=like_pattern(text_value)
+            ).limit(limit).all()
+            return [db_record_to_model(record) for record in records]
+    
+    def _search_history_in_file(self, text_value: str, limit: int) -> List[QueryHistoryModel]:
+        """以記憶體倒排索引搜尋文件"""
+        try:
+            records = self._file_index.search(self.history_file, text_value, limit)
+            return [_file_record_to_model(record) for record in records]
+        except Exception as e:
+            logger.error(f"從文件搜尋查詢歷史失敗: {e}")
+            return []
+    
     def get_query_by_id(self, query_id: str) -> Optional[QueryHistoryModel]:
         """根據 ID 獲取查詢歷史"""
+        if self.writer is not None:
+            pending = self.writer.get_pending(query_id)
+            if pending is not None:
+                return pending
         if self.use_db:
             return self._get_query_by_id_from_db(query_id)
         else:
             return self._get_query_by_id_from_file(query_id)
             
-    def _get_history_from_db(self, limit: int, offset: int) -> List[QueryHistoryModel]:
-        """從資料庫獲取查詢歷史"""
-        try:
-            with self.Session() as session:
-                records = session.query(QueryHistory).order_by(
-                    QueryHistory.created_at.desc()
-                ).limit(limit).offset(offset).all()
-                
-                return [
-                    QueryHistoryModel(
-                        id=record.id,
-                        user_query=record.user_query,
-                        generated_sql=record.generated_sql,
-                        explanation=record.explanation,
-                        executed=record.executed,
-                        execution_time=record.execution_time,
-                        error_message=record.error_message,
-                        created_at=record.created_at,
-                        updated_at=record.updated_at,
-                        conversation_id=record.conversation_id,
-                        references_query_id=record.references_query_id,
-                        resolved_query=record.resolved_query,
-                        entity_references=record.entity_references or {},
-                        parameters=record.parameters or {},
-                        is_favorite=record.is_favorite or False,
-                        is_template=record.is_template or False,
-                        template_name=record.template_name,
-                        template_description=record.template_description,
-                        template_tags=record.template_tags or []
-                    ) for record in records
-                ]
-        except Exception as e:
-            logger.error(f"從資料庫獲取查詢歷史失敗: {e}")
-            # 失敗時改用文件讀取
-            return self._get_history_from_file(limit, offset)
-    
     def _get_query_by_id_from_db(self, query_id: str) -> Optional[QueryHistoryModel]:
         """從資料庫獲取指定 ID 的查詢歷史"""
+        from .history_db import QueryHistory
         try:
             with self.Session() as session:
                 record = session.query(QueryHistory).filter(QueryHistory.id == query_id).first()
@@ -275,41 +454,15 @@ class HistoryService:
     def _get_query_by_id_from_file(self, query_id: str) -> Optional[QueryHistoryModel]:
         """從文件獲取指定 ID 的查詢歷史"""
         try:
-            if not os.path.exists(self.history_file):
-                return None
-            
-            with open(self.history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-            
-            for record in history:
-                if record.get("id") == query_id:
-                    return QueryHistoryModel(
-                        id=record.get("id"),
-                        user_query=record.get("user_query"),
-                        generated_sql=record.get("generated_sql"),
-                        explanation=record.get("explanation"),
-                        executed=record.get("executed", False),
-                        execution_time=record.get("execution_time"),
-                        error_message=record.get("error_message"),
-                        created_at=record.get("created_at"),
-                        conversation_id=record.get("conversation_id"),
-                        references_query_id=record.get("references_query_id"),
-                        resolved_query=record.get("resolved_query"),
-                        entity_references=record.get("entity_references", {}),
-                        parameters=record.get("parameters", {}),
-                        is_favorite=record.get("is_favorite", False),
-                        is_template=record.get("is_template", False),
-                        template_name=record.get("template_name"),
-                        template_description=record.get("template_description"),
-                        template_tags=record.get("template_tags", [])
-                    )
-            return None
+            record = self._file_index.get(self.history_file, str(query_id))
+            return _file_record_to_model(record) if record else None
         except Exception as e:
             logger.error(f"從文件獲取查詢歷史失敗: {e}")
             return None
                 
     def get_history_by_conversation(self, conversation_id: str, limit: int = 20) -> List[QueryHistoryModel]:
         """獲取對話相關的查詢歷史"""
+        self.flush()
         if self.use_db:
             return self._get_history_by_conversation_from_db(conversation_id, limit)
         else:
@@ -317,11 +470,12 @@ class HistoryService:
     
     def _get_history_by_conversation_from_db(self, conversation_id: str, limit: int) -> List[QueryHistoryModel]:
         """從資料庫獲取對話相關的查詢歷史"""
+        from .history_db import QueryHistory
         try:
             with self.Session() as session:
                 records = session.query(QueryHistory).filter(
                     QueryHistory.conversation_id == conversation_id
-                ).order_by(QueryHistory.created_at.desc()).limit(limit).all()
+                ).order_by(QueryHistory.created_at.desc(), QueryHistory.id.desc()).limit(limit).all()
                 
                 return [
                     QueryHistoryModel(
@@ -347,40 +501,8 @@ class HistoryService:
     def _get_history_by_conversation_from_file(self, conversation_id: str, limit: int) -> List[QueryHistoryModel]:
         """從文件獲取對話相關的查詢歷史"""
         try:
-            if not os.path.exists(self.history_file):
-                return []
-            
-            with open(self.history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-            
-            # 過濾並排序
-            conversation_history = [record for record in history if record.get("conversation_id") == conversation_id]
-            sorted_history = sorted(conversation_history, key=lambda x: x.get("created_at", ""), reverse=True)
-            limited_history = sorted_history[:limit]
-            
-            # 轉換為 Pydantic 模型
-            return [
-                QueryHistoryModel(
-                    id=record.get("id"),
-                    user_query=record.get("user_query"),
-                    generated_sql=record.get("generated_sql"),
-                    explanation=record.get("explanation"),
-                    executed=record.get("executed", False),
-                    execution_time=record.get("execution_time"),
-                    error_message=record.get("error_message"),
-                    created_at=record.get("created_at"),
-                    conversation_id=record.get("conversation_id"),
-                    references_query_id=record.get("references_query_id"),
-                    resolved_query=record.get("resolved_query"),
-                    entity_references=record.get("entity_references", {}),
-                    parameters=record.get("parameters", {}),
-                    is_favorite=record.get("is_favorite", False),
-                    is_template=record.get("is_template", False),
-                    template_name=record.get("template_name"),
-                    template_description=record.get("template_description"),
-                    template_tags=record.get("template_tags", [])
-                ) for record in limited_history
-            ]
+            records = self._file_index.page(self.history_file, conversation_index(conversation_id), limit)
+            return [_file_record_to_model(record) for record in records]
         except Exception as e:
             logger.error(f"從文件獲取對話歷史失敗: {e}")
             return []
@@ -398,6 +520,7 @@ class HistoryService:
         
     def get_favorites(self, limit: int = 20, offset: int = 0) -> List[QueryHistoryModel]:
         """獲取收藏的查詢"""
+        self.flush()
         if self.use_db:
             return self._get_favorites_from_db(limit, offset)
         else:
@@ -405,11 +528,12 @@ class HistoryService:
             
     def _get_favorites_from_db(self, limit: int, offset: int) -> List[QueryHistoryModel]:
         """從資料庫獲取收藏的查詢"""
+        from .history_db import QueryHistory
         try:
             with self.Session() as session:
                 records = session.query(QueryHistory).filter(
                     QueryHistory.is_favorite == True
-                ).order_by(QueryHistory.created_at.desc()).limit(limit).offset(offset).all()
+                ).order_by(QueryHistory.created_at.desc(), QueryHistory.id.desc()).limit(limit).offset(offset).all()
                 
                 return [
                     QueryHistoryModel(
@@ -441,40 +565,8 @@ class HistoryService:
     def _get_favorites_from_file(self, limit: int, offset: int) -> List[QueryHistoryModel]:
         """從文件獲取收藏的查詢"""
         try:
-            if not os.path.exists(self.history_file):
-                return []
-            
-            with open(self.history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-            
-            # 過濾、排序、分頁
-            favorite_history = [record for record in history if record.get("is_favorite", False)]
-            sorted_history = sorted(favorite_history, key=lambda x: x.get("created_at", ""), reverse=True)
-            paged_history = sorted_history[offset:offset + limit]
-            
-            # 轉換為 Pydantic 模型
-            return [
-                QueryHistoryModel(
-                    id=record.get("id"),
-                    user_query=record.get("user_query"),
-                    generated_sql=record.get("generated_sql"),
-                    explanation=record.get("explanation"),
-                    executed=record.get("executed", False),
-                    execution_time=record.get("execution_time"),
-                    error_message=record.get("error_message"),
-                    created_at=record.get("created_at"),
-                    conversation_id=record.get("conversation_id"),
-                    references_query_id=record.get("references_query_id"),
-                    resolved_query=record.get("resolved_query"),
-                    entity_references=record.get("entity_references", {}),
-                    parameters=record.get("parameters", {}),
-                    is_favorite=record.get("is_favorite", False),
-                    is_template=record.get("is_template", False),
-                    template_name=record.get("template_name"),
-                    template_description=record.get("template_description"),
-                    template_tags=record.get("template_tags", [])
-                ) for record in paged_history
-            ]
+            records = self._file_index.page(self.history_file, FAVORITES, limit, offset=offset)
+            return [_file_record_to_model(record) for record in records]
         except Exception as e:
             logger.error(f"從文件獲取收藏查詢失敗: {e}")
             return []
@@ -517,6 +609,7 @@ class HistoryService:
     
     def _save_template(self, template: QueryTemplateModel) -> QueryTemplateModel:
         """保存查詢模板"""
+        self.templates_version += 1
         if self.use_db:
             return self._save_template_to_db(template)
         else:
@@ -524,6 +617,7 @@ class HistoryService:
             
     def _save_template_to_db(self, template: QueryTemplateModel) -> QueryTemplateModel:
         """將模板保存到資料庫"""
+        from .history_db import QueryTemplate
         try:
             with self.Session() as session:
                 # 將 Pydantic 模型轉換為 SQLAlchemy 模型
@@ -583,24 +677,47 @@ class HistoryService:
             return template
             
     def get_templates(self, limit: int = 20, offset: int = 0, 
-                     tag: Optional[str] = None) -> List[QueryTemplateModel]:
-        """獲取查詢模板"""
+                     tag: Optional[str] = None, search: Optional[str] = None) -> List[QueryTemplateModel]:
+        """
+        獲取查詢模板
+        
+        Args:
+            limit: 返回數量限制
+            offset: 偏移量
+            tag: 只返回有此標籤的模板
+            search: 只返回名稱、描述、問題或 SQL 包含此字串的模板
+            
+        Returns:
+            模板列表，依使用次數由多到少
+        """
+        search = search.strip() if search else None
         if self.use_db:
-            return self._get_templates_from_db(limit, offset, tag)
+            return self._get_templates_from_db(limit, offset, tag, search)
         else:
-            return self._get_templates_from_file(limit, offset, tag)
+            return self._get_templates_from_file(limit, offset, tag, search)
             
     def _get_templates_from_db(self, limit: int, offset: int, 
-                              tag: Optional[str] = None) -> List[QueryTemplateModel]:
+                              tag: Optional[str] = None, search: Optional[str] = None) -> List[QueryTemplateModel]:
         """從資料庫獲取查詢模板"""
+        from .history_db import QueryTemplate
         try:
             with self.Session() as session:
                 # 創建查詢
                 query = session.query(QueryTemplate)
                 
-                # 如果有標籤過濾
+                # 如果有標籤過濾 (tags 的 GIN 索引支援 @>)
                 if tag:
                     query = query.filter(QueryTemplate.tags.contains([tag]))
+                
+                # 如果有搜尋字串 (pg_trgm 索引支援 ILIKE)
+                if search:
+                    pattern = like_pattern(search)
+                    query = query.filter(
+                        QueryTemplate.name.ilike(pattern, escape="\\")
+                        | QueryTemplate.description.ilike(pattern, escape="\\")
+                        | QueryTemplate.user_query.ilike(pattern, escape="\\")
+                        | QueryTemplate.generated_sql.ilike(pattern, escape="\\")
+                    )
                     
                 # 排序和分頁
                 records = query.order_by(
@@ -626,10 +743,10 @@ class HistoryService:
                 ]
         except Exception as e:
             logger.error(f"從資料庫獲取模板失敗: {e}")
-            return self._get_templates_from_file(limit, offset, tag)
+            return self._get_templates_from_file(limit, offset, tag, search)
             
     def _get_templates_from_file(self, limit: int, offset: int, 
-                               tag: Optional[str] = None) -> List[QueryTemplateModel]:
+                               tag: Optional[str] = None, search: Optional[str] = None) -> List[QueryTemplateModel]:
         """從文件獲取查詢模板"""
         try:
             if not os.path.exists(self.templates_file):
@@ -641,6 +758,10 @@ class HistoryService:
             # 如果有標籤過濾
             if tag:
                 templates = [t for t in templates if tag in t.get("tags", [])]
+            
+            # 如果有搜尋字串 (與查詢歷史相同的切詞，非 CJK 單字以前綴比對)
+            if search:
+                templates = [t for t in templates if _template_matches(t, search)]
                 
             # 排序
             sorted_templates = sorted(
@@ -681,6 +802,7 @@ class HistoryService:
             
     def _get_template_by_id_from_db(self, template_id: str) -> Optional[QueryTemplateModel]:
         """從資料庫獲取指定 ID 的模板"""
+        from .history_db import QueryTemplate
         try:
             with self.Session() as session:
                 record = session.query(QueryTemplate).filter(QueryTemplate.id == template_id).first()
@@ -735,6 +857,11 @@ class HistoryService:
             
     def update_template(self, template: QueryTemplateModel) -> bool:
         """更新查詢模板"""
+        self.templates_version += 1
+        return self._write_template(template)
+    
+    def _write_template(self, template: QueryTemplateModel) -> bool:
+        """寫入更新後的模板"""
         if self.use_db:
             return self._update_template_in_db(template)
         else:
@@ -742,6 +869,7 @@ class HistoryService:
             
     def _update_template_in_db(self, template: QueryTemplateModel) -> bool:
         """在資料庫中更新查詢模板"""
+        from .history_db import QueryTemplate
         try:
             with self.Session() as session:
                 record = session.query(QueryTemplate).filter(QueryTemplate.id == template.id).first()
@@ -808,6 +936,7 @@ class HistoryService:
             
     def delete_template(self, template_id: str) -> bool:
         """刪除查詢模板"""
+        self.templates_version += 1
         if self.use_db:
             return self._delete_template_from_db(template_id)
         else:
@@ -815,6 +944,7 @@ class HistoryService:
             
     def _delete_template_from_db(self, template_id: str) -> bool:
         """從資料庫刪除模板"""
+        from .history_db import QueryTemplate
         try:
             with self.Session() as session:
                 record = session.query(QueryTemplate).filter(QueryTemplate.id == template_id).first()
@@ -856,10 +986,14 @@ class HistoryService:
             return False
             
         template.usage_count += 1
-        return self.update_template(template)
+        return self._write_template(template)
                 
     def update_query(self, query: QueryHistoryModel) -> bool:
         """更新查詢歷史"""
+        writer = self.get_writer()
+        if writer is not None:
+            writer.enqueue(query, is_new=False)
+            return True
         if self.use_db:
             return self._update_query_in_db(query)
         else:
@@ -867,6 +1001,7 @@ class HistoryService:
     
     def _update_query_in_db(self, query: QueryHistoryModel) -> bool:
         """在資料庫中更新查詢歷史"""
+        from .history_db import QueryHistory
         try:
             with self.Session() as session:
                 record = session.query(QueryHistory).filter(QueryHistory.id == query.id).first()
@@ -946,12 +1081,146 @@ class HistoryService:
             logger.error(f"更新文件中的查詢歷史失敗: {e}")
             return False
     
+    def write_batch(self, entries: List[Tuple[QueryHistoryModel, bool]]) -> None:
+        """
+        批次寫入查詢歷史 (背景寫入器使用)
+        
+        Args:
+            entries: (查詢歷史模型, 是否為新增) 列表，同一 ID 只出現一次
+        """
+        if self.use_db:
+            try:
+                self._write_batch_to_db(entries)
+                return
+            except Exception as e:
+                logger.error(f"批次保存查詢歷史到資料庫失敗: {e}")
+                # 失敗時改用文件存儲
+        self._write_batch_to_file(entries)
+    
+    def _write_batch_to_db(self, entries: List[Tuple[QueryHistoryModel, bool]]) -> None:
+        """
+        在同一交易中寫入一批新增與更新
+
+        新增以單一多列 INSERT ... ON CONFLICT 寫入；更新以 executemany 的 UPDATE ... WHERE id 寫入，
+        與 update_query 及文件存儲相同，不存在的記錄不更新 (不會被新增)
+        """
+        from sqlalchemy import bindparam, update
+        from sqlalchemy.dialects.postgresql import insert
+        from .history_db import QueryHistory
+        
+        now = datetime.now()
+        new_rows = []
+        updated_rows = []
+        for query, is_new in entries:
+            (new_rows if is_new else updated_rows).append({
+                "id": query.id,
+                "user_query": query.user_query,
+                "generated_sql": query.generated_sql,
+                "explanation": query.explanation,
+                "executed": query.executed,
+                "execution_time": query.execution_time,
+                "error_message": query.error_message,
+                "created_at": query.created_at or now,
+                "updated_at": None if is_new else now,
+                "conversation_id": query.conversation_id,
+                "references_query_id": query.references_query_id,
+                "resolved_query": query.resolved_query,
+                "entity_references": query.entity_references,
+                "parameters": query.parameters,
+                "is_favorite": query.is_favorite,
+                "is_template": query.is_template,
+                "template_name": query.template_name,
+                "template_description": query.template_description,
+                "template_tags": query.template_tags if query.template_tags else None
+            })
+        
+        with self.engine.begin() as conn:
+            if new_rows:
+                statement = insert(QueryHistory).values(new_rows)
+                # 新增的記錄已存在時 (例如重試部分寫入的批次) 保留原本的建立時間，其餘欄位以新值覆蓋
+                statement = statement.on_conflict_do_update(
+                    index_elements=[QueryHistory.id],
+                    set_={
+                        column: statement.excluded[column]
+                        for column in new_rows[0] if column not in ("id", "created_at")
+                    }
+                )
+                conn.execute(statement)
+            if updated_rows:
+                # 綁定參數名稱不可與欄位名稱相同，加上 b_ 前綴
+                columns = [column for column in updated_rows[0] if column not in ("id", "created_at")]
+                statement = (
+                    update(QueryHistory)
+                    .where(QueryHistory.id == bindparam("b_id"))
+                    .values({column: bindparam(f"b_{column}") for column in columns})
+                )
+                conn.execute(
+                    statement,
+                    [
+                        {f"b_{column}": row[column] for column in ["id", *columns]}
+                        for row in updated_rows
+                    ]
+                )
+    
+    def _write_batch_to_file(self, entries: List[Tuple[QueryHistoryModel, bool]]) -> None:
+        """讀取一次 JSON 文件、套用一批新增與更新後整個寫回 (先寫入暫存檔再取代，讀取端不會讀到寫到一半的文件)"""
+        history = []
+        previous_signature = FileHistoryIndex.signature(self.history_file)
+        if previous_signature is not None:
+            with open(self.history_file, "r", encoding="utf-8") as f:
+                history = json.load(f)
+        positions = {record.get("id"): i for i, record in enumerate(history)}
+        written = []
+        
+        now = datetime.now().isoformat()
+        for query, is_new in entries:
+            position = positions.get(str(query.id))
+            if position is None and not is_new:
+                # 與 update_query 相同，不存在的記錄不更新
+                continue
+            record = {
+                "id": str(query.id),
+                "user_query": query.user_query,
+                "generated_sql": query.generated_sql,
+                "explanation": query.explanation,
+                "executed": query.executed,
+                "execution_time": query.execution_time,
+                "error_message": query.error_message,
+                "created_at": history[position].get("created_at") if position is not None else (
+                    query.created_at.isoformat() if query.created_at else now
+                ),
+                "conversation_id": query.conversation_id,
+                "references_query_id": query.references_query_id,
+                "resolved_query": query.resolved_query,
+                "entity_references": query.entity_references,
+                "parameters": query.parameters,
+                "is_favorite": query.is_favorite,
+                "is_template": query.is_template,
+                "template_name": query.template_name,
+                "template_description": query.template_description,
+                "template_tags": query.template_tags
+            }
+            if position is None:
+                positions[record["id"]] = len(history)
+                history.append(record)
+            else:
+                history[position] = record
+            written.append(record)
+        
+        temp_file = f"{self.history_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, self.history_file)
+        # 直接更新排序索引，下次讀取不需重新載入整個文件
+        self._file_index.apply(self.history_file, written, previous_signature)
+    
     def _get_history_from_db(self, limit: int, offset: int) -> List[QueryHistoryModel]:
         """從資料庫獲取查詢歷史"""
+        from .history_db import QueryHistory
         try:
             with self.Session() as session:
                 records = session.query(QueryHistory).order_by(
-                    QueryHistory.created_at.desc()
+                    QueryHistory.created_at.desc(), QueryHistory.id.desc()
                 ).limit(limit).offset(offset).all()
                 
                 return [
@@ -985,39 +1254,8 @@ class HistoryService:
     def _get_history_from_file(self, limit: int, offset: int) -> List[QueryHistoryModel]:
         """從 JSON 文件獲取查詢歷史"""
         try:
-            if not os.path.exists(self.history_file):
-                return []
-            
-            with open(self.history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-            
-            # 排序、分頁
-            sorted_history = sorted(history, key=lambda x: x.get("created_at", ""), reverse=True)
-            paged_history = sorted_history[offset:offset + limit]
-            
-            # 轉換為 Pydantic 模型
-            return [
-                QueryHistoryModel(
-                    id=record.get("id"),
-                    user_query=record.get("user_query"),
-                    generated_sql=record.get("generated_sql"),
-                    explanation=record.get("explanation"),
-                    executed=record.get("executed", False),
-                    execution_time=record.get("execution_time"),
-                    error_message=record.get("error_message"),
-                    created_at=record.get("created_at"),
-                    conversation_id=record.get("conversation_id"),
-                    references_query_id=record.get("references_query_id"),
-                    resolved_query=record.get("resolved_query"),
-                    entity_references=record.get("entity_references", {}),
-                    parameters=record.get("parameters", {}),
-                    is_favorite=record.get("is_favorite", False),
-                    is_template=record.get("is_template", False),
-                    template_name=record.get("template_name"),
-                    template_description=record.get("template_description"),
-                    template_tags=record.get("template_tags", [])
-                ) for record in paged_history
-            ]
+            records = self._file_index.page(self.history_file, ALL, limit, offset=offset)
+            return [_file_record_to_model(record) for record in records]
         except Exception as e:
             logger.error(f"從文件獲取查詢歷史失敗: {e}")
-            return []
\ No newline at end of file
+            return []
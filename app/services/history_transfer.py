@@ -0,0 +1,648 @@
+"""
+查詢歷史與模板的匯出與匯入
+
+記錄以固定筆數的區塊串流，記憶體用量與總筆數無關:
+- JSON 文件存儲: 以 JSONDecoder.raw_decode 逐筆讀取陣列，寫入時逐筆附加到暫存檔後取代原檔案
+- 資料庫存儲 (PostgreSQL): 匯出以 COPY (SELECT row_to_json(...)) TO STDOUT 串流，
+  匯入以 COPY 寫入暫存表後 INSERT ... SELECT jsonb_populate_record(...) ON CONFLICT (id) DO NOTHING
+- 檔案格式: JSONL (每行一筆) 或 Parquet (pyarrow，逐列群組讀寫)
+
+讀取在背景執行緒進行，與寫入重疊，佇列最多保留 PREFETCH_CHUNKS 個區塊。
+"""
+import io
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from pydantic import BaseModel, Field
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 每個區塊的筆數
+DEFAULT_CHUNK_SIZE = 10000
+# 讀取端最多領先寫入端的區塊數
+PREFETCH_CHUNKS = 2
+
+# 欄位與類型: string / bool / int / double / json (物件) / string_list；日期以 ISO 字串表示
+HISTORY_FIELDS: List[Tuple[str, str]] = [
+    ("id", "string"),
+    ("user_query", "string"),
+    ("generated_sql", "string"),
+    ("explanation", "string"),
+    ("executed", "bool"),
+    ("execution_time", "double"),
+    ("error_message", "string"),
+    ("created_at", "string"),
+    ("updated_at", "string"),
+    ("conversation_id", "string"),
+    ("references_query_id", "string"),
+    ("resolved_query", "string"),
+    ("entity_references", "json"),
+    ("parameters", "json"),
+    ("is_favorite", "bool"),
+    ("is_template", "bool"),
+    ("template_name", "string"),
+    ("template_description", "string"),
+    ("template_tags", "string_list"),
+]
+
+TEMPLATE_FIELDS: List[Tuple[str, str]] = [
+    ("id", "string"),
+    ("name", "string"),
+    ("description", "string"),
+    ("user_query", "string"),
+    ("generated_sql", "string"),
+    ("explanation", "string"),
+    ("parameters", "json"),
+    ("tags", "string_list"),
+    ("usage_count", "int"),
+    ("created_at", "string"),
+    ("updated_at", "string"),
+]
+
+TABLES: Dict[str, List[Tuple[str, str]]] = {
+    "query_history": HISTORY_FIELDS,
+    "query_templates": TEMPLATE_FIELDS,
+}
+
+FORMATS = ("jsonl", "parquet")
+
+# 缺少欄位時的預設值 (與 JSON 文件存儲及 Pydantic 模型相同)
+_EMPTY_VALUES = {"bool": False, "int": 0, "json": dict, "string_list": list}
+
+
+class TransferSummary(BaseModel):
+    """匯出或匯入的統計"""
+    table: str = Field(description="資料表")
+    read: int = Field(default=0, description="讀取筆數")
+    written: int = Field(default=0, description="寫入筆數")
+    skipped: int = Field(default=0, description="略過筆數 (ID 已存在)")
+    elapsed_seconds: float = Field(default=0.0, description="耗時 (秒)")
+
+    @property
+    def records_per_second(self) -> float:
+        return self.read / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+
+def normalize_record(record: Dict[str, Any], fields: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """只保留資料表欄位，補上缺少的欄位並統一類型 (ID 與日期轉為字串、JSON 字串解析為物件)"""
+    row = {}
+    for name, kind in fields:
+        value = record.get(name)
+        if value is None:
+            empty = _EMPTY_VALUES.get(kind)
+            value = empty() if callable(empty) else empty
+        elif kind == "string" and not isinstance(value, str):
+            value = value.isoformat() if hasattr(value, "isoformat") else str(value)
+        elif kind == "json" and isinstance(value, str):
+            value = json.loads(value)
+        row[name] = value
+    return row
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    """檔案格式: 指定的格式，或依副檔名判斷 (.parquet 為 Parquet，其餘為 JSONL)"""
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"不支援的格式: {fmt}，可用格式: {', '.join(FORMATS)}")
+        return fmt
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "jsonl"
+
+
+def _close_iterator(iterator) -> None:
+    """關閉生成器 (執行其 finally，例如 iter_database 關閉 COPY 連線)；其他迭代器不處理"""
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+def _normalized(records: Iterable[Dict[str, Any]], fields: List[Tuple[str, str]]) -> Iterator[Dict[str, Any]]:
+    try:
+        for record in records:
+            yield normalize_record(record, fields)
+    finally:
+        _close_iterator(records)
+
+
+def _chunked(records: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    try:
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        _close_iterator(records)
+
+
+def iter_json_array(path: str, read_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """
+    逐筆讀取 JSON 陣列檔案 (query_history.json 等)，不需將整個檔案載入記憶體
+
+    Args:
+        path: 檔案路徑，不存在時視為空陣列
+        read_size: 每次讀取的字元數
+    """
+    if not os.path.exists(path):
+        return
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # 略過空白、陣列開頭與分隔的逗號
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ","
+                                              or (not started and buffer[position] == "[")):
+                started = started or buffer[position] == "["
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            if position < len(buffer):
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # 記錄在緩衝區結尾被截斷，讀取更多內容後重試
+                    if eof:
+                        raise
+                else:
+                    yield record
+                    position = end
+                    continue
+            if eof:
+                return
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+class JsonArrayWriter:
+    """
+    將記錄合併寫入 JSON 文件存儲 (query_history.json 等)
+
+    先把既有記錄逐筆複製到暫存檔，再附加匯入的記錄，完成後取代原檔案；
+    ID 已存在的記錄略過。為判斷重複需保留所有 ID (每筆約 100 位元組)，記錄內容不保留在記憶體中。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.seen_ids: Set[str] = set()
+        directory = os.path.dirname(os.path.abspath(path))
+        self._file = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False)
+        self._file.write("[")
+        self._count = 0
+        for record in iter_json_array(path):
+            self.seen_ids.add(str(record.get("id")))
+            self._append(record)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        self._file.write(",\n  " if self._count else "\n  ")
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._count += 1
+
+    def write(self, records: List[Dict[str, Any]]) -> int:
+        """寫入一個區塊，返回實際寫入的筆數"""
+        written = 0
+        for record in records:
+            record_id = str(record.get("id"))
+            if record_id in self.seen_ids:
+                continue
+            self.seen_ids.add(record_id)
+            self._append(record)
+            written += 1
+        return written
+
+    def close(self) -> None:
+        self._file.write("\n]\n" if self._count else "]\n")
+        self._file.close()
+        # 暫存檔權限為 0600，改回原檔案 (或依 umask 建立新檔案) 的權限
+        if os.path.exists(self.path):
+            mode = os.stat(self.path).st_mode & 0o777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(self._file.name, mode)
+        os.replace(self._file.name, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.unlink(self._file.name)
+
+
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """逐行讀取 JSONL 檔案 (略過空行)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class JsonlWriter:
+    """每行寫入一筆記錄"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, records: List[Dict[str, Any]]) -> int:
+        self._file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        return len(records)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('Parquet 格式需要 pyarrow 套件 (pip install -e ".[parquet]")') from e
+    return pyarrow, pyarrow.parquet
+
+
+def parquet_schema(fields: List[Tuple[str, str]]):
+    """Parquet 欄位類型；json 欄位以 JSON 字串儲存 (各記錄的鍵不同，無法使用固定的結構)"""
+    pa, _ = _import_pyarrow()
+    types = {
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "int": pa.int64(),
+        "double": pa.float64(),
+        "json": pa.string(),
+        "string_list": pa.list_(pa.string()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in fields])
+
+
+def iter_parquet(path: str, fields: List[Tuple[str, str]], chunk_size: int) -> Iterator[Dict[str, Any]]:
+    """逐個列群組批次讀取 Parquet 檔案"""
+    _, pq = _import_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield from batch.to_pylist()  # json 欄位由 normalize_record 解析
+
+
+class ParquetWriter:
+    """每個區塊寫入一個列群組"""
+
+    def __init__(self, path: str, fields: List[Tuple[str, str]]):
+        pa, pq = _import_pyarrow()
+        self._pa = pa
+        self.fields = fields
+        self.schema = parquet_schema(fields)
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, records: List[Dict[str, Any]]) -> int:
+        json_fields = [name for name, kind in self.fields if kind == "json"]
+        rows = [
+            {**record, **{name: json.dumps(record[name], ensure_ascii=False) for name in json_fields}}
+            for record in records
+        ]
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self.schema))
+        return len(records)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def abort(self) -> None:
+        self._writer.close()
+
+
+def _table_columns(table: str) -> List[str]:
+    """ORM 定義的欄位 (history_db)"""
+    from .history_db import QueryHistory, QueryTemplate
+
+    model = {"query_history": QueryHistory, "query_templates": QueryTemplate}[table]
+    return [column.name for column in model.__table__.columns]
+
+
+def _driver_connection(engine):
+    """SQLAlchemy 連線池中的 DBAPI 連線 (psycopg 3 或 psycopg2)"""
+    raw = engine.raw_connection()
+    return raw, getattr(raw, "driver_connection", None) or raw.connection
+
+
+class _QueueWriter(io.RawIOBase):
+    """psycopg2 的 copy_expert 寫入的檔案物件，資料轉交給有上限的佇列"""
+
+    def __init__(self, target: "queue.Queue"):
+        self.target = target
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.target.put(bytes(data))
+        return len(data)
+
+
+# COPY 文字格式必須跳脫的字元 (反斜線、換行、歸位與分隔字元 tab)
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+# COPY 文字格式的跳脫序列: \b \f \n \r \t \v、八進位 \ddd、十六進位 \xhh 與其他字元本身
+_COPY_ESCAPE_SEQUENCE = re.compile(r"\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))", re.DOTALL)
+_COPY_SPECIAL = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def copy_text_escape(value: str) -> str:
+    """將字串轉為 COPY 文字格式的單一欄位"""
+    return value.translate(_COPY_ESCAPES)
+
+
+def _unescape_sequence(match: "re.Match") -> str:
+    octal, hexadecimal, char = match.groups()
+    if octal is not None:
+        return chr(int(octal, 8))
+    if hexadecimal is not None:
+        return chr(int(hexadecimal, 16))
+    return _COPY_SPECIAL.get(char, char)
+
+
+def copy_text_unescape(field: str) -> str:
+    """還原 COPY 文字格式的單一欄位 (copy_text_escape 與 PostgreSQL COPY TO 輸出的反向轉換)"""
+    if "\\" not in field:
+        return field
+    return _COPY_ESCAPE_SEQUENCE.sub(_unescape_sequence, field)
+
+
+def _copy_out(connection, sql: str) -> Iterator[bytes]:
+    """串流 COPY ... TO STDOUT 的輸出"""
+    cursor = connection.cursor()
+    if hasattr(cursor, "copy"):
+        # psycopg 3: 逐塊讀取
+        with cursor.copy(sql) as copy:
+            for block in copy:
+                yield bytes(block)
+        return
+
+    # psycopg2: copy_expert 會一直寫到結束，在背景執行緒執行並經由有上限的佇列取回
+    blocks: "queue.Queue" = queue.Queue(maxsize=64)
+    errors: List[BaseException] = []
+    done = object()
+
+    def _run():
+        try:
+            cursor.copy_expert(sql, _QueueWriter(blocks), size=1 << 16)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            blocks.put(done)
+
+    thread = threading.Thread(target=_run, name="history-copy-out", daemon=True)
+    thread.start()
+    while True:
+        block = blocks.get()
+        if block is done:
+            break
+        yield block
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def iter_database(engine, table: str) -> Iterator[Dict[str, Any]]:
+    """以 COPY 串流讀取資料表，每列轉為 JSON 後解析 (依 created_at, id 排序)"""
+    columns = ", ".join(_table_columns(table))
+    sql = (f"COPY (SELECT row_to_json(t) FROM (SELECT {columns} FROM {table} ORDER BY created_at, id) t) "
+           f"TO STDOUT")
+    raw, connection = _driver_connection(engine)
+    try:
+        pending = b""
+        for block in _copy_out(connection, sql):
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                # 欄位中的換行已跳脫為 \n，實際的換行只出現在列與列之間
+                yield json.loads(copy_text_unescape(line.decode("utf-8")))
+        if pending.strip():
+            yield json.loads(copy_text_unescape(pending.decode("utf-8")))
+    finally:
+        raw.close()
+
+
+class DatabaseWriter:
+    """
+    以 COPY 將區塊寫入暫存表，再插入目標資料表 (ID 已存在時略過)
+
+    每個區塊一個交易；中斷後重新匯入同一檔案時，已寫入的記錄會被略過。
+    """
+
+    STAGING_TABLE = "history_import_staging"
+
+    def __init__(self, engine, table: str):
+        from .history_db import Base
+
+        Base.metadata.create_all(engine)  # 與資料庫存儲的 HistoryService 相同，必要時建立資料表
+        self.table = table
+        self._raw, self._connection = _driver_connection(engine)
+        columns = _table_columns(table)
+        column_list = ", ".join(columns)
+        select_list = ", ".join(f"r.{column}" for column in columns)
+        self._insert_sql = (
+            f"INSERT INTO {table} ({column_list}) "
+            f"SELECT {select_list} FROM {self.STAGING_TABLE} s, jsonb_populate_record(NULL::{table}, s.doc) r "
+            f"ON CONFLICT (id) DO NOTHING"
+        )
+        self._copy_sql = f"COPY {self.STAGING_TABLE} (doc) FROM STDIN"
+        cursor = self._connection.cursor()
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {self.STAGING_TABLE} (doc jsonb) ON COMMIT DELETE ROWS")
+        self._connection.commit()
+
+    def write(self, records: List[Dict[str, Any]]) -> int:
+        data = "".join(copy_text_escape(json.dumps(record, ensure_ascii=False)) + "\n" for record in records)
+        cursor = self._connection.cursor()
+        try:
+            if hasattr(cursor, "copy"):
+                with cursor.copy(self._copy_sql) as copy:
+                    copy.write(data.encode("utf-8"))
+            else:
+                cursor.copy_expert(self._copy_sql, io.BytesIO(data.encode("utf-8")))
+            cursor.execute(self._insert_sql)
+            inserted = cursor.rowcount
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+        return inserted
+
+    def close(self) -> None:
+        self._raw.close()
+
+    def abort(self) -> None:
+        self._raw.close()
+
+
+def _prefetch(chunks: Iterator[List[Dict[str, Any]]], depth: int) -> Iterator[List[Dict[str, Any]]]:
+    """在背景執行緒讀取區塊，最多領先 depth 個區塊"""
+    buffer: "queue.Queue" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item) -> bool:
+        """放入佇列；讀取端已停止 (例如寫入失敗) 時返回 False，避免永遠等待"""
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for chunk in chunks:
+                if not _put(chunk):
+                    return
+            _put(done)
+        except BaseException as e:
+            _put(e)
+        finally:
+            # 提前停止或讀取失敗時關閉來源，在讀取執行緒中執行來源的清理 (例如關閉 COPY 連線與其執行緒)
+            _close_iterator(chunks)
+
+    thread = threading.Thread(target=_produce, name="history-transfer-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def transfer(records: Iterable[Dict[str, Any]], writer, table: str,
+             chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None) -> TransferSummary:
+    """
+    將記錄逐區塊寫入目標
+
+    Args:
+        records: 來源記錄 (迭代器，不會一次載入)
+        writer: 目標 (write(records) 返回寫入筆數、close()、abort())
+        table: 資料表名稱
+        chunk_size: 每個區塊的筆數
+        progress: 每寫完一個區塊呼叫 progress(summary)
+
+    Returns:
+        匯出或匯入的統計
+    """
+    fields = TABLES[table]
+    summary = TransferSummary(table=table)
+    start = time.perf_counter()
+    normalized = _normalized(records, fields)
+    try:
+        for chunk in _prefetch(_chunked(normalized, chunk_size), PREFETCH_CHUNKS):
+            written = writer.write(chunk)
+            summary.read += len(chunk)
+            summary.written += written
+            summary.skipped += len(chunk) - written
+            summary.elapsed_seconds = time.perf_counter() - start
+            if progress is not None:
+                progress(summary)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    summary.elapsed_seconds = time.perf_counter() - start
+    logger.info(f"{table}: 讀取 {summary.read} 筆，寫入 {summary.written} 筆，略過 {summary.skipped} 筆，"
+                f"耗時 {summary.elapsed_seconds:.1f} 秒")
+    return summary
+
+
+def _file_path(history_service, table: str) -> str:
+    return history_service.history_file if table == "query_history" else history_service.templates_file
+
+
+def _engine(database_url: Optional[str]):
+    from sqlalchemy import create_engine
+    from ..utils import settings
+
+    return create_engine(database_url or settings.database_url)
+
+
+def export_table(history_service, table: str, path: str, backend: str = "file", fmt: Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, database_url: Optional[str] = None,
+                 progress=None) -> TransferSummary:
+    """
+    匯出查詢歷史或模板
+
+    Args:
+        history_service: 提供 JSON 文件存儲路徑的 HistoryService
+        table: query_history 或 query_templates
+        path: 輸出檔案 (.jsonl 或 .parquet)
+        backend: 來源存儲，file (JSON 文件) 或 db (資料庫)
+        fmt: 檔案格式，None 表示依副檔名判斷
+        chunk_size: 每個區塊的筆數
+        database_url: 覆寫資料庫連接 URL
+        progress: 每寫完一個區塊呼叫 progress(summary)
+    """
+    if table not in TABLES:
+        raise ValueError(f"未知的資料表: {table}")
+    fmt = detect_format(path, fmt)
+    history_service.flush()  # 背景佇列中的記錄也要匯出
+
+    if backend == "db":
+        engine = _engine(database_url)
+        records = iter_database(engine, table)
+    else:
+        engine = None
+        records = iter_json_array(_file_path(history_service, table))
+
+    writer = ParquetWriter(path, TABLES[table]) if fmt == "parquet" else JsonlWriter(path)
+    try:
+        return transfer(records, writer, table, chunk_size, progress)
+    finally:
+        if engine is not None:
+            engine.dispose()
+
+
+def import_table(history_service, table: str, path: str, backend: str = "file", fmt: Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, database_url: Optional[str] = None,
+                 progress=None) -> TransferSummary:
+    """
+    匯入查詢歷史或模板 (ID 已存在的記錄略過)
+
+    Args:
+        history_service: 提供 JSON 文件存儲路徑的 HistoryService
+        table: query_history 或 query_templates
+        path: 輸入檔案 (.jsonl 或 .parquet)
+        backend: 目標存儲，file (JSON 文件) 或 db (資料庫)
+        fmt: 檔案格式，None 表示依副檔名判斷
+        chunk_size: 每個區塊的筆數
+        database_url: 覆寫資料庫連接 URL
+        progress: 每寫完一個區塊呼叫 progress(summary)
+    """
+    if table not in TABLES:
+        raise ValueError(f"未知的資料表: {table}")
+    fmt = detect_format(path, fmt)
+    records = iter_parquet(path, TABLES[table], chunk_size) if fmt == "parquet" else iter_jsonl(path)
+
+    if backend == "db":
+        engine = _engine(database_url)
+        writer = DatabaseWriter(engine, table)
+    else:
+        engine = None
+        history_service.flush()  # 先寫完背景佇列，避免稍後覆寫合併後的檔案
+        writer = JsonArrayWriter(_file_path(history_service, table))
+    try:
+        return transfer(records, writer, table, chunk_size, progress)
+    finally:
+        if engine is not None:
+            engine.dispose()
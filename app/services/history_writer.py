@@ -0,0 +1,203 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from ..models import QueryHistoryModel
+from ..utils.metrics import metrics
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+HISTORY_FLUSH_DURATION = metrics.histogram(
+    "texttosql_history_flush_duration_seconds", "每批查詢歷史寫入耗時 (秒)"
+)
+HISTORY_FLUSHED = metrics.counter(
+    "texttosql_history_flushed_total", "背景寫入的查詢歷史筆數"
+)
+HISTORY_COALESCED = metrics.counter(
+    "texttosql_history_coalesced_total", "寫入前合併的查詢歷史變更數 (同一 ID 的新增與更新)"
+)
+HISTORY_WRITE_FAILURES = metrics.counter(
+    "texttosql_history_write_failures_total", "批次寫入失敗次數 (失敗的變更放回佇列重試)"
+)
+
+# 寫入失敗後背景重試的最長間隔秒數
+MAX_RETRY_DELAY = 30.0
+# 程序結束前寫入失敗時的重試次數
+CLOSE_ATTEMPTS = 3
+
+# (查詢歷史模型, 是否為新增)
+HistoryEntry = Tuple[QueryHistoryModel, bool]
+
+
+class HistoryWriter:
+    """
+    查詢歷史的背景批次寫入器 (write-behind)
+
+    add_query / update_query 只將變更放入記憶體佇列即返回，請求路徑不包含歷史記錄的 I/O。
+    同一 ID 尚未寫入的新增與更新合併為一筆，背景執行緒每 flush_interval 秒或累積 batch_size 筆時批次寫入。
+    佇列超過 max_pending 筆 (資料庫過慢) 時由呼叫端同步寫入，限制記憶體用量；程序結束前會寫完所有變更。
+    寫入失敗的變更放回佇列，背景執行緒以指數退避重試 (最長 MAX_RETRY_DELAY 秒)，不會捨棄；
+    呼叫端同步寫入失敗時拋出錯誤。
+    """
+
+    def __init__(self, write_batch: Callable[[List[HistoryEntry]], None], batch_size: int = 100,
+                 flush_interval: float = 0.5, max_pending: int = 10000):
+        """
+        Args:
+            write_batch: 批次寫入函數，接收 (查詢歷史模型, 是否為新增) 列表
+            batch_size: 每批寫入的筆數上限
+            flush_interval: 背景寫入的間隔秒數
+            max_pending: 佇列筆數上限，超過時由呼叫端同步寫入
+        """
+        self.write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: "OrderedDict[str, HistoryEntry]" = OrderedDict()
+        self._inflight: "OrderedDict[str, HistoryEntry]" = OrderedDict()  # 正在寫入的變更，寫入完成前仍可讀取
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """啟動背景寫入執行緒，並在程序結束時寫完所有變更"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, query: QueryHistoryModel, is_new: bool) -> None:
+        """
+        加入一筆變更 (保存當下的內容)
+
+        Args:
+            query: 查詢歷史模型
+            is_new: 是否為新增 (否則為更新)
+        """
+        key = str(query.id)
+        snapshot = query.model_copy(deep=True)
+        with self._lock:
+            previous = self._pending.pop(key, None)
+            if previous is not None:
+                # 尚未寫入的新增後接著更新，合併為一次新增
+                is_new = is_new or previous[1]
+                HISTORY_COALESCED.inc()
+            self._pending[key] = (snapshot, is_new)
+            pending = len(self._pending)
+
+        if pending >= self.max_pending:
+            logger.warning(f"查詢歷史寫入佇列已達 {pending} 筆，改為同步寫入")
+            self.flush(raise_errors=True)
+        elif pending >= self.batch_size:
+            self._wakeup.set()
+
+    def get_pending(self, query_id) -> Optional[QueryHistoryModel]:
+        """獲取尚未寫入完成的查詢歷史 (讀取時優先使用，確保讀得到自己的寫入)"""
+        key = str(query_id)
+        with self._lock:
+            entry = self._pending.get(key) or self._inflight.get(key)
+        return entry[0].model_copy(deep=True) if entry is not None else None
+
+    def has_pending(self) -> bool:
+        """是否有尚未寫入的變更"""
+        with self._lock:
+            return bool(self._pending)
+
+    def flush(self, raise_errors: bool = False) -> int:
+        """
+        寫入所有尚未寫入的變更
+
+        寫入失敗時，該批與之後尚未寫入的變更放回佇列 (期間同一 ID 的新變更優先)，等待下次寫入。
+
+        Args:
+            raise_errors: 寫入失敗時是否拋出錯誤 (否則只記錄錯誤)
+
+        Returns:
+            寫入的筆數
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._inflight = self._pending
+                self._pending = OrderedDict()
+                entries = list(self._inflight.values())
+
+            written = 0
+            try:
+                for start in range(0, len(entries), self.batch_size):
+                    batch = entries[start:start + self.batch_size]
+                    start_time = time.perf_counter()
+                    try:
+                        self.write_batch(batch)
+                    except Exception as e:
+                        HISTORY_WRITE_FAILURES.inc()
+                        remaining = entries[start:]
+                        self._requeue(remaining)
+                        logger.error(f"批次寫入查詢歷史失敗，{len(remaining)} 筆放回佇列稍後重試: {e}")
+                        if raise_errors:
+                            raise
+                        return written
+                    finally:
+                        HISTORY_FLUSH_DURATION.observe(time.perf_counter() - start_time)
+                    HISTORY_FLUSHED.inc(len(batch))
+                    written += len(batch)
+            finally:
+                with self._lock:
+                    self._inflight = OrderedDict()
+            return written
+
+    def _requeue(self, entries: List[HistoryEntry]) -> None:
+        """將寫入失敗的變更放回佇列前端 (佇列中同一 ID 的較新內容優先)"""
+        with self._lock:
+            requeued: "OrderedDict[str, HistoryEntry]" = OrderedDict()
+            for query, is_new in entries:
+                key = str(query.id)
+                newer = self._pending.pop(key, None)
+                if newer is not None:
+                    # 失敗的新增之後又有更新，合併為一次新增
+                    requeued[key] = (newer[0], newer[1] or is_new)
+                else:
+                    requeued[key] = (query, is_new)
+            requeued.update(self._pending)
+            self._pending = requeued
+
+    def _run(self) -> None:
+        """背景寫入迴圈，寫入失敗時以指數退避重試"""
+        retry_delay = 0.0
+        while not self._stopped.is_set():
+            if retry_delay:
+                # 退避期間不因佇列累積而提早重試
+                self._stopped.wait(retry_delay)
+            else:
+                self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set() or not self.has_pending():
+                continue
+            try:
+                self.flush(raise_errors=True)
+                retry_delay = 0.0
+            except Exception:
+                retry_delay = min(max(retry_delay * 2, self.flush_interval, 0.1), MAX_RETRY_DELAY)
+
+    def close(self) -> None:
+        """停止背景執行緒並寫完所有變更"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        for attempt in range(CLOSE_ATTEMPTS):
+            try:
+                self.flush(raise_errors=True)
+                return
+            except Exception:
+                if attempt + 1 < CLOSE_ATTEMPTS:
+                    time.sleep(0.5 * (attempt + 1))
+        with self._lock:
+            lost = len(self._pending)
+        logger.critical(f"程序結束前仍有 {lost} 筆查詢歷史無法寫入")
@@ -0,0 +1,134 @@
+import asyncio
+import atexit
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from ..utils.config import settings
+
+if TYPE_CHECKING:
+    import httpx
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 名稱 -> 長連線 HTTP 客戶端
+_clients: Dict[str, "httpx.Client"] = {}
+# 名稱 -> (非同步客戶端, 建立時的事件迴圈)
+_async_clients: Dict[str, Tuple["httpx.AsyncClient", asyncio.AbstractEventLoop]] = {}
+_lock = threading.Lock()
+
+
+def _build_limits() -> "httpx.Limits":
+    """依設定建立連線池限制"""
+    import httpx
+
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+
+
+def get_http_client(name: str, base_url: Optional[str] = None) -> "httpx.Client":
+    """
+    獲取共用的長連線 HTTP 客戶端
+
+    同名客戶端在整個程序中只會建立一次，連線 (含 TLS 會話) 會保留在連線池中重複使用。
+    httpx.Client 為執行緒安全，可同時被多個執行緒 (包含 FastAPI 執行緒池中的請求) 使用。
+
+    Args:
+        name: 客戶端名稱，通常為提供者名稱
+        base_url: 基礎 URL
+
+    Returns:
+        HTTP 客戶端
+    """
+    client = _clients.get(name)
+    if client is not None and not client.is_closed:
+        return client
+
+    with _lock:
+        client = _clients.get(name)
+        if client is None or client.is_closed:
+            import httpx  # 第一次建立客戶端時才匯入
+
+            client = httpx.Client(
+                base_url=base_url or "",
+                limits=_build_limits(),
+                timeout=settings.http_timeout,
+            )
+            _clients[name] = client
+            logger.info(f"建立 HTTP 連線池: {name}")
+        return client
+
+
+def close_http_clients() -> None:
+    """關閉所有 HTTP 客戶端並釋放連線"""
+    with _lock:
+        for name, client in _clients.items():
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"關閉 HTTP 客戶端 {name} 失敗: {e}")
+        _clients.clear()
+
+
+def get_async_http_client(name: str, base_url: Optional[str] = None) -> "httpx.AsyncClient":
+    """
+    獲取共用的非同步長連線 HTTP 客戶端
+
+    httpx.AsyncClient 的連線綁定在建立它的事件迴圈上，因此每個名稱在每個事件迴圈中只建立一次，
+    同一迴圈中的所有協程共用連線池；事件迴圈改變 (例如測試或 CLI 中多次 asyncio.run) 時重新建立。
+    必須在事件迴圈中呼叫。
+
+    Args:
+        name: 客戶端名稱，通常為提供者名稱
+        base_url: 基礎 URL
+
+    Returns:
+        非同步 HTTP 客戶端
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(name)
+    if entry is not None and entry[1] is loop and not entry[0].is_closed:
+        return entry[0]
+
+    with _lock:
+        entry = _async_clients.get(name)
+        if entry is not None and entry[1] is loop and not entry[0].is_closed:
+            return entry[0]
+
+        import httpx  # 第一次建立客戶端時才匯入
+
+        # 舊事件迴圈已結束時無法在目前迴圈關閉其連線，直接捨棄
+        client = httpx.AsyncClient(
+            base_url=base_url or "",
+            limits=_build_limits(),
+            timeout=settings.http_timeout,
+        )
+        _async_clients[name] = (client, loop)
+        logger.info(f"建立非同步 HTTP 連線池: {name}")
+        return client
+
+
+async def close_async_http_clients() -> None:
+    """關閉目前事件迴圈建立的非同步 HTTP 客戶端並釋放連線"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entries = [
+            (name, client)
+            for name, (client, client_loop) in _async_clients.items()
+            if client_loop is loop
+        ]
+        for name, _ in entries:
+            del _async_clients[name]
+
+    for name, client in entries:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"關閉非同步 HTTP 客戶端 {name} 失敗: {e}")
+
+
+atexit.register(close_http_clients)
@@ -1,17 +1,45 @@
+import asyncio
+import hashlib
 import json
 import logging
+import math
 import os
+import random
+import threading
 import time
 import typing
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
 from uuid import uuid4
 
 from ..utils.config import ModelConfig, ModelProvider, settings
+from ..utils.metrics import metrics
+from ..utils.profiling import current_stage, record_cache_access, record_counter, stage
+from ..utils.tokens import estimate_tokens
+from .http_clients import get_async_http_client, get_http_client
+from .rate_limiter import RateLimiter
+from .token_meter import (
+    TokenBudgetExceeded,
+    TokenMeter,
+    get_usage_context,
+    normalize_token_usage,
+)
 
 # 設定日誌
 logger = logging.getLogger(__name__)
 
+# 未設定 max_tokens 時，預估生成的 token 數
+DEFAULT_COMPLETION_TOKENS = 1024
+
+# 各模型的 LLM 呼叫延遲 (不含排隊時間)
+LLM_DURATION = metrics.histogram(
+    "llm_request_duration_seconds", "LLM 呼叫耗時 (秒)", labelnames=("provider", "model")
+)
+
+# 每個 Google 提供者快取的 GenerativeModel 數量上限 (依系統提示詞區分)
+GOOGLE_MODEL_CACHE_SIZE = 16
+
 
 class LLMResponse:
     """語言模型回應"""
@@ -52,6 +80,19 @@ class LLMResponse:
         """是否為錯誤回應"""
         return self.error is not None
 
+    def get_total_tokens(self) -> Optional[int]:
+        """取得總 token 用量，提供者未回報時返回 None"""
+        usage = self.token_usage
+        if not usage:
+            return None
+        if "total_tokens" in usage:
+            return int(usage["total_tokens"])
+        prompt_tokens = usage.get("prompt_tokens", usage.get("input_tokens", 0))
+        completion_tokens = usage.get(
+            "completion_tokens", usage.get("output_tokens", 0)
+        )
+        return int(prompt_tokens + completion_tokens)
+
     def get_parsed_json(self) -> Dict[str, Any]:
         """嘗試解析 JSON 內容"""
         try:
@@ -92,79 +133,141 @@ class LLMProvider(ABC):
         """生成文本"""
         pass
 
+    async def agenerate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """非同步生成文本，未提供原生非同步客戶端的提供者在執行緒池中呼叫 generate"""
+        return await asyncio.to_thread(self.generate, prompt, system_prompt, json_mode)
+
+    def _get_async_client(self, name: str, factory: Callable[[Any], Any]) -> Any:
+        """
+        獲取使用共用非同步連線池的 SDK 客戶端
+
+        連線池綁定事件迴圈，連線池重新建立時 SDK 客戶端也跟著重建。
+
+        Args:
+            name: 共用連線池名稱
+            factory: 以 httpx.AsyncClient 建立 SDK 客戶端的函數
+
+        Returns:
+            非同步 SDK 客戶端
+        """
+        http_client = get_async_http_client(name)
+        cached = getattr(self, "_async_client", None)
+        if cached is None or cached[0] is not http_client:
+            cached = (http_client, factory(http_client))
+            self._async_client = cached
+        return cached[1]
+
 
 class OpenAIProvider(LLMProvider):
     """OpenAI 模型提供者"""
 
+    # 共用連線池名稱與錯誤日誌中的 API 名稱
+    client_name = "openai"
+    api_label = "OpenAI API"
+
     def _setup(self):
         """設置 OpenAI API 客戶端"""
         try:
             import openai
 
-            self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+            self.openai = openai
+            self.client = openai.OpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=get_http_client(self.client_name),
+            )
         except ImportError:
             logger.error("OpenAI 套件未安裝，請執行 pip install openai")
             raise
 
-    def generate(
-        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
-    ) -> LLMResponse:
-        """使用 OpenAI API 生成文本"""
-        try:
-            start_time = time.time()
+    def _create_async_client(self, http_client: Any) -> Any:
+        """建立非同步 OpenAI 客戶端"""
+        return self.openai.AsyncOpenAI(
+            api_key=self.api_key, base_url=self.base_url, http_client=http_client
+        )
 
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": prompt})
+    def _request_params(
+        self, prompt: str, system_prompt: Optional[str], json_mode: bool
+    ) -> Dict[str, Any]:
+        """準備 chat.completions 請求參數"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+
+        # 準備參數
+        params = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": self.temperature,
+        }
 
-            # 準備參數
-            params = {
-                "model": self.model_name,
-                "messages": messages,
-                "temperature": self.temperature,
-            }
+        # 添加 JSON 模式
+        if json_mode and self.supports_json_mode:
+            params["response_format"] = {"type": "json_object"}
 
-            # 添加 JSON 模式
-            if json_mode and self.supports_json_mode:
-                params["response_format"] = {"type": "json_object"}
+        # 添加 max_tokens 如果有設定
+        if self.max_tokens:
+            params["max_tokens"] = self.max_tokens
 
-            # 添加 max_tokens 如果有設定
-            if self.max_tokens:
-                params["max_tokens"] = self.max_tokens
+        # 添加額外參數
+        for key, value in self.additional_params.items():
+            params[key] = value
 
-            # 添加額外參數
-            for key, value in self.additional_params.items():
-                params[key] = value
+        return params
 
-            # 調用 API
-            response = self.client.chat.completions.create(**params)
+    def _build_response(self, response: Any, start_time: float) -> LLMResponse:
+        """將 chat.completions 回應轉為 LLMResponse"""
+        # 計算耗時
+        latency = (time.perf_counter() - start_time) * 1000  # 轉換為毫秒
 
-            # 計算耗時
-            latency = (time.time() - start_time) * 1000  # 轉換為毫秒
+        # 獲取 token 使用量
+        token_usage = {}
+        if hasattr(response, "usage"):
+            token_usage = {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens,
+            }
 
-            # 獲取 token 使用量
-            token_usage = {}
-            if hasattr(response, "usage"):
-                token_usage = {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens,
-                }
+        # 構建回應
+        content = response.choices[0].message.content
 
-            # 構建回應
-            content = response.choices[0].message.content
+        return LLMResponse(
+            content=content,
+            model=self.model_name,
+            token_usage=token_usage,
+            raw_response=response,
+            latency=latency,
+        )
 
-            return LLMResponse(
-                content=content,
-                model=self.model_name,
-                token_usage=token_usage,
-                raw_response=response,
-                latency=latency,
-            )
+    def generate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """使用 OpenAI API 生成文本"""
+        try:
+            start_time = time.perf_counter()
+            params = self._request_params(prompt, system_prompt, json_mode)
+            response = self.client.chat.completions.create(**params)
+            return self._build_response(response, start_time)
+        except Exception as e:
+            logger.error(f"{self.api_label} 調用錯誤: {e}")
+            return LLMResponse(content="", model=self.model_name, error=str(e))
 
+    async def agenerate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """使用非同步 OpenAI 客戶端生成文本，連線取自共用的非同步連線池"""
+        try:
+            start_time = time.perf_counter()
+            params = self._request_params(prompt, system_prompt, json_mode)
+            client = self._get_async_client(self.client_name, self._create_async_client)
+            response = await client.chat.completions.create(**params)
+            return self._build_response(response, start_time)
         except Exception as e:
-            logger.error(f"OpenAI API 調用錯誤: {e}")
+            logger.error(f"{self.api_label} 調用錯誤: {e}")
             return LLMResponse(content="", model=self.model_name, error=str(e))
 
 
@@ -176,63 +279,91 @@ class AnthropicProvider(LLMProvider):
         try:
             import anthropic
 
-            self.client = anthropic.Anthropic(api_key=self.api_key)
+            self.anthropic = anthropic
+            self.client = anthropic.Anthropic(
+                api_key=self.api_key, http_client=get_http_client("anthropic")
+            )
         except ImportError:
             logger.error("Anthropic 套件未安裝，請執行 pip install anthropic")
             raise
 
-    def generate(
-        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
-    ) -> LLMResponse:
-        """使用 Anthropic API 生成文本"""
-        try:
-            start_time = time.time()
+    def _request_params(
+        self, prompt: str, system_prompt: Optional[str], json_mode: bool
+    ) -> Dict[str, Any]:
+        """準備 messages 請求參數"""
+        params = {
+            "model": self.model_name,
+            "max_tokens": self.max_tokens or 4096,
+            "temperature": self.temperature,
+            "messages": [{"role": "user", "content": prompt}],
+        }
 
-            # 準備參數
-            params = {
-                "model": self.model_name,
-                "max_tokens": self.max_tokens or 4096,
-                "temperature": self.temperature,
-                "messages": [{"role": "user", "content": prompt}],
-            }
+        # 添加 system 提示
+        if system_prompt:
+            params["system"] = system_prompt
 
-            # 添加 system 提示
-            if system_prompt:
-                params["system"] = system_prompt
+        # 添加 JSON 模式
+        if json_mode and self.supports_json_mode:
+            params["response_format"] = {"type": "json_object"}
 
-            # 添加 JSON 模式
-            if json_mode and self.supports_json_mode:
-                params["response_format"] = {"type": "json_object"}
+        # 添加額外參數
+        for key, value in self.additional_params.items():
+            params[key] = value
 
-            # 添加額外參數
-            for key, value in self.additional_params.items():
-                params[key] = value
+        return params
 
-            # 調用 API
-            response = self.client.messages.create(**params)
+    def _build_response(self, response: Any, start_time: float) -> LLMResponse:
+        """將 messages 回應轉為 LLMResponse"""
+        # 計算耗時
+        latency = (time.perf_counter() - start_time) * 1000  # 轉換為毫秒
 
-            # 計算耗時
-            latency = (time.time() - start_time) * 1000  # 轉換為毫秒
+        # 獲取 token 使用量
+        token_usage = {}
+        if hasattr(response, "usage"):
+            token_usage = {
+                "input_tokens": response.usage.input_tokens,
+                "output_tokens": response.usage.output_tokens,
+            }
 
-            # 獲取 token 使用量
-            token_usage = {}
-            if hasattr(response, "usage"):
-                token_usage = {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens,
-                }
+        # 構建回應
+        content = response.content[0].text
 
-            # 構建回應
-            content = response.content[0].text
+        return LLMResponse(
+            content=content,
+            model=self.model_name,
+            token_usage=token_usage,
+            raw_response=response,
+            latency=latency,
+        )
 
-            return LLMResponse(
-                content=content,
-                model=self.model_name,
-                token_usage=token_usage,
-                raw_response=response,
-                latency=latency,
-            )
+    def generate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """使用 Anthropic API 生成文本"""
+        try:
+            start_time = time.perf_counter()
+            params = self._request_params(prompt, system_prompt, json_mode)
+            response = self.client.messages.create(**params)
+            return self._build_response(response, start_time)
+        except Exception as e:
+            logger.error(f"Anthropic API 調用錯誤: {e}")
+            return LLMResponse(content="", model=self.model_name, error=str(e))
 
+    async def agenerate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """使用非同步 Anthropic 客戶端生成文本，連線取自共用的非同步連線池"""
+        try:
+            start_time = time.perf_counter()
+            params = self._request_params(prompt, system_prompt, json_mode)
+            client = self._get_async_client(
+                "anthropic",
+                lambda http_client: self.anthropic.AsyncAnthropic(
+                    api_key=self.api_key, http_client=http_client
+                ),
+            )
+            response = await client.messages.create(**params)
+            return self._build_response(response, start_time)
         except Exception as e:
             logger.error(f"Anthropic API 調用錯誤: {e}")
             return LLMResponse(content="", model=self.model_name, error=str(e))
@@ -248,6 +379,10 @@ class GoogleProvider(LLMProvider):
 
             genai.configure(api_key=self.api_key)
             self.genai = genai
+
+            # 依系統提示詞快取模型物件，避免每次呼叫重新建立
+            self.models: "OrderedDict[Optional[str], Any]" = OrderedDict()
+            self._models_lock = threading.Lock()
         except ImportError:
             logger.error(
                 "Google Generative AI 套件未安裝，請執行 pip install google-generativeai"
@@ -259,10 +394,10 @@ class GoogleProvider(LLMProvider):
     ) -> LLMResponse:
         """使用 Google Generative AI API 生成文本"""
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
 
-            # 設置模型
-            model = self.genai.GenerativeModel(self.model_name)
+            # 獲取快取的模型
+            model = self._get_model(system_prompt)
 
             # 配置生成參數
             generation_config = {
@@ -272,19 +407,13 @@ class GoogleProvider(LLMProvider):
                 "top_k": 0,
             }
 
-            # 添加系統提示
-            if system_prompt:
-                chat = model.start_chat(system_instruction=system_prompt)
-                response = chat.send_message(
-                    prompt, generation_config=generation_config
-                )
-            else:
-                response = model.generate_content(
-                    prompt, generation_config=generation_config
-                )
+            # 系統提示已設定在模型上
+            response = model.generate_content(
+                prompt, generation_config=generation_config
+            )
 
             # 計算耗時
-            latency = (time.time() - start_time) * 1000  # 轉換為毫秒
+            latency = (time.perf_counter() - start_time) * 1000  # 轉換為毫秒
 
             # 構建回應
             if json_mode:
@@ -293,9 +422,20 @@ class GoogleProvider(LLMProvider):
 
             content = response.text
 
+            # 獲取 token 使用量 (部分版本的 SDK 沒有 usage_metadata)
+            token_usage = {}
+            usage_metadata = getattr(response, "usage_metadata", None)
+            if usage_metadata is not None:
+                token_usage = {
+                    "prompt_token_count": usage_metadata.prompt_token_count,
+                    "candidates_token_count": usage_metadata.candidates_token_count,
+                    "total_token_count": usage_metadata.total_token_count,
+                }
+
             return LLMResponse(
                 content=content,
                 model=self.model_name,
+                token_usage=token_usage,
                 raw_response=response,
                 latency=latency,
             )
@@ -304,79 +444,86 @@ class GoogleProvider(LLMProvider):
             logger.error(f"Google API 調用錯誤: {e}")
             return LLMResponse(content="", model=self.model_name, error=str(e))
 
+    def _get_model(self, system_prompt: Optional[str]) -> Any:
+        """獲取指定系統提示詞的模型物件 (LRU 快取)"""
+        with self._models_lock:
+            model = self.models.get(system_prompt)
+            if model is not None:
+                self.models.move_to_end(system_prompt)
+                return model
+
+            if system_prompt:
+                model = self.genai.GenerativeModel(
+                    self.model_name, system_instruction=system_prompt
+                )
+            else:
+                model = self.genai.GenerativeModel(self.model_name)
+
+            self.models[system_prompt] = model
+            if len(self.models) > GOOGLE_MODEL_CACHE_SIZE:
+                self.models.popitem(last=False)
+            return model
+
 
-class AzureProvider(LLMProvider):
+class AzureProvider(OpenAIProvider):
     """Azure OpenAI 模型提供者"""
 
+    client_name = "azure"
+    api_label = "Azure OpenAI API"
+
     def _setup(self):
         """設置 Azure OpenAI API 客戶端"""
         try:
-            from openai import AzureOpenAI
+            import openai
 
-            self.client = AzureOpenAI(
+            self.openai = openai
+            self.client = openai.AzureOpenAI(
                 api_key=self.api_key,
-                api_version=self.additional_params.get("api_version", "2023-05-15"),
+                api_version=self._api_version(),
                 azure_endpoint=self.base_url,
+                http_client=get_http_client(self.client_name),
             )
         except ImportError:
             logger.error("OpenAI 套件未安裝，請執行 pip install openai")
             raise
 
-    def generate(
-        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
-    ) -> LLMResponse:
-        """使用 Azure OpenAI API 生成文本"""
-        try:
-            start_time = time.time()
-
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": prompt})
+    def _api_version(self) -> str:
+        return self.additional_params.get("api_version", "2023-05-15")
 
-            # 準備參數
-            params = {
-                "messages": messages,
-                "temperature": self.temperature,
-                "deployment_name": self.additional_params.get("deployment_name", ""),
-            }
-
-            # 添加 JSON 模式
-            if json_mode and self.supports_json_mode:
-                params["response_format"] = {"type": "json_object"}
-
-            # 添加 max_tokens 如果有設定
-            if self.max_tokens:
-                params["max_tokens"] = self.max_tokens
-
-            # 調用 API
-            response = self.client.chat.completions.create(**params)
+    def _create_async_client(self, http_client: Any) -> Any:
+        """建立非同步 Azure OpenAI 客戶端"""
+        return self.openai.AsyncAzureOpenAI(
+            api_key=self.api_key,
+            api_version=self._api_version(),
+            azure_endpoint=self.base_url,
+            http_client=http_client,
+        )
 
-            # 計算耗時
-            latency = (time.time() - start_time) * 1000  # 轉換為毫秒
+    def _request_params(
+        self, prompt: str, system_prompt: Optional[str], json_mode: bool
+    ) -> Dict[str, Any]:
+        """準備 chat.completions 請求參數 (以部署名稱取代模型名稱)"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+
+        # 準備參數
+        params = {
+            "messages": messages,
+            "temperature": self.temperature,
+            "deployment_name": self.additional_params.get("deployment_name", ""),
+        }
 
-            # 獲取 token 使用量
-            token_usage = {}
-            if hasattr(response, "usage"):
-                token_usage = {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens,
-                }
-            # 構建回應
-            content = response.choices[0].message.content
+        # 添加 JSON 模式
+        if json_mode and self.supports_json_mode:
+            params["response_format"] = {"type": "json_object"}
 
-            return LLMResponse(
-                content=content,
-                model=self.model_name,
-                token_usage=token_usage,
-                raw_response=response,
-                latency=latency,
-            )
+        # 添加 max_tokens 如果有設定
+        if self.max_tokens:
+            params["max_tokens"] = self.max_tokens
 
-        except Exception as e:
-            logger.error(f"Azure OpenAI API 調用錯誤: {e}")
-            return LLMResponse(content="", model=self.model_name, error=str(e))
+        return params
 
 
 class LocalProvider(LLMProvider):
@@ -384,61 +531,291 @@ class LocalProvider(LLMProvider):
 
     def _setup(self):
         """設置本地模型客戶端"""
-        # Ollama 使用 REST API，不需要特殊客戶端
-        import requests
+        # Ollama 使用 REST API，使用共用的長連線 HTTP 客戶端
+        self.client_name = f"local:{self.base_url}"
+        self.client = get_http_client(self.client_name)
+
+    def _request_data(
+        self, prompt: str, system_prompt: Optional[str], json_mode: bool
+    ) -> Dict[str, Any]:
+        """準備 /generate 請求數據"""
+        data = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "temperature": self.temperature,
+            "stream": False,
+        }
+
+        if system_prompt:
+            data["system"] = system_prompt
+
+        # 如果需要 JSON 輸出，添加到提示詞中
+        if json_mode:
+            data["prompt"] = f"{prompt}\n\n請只返回有效的 JSON 格式，不要加入任何解釋文字。"
+
+        return data
 
-        self.requests = requests
+    def _build_response(self, response: Any, start_time: float) -> LLMResponse:
+        """將 /generate 回應轉為 LLMResponse"""
+        # 確保請求成功
+        response.raise_for_status()
+
+        # 解析回應
+        json_response = response.json()
+
+        # 計算耗時
+        latency = (time.perf_counter() - start_time) * 1000  # 轉換為毫秒
+
+        # 構建回應
+        content = json_response.get("response", "")
+
+        # Ollama 以 prompt_eval_count / eval_count 回報 token 數
+        token_usage = {
+            key: json_response[key]
+            for key in ("prompt_eval_count", "eval_count")
+            if json_response.get(key) is not None
+        }
+
+        return LLMResponse(
+            content=content,
+            model=self.model_name,
+            token_usage=token_usage,
+            raw_response=json_response,
+            latency=latency,
+        )
 
     def generate(
         self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
     ) -> LLMResponse:
         """使用本地模型生成文本"""
         try:
-            start_time = time.time()
+            start_time = time.perf_counter()
+            response = self.client.post(
+                f"{self.base_url}/generate",
+                headers={"Content-Type": "application/json"},
+                json=self._request_data(prompt, system_prompt, json_mode),
+            )
+            return self._build_response(response, start_time)
+        except Exception as e:
+            logger.error(f"本地模型 API 調用錯誤: {e}")
+            return LLMResponse(content="", model=self.model_name, error=str(e))
 
-            # 準備請求數據
-            headers = {"Content-Type": "application/json"}
-            data = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "temperature": self.temperature,
-                "stream": False,
-            }
+    async def agenerate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """使用共用的非同步連線池呼叫本地模型"""
+        try:
+            start_time = time.perf_counter()
+            client = get_async_http_client(self.client_name)
+            response = await client.post(
+                f"{self.base_url}/generate",
+                headers={"Content-Type": "application/json"},
+                json=self._request_data(prompt, system_prompt, json_mode),
+            )
+            return self._build_response(response, start_time)
+        except Exception as e:
+            logger.error(f"本地模型 API 調用錯誤: {e}")
+            return LLMResponse(content="", model=self.model_name, error=str(e))
 
-            if system_prompt:
-                data["system"] = system_prompt
 
-            # 如果需要 JSON 輸出，添加到提示詞中
-            if json_mode:
-                data["prompt"] = f"{prompt}\n\n請只返回有效的 JSON 格式，不要加入任何解釋文字。"
+class LatencyDistribution:
+    """
+    重放回應時模擬的延遲分佈
 
-            # 發送請求
-            response = self.requests.post(
-                f"{self.base_url}/generate", headers=headers, json=data
-            )
+    規格格式:
+        recorded[:倍率]            使用錄製時的延遲 (可乘上倍率)
+        none                       不延遲
+        fixed:毫秒                 固定延遲
+        uniform:最小:最大          均勻分佈
+        normal:平均:標準差         常態分佈 (截斷於 0)
+        lognormal:平均:標準差      對數常態分佈，接近真實 API 的長尾延遲
+    """
 
-            # 確保請求成功
-            response.raise_for_status()
+    KINDS = ("recorded", "none", "fixed", "uniform", "normal", "lognormal")
 
-            # 解析回應
-            json_response = response.json()
+    def __init__(self, spec: str = "recorded", seed: Optional[int] = None):
+        parts = (spec or "recorded").split(":")
+        self.kind = parts[0].strip().lower()
+        if self.kind not in self.KINDS:
+            raise ValueError(f"未知的延遲分佈: {spec}，可用: {', '.join(self.KINDS)}")
+        try:
+            self.args = [float(part) for part in parts[1:]]
+        except ValueError:
+            raise ValueError(f"延遲分佈參數必須為數字: {spec}")
+        self.spec = spec
+        self.rng = random.Random(seed)
+
+        if self.kind == "lognormal":
+            mean, stddev = self._require(2)
+            sigma_squared = math.log(1 + (stddev / mean) ** 2)
+            self.mu = math.log(mean) - sigma_squared / 2
+            self.sigma = math.sqrt(sigma_squared)
+        elif self.kind in ("uniform", "normal"):
+            self._require(2)
+        elif self.kind == "fixed":
+            self._require(1)
+
+    def _require(self, count: int) -> List[float]:
+        """檢查參數數量"""
+        if len(self.args) < count:
+            raise ValueError(f"延遲分佈 {self.kind} 需要 {count} 個參數: {self.spec}")
+        return self.args[:count]
+
+    def sample(self, recorded_ms: float = 0.0) -> float:
+        """抽樣一次延遲 (毫秒)"""
+        if self.kind == "recorded":
+            scale = self.args[0] if self.args else 1.0
+            return max(0.0, recorded_ms * scale)
+        if self.kind == "none":
+            return 0.0
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(self.args[0], self.args[1])
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(self.args[0], self.args[1]))
+        return self.rng.lognormvariate(self.mu, self.sigma)
+
+
+def prompt_hash(prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False) -> str:
+    """計算提示詞雜湊，作為錄製與重放的鍵 (與模型無關，可用任一模型錄製)"""
+    payload = json.dumps([system_prompt or "", prompt, bool(json_mode)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReplayProvider(LLMProvider):
+    """
+    重放錄製回應的提供者
+
+    依提示詞雜湊回傳 LLMRecorder 錄製的回應並模擬延遲，用於不依賴網路的壓力測試。
+    同一提示詞有多筆錄製時依序輪流回放。
+    """
 
-            # 計算耗時
-            latency = (time.time() - start_time) * 1000  # 轉換為毫秒
+    def _setup(self):
+        """載入錄製檔案"""
+        params = self.additional_params
+        self.recording_file = params.get("recording_file", "llm_recordings.jsonl")
+        self.latency = LatencyDistribution(params.get("latency", "recorded"), seed=params.get("seed"))
+        self.on_miss = params.get("on_miss", "error")
+        if self.on_miss not in ("error", "any"):
+            raise ValueError(f"未知的 on_miss 設定: {self.on_miss}，可用: error, any")
+
+        self.recordings: Dict[str, List[Dict[str, Any]]] = {}
+        self.all_records: List[Dict[str, Any]] = []
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(params.get("seed"))
+        self.load(self.recording_file)
+
+    def load(self, path: str) -> int:
+        """
+        載入 JSONL 錄製檔案
+
+        Args:
+            path: 錄製檔案路徑
+
+        Returns:
+            載入的回應數
+        """
+        if not os.path.exists(path):
+            logger.warning(f"找不到錄製檔案: {path}")
+            return 0
+
+        loaded = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"略過格式錯誤的錄製記錄: {line[:80]}")
+                    continue
+                self.recordings.setdefault(record["key"], []).append(record)
+                self.all_records.append(record)
+                loaded += 1
+
+        logger.info(f"已載入 {loaded} 筆錄製回應 ({len(self.recordings)} 個提示詞): {path}")
+        return loaded
+
+    def _next_record(self, key: str) -> Optional[Dict[str, Any]]:
+        """取得下一筆錄製回應"""
+        with self._lock:
+            records = self.recordings.get(key)
+            if records:
+                cursor = self._cursors.get(key, 0)
+                self._cursors[key] = cursor + 1
+                return records[cursor % len(records)]
+            if self.on_miss == "any" and self.all_records:
+                return self._rng.choice(self.all_records)
+            return None
 
-            # 構建回應
-            content = json_response.get("response", "")
+    def generate(
+        self, prompt: str, system_prompt: Optional[str] = None, json_mode: bool = False
+    ) -> LLMResponse:
+        """回放錄製的回應"""
+        key = prompt_hash(prompt, system_prompt, json_mode)
+        record_cache_access("llm_replay", key in self.recordings)
 
+        record = self._next_record(key)
+        if record is None:
             return LLMResponse(
-                content=content,
-                model=self.model_name,
-                raw_response=json_response,
-                latency=latency,
+                content="", model=self.model_name, error=f"沒有錄製的回應 (提示詞雜湊 {key[:12]})"
             )
 
-        except Exception as e:
-            logger.error(f"本地模型 API 調用錯誤: {e}")
-            return LLMResponse(content="", model=self.model_name, error=str(e))
+        latency = self.latency.sample(record.get("latency", 0.0))
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        return LLMResponse(
+            content=record.get("content", ""),
+            model=self.model_name,
+            token_usage=dict(record.get("token_usage") or {}),
+            raw_response={"recorded_model": record.get("model"), "key": record.get("key")},
+            latency=latency,
+        )
+
+
+class LLMRecorder:
+    """將真實的 LLM 回應附加寫入 JSONL 檔案，供 ReplayProvider 重放"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        json_mode: bool,
+        response: LLMResponse,
+    ) -> None:
+        """錄製一次成功的回應"""
+        if response.is_error():
+            return
+
+        line = json.dumps(
+            {
+                "key": prompt_hash(prompt, system_prompt, json_mode),
+                "model": response.model,
+                "prompt_preview": prompt[:200],
+                "content": response.content,
+                "token_usage": response.token_usage,
+                "latency": response.latency,
+                "recorded_at": time.time(),
+            },
+            ensure_ascii=False,
+            default=str,
+        )
+        try:
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.count += 1
+        except OSError as e:
+            logger.error(f"錄製 LLM 回應失敗: {e}")
 
 
 class LLMService:
@@ -451,6 +828,7 @@ class LLMService:
             ModelProvider.GOOGLE: GoogleProvider,
             ModelProvider.AZURE: AzureProvider,
             ModelProvider.LOCAL: LocalProvider,
+            ModelProvider.REPLAY: ReplayProvider,
         }
 
         # 初始化提供者緩存
@@ -459,11 +837,23 @@ class LLMService:
         # 模型評分記錄
         self.model_scores = {}
 
+        # 並發與速率限制
+        self.rate_limiter = RateLimiter(queue_timeout=settings.llm_queue_timeout)
+
+        # 錄製模式：將真實回應寫入磁碟
+        self.recorder = LLMRecorder(settings.llm_record_file) if settings.llm_record_file else None
+        if self.recorder:
+            logger.info(f"LLM 錄製模式已啟用: {settings.llm_record_file}")
+
+        # Token 用量與費用計量
+        self.token_meter = TokenMeter(log_file=settings.token_usage_file)
+
     def get_provider(self, model_name: Optional[str] = None) -> LLMProvider:
         """獲取語言模型提供者"""
         model_name = model_name or settings.default_model
 
         # 如果提供者已經被初始化過，則直接返回
+        record_cache_access("llm_provider", model_name in self.providers)
         if model_name in self.providers:
             return typing.cast(
                 LLMProvider, self.providers[model_name]
@@ -487,7 +877,7 @@ class LLMService:
         # 初始化提供者
         try:
             provider = provider_class(model_config)
-            self.providers[model_name] = provider
+            self.register_provider(model_name, provider)
             return provider
         except Exception as e:
             logger.error(f"初始化模型提供者 {model_name} 失敗: {e}")
@@ -501,14 +891,236 @@ class LLMService:
         json_mode: bool = False,
     ) -> LLMResponse:
         """生成文本"""
+        model_name = model_name or settings.default_model
+        try:
+            model_name = self._apply_token_budget(model_name, prompt, system_prompt)
+        except TokenBudgetExceeded as e:
+            logger.warning(str(e))
+            return LLMResponse(content="", model=model_name, error=str(e))
+
+        # 呼叫端所在的處理階段 (例如 reference_resolution 或 llm)
+        caller_stage = current_stage()
+
         try:
             provider = self.get_provider(model_name)
-            return provider.generate(prompt, system_prompt, json_mode)
+
+            # 取得速率限制許可，超出配額時排隊等待
+            with stage("llm_queue"):
+                permit = self.rate_limiter.acquire(
+                    provider.model_config.provider.value,
+                    model_name,
+                    self._estimate_request_tokens(provider, prompt, system_prompt),
+                )
+            response = None
+            try:
+                start_time = time.perf_counter()
+                with stage("llm_call", model=model_name):
+                    response = provider.generate(prompt, system_prompt, json_mode)
+                self._record_response(
+                    provider,
+                    model_name,
+                    prompt,
+                    system_prompt,
+                    json_mode,
+                    response,
+                    start_time,
+                    caller_stage,
+                )
+                return response
+            finally:
+                self._release_permit(permit, response)
         except Exception as e:
             logger.error(f"生成文本失敗: {e}")
-            return LLMResponse(
-                content="", model=model_name or settings.default_model, error=str(e)
+            return LLMResponse(content="", model=model_name, error=str(e))
+
+    async def agenerate(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        model_name: Optional[str] = None,
+        json_mode: bool = False,
+    ) -> LLMResponse:
+        """
+        非同步生成文本
+
+        與 generate 共用速率限制、token 預算與用量記錄；提供者呼叫使用共用的非同步連線池，
+        不佔用執行緒池。速率限制的排隊在執行緒池中等待，不阻塞事件迴圈。
+        """
+        model_name = model_name or settings.default_model
+        try:
+            model_name = self._apply_token_budget(model_name, prompt, system_prompt)
+        except TokenBudgetExceeded as e:
+            logger.warning(str(e))
+            return LLMResponse(content="", model=model_name, error=str(e))
+
+        caller_stage = current_stage()
+
+        try:
+            provider = self.get_provider(model_name)
+
+            with stage("llm_queue"):
+                permit = await asyncio.to_thread(
+                    self.rate_limiter.acquire,
+                    provider.model_config.provider.value,
+                    model_name,
+                    self._estimate_request_tokens(provider, prompt, system_prompt),
+                )
+            response = None
+            try:
+                start_time = time.perf_counter()
+                with stage("llm_call", model=model_name):
+                    response = await provider.agenerate(prompt, system_prompt, json_mode)
+                self._record_response(
+                    provider,
+                    model_name,
+                    prompt,
+                    system_prompt,
+                    json_mode,
+                    response,
+                    start_time,
+                    caller_stage,
+                )
+                return response
+            finally:
+                self._release_permit(permit, response)
+        except Exception as e:
+            logger.error(f"生成文本失敗: {e}")
+            return LLMResponse(content="", model=model_name, error=str(e))
+
+    def _record_response(
+        self,
+        provider: LLMProvider,
+        model_name: str,
+        prompt: str,
+        system_prompt: Optional[str],
+        json_mode: bool,
+        response: LLMResponse,
+        start_time: float,
+        caller_stage: Optional[str],
+    ) -> None:
+        """記錄 LLM 呼叫耗時、token 用量與錄製檔"""
+        LLM_DURATION.observe(
+            time.perf_counter() - start_time,
+            provider=provider.model_config.provider.value,
+            model=model_name,
+        )
+        if not response.is_error():
+            # 統一各提供者的用量欄位，未回報時以分詞器估算
+            response.token_usage = normalize_token_usage(
+                response.token_usage,
+                prompt,
+                system_prompt,
+                response.content,
+                provider.model_name,
+            )
+            self.token_meter.record(
+                model_name,
+                response.token_usage,
+                cost=self._calculate_cost(provider.model_config, response.token_usage),
+                stage=caller_stage,
+            )
+        if self.recorder and not isinstance(provider, ReplayProvider):
+            self.recorder.record(prompt, system_prompt, json_mode, response)
+
+    @staticmethod
+    def _release_permit(permit: Any, response: Optional[LLMResponse]) -> None:
+        """以實際 token 用量釋放速率限制許可"""
+        total_tokens = response.get_total_tokens() if response else None
+        permit.release(total_tokens)
+        record_counter("llm.calls")
+        if total_tokens is not None:
+            record_counter("llm.total_tokens", total_tokens)
+
+    def _apply_token_budget(
+        self, model_name: str, prompt: str, system_prompt: Optional[str]
+    ) -> str:
+        """
+        檢查目前會話的 token 預算
+
+        預估本次提示詞的 token 數，加上會話已使用量超出預算時，依設定拒絕
+        (拋出 TokenBudgetExceeded) 或改用降級模型。
+
+        Returns:
+            實際使用的模型名稱
+        """
+        budget = settings.session_token_budget
+        session_id = get_usage_context().get("session")
+        if budget <= 0 or not session_id:
+            return model_name
+
+        used = self.token_meter.get_session_total(session_id)
+        estimated = estimate_tokens(prompt) + estimate_tokens(system_prompt)
+        if used + estimated <= budget:
+            return model_name
+
+        downgrade_model = settings.token_budget_downgrade_model
+        if (
+            settings.token_budget_action == "downgrade"
+            and downgrade_model
+            and downgrade_model != model_name
+        ):
+            logger.info(
+                f"會話 {session_id} 已使用 {used} tokens，超出預算 {budget}，改用模型 {downgrade_model}"
             )
+            return downgrade_model
+
+        raise TokenBudgetExceeded(
+            f"會話 {session_id} 已使用 {used} tokens，本次預估 {estimated} tokens，超出預算 {budget}"
+        )
+
+    def _calculate_cost(
+        self, model_config: ModelConfig, token_usage: Dict[str, Any]
+    ) -> Optional[float]:
+        """依模型單價計算費用 (美元)，未設定單價時返回 None"""
+        if model_config.input_cost_per_1k is None and model_config.output_cost_per_1k is None:
+            return None
+        return (
+            token_usage.get("prompt_tokens", 0) * (model_config.input_cost_per_1k or 0.0)
+            + token_usage.get("completion_tokens", 0) * (model_config.output_cost_per_1k or 0.0)
+        ) / 1000
+
+    def get_token_usage(self, group_by: Optional[str] = None) -> Dict[str, Any]:
+        """獲取依模型、端點、會話與階段彙總的 token 用量"""
+        return self.token_meter.get_summary(group_by)
+
+    def _estimate_request_tokens(
+        self, provider: LLMProvider, prompt: str, system_prompt: Optional[str]
+    ) -> int:
+        """預估單次呼叫的 token 數 (提示詞 + 生成上限)，不超過模型上下文窗口"""
+        prompt_tokens = estimate_tokens(prompt) + estimate_tokens(system_prompt)
+        completion_tokens = provider.max_tokens or DEFAULT_COMPLETION_TOKENS
+        return min(
+            prompt_tokens + completion_tokens, provider.model_config.context_window
+        )
+
+    def register_provider(self, model_name: str, provider: LLMProvider) -> None:
+        """
+        註冊已建立的提供者實例 (例如基準測試使用的模擬提供者)
+
+        Args:
+            model_name: 模型名稱，呼叫 generate 時以此名稱選用
+            provider: 提供者實例
+        """
+        self.providers[model_name] = provider
+        # 重放不會呼叫外部 API，不限制提供者並發
+        provider_concurrency = (
+            None
+            if provider.model_config.provider == ModelProvider.REPLAY
+            else settings.llm_provider_max_concurrency
+        )
+        self.rate_limiter.configure_provider(
+            provider.model_config.provider.value, provider_concurrency
+        )
+        self.rate_limiter.configure_model(
+            model_name,
+            max_concurrency=provider.model_config.max_concurrency,
+            requests_per_minute=provider.model_config.requests_per_minute,
+            tokens_per_minute=provider.model_config.tokens_per_minute,
+        )
+
+    def get_rate_limit_stats(self) -> Dict[str, Any]:
+        """獲取各提供者與模型的排隊深度與等待時間統計"""
+        return self.rate_limiter.get_stats()
 
     def rate_response(
         self, response: LLMResponse, score: float, reason: Optional[str] = None
@@ -566,5 +1178,24 @@ class LLMService:
         return list(settings.models.keys())
 
 
-# 建立全局 LLM 服務實例
-llm_service = LLMService()
+# 全局 LLM 服務實例 (第一次使用時建立)
+_llm_service: Optional[LLMService] = None
+_llm_service_lock = threading.Lock()
+
+
+def get_llm_service() -> LLMService:
+    """獲取程序共用的 LLM 服務"""
+    global _llm_service
+    if _llm_service is None:
+        with _llm_service_lock:
+            if _llm_service is None:
+                _llm_service = LLMService()
+    return _llm_service
+
+
+def __getattr__(name: str):
+    # 保留 `from .llm_service import llm_service` 的用法，匯入模組時不建立服務
+    if name == "llm_service":
+        return get_llm_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
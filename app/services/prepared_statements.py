@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text, exc
+
+from ..utils.metrics import metrics
+from ..utils.profiling import record_cache_access
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+PREPARED_EVICTIONS = metrics.counter(
+    "texttosql_prepared_statement_evictions_total", "因超出容量而釋放的預備語句數"
+)
+
+# 與 sqlalchemy.text() 相同的具名參數規則 (排除 ::type 轉型)
+_BIND_PATTERN = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+# 連線 info 字典中存放預備語句 LRU 的鍵
+_CONNECTION_KEY = "texttosql_prepared_statements"
+
+# 無法預備的 SQL 最多記錄數
+MAX_UNPREPARABLE = 1000
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    預備語句的快取鍵 (只移除前後空白與結尾分號)
+
+    不合併內部空白：字串常數中的空白有意義 ('a  b' 與 'a b' 是不同查詢)，
+    合併換行也會使 -- 註解吃掉後續內容，兩者都會讓不同的查詢共用同一個預備語句。
+    """
+    return sql.strip().rstrip(";").strip()
+
+
+def to_positional(sql: str) -> Tuple[str, List[str]]:
+    """
+    將 :name 具名參數轉換為 $1、$2 位置參數
+
+    Returns:
+        (轉換後的 SQL, 依位置排列的參數名稱)
+    """
+    names: List[str] = []
+
+    def replace(match: re.Match) -> str:
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _BIND_PATTERN.sub(replace, sql), names
+
+
+class PreparedStatementCache:
+    """
+    每個連線池連線上的伺服器端預備語句快取
+
+    帶有具名參數的 SQL 在第一次執行時以 PREPARE 建立預備語句，之後以 EXECUTE 直接使用，
+    PostgreSQL 不需重新解析與規劃。預備語句依連線各自保存 (存放於連線的 info 字典，隨連線池重用)，
+    超出容量時以 LRU 順序 DEALLOCATE。無法預備的 SQL (例如多個語句、參數類型無法推斷) 改用一般執行。
+    """
+
+    def __init__(self, capacity: int = 100):
+        """
+        Args:
+            capacity: 每個連線保留的預備語句數量上限，0 表示停用
+        """
+        self.capacity = capacity
+        self._unpreparable: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def execute(self, conn, sql: str, params: Optional[Dict[str, Any]] = None):
+        """
+        執行查詢，適用時使用預備語句
+
+        Args:
+            conn: SQLAlchemy 連線
+            sql: SQL 查詢語句 (:name 具名參數)
+            params: 查詢參數
+
+        Returns:
+            SQLAlchemy 查詢結果
+        """
+        normalized = normalize_sql(sql)
+        if not self.capacity or not params or self._is_unpreparable(normalized):
+            return conn.execute(text(sql), params or {})
+
+        positional_sql, names = to_positional(normalized)
+        if not names or any(name not in params for name in names):
+            return conn.execute(text(sql), params)
+
+        statements = conn.info.setdefault(_CONNECTION_KEY, OrderedDict())
+        name = statements.get(normalized)
+        hit = name is not None
+        record_cache_access("prepared_statement", hit)
+
+        if hit:
+            statements.move_to_end(normalized)
+        else:
+            name = self._prepare(conn, statements, normalized, positional_sql)
+            if name is None:
+                return conn.execute(text(sql), params)
+
+        placeholders = ", ".join(["%s"] * len(names))
+        try:
+            return conn.exec_driver_sql(f"EXECUTE {name} ({placeholders})", tuple(params[key] for key in names))
+        except exc.DBAPIError as e:
+            # 伺服器端的預備語句已被清除 (例如連線經過 DISCARD ALL)，移除記錄後改用一般執行
+            if not hit or f'prepared statement "{name}" does not exist' not in str(e):
+                raise
+            statements.pop(normalized, None)
+            conn.rollback()
+            return conn.execute(text(sql), params)
+
+    def _prepare(self, conn, statements: "OrderedDict[str, str]", normalized: str, positional_sql: str) -> Optional[str]:
+        """在連線上建立預備語句，失敗時記錄為無法預備並返回 None"""
+        name = "tts_" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+        try:
+            # 以 SAVEPOINT 隔離，PREPARE 失敗不會中止外層交易
+            with conn.begin_nested():
+                conn.exec_driver_sql(f"PREPARE {name} AS {positional_sql}")
+        except exc.DBAPIError as e:
+            if "already exists" not in str(e):
+                logger.debug(f"無法預備 SQL，改用一般執行: {e}")
+                self._mark_unpreparable(normalized)
+                return None
+            # 連線資訊遺失 (例如 info 被重設) 但伺服器端仍存在，直接沿用
+
+        statements[normalized] = name
+        while len(statements) > self.capacity:
+            _, evicted = statements.popitem(last=False)
+            PREPARED_EVICTIONS.inc()
+            try:
+                conn.exec_driver_sql(f"DEALLOCATE {evicted}")
+            except exc.DBAPIError as e:
+                logger.warning(f"釋放預備語句失敗: {e}")
+        return name
+
+    def _is_unpreparable(self, normalized: str) -> bool:
+        """是否已知無法預備"""
+        with self._lock:
+            return normalized in self._unpreparable
+
+    def _mark_unpreparable(self, normalized: str) -> None:
+        """記錄無法預備的 SQL"""
+        with self._lock:
+            self._unpreparable[normalized] = None
+            while len(self._unpreparable) > MAX_UNPREPARABLE:
+                self._unpreparable.popitem(last=False)
@@ -0,0 +1,160 @@
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from ..utils import settings, count_tokens
+from ..utils.config import ModelConfig
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 未設定 max_tokens 時，為模型回應保留的 token 數
+DEFAULT_COMPLETION_RESERVE = 1024
+
+_CJK_RUN_PATTERN = re.compile(r"[一-鿿]+")
+_WORD_PATTERN = re.compile(r"[a-zA-Z0-9_]{2,}")
+
+
+def _terms(text: str) -> Set[str]:
+    """擷取文本中的比對詞：CJK 連續字串的二元組與英數詞"""
+    terms = {word.lower() for word in _WORD_PATTERN.findall(text)}
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def score_relevance(query: str, text: str) -> float:
+    """以詞彙重疊估算文本與查詢的相關性 (0 表示無關)"""
+    query_terms = _terms(query)
+    if not query_terms:
+        return 0.0
+    return len(query_terms & _terms(text)) / len(query_terms)
+
+
+class BudgetSection:
+    """
+    提示詞中的一個區段
+
+    固定區段 (trim_priority 為 None) 不會被裁剪；可裁剪區段依 trim_priority 由小到大
+    逐項移除，items 的順序代表重要性 (由高到低)，裁剪時從最後一項開始移除。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        items: Optional[List[Any]] = None,
+        render: Optional[Callable[[List[Any]], str]] = None,
+        measure: Optional[Callable[[Any], str]] = None,
+        trim_priority: Optional[int] = None,
+        min_items: int = 0,
+    ):
+        """
+        Args:
+            name: 區段名稱 (用於日誌)
+            items: 區段項目，依重要性由高到低排列
+            render: 由保留的項目產生區段文本，默認直接串接
+            measure: 取得項目文本以計算 token 數，默認為項目本身
+            trim_priority: 裁剪優先順序，數字越小越先裁剪；None 表示不可裁剪
+            min_items: 至少保留的項目數
+        """
+        self.name = name
+        self.items = list(items or [])
+        self.render_items = render or (lambda kept: "".join(kept))
+        self.measure = measure or (lambda item: item)
+        self.trim_priority = trim_priority
+        self.min_items = min_items
+        self.kept = len(self.items)
+
+    def render(self) -> str:
+        """產生保留項目的區段文本"""
+        if self.kept == 0 and self.min_items == 0 and self.items:
+            return ""
+        return self.render_items(self.items[:self.kept])
+
+
+class PromptBudgeter:
+    """依模型上下文窗口分配提示詞各區段的 token 預算"""
+
+    def __init__(self, model_config: ModelConfig):
+        self.model_config = model_config
+        self.model_name = model_config.model_name
+        self.budget = self.get_budget(model_config)
+
+    @staticmethod
+    def get_budget(model_config: ModelConfig) -> int:
+        """
+        計算提示詞的 token 預算
+
+        優先使用模型設定的 prompt_token_budget，否則為上下文窗口乘以 PROMPT_BUDGET_RATIO
+        (保留分詞器估算誤差)，再扣除為回應保留的 token 數。
+        """
+        if model_config.prompt_token_budget:
+            return model_config.prompt_token_budget
+        reserve = model_config.max_tokens or DEFAULT_COMPLETION_RESERVE
+        return max(0, int(model_config.context_window * settings.prompt_budget_ratio) - reserve)
+
+    def allocate(self, sections: List[BudgetSection]) -> Dict[str, Any]:
+        """
+        裁剪可裁剪區段直到總 token 數不超過預算
+
+        各項目的 token 數只計算一次，區段的標題與說明等固定開銷以完整渲染結果扣除項目後估算。
+        裁剪結果寫回各區段的 kept，並記錄分配情況。
+
+        Returns:
+            分配結果 {"budget", "total_tokens", "fits", "sections": {名稱: {...}}}
+        """
+        item_tokens: Dict[str, List[int]] = {}
+        overhead: Dict[str, int] = {}
+        for section in sections:
+            tokens = [count_tokens(section.measure(item), self.model_name) for item in section.items]
+            item_tokens[section.name] = tokens
+            overhead[section.name] = max(0, count_tokens(section.render(), self.model_name) - sum(tokens))
+
+        def section_tokens(section: BudgetSection) -> int:
+            if section.kept == 0 and section.min_items == 0 and section.items:
+                return 0
+            return overhead[section.name] + sum(item_tokens[section.name][:section.kept])
+
+        total = sum(section_tokens(section) for section in sections)
+        original_total = total
+
+        trimmable = sorted(
+            (section for section in sections if section.trim_priority is not None),
+            key=lambda section: section.trim_priority
+        )
+        for section in trimmable:
+            while total > self.budget and section.kept > section.min_items:
+                before = section_tokens(section)
+                section.kept -= 1
+                total -= before - section_tokens(section)
+            if total <= self.budget:
+                break
+
+        allocation = {
+            "model": self.model_name,
+            "budget": self.budget,
+            "original_tokens": original_total,
+            "total_tokens": total,
+            "fits": total <= self.budget,
+            "sections": {
+                section.name: {
+                    "tokens": section_tokens(section),
+                    "items": section.kept,
+                    "total_items": len(section.items),
+                }
+                for section in sections
+            },
+        }
+
+        summary = ", ".join(
+            f"{name}={info['tokens']}" + (f" ({info['items']}/{info['total_items']})" if info["total_items"] else "")
+            for name, info in allocation["sections"].items()
+        )
+        log = logger.info if total != original_total or total > self.budget else logger.debug
+        log(f"提示詞預算 {self.model_name}: {total}/{self.budget} tokens (原始 {original_total}) - {summary}")
+        if total > self.budget:
+            logger.warning(f"提示詞裁剪後仍超出預算: {total} > {self.budget}")
+
+        return allocation
@@ -0,0 +1,307 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+
+class RateLimitTimeout(Exception):
+    """等待速率限制配額逾時"""
+
+    pass
+
+
+class TokenBucket:
+    """令牌桶，以固定速率補充配額"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    @classmethod
+    def per_minute(cls, amount: int) -> "TokenBucket":
+        """建立每分鐘補充 amount 配額的令牌桶"""
+        return cls(capacity=amount, refill_per_second=amount / 60.0)
+
+    def _refill(self, now: float) -> None:
+        """依經過時間補充配額"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(
+                self.capacity, self.tokens + elapsed * self.refill_per_second
+            )
+            self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取得配額足夠前需要等待的秒數"""
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        """消耗配額 (負數代表退還)，允許短暫透支以反映實際用量"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _LimitState:
+    """單一提供者或模型的限制狀態與統計"""
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.request_bucket = (
+            TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket.per_minute(tokens_per_minute) if tokens_per_minute else None
+        )
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_requests = 0
+        self.total_timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.recent_waits: Deque[float] = deque(maxlen=1000)
+
+    def wait_time(self, tokens: int, now: float) -> Optional[float]:
+        """
+        取得取得許可前需要等待的秒數
+
+        Returns:
+            0 表示可立即執行；None 表示需等待其他請求釋放並發槽位
+        """
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            return None
+
+        wait = 0.0
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket:
+            # 單次請求不可超過令牌桶容量，否則將永遠無法取得配額
+            amount = min(tokens, self.token_bucket.capacity)
+            wait = max(wait, self.token_bucket.wait_time(amount, now))
+        return wait
+
+    def acquire(self, tokens: int) -> None:
+        """取得許可並扣除配額"""
+        self.in_flight += 1
+        if self.request_bucket:
+            self.request_bucket.consume(1)
+        if self.token_bucket:
+            self.token_bucket.consume(min(tokens, self.token_bucket.capacity))
+
+    def record_wait(self, wait_ms: float, timed_out: bool = False) -> None:
+        """記錄等待時間"""
+        self.total_requests += 1
+        if timed_out:
+            self.total_timeouts += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.recent_waits.append(wait_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """取得統計資料"""
+        waits = sorted(self.recent_waits)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(len(waits) * p))]
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "total_requests": self.total_requests,
+            "total_timeouts": self.total_timeouts,
+            "avg_wait_ms": (
+                self.total_wait_ms / self.total_requests if self.total_requests else 0.0
+            ),
+            "p95_wait_ms": percentile(0.95),
+            "max_wait_ms": self.max_wait_ms,
+            "available_requests": (
+                int(self.request_bucket.tokens) if self.request_bucket else None
+            ),
+            "available_tokens": (
+                int(self.token_bucket.tokens) if self.token_bucket else None
+            ),
+        }
+
+
+class RatePermit:
+    """速率限制許可，呼叫結束後必須釋放"""
+
+    def __init__(
+        self, limiter: "RateLimiter", states: List[_LimitState], reserved_tokens: int
+    ):
+        self.limiter = limiter
+        self.states = states
+        self.reserved_tokens = reserved_tokens
+        self.released = False
+
+    def release(self, actual_tokens: Optional[int] = None) -> None:
+        """
+        釋放許可，並以實際 token 用量校正令牌桶
+
+        Args:
+            actual_tokens: 實際使用的 token 數，None 表示沿用預估值
+        """
+        if self.released:
+            return
+        self.released = True
+        self.limiter._release(self, actual_tokens)
+
+
+class RateLimiter:
+    """
+    LLM 呼叫的並發與速率限制器
+
+    每個提供者有一個並發上限；每個模型有各自的並發上限、每分鐘請求數與每分鐘 token 數令牌桶。
+    超出配額的呼叫會排隊等待，等待超過上限時拋出 RateLimitTimeout。
+    """
+
+    def __init__(self, queue_timeout: float = 30.0):
+        self.queue_timeout = queue_timeout
+        self.provider_states: Dict[str, _LimitState] = {}
+        self.model_states: Dict[str, _LimitState] = {}
+        self._condition = threading.Condition()
+
+    def configure_provider(self, provider: str, max_concurrency: Optional[int]) -> None:
+        """設定提供者的並發上限"""
+        with self._condition:
+            if provider not in self.provider_states:
+                self.provider_states[provider] = _LimitState(
+                    max_concurrency=max_concurrency
+                )
+
+    def configure_model(
+        self,
+        model: str,
+        max_concurrency: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> None:
+        """設定模型的並發上限與每分鐘配額"""
+        with self._condition:
+            if model not in self.model_states:
+                self.model_states[model] = _LimitState(
+                    max_concurrency=max_concurrency,
+                    requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute,
+                )
+
+    def acquire(
+        self,
+        provider: str,
+        model: str,
+        estimated_tokens: int,
+        timeout: Optional[float] = None,
+    ) -> RatePermit:
+        """
+        取得呼叫許可，配額不足時排隊等待
+
+        Args:
+            provider: 提供者名稱
+            model: 模型名稱
+            estimated_tokens: 預估本次呼叫的 token 數 (提示詞 + 生成)
+            timeout: 最長等待秒數，None 表示使用預設值
+
+        Returns:
+            呼叫許可
+
+        Raises:
+            RateLimitTimeout: 等待超過上限
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._condition:
+            states = [self.provider_states[provider], self.model_states[model]]
+            queued = False
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    waits = [state.wait_time(estimated_tokens, now) for state in states]
+
+                    if all(wait == 0.0 for wait in waits):
+                        for state in states:
+                            state.acquire(estimated_tokens)
+                        wait_ms = (now - start) * 1000
+                        for state in states:
+                            state.record_wait(wait_ms)
+                        if wait_ms > 0:
+                            logger.debug(f"模型 {model} 排隊等待 {wait_ms:.1f} ms")
+                        return RatePermit(self, states, estimated_tokens)
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        wait_ms = (now - start) * 1000
+                        for state in states:
+                            state.record_wait(wait_ms, timed_out=True)
+                        logger.warning(
+                            f"模型 {model} 等待速率限制配額逾時 ({wait_ms:.0f} ms)"
+                        )
+                        raise RateLimitTimeout(
+                            f"等待 {provider}/{model} 的速率限制配額逾時 ({timeout:.1f} 秒)"
+                        )
+
+                    if not queued:
+                        queued = True
+                        for state in states:
+                            state.queue_depth += 1
+                            state.max_queue_depth = max(
+                                state.max_queue_depth, state.queue_depth
+                            )
+
+                    # 並發槽位被占用時等待釋放通知，否則等待令牌桶補充
+                    bucket_waits = [wait for wait in waits if wait is not None]
+                    sleep_for = min([remaining] + bucket_waits)
+                    self._condition.wait(timeout=max(sleep_for, 0.001))
+            finally:
+                if queued:
+                    for state in states:
+                        state.queue_depth -= 1
+
+    def _release(self, permit: RatePermit, actual_tokens: Optional[int]) -> None:
+        """釋放許可"""
+        with self._condition:
+            for state in permit.states:
+                state.in_flight -= 1
+                if state.token_bucket and actual_tokens is not None:
+                    reserved = min(permit.reserved_tokens, state.token_bucket.capacity)
+                    state.token_bucket.consume(actual_tokens - reserved)
+            self._condition.notify_all()
+
+    def get_in_flight(self) -> int:
+        """取得目前進行中的呼叫數"""
+        with self._condition:
+            return sum(state.in_flight for state in self.provider_states.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """取得所有提供者與模型的排隊與等待統計"""
+        with self._condition:
+            return {
+                "providers": {
+                    name: state.get_stats()
+                    for name, state in self.provider_states.items()
+                },
+                "models": {
+                    name: state.get_stats() for name, state in self.model_states.items()
+                },
+            }
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from ..utils.profiling import record_cache_access
+from ..utils.sql_parser import SQLAnalysis
+from .prepared_statements import normalize_sql
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 每次執行結果可能不同的函數，呼叫這些函數的查詢不快取
+_VOLATILE_PATTERN = re.compile(
+    r"\b(random|nextval|setval|currval|clock_timestamp|timeofday|gen_random_uuid|uuid_generate_v4|pg_sleep)\s*\(",
+    re.IGNORECASE
+)
+
+
+class QueryResultCache:
+    """
+    查詢結果快取
+
+    以 SQL 原文與參數作為鍵，保存只讀查詢的結果。每筆結果記錄所依賴資料表的版本，
+    資料表變更 (invalidate_table，由資料表觸發器的 NOTIFY 觸發) 時版本遞增，舊結果即失效；
+    另以短 TTL 限制依賴未知或時間相關 (CURRENT_DATE、now()) 的結果。
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 1000):
+        """
+        Args:
+            ttl: 結果有效秒數，0 表示停用快取
+            max_entries: 最多保存的結果數 (LRU 淘汰)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, int], Any]]" = OrderedDict()
+        self._table_versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """是否啟用快取"""
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(sql: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        以 SQL 原文 (只移除前後空白與結尾分號) 與參數產生快取鍵
+
+        不合併內部空白：只在字串常數或 -- 註解中的空白不同的查詢，結果也可能不同。
+        """
+        payload = json.dumps([normalize_sql(sql), params or {}], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(sql: str, analysis: SQLAnalysis) -> bool:
+        """查詢是否可快取 (單一只讀查詢語句且不呼叫易變函數)"""
+        if not analysis.is_read_only or analysis.statement_types not in (["SELECT"], ["UNION"], ["INTERSECT"], ["EXCEPT"]):
+            return False
+        return not _VOLATILE_PATTERN.search(sql)
+
+    def get(self, key: str) -> Optional[Any]:
+        """獲取快取的結果，不存在或已失效時返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, versions, result = entry
+                if expires_at > time.monotonic() and all(
+                    self._table_versions.get(table, 0) == version for table, version in versions.items()
+                ):
+                    self._entries.move_to_end(key)
+                    record_cache_access("query_result", True)
+                    return result
+                del self._entries[key]
+        record_cache_access("query_result", False)
+        return None
+
+    def get_versions(self, tables: Iterable[str]) -> Dict[str, int]:
+        """獲取資料表目前的版本 (應在執行查詢前取得，再傳給 set())"""
+        with self._lock:
+            return {table: self._table_versions.get(table, 0) for table in tables}
+
+    def set(self, key: str, result: Any, versions: Dict[str, int]) -> None:
+        """
+        保存結果
+
+        Args:
+            key: 快取鍵
+            result: 查詢結果
+            versions: 執行查詢前依賴資料表的版本 (get_versions() 的結果)
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, versions, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_table(self, table_name: Optional[str]) -> None:
+        """
+        使依賴指定資料表的結果失效 (可直接作為通知回呼)
+
+        table_name 為 None 時 (例如監聽連線重新建立，期間可能遺漏通知) 清除所有結果。
+        """
+        if not table_name:
+            self.clear()
+            return
+        with self._lock:
+            self._table_versions[table_name] = self._table_versions.get(table_name, 0) + 1
+        logger.debug(f"資料表 {table_name} 已變更，相關查詢結果快取失效")
+
+    def invalidate_tables(self, tables: Iterable[str]) -> None:
+        """使依賴任一指定資料表的結果失效"""
+        for table in tables:
+            self.invalidate_table(table)
+
+    def clear(self) -> None:
+        """清除所有結果"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取快取狀態"""
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl}
@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from ..utils.profiling import stage, record_cache_access
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 一次讀取 public schema 中所有資料表、欄位、主鍵與外鍵 (每個外鍵參照一列)
+SCHEMA_QUERY = """
+    SELECT
+        c.relname AS table_name,
+        obj_description(c.oid, 'pg_class') AS table_comment,
+        a.attname AS column_name,
+        format_type(a.atttypid, a.atttypmod) AS data_type,
+        NOT a.attnotnull AS nullable,
+        pg_get_expr(d.adbin, d.adrelid) AS column_default,
+        EXISTS (
+            SELECT 1 FROM pg_constraint pk
+            WHERE pk.conrelid = c.oid AND pk.contype = 'p' AND a.attnum = ANY (pk.conkey)
+        ) AS is_primary_key,
+        fk.reference_table,
+        fk.reference_column
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+    LEFT JOIN LATERAL (
+        SELECT rc.relname AS reference_table, ra.attname AS reference_column
+        FROM pg_constraint con
+        JOIN pg_class rc ON rc.oid = con.confrelid
+        JOIN pg_attribute ra ON ra.attrelid = con.confrelid
+            AND ra.attnum = con.confkey[array_position(con.conkey, a.attnum)]
+        WHERE con.conrelid = c.oid AND con.contype = 'f' AND a.attnum = ANY (con.conkey)
+    ) fk ON TRUE
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'f')
+    ORDER BY c.relname, a.attnum
+"""
+
+
+class LiveSchemaCache:
+    """
+    資料庫即時結構快取
+
+    以單一 pg_catalog 查詢載入所有資料表、欄位、主鍵與外鍵，之後的請求直接由記憶體回應。
+    超過 TTL 或呼叫 invalidate() (由 DDL 事件觸發器的 NOTIFY 觸發) 時失效，下次存取重新載入。
+    """
+
+    def __init__(self, engine, ttl: float = 300):
+        """
+        Args:
+            engine: SQLAlchemy 引擎
+            ttl: 快取有效秒數，0 表示只依變更通知失效
+        """
+        self.engine = engine
+        self.ttl = ttl
+        self.version = 0  # 每次重新載入後遞增，供衍生資料 (提示詞片段) 判斷是否過期
+        self._tables: Optional[Dict[str, Dict[str, Any]]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._prompt_cache: Optional[Dict[str, Any]] = None
+
+    def _is_fresh(self) -> bool:
+        """快取是否仍有效"""
+        if self._tables is None:
+            return False
+        return not self.ttl or time.monotonic() - self._loaded_at < self.ttl
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """執行結構查詢並組合各資料表定義"""
+        with stage("schema_introspection"):
+            with self.engine.connect() as conn:
+                rows = conn.execute(text(SCHEMA_QUERY)).fetchall()
+        return self._build_tables(rows)
+
+    @staticmethod
+    def _build_tables(rows) -> Dict[str, Dict[str, Any]]:
+        """由結構查詢的結果列組合各資料表定義"""
+        tables: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            table = tables.setdefault(row.table_name, {
+                "table_name": row.table_name,
+                "comment": row.table_comment or "",
+                "columns": [],
+                "primary_keys": [],
+                "foreign_keys": [],
+            })
+            # 多個外鍵參照同一欄位時會有多列，欄位只記錄一次
+            if not table["columns"] or table["columns"][-1]["name"] != row.column_name:
+                table["columns"].append({
+                    "name": row.column_name,
+                    "type": row.data_type,
+                    "nullable": bool(row.nullable),
+                    "default": row.column_default,
+                })
+                if row.is_primary_key:
+                    table["primary_keys"].append(row.column_name)
+            if row.reference_table:
+                table["foreign_keys"].append({
+                    "column": row.column_name,
+                    "reference_table": row.reference_table,
+                    "reference_column": row.reference_column,
+                })
+        return tables
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        """獲取所有資料表結構 (資料表名稱 -> 結構)，快取失效時重新載入"""
+        if self._is_fresh():
+            record_cache_access("schema", True)
+            return self._tables
+
+        with self._lock:
+            if self._is_fresh():
+                record_cache_access("schema", True)
+                return self._tables
+            record_cache_access("schema", False)
+            return self._store(self._load())
+
+    async def get_all_async(self, async_engine) -> Dict[str, Dict[str, Any]]:
+        """
+        獲取所有資料表結構 (非同步版本)，快取失效時以非同步引擎重新載入
+
+        與 get_all() 共用同一份快取；同時有多個請求在快取失效時進入，可能各自載入一次。
+
+        Args:
+            async_engine: SQLAlchemy 非同步引擎
+        """
+        if self._is_fresh():
+            record_cache_access("schema", True)
+            return self._tables
+
+        record_cache_access("schema", False)
+        with stage("schema_introspection"):
+            async with async_engine.connect() as conn:
+                rows = (await conn.execute(text(SCHEMA_QUERY))).fetchall()
+        tables = self._build_tables(rows)
+        with self._lock:
+            return self._store(tables)
+
+    def _store(self, tables: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """保存載入的結構並遞增版本 (呼叫端需持有鎖)"""
+        self._tables = tables
+        self._loaded_at = time.monotonic()
+        self.version += 1
+        logger.info(f"已載入資料庫結構: {len(self._tables)} 個資料表")
+        return self._tables
+
+    def get_tables(self) -> List[str]:
+        """獲取所有表名"""
+        return sorted(self.get_all())
+
+    def get_table(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """獲取單一資料表結構，不存在時返回 None"""
+        return self.get_all().get(table_name)
+
+    def invalidate(self, payload: Optional[str] = None) -> None:
+        """使快取失效，下次存取時重新載入 (可直接作為通知回呼)"""
+        with self._lock:
+            self._tables = None
+        logger.info("資料庫結構快取已失效")
+
+    def to_schema_definitions(self) -> Dict[str, Dict[str, Any]]:
+        """
+        轉換為與 SQL 檔案解析結果相同的格式 {表名: {"columns": [{"name", "type"}], "comment"}}
+
+        欄位類型包含主鍵、NOT NULL、預設值與外鍵參照，與建表語句的欄位定義相近。
+        """
+        definitions = {}
+        for table_name, table in self.get_all().items():
+            references = {fk["column"]: fk for fk in table["foreign_keys"]}
+            columns = []
+            for column in table["columns"]:
+                column_type = column["type"]
+                if column["name"] in table["primary_keys"]:
+                    column_type += " PRIMARY KEY"
+                elif not column["nullable"]:
+                    column_type += " NOT NULL"
+                if column["default"] is not None:
+                    column_type += f" DEFAULT {column['default']}"
+                reference = references.get(column["name"])
+                if reference:
+                    column_type += f" REFERENCES {reference['reference_table']}({reference['reference_column']})"
+                columns.append({"name": column["name"], "type": column_type})
+            definitions[table_name] = {"columns": columns, "comment": table["comment"]}
+        return definitions
+
+    def get_prompt_schema(self, functions: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        獲取以即時結構建立的提示詞片段與完整描述 {"fragments", "description"}
+
+        結果依快取版本保留，結構未重新載入前不重複產生。
+        """
+        from ..schema import get_schema_fragments, build_schema_description
+
+        self.get_all()  # 確保結構為最新 (必要時重新載入並遞增版本)
+        cached = self._prompt_cache
+        if cached is not None and cached["version"] == self.version:
+            return cached
+
+        fragments = get_schema_fragments(functions, self.to_schema_definitions())
+        cached = {
+            "version": self.version,
+            "fragments": fragments,
+            "description": build_schema_description(fragments),
+        }
+        self._prompt_cache = cached
+        return cached
@@ -0,0 +1,329 @@
+import difflib
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..models import QueryTemplateModel
+from ..utils import settings
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 槽位類型
+DATE = "date"
+SERVICE = "service"
+PERIOD = "period"
+PHONE = "phone"
+
+# 相對日期
+_RELATIVE_DAYS = {"前天": -2, "昨天": -1, "昨日": -1, "今天": 0, "今日": 0, "明天": 1, "明日": 1, "後天": 2}
+_FULL_DATE_PATTERN = re.compile(r"(\d{4})\s*[-/年]\s*(\d{1,2})\s*[-/月]\s*(\d{1,2})\s*[日號]?")
+_MONTH_DAY_PATTERN = re.compile(r"(\d{1,2})\s*月\s*(\d{1,2})\s*[日號]")
+_RELATIVE_DATE_PATTERN = re.compile("|".join(_RELATIVE_DAYS))
+_PHONE_PATTERN = re.compile(r"09\d{8}")
+# 比對前移除的空白與標點
+_NOISE_PATTERN = re.compile(r"[\s?？!！。.,，、：:;；「」\"']+")
+# 否定與排除詞：兩邊的出現次數不同時不使用模板 (「有空位」與「沒有空位」只差一個字，相似度仍很高)
+_NEGATION_PATTERN = re.compile(r"取消|除了|以外|之外|排除|[沒没不未無无非別别勿莫否]")
+# 相異部分含數字或英文 (數量、名稱、SQL 識別字) 時不使用模板
+_CONTENT_PATTERN = re.compile(r"[0-9a-z]")
+
+# 槽位名稱詞彙 (服務名稱、時段名稱) 的來源資料表
+_VOCABULARY_SQL = {
+    SERVICE: "SELECT name FROM n8n_booking_services",
+    PERIOD: "SELECT name FROM n8n_booking_time_periods",
+}
+
+
+@dataclass
+class Slot:
+    """查詢中的一個槽位值"""
+    kind: str
+    start: int
+    end: int
+    value: Any
+
+
+@dataclass
+class CompiledTemplate:
+    """預先分析的模板"""
+    template: QueryTemplateModel
+    skeleton: str  # 綁定參數的槽位以 {類型} 取代後的問題
+    bindings: List[Tuple[str, str]] = field(default_factory=list)  # 依出現順序的 (參數名稱, 槽位類型)
+
+    @property
+    def kinds(self) -> Tuple[str, ...]:
+        return tuple(kind for _, kind in self.bindings)
+
+
+@dataclass
+class TemplateMatch:
+    """模板比對結果"""
+    template: QueryTemplateModel
+    score: float
+    sql: str
+    parameters: Dict[str, Any]
+    explanation: str
+
+
+def normalize(text: str) -> str:
+    """移除空白與標點並轉為小寫"""
+    return _NOISE_PATTERN.sub("", text).lower()
+
+
+def differs_in_meaning(text: str, template_text: str, matcher: "difflib.SequenceMatcher") -> bool:
+    """
+    查詢與模板問題 (槽位已取代) 的差異是否可能改變語意
+
+    字元相似度無法分辨否定 (「有空位的時段」與「沒有空位的時段」)，因此否定與排除詞的出現次數必須相同，
+    相異的片段也不能包含數字或英文。
+    """
+    if sorted(_NEGATION_PATTERN.findall(text)) != sorted(_NEGATION_PATTERN.findall(template_text)):
+        return True
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal" and (_CONTENT_PATTERN.search(text[i1:i2]) or _CONTENT_PATTERN.search(template_text[j1:j2])):
+            return True
+    return False
+
+
+def _to_date(year: int, month: int, day: int) -> Optional[str]:
+    """轉換為 ISO 日期字串，日期不合法時返回 None"""
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+class SlotExtractor:
+    """
+    從自然語言查詢中擷取槽位值
+
+    日期 (2025-05-01、5月1日、今天、明天等，轉換為 ISO 日期)、手機號碼，
+    以及詞彙中的服務名稱與時段名稱 (較長的名稱優先)。
+    """
+
+    def __init__(self, vocabulary: Optional[Dict[str, List[str]]] = None):
+        """
+        Args:
+            vocabulary: 槽位類型 -> 名稱列表
+        """
+        self.names: List[Tuple[str, str]] = sorted(
+            ((name, kind) for kind, names in (vocabulary or {}).items() for name in names if name),
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+
+    def extract(self, text: str, today: Optional[date] = None) -> List[Slot]:
+        """
+        擷取槽位 (互不重疊，依出現位置排序)
+
+        Args:
+            text: 已正規化的查詢
+            today: 相對日期的基準日，預設為今天
+
+        Returns:
+            槽位列表
+        """
+        today = today or date.today()
+        slots: List[Slot] = []
+        taken = [False] * len(text)
+
+        def claim(kind: str, start: int, end: int, value: Any) -> None:
+            if value is None or any(taken[start:end]):
+                return
+            taken[start:end] = [True] * (end - start)
+            slots.append(Slot(kind, start, end, value))
+
+        for match in _FULL_DATE_PATTERN.finditer(text):
+            claim(DATE, match.start(), match.end(), _to_date(*(int(group) for group in match.groups())))
+        for match in _MONTH_DAY_PATTERN.finditer(text):
+            claim(DATE, match.start(), match.end(), _to_date(today.year, int(match.group(1)), int(match.group(2))))
+        for match in _RELATIVE_DATE_PATTERN.finditer(text):
+            claim(DATE, match.start(), match.end(), (today + timedelta(days=_RELATIVE_DAYS[match.group()])).isoformat())
+        for match in _PHONE_PATTERN.finditer(text):
+            claim(PHONE, match.start(), match.end(), match.group())
+        for name, kind in self.names:
+            start = text.find(name)
+            while start != -1:
+                claim(kind, start, start + len(name), name)
+                start = text.find(name, start + len(name))
+
+        slots.sort(key=lambda slot: slot.start)
+        return slots
+
+
+def build_skeleton(text: str, slots: List[Slot]) -> str:
+    """將槽位以 {類型} 取代"""
+    parts = []
+    position = 0
+    for slot in slots:
+        parts.append(text[position:slot.start])
+        parts.append(f"{{{slot.kind}}}")
+        position = slot.end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def compile_template(template: QueryTemplateModel, extractor: SlotExtractor, today: Optional[date] = None) -> CompiledTemplate:
+    """
+    分析模板問題中的槽位
+
+    只有值與模板參數相同的槽位才抽象化 (換成新值會改變 SQL 參數)；其他槽位保留原文，
+    例如 SQL 以 CURRENT_DATE 實作的「今天」，不會誤配「明天」的查詢。
+    """
+    text = normalize(template.user_query)
+    unbound = {name: str(value) for name, value in (template.parameters or {}).items()}
+    bound_slots: List[Slot] = []
+    bindings: List[Tuple[str, str]] = []
+    for slot in extractor.extract(text, today):
+        name = next((name for name, value in unbound.items() if value == str(slot.value)), None)
+        if name is None:
+            continue
+        del unbound[name]
+        bound_slots.append(slot)
+        bindings.append((name, slot.kind))
+    return CompiledTemplate(template=template, skeleton=build_skeleton(text, bound_slots), bindings=bindings)
+
+
+class TemplateMatcher:
+    """
+    呼叫 LLM 前的查詢模板比對
+
+    將模板問題與輸入查詢中的槽位 (日期、服務名稱、時段名稱、手機號碼) 換成 {類型} 後比較相似度，
+    達到 TEMPLATE_MATCH_THRESHOLD 且差異不含否定詞、數字或英文時，以新的槽位值填入模板參數，
+    直接使用模板 SQL；否則交由 LLM 生成。
+    模板與詞彙 (資料庫中的服務與時段名稱、模板參數值) 每 TEMPLATE_MATCH_REFRESH 秒或模板變更後重新載入。
+    """
+
+    def __init__(self, history_service, db_service=None, threshold: Optional[float] = None,
+                 refresh_interval: Optional[float] = None):
+        """
+        Args:
+            history_service: 查詢歷史服務 (模板來源)
+            db_service: 資料庫服務 (服務與時段名稱來源)，None 時只使用模板參數值
+            threshold: 使用模板的最低相似度 (0-1)
+            refresh_interval: 重新載入模板與詞彙的間隔秒數
+        """
+        self.history_service = history_service
+        self.db_service = db_service
+        self.threshold = settings.template_match_threshold if threshold is None else threshold
+        self.refresh_interval = settings.template_match_refresh if refresh_interval is None else refresh_interval
+        self._lock = threading.Lock()
+        self._templates: List[CompiledTemplate] = []
+        self._extractor = SlotExtractor()
+        self._loaded_at: Optional[float] = None
+        self._loaded_version: Optional[int] = None
+        self._loaded_day: Optional[date] = None
+
+    def invalidate(self) -> None:
+        """下次比對時重新載入模板"""
+        with self._lock:
+            self._loaded_at = None
+
+    def preload(self) -> None:
+        """預先載入模板與槽位詞彙 (常駐程序啟動時使用，第一次比對不需等待)"""
+        with self._lock:
+            self._ensure_loaded()
+
+    def _load_vocabulary(self, templates: List[QueryTemplateModel]) -> Dict[str, List[str]]:
+        """載入服務與時段名稱 (資料庫無法使用時只使用模板參數值)"""
+        vocabulary: Dict[str, List[str]] = {kind: [] for kind in _VOCABULARY_SQL}
+        if self.db_service is not None and self.db_service.is_connected():
+            for kind, sql in _VOCABULARY_SQL.items():
+                result = self.db_service.execute_query(sql)
+                if result.error:
+                    logger.warning(f"載入模板槽位詞彙失敗 ({kind}): {result.error}")
+                    continue
+                vocabulary[kind] = [normalize(str(row[0])) for row in result.rows if row and row[0]]
+
+        # 模板參數中的名稱 (例如 service_name、period_name) 也視為詞彙
+        for template in templates:
+            for name, value in (template.parameters or {}).items():
+                if not isinstance(value, str):
+                    continue
+                for kind in _VOCABULARY_SQL:
+                    if kind in name.lower() and normalize(value) not in vocabulary[kind]:
+                        vocabulary[kind].append(normalize(value))
+        return vocabulary
+
+    def _ensure_loaded(self) -> None:
+        """模板過期、變更或換日 (相對日期改變) 時重新載入 (呼叫端需持有鎖)"""
+        now = time.monotonic()
+        version = getattr(self.history_service, "templates_version", None)
+        if (self._loaded_at is not None and now - self._loaded_at < self.refresh_interval
+                and version == self._loaded_version and self._loaded_day == date.today()):
+            return
+
+        templates = self.history_service.get_templates(limit=settings.template_match_max_templates)
+        self._extractor = SlotExtractor(self._load_vocabulary(templates))
+        today = date.today()
+        self._templates = [compile_template(template, self._extractor, today) for template in templates]
+        self._loaded_at = now
+        self._loaded_version = version
+        self._loaded_day = today
+        logger.debug(f"已載入 {len(self._templates)} 個查詢模板供比對")
+
+    def match(self, query: str) -> Optional[TemplateMatch]:
+        """
+        比對查詢模板
+
+        Args:
+            query: 自然語言查詢 (已解析對話引用)
+
+        Returns:
+            相似度達到門檻的模板與填入槽位後的 SQL 參數；沒有時返回 None
+        """
+        with self._lock:
+            self._ensure_loaded()
+            templates = self._templates
+            extractor = self._extractor
+        if not templates:
+            return None
+
+        text = normalize(query)
+        slots = extractor.extract(text)
+        skeletons: Dict[Tuple[str, ...], Tuple[str, List[Slot]]] = {}
+        best: Optional[Tuple[float, CompiledTemplate, List[Slot]]] = None
+
+        for compiled in templates:
+            kinds = compiled.kinds
+            if kinds not in skeletons:
+                # 只抽象化此模板有綁定參數的槽位類型，其他部分保留原文比較
+                selected = [slot for slot in slots if slot.kind in kinds]
+                skeletons[kinds] = (build_skeleton(text, selected), selected)
+            skeleton, selected = skeletons[kinds]
+            if tuple(slot.kind for slot in selected) != kinds:
+                continue
+
+            matcher = difflib.SequenceMatcher(None, skeleton, compiled.skeleton, autojunk=False)
+            if matcher.real_quick_ratio() < self.threshold or matcher.quick_ratio() < self.threshold:
+                continue
+            score = matcher.ratio()
+            if score < 1.0 and differs_in_meaning(skeleton, compiled.skeleton, matcher):
+                continue
+            # 模板依使用次數由多到少排列，相同分數時保留使用較多的模板
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, compiled, selected)
+                if score == 1.0:
+                    break
+
+        if best is None:
+            return None
+
+        score, compiled, selected = best
+        template = compiled.template
+        parameters = dict(template.parameters or {})
+        for (name, _), slot in zip(compiled.bindings, selected):
+            parameters[name] = slot.value
+        explanation = template.explanation or template.description or ""
+        return TemplateMatch(
+            template=template,
+            score=score,
+            sql=template.generated_sql,
+            parameters=parameters,
+            explanation=f"{explanation} (使用查詢模板「{template.name}」)".strip()
+        )
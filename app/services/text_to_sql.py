@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional, Union
-from ..schema import get_table_schema_description
+from typing import List, Dict, Any, Optional, Tuple, Union
+from ..schema import get_table_schema_description, get_schema_fragments, build_schema_description, get_catalog
 from ..utils import (
     settings, 
     get_function_suggestion, 
@@ -8,12 +8,16 @@ from ..utils import (
     get_fallback_query, 
     is_function_working
 )
+from ..utils.profiling import stage, traced, set_trace_attributes, record_cache_access
 from .history_service import HistoryService
 from .database_service import DatabaseService, QueryResult
-from .llm_service import llm_service, LLMResponse
+from .llm_service import get_llm_service, LLMResponse
+from .token_meter import usage_context
+from .prompt_budget import BudgetSection, PromptBudgeter, score_relevance
 # 暫時註解掉 vector_store 以便程式可以啟動
 # from .vector_store import vector_store
 from .conversation_service import conversation_manager
+from .template_matcher import TemplateMatcher, TemplateMatch
 from ..models import QueryHistoryModel
 import logging
 import json
@@ -37,20 +41,29 @@ class SQLResult(BaseModel):
     execution_result: Optional[Dict[str, Any]] = Field(default=None, description="執行結果")
     query_id: Optional[str] = Field(default=None, description="查詢ID")
     similar_queries: Optional[List[SimilarQuery]] = Field(default=None, description="相似查詢列表")
+    template_id: Optional[str] = Field(default=None, description="直接使用的查詢模板ID (略過 LLM 時)")
 
 
 class TextToSQLService:
     """文本到 SQL 轉換服務"""
     
-    def __init__(self):
+    def __init__(self, history_service: Optional[HistoryService] = None):
+        """
+        Args:
+            history_service: 共用的歷史紀錄服務，None 表示建立新的服務 (JSON 文件存儲)
+        """
         # 初始化 LLM 服務
-        self.llm_service = llm_service
-        self.schema_description = get_table_schema_description()
+        self.llm_service = get_llm_service()
+        self.static_schema_description = get_table_schema_description()
+        self.static_schema_fragments = get_schema_fragments()
         
         # 初始化歷史記錄和資料庫服務
-        self.history_service = HistoryService(use_db=False)  # 預設使用 JSON 文件存儲
+        self.history_service = history_service or HistoryService(use_db=False)  # 預設使用 JSON 文件存儲
         self.db_service = DatabaseService()
         
+        # 呼叫 LLM 前比對的查詢模板
+        self.template_matcher = TemplateMatcher(self.history_service, self.db_service)
+        
         # 初始化向量存儲服務（暫時註解掉）
         # self.vector_store = vector_store
         # 建立一個临時空物件供使用
@@ -66,7 +79,31 @@ class TextToSQLService:
         # 設定日誌
         self.logger = logging.getLogger(__name__)
     
-    def text_to_sql(self, query: str, session_id: str = None, execute: bool = False, find_similar: bool = True) -> SQLResult:
+    def _get_live_schema(self) -> Optional[Dict[str, Any]]:
+        """SCHEMA_SOURCE=live 時獲取以資料庫即時結構建立的提示詞片段，無法取得時返回 None"""
+        if settings.schema_source != "live" or not self.db_service.is_connected():
+            return None
+        try:
+            return self.db_service.schema_cache.get_prompt_schema(get_catalog().functions)
+        except Exception as e:
+            self.logger.warning(f"讀取資料庫即時結構失敗，改用 SQL 檔案定義: {e}")
+            return None
+    
+    @property
+    def schema_fragments(self) -> List[Dict[str, Any]]:
+        """提示詞使用的資料表與函數描述片段"""
+        live_schema = self._get_live_schema()
+        return live_schema["fragments"] if live_schema else self.static_schema_fragments
+    
+    @property
+    def schema_description(self) -> str:
+        """提示詞使用的完整 schema 描述"""
+        live_schema = self._get_live_schema()
+        return live_schema["description"] if live_schema else self.static_schema_description
+    
+    @traced("text_to_sql")
+    def text_to_sql(self, query: str, session_id: str = None, execute: bool = False, find_similar: bool = True,
+                    model_name: Optional[str] = None, confirm_cost: bool = False) -> SQLResult:
         """
         將自然語言查詢轉換為 SQL 查詢
         
@@ -75,12 +112,16 @@ class TextToSQLService:
             session_id: 會話ID，用於對話上下文管理
             execute: 是否執行生成的 SQL 查詢
             find_similar: 是否查找相似查詢
+            model_name: 使用的模型名稱，默認使用設定中的默認模型
+            confirm_cost: 確認執行超出成本上限的查詢 (EXPLAIN_ACTION=confirm 時)
             
         Returns:
             SQL 查詢結果
         """
         # 生成查詢 ID
         query_id = str(uuid4())
+        model_name = model_name or settings.default_model
+        set_trace_attributes(query=query, model=model_name, session_id=session_id, execute=execute)
         
         try:
             # 處理對話上下文
@@ -88,121 +129,31 @@ class TextToSQLService:
             resolved_query = query
             entity_references = {}
             
-            if session_id:
-                # 獲取會話歷史
-                conversation_history = self.conversation_manager.get_conversation_history(session_id, limit=5)
+            with stage("reference_resolution"), usage_context(session=session_id):
+                if session_id:
+                    # 獲取會話最近幾輪 (上下文中保留的窗口，不重新讀取查詢歷史)
+                    conversation_history = self.conversation_manager.get_conversation_turns(session_id, limit=5)
                 
-                if conversation_history:
-                    # 解析引用
-                    self.logger.info(f"嘗試解析查詢中的引用: {query}")
-                    resolved_query, entity_references = self._resolve_references(query, conversation_history)
-                    
-                    if resolved_query != query:
-                        self.logger.info(f"已解析查詢: {resolved_query}")
-                    
-            # 查找相似查詢
-            similar_queries = []
-            if find_similar:
-                try:
-                    # 查找相似的歷史查詢
-                    similar_results = self.vector_store.search_similar(query, k=3)
-                    
-                    # 將結果轉換為 SimilarQuery 模型
-                    similar_queries = [
-                        SimilarQuery(
-                            query=result["query"],
-                            sql=result["sql"],
-                            similarity=result["similarity"],
-                            timestamp=result["timestamp"] if isinstance(result["timestamp"], str) else result["timestamp"].isoformat()
+                    if conversation_history:
+                        # 解析引用
+                        self.logger.info(f"嘗試解析查詢中的引用: {query}")
+                        resolved_query, entity_references = self._resolve_references(
+                            query, conversation_history, model_name,
+                            known_entities=self.conversation_manager.get_entities(session_id)
                         )
-                        for result in similar_results
-                        if result["similarity"] > 0.7  # 只返回相似度大於 0.7 的查詢
-                    ]
-                    
-                    if similar_queries:
-                        self.logger.info(f"找到 {len(similar_queries)} 個相似查詢")
-                except Exception as e:
-                    self.logger.error(f"查找相似查詢時出錯: {e}")
-                    # 如果查找相似查詢時出錯，忽略錯誤，繼續處理
-            
-            # 嘗試推薦適合的資料庫函數
-            function_suggestion = get_function_suggestion(query)
-            
-            # 建構基本 prompt
-            prompt = self._build_prompt(query)
-            
-            # 如果有對話歷史，添加對話上下文到 prompt
-            if conversation_history:
-                conversation_prompt = self._build_conversation_context_prompt(conversation_history)
-                prompt = f"{prompt}\n\n{conversation_prompt}"
-            
-            # 如果找到相似查詢，添加到 prompt 中
-            if similar_queries:
-                similar_query_prompt = self._build_similar_query_prompt(similar_queries)
-                prompt = f"{prompt}\n\n{similar_query_prompt}"
-                
-            # 使用解析後的查詢（如果有）
-            user_query_to_use = resolved_query if resolved_query != query else query
-            
-            # 如果有合適的函數推薦，檢查函數是否可用，並添加到 prompt 中
-            if function_suggestion:
-                func_name, func_info = function_suggestion
-                
-                # 檢查推薦的函數是否可用
-                if is_function_working(func_name):
-                    # 函數可用，使用正常的函數示例
-                    example = generate_function_example(func_name, func_info)
                     
-                    func_prompt = f"""
-根據你的查詢，我推薦使用 {func_name} 函數：
-
-函數名稱: {func_name}
-描述: {func_info.get('description', '無描述')}
-參數: {func_info.get('parameters', '無參數')}
-返回類型: {func_info.get('return_type', '無返回類型')}
-
-使用示例:
-{example}
-
-請儘量利用這個函數來回答用戶的查詢。
-"""
-                else:
-                    # 函數不可用，提供替代方案
-                    fallback_query = get_fallback_query(query, func_name)
+                        if resolved_query != query:
+                            self.logger.info(f"已解析查詢: {resolved_query}")
                     
-                    func_prompt = f"""
-原本推薦使用 {func_name} 函數，但該函數目前可能不可用或有解析錯誤。
-
-請使用以下替代查詢方式：
-{fallback_query}
-
-請根據用戶需求調整上述查詢中的參數值。
-"""
-                
-                # 將用戶查詢和函數建議結合
-                user_query = f"{user_query_to_use}\n\n{func_prompt}"
+            # 呼叫 LLM 前比對查詢模板，相似度足夠時直接使用模板 SQL
+            template_match = self._match_template(resolved_query)
+            if template_match is not None:
+                sql, explanation, parameters = template_match.sql, template_match.explanation, template_match.parameters
+                similar_queries = []
             else:
-                user_query = user_query_to_use
-            
-            # 使用 LLM 服務生成回應
-            model_name = settings.default_model
-            llm_response = self.llm_service.generate(
-                prompt=user_query,
-                system_prompt=prompt,
-                model_name=model_name,
-                json_mode=True
-            )
-            
-            # 檢查是否有錯誤
-            if llm_response.is_error():
-                raise Exception(f"生成回應時出錯: {llm_response.error}")
-            
-            # 解析回應
-            result = llm_response.get_parsed_json()
-            
-            sql = result.get("sql", "")
-            explanation = result.get("explanation", "")
-            parameters = result.get("parameters", {})  # 提取參數
+                sql, explanation, parameters, similar_queries = self._generate_with_llm(
+                    query, resolved_query, session_id, model_name, conversation_history, find_similar, execute
+                )
             
             # 創建查詢結果
             sql_result = SQLResult(
@@ -210,7 +161,8 @@ class TextToSQLService:
                 explanation=explanation,
                 parameters=parameters,  # 添加參數到結果
                 query_id=query_id,
-                similar_queries=similar_queries if similar_queries else None
+                similar_queries=similar_queries if similar_queries else None,
+                template_id=str(template_match.template.id) if template_match is not None else None
             )
             
             # 添加到歷史記錄
@@ -228,27 +180,29 @@ class TextToSQLService:
             )
             
             # 如果需要執行查詢
-            if execute and sql:
-                execution_result = self.execute_sql(sql, parameters)  # 傳遞參數到執行函數
+            with stage("execution"):
+                if execute and sql:
+                    execution_result = self.execute_sql(sql, parameters, confirmed=confirm_cost)  # 傳遞參數到執行函數
                 
-                # 更新查詢結果和歷史記錄
-                sql_result.execution_result = execution_result.to_dict()
-                history_entry.executed = True
-                history_entry.execution_time = execution_result.execution_time
-                history_entry.error_message = execution_result.error
+                    # 更新查詢結果和歷史記錄
+                    sql_result.execution_result = execution_result.to_dict()
+                    history_entry.executed = True
+                    history_entry.execution_time = execution_result.execution_time
+                    history_entry.error_message = execution_result.error
             
-            # 保存歷史記錄
-            self.history_service.add_query(history_entry)
+            with stage("history_write"):
+                # 保存歷史記錄
+                self.history_service.add_query(history_entry)
             
-            # 如果有會話ID，將查詢添加到對話
-            if session_id:
-                self.conversation_manager.add_query_to_conversation(session_id, history_entry)
+                # 如果有會話ID，將查詢添加到對話
+                if session_id:
+                    self.conversation_manager.add_query_to_conversation(session_id, history_entry)
             
             # 將查詢添加到向量存儲
             try:
                 metadata = {
                     "executed": execute,
-                    "model": settings.default_model,
+                    "model": model_name,
                     "timestamp": datetime.now().isoformat(),
                     "parameters": parameters  # 添加參數信息到元數據
                 }
@@ -284,7 +238,183 @@ class TextToSQLService:
                 query_id=query_id
             )
     
-    def execute_sql(self, sql: str, params: Optional[Dict[str, Any]] = None, visualize: bool = True) -> QueryResult:
+    def _match_template(self, query: str) -> Optional[TemplateMatch]:
+        """
+        比對查詢模板
+        
+        Returns:
+            模板比對結果；未啟用、沒有相似度足夠的模板或比對失敗時返回 None
+        """
+        if not settings.template_match_enabled:
+            return None
+        with stage("template_match"):
+            try:
+                template_match = self.template_matcher.match(query)
+            except Exception as e:
+                self.logger.error(f"比對查詢模板時出錯: {e}")
+                return None
+            record_cache_access("template", template_match is not None)
+            if template_match is None:
+                return None
+            
+            self.logger.info(f"使用查詢模板 '{template_match.template.name}' (相似度 {template_match.score:.2f})，略過 LLM")
+            set_trace_attributes(template_id=str(template_match.template.id))
+            try:
+                self.history_service.increment_template_usage(str(template_match.template.id))
+            except Exception as e:
+                self.logger.warning(f"更新模板使用次數失敗: {e}")
+            return template_match
+    
+    def _generate_with_llm(self, query: str, resolved_query: str, session_id: Optional[str], model_name: str,
+                           conversation_history, find_similar: bool,
+                           execute: bool) -> Tuple[str, str, Dict[str, Any], List[SimilarQuery]]:
+        """
+        以 LLM 生成 SQL (查找相似查詢、建構提示詞，成本過高時重新生成)
+        
+        Returns:
+            (SQL, 解釋, 參數, 相似查詢列表)
+        """
+        # 查找相似查詢
+        with stage("similarity_search"):
+            similar_queries = []
+            if find_similar:
+                try:
+                    # 查找相似的歷史查詢
+                    similar_results = self.vector_store.search_similar(query, k=3)
+                
+                    # 將結果轉換為 SimilarQuery 模型
+                    similar_queries = [
+                        SimilarQuery(
+                            query=result["query"],
+                            sql=result["sql"],
+                            similarity=result["similarity"],
+                            timestamp=result["timestamp"] if isinstance(result["timestamp"], str) else result["timestamp"].isoformat()
+                        )
+                        for result in similar_results
+                        if result["similarity"] > 0.7  # 只返回相似度大於 0.7 的查詢
+                    ]
+                
+                    record_cache_access("similar_queries", bool(similar_queries))
+                    if similar_queries:
+                        self.logger.info(f"找到 {len(similar_queries)} 個相似查詢")
+                except Exception as e:
+                    self.logger.error(f"查找相似查詢時出錯: {e}")
+                    # 如果查找相似查詢時出錯，忽略錯誤，繼續處理
+        
+        with stage("prompt_build"):
+            # 嘗試推薦適合的資料庫函數
+            function_suggestion = get_function_suggestion(query)
+        
+            # 使用解析後的查詢（如果有）
+            user_query_to_use = resolved_query if resolved_query != query else query
+        
+            # 如果有合適的函數推薦，檢查函數是否可用，並添加到 prompt 中
+            if function_suggestion:
+                func_name, func_info = function_suggestion
+            
+                # 檢查推薦的函數是否可用
+                if is_function_working(func_name):
+                    # 函數可用，使用正常的函數示例
+                    example = generate_function_example(func_name, func_info)
+                
+                    func_prompt = f"""
+    根據你的查詢，我推薦使用 {func_name} 函數：
+
+    函數名稱: {func_name}
+    描述: {func_info.get('description', '無描述')}
+    參數: {func_info.get('parameters', '無參數')}
+    返回類型: {func_info.get('return_type', '無返回類型')}
+
+    使用示例:
+    {example}
+
+    請儘量利用這個函數來回答用戶的查詢。
+    """
+                else:
+                    # 函數不可用，提供替代方案
+                    fallback_query = get_fallback_query(query, func_name)
+                
+                    func_prompt = f"""
+    原本推薦使用 {func_name} 函數，但該函數目前可能不可用或有解析錯誤。
+
+    請使用以下替代查詢方式：
+    {fallback_query}
+
+    請根據用戶需求調整上述查詢中的參數值。
+    """
+            
+                # 將用戶查詢和函數建議結合
+                user_query = f"{user_query_to_use}\n\n{func_prompt}"
+            else:
+                user_query = user_query_to_use
+        
+            # 依模型上下文窗口裁剪提示詞 (相似查詢 -> 較舊的對話 -> 不相關的 schema)
+            prompt = self._build_budgeted_prompt(
+                query=user_query_to_use,
+                user_query=user_query,
+                model_name=model_name,
+                conversation_history=conversation_history,
+                similar_queries=similar_queries,
+                suggested_function=function_suggestion[0] if function_suggestion else None
+            )
+        
+        with stage("llm"), usage_context(session=session_id):
+            sql, explanation, parameters = self._generate_sql(user_query, prompt, model_name)
+        
+        # 預估成本過高時，帶著查詢規劃器的意見重新生成 (未通過只讀檢查的 SQL 不送去 EXPLAIN)
+        if execute and sql and self.db_service.cost_gate is not None and self.db_service.is_safe_query(sql)[0]:
+            with stage("cost_check"):
+                for attempt in range(settings.explain_regenerate_attempts):
+                    plan_check = self.db_service.check_query_cost(sql, parameters)
+                    if plan_check is None or plan_check.allowed or plan_check.requires_confirmation:
+                        break
+                    self.logger.info(f"生成的 SQL 成本過高，重新生成 (第 {attempt + 1} 次): {plan_check.reason}")
+                    feedback = self._build_plan_feedback_prompt(sql, parameters, plan_check)
+                    with stage("llm_regenerate"), usage_context(session=session_id):
+                        sql, explanation, parameters = self._generate_sql(f"{user_query}\n\n{feedback}", prompt, model_name)
+        
+        return sql, explanation, parameters, similar_queries
+    
+    def _generate_sql(self, user_query: str, system_prompt: str, model_name: str) -> Tuple[str, str, Dict[str, Any]]:
+        """
+        呼叫 LLM 生成 SQL
+        
+        Returns:
+            (SQL, 解釋, 參數)
+        """
+        llm_response = self.llm_service.generate(
+            prompt=user_query,
+            system_prompt=system_prompt,
+            model_name=model_name,
+            json_mode=True
+        )
+        
+        # 檢查是否有錯誤
+        if llm_response.is_error():
+            raise Exception(f"生成回應時出錯: {llm_response.error}")
+        
+        # 解析回應
+        result = llm_response.get_parsed_json()
+        return result.get("sql", ""), result.get("explanation", ""), result.get("parameters", {})
+    
+    def _build_plan_feedback_prompt(self, sql: str, parameters: Optional[Dict[str, Any]], plan_check) -> str:
+        """建構成本過高時的重新生成提示，包含查詢規劃器指出的問題"""
+        hotspots = "\n".join(f"- {hotspot}" for hotspot in plan_check.hotspots)
+        return f"""先前生成的 SQL 被查詢規劃器拒絕執行，原因: {plan_check.reason}
+
+先前的 SQL:
+{sql}
+
+參數: {json.dumps(parameters or {}, ensure_ascii=False, default=str)}
+
+執行計畫中成本最高的部分:
+{hotspots}
+
+請重新生成成本較低的 SQL，例如補上遺漏的連接條件、加入篩選條件或使用 LIMIT 限制返回列數。"""
+    
+    @traced("execute_sql")
+    def execute_sql(self, sql: str, params: Optional[Dict[str, Any]] = None, visualize: bool = True,
+                    confirmed: bool = False) -> QueryResult:
         """
         執行 SQL 查詢
         
@@ -292,6 +422,7 @@ class TextToSQLService:
             sql: SQL 查詢
             params: 查詢參數
             visualize: 是否生成視覺化圖表
+            confirmed: 確認執行超出成本上限的查詢
             
         Returns:
             查詢結果
@@ -302,7 +433,7 @@ class TextToSQLService:
         
         # 使用增強版查詢執行 (帶視覺化)
         if visualize:
-            result, viz_metadata = self.db_service.execute_query_with_viz(sql, params, visualize=True)
+            result, viz_metadata = self.db_service.execute_query_with_viz(sql, params, visualize=True, confirmed=confirmed)
             
             # 如果有視覺化數據，添加到結果中
             if viz_metadata:
@@ -314,7 +445,7 @@ class TextToSQLService:
             return result
         else:
             # 普通查詢執行（無視覺化）
-            return self.db_service.execute_query(sql, params)
+            return self.db_service.execute_query(sql, params, confirmed=confirmed)
     
     def get_history(self, limit: int = 20, offset: int = 0) -> List[QueryHistoryModel]:
         """
@@ -329,12 +460,87 @@ class TextToSQLService:
         """
         return self.history_service.get_history(limit, offset)
     
-    def _build_prompt(self, query: str) -> str:
+    def _build_budgeted_prompt(self, query: str, user_query: str, model_name: str, conversation_history,
+                               similar_queries: List[SimilarQuery], suggested_function: Optional[str] = None) -> str:
+        """
+        建構符合模型上下文窗口的系統提示詞
+        
+        各區段以 token 計量，超出預算時依序裁剪相似查詢、較舊的對話輪次，
+        最後移除與查詢最不相關的資料表與函數說明。
+        
+        Args:
+            query: 用於評估 schema 相關性的查詢 (解析後)
+            user_query: 實際送出的用戶提示詞 (含函數建議)，計入預算但不裁剪
+            model_name: 模型名稱
+            conversation_history: 對話歷史 (由舊到新)
+            similar_queries: 相似查詢 (由最相似排列)
+            suggested_function: 推薦的資料庫函數，排在 schema 相關性最前面
+            
+        Returns:
+            系統提示詞
+        """
+        # schema 片段依相關性排序，推薦的函數永遠優先保留
+        schema_fragments = self.schema_fragments
+        ranked_fragments = sorted(
+            schema_fragments,
+            key=lambda fragment: (
+                fragment['name'] == suggested_function,
+                score_relevance(query, fragment['keywords'])
+            ),
+            reverse=True
+        )
+        fragment_order = {id(fragment): index for index, fragment in enumerate(schema_fragments)}
+        
+        sections = [
+            BudgetSection("instructions", [self._build_prompt(query, schema_description="")]),
+            BudgetSection("user_query", [user_query]),
+            BudgetSection(
+                "similar_queries",
+                sorted(similar_queries, key=lambda item: item.similarity, reverse=True),
+                render=lambda kept: self._build_similar_query_prompt(kept) if kept else "",
+                measure=lambda item: f"{item.query}\n{item.sql}",
+                trim_priority=1
+            ),
+            BudgetSection(
+                "conversation",
+                list(reversed(conversation_history)),  # 最新的對話最重要
+                render=lambda kept: self._build_conversation_context_prompt(list(reversed(kept))) if kept else "",
+                measure=lambda item: f"{item.user_query}\n{item.resolved_query or ''}\n{item.generated_sql}",
+                trim_priority=2,
+                min_items=1 if conversation_history else 0
+            ),
+            BudgetSection(
+                "schema",
+                ranked_fragments,
+                render=lambda kept: build_schema_description(
+                    sorted(kept, key=lambda fragment: fragment_order[id(fragment)])
+                ),
+                measure=lambda fragment: fragment['text'],
+                trim_priority=3,
+                min_items=1
+            ),
+        ]
+        
+        budgeter = PromptBudgeter(self.llm_service.get_provider(model_name).model_config)
+        allocation = budgeter.allocate(sections)
+        set_trace_attributes(prompt_tokens=allocation["total_tokens"], prompt_budget=allocation["budget"])
+        
+        section_map = {section.name: section for section in sections}
+        prompt = self._build_prompt(query, schema_description=section_map["schema"].render())
+        for name in ("conversation", "similar_queries"):
+            text = section_map[name].render()
+            if text:
+                prompt = f"{prompt}\n\n{text}"
+        return prompt
+    
+    def _build_prompt(self, query: str, schema_description: Optional[str] = None) -> str:
         """建構基本提示詞"""
+        if schema_description is None:
+            schema_description = self.schema_description
         return f"""你是一個專業的 PostgreSQL 資料庫專家。你的任務是將用戶的自然語言查詢轉換成精確的 SQL 查詢。
 以下是資料庫結構的詳細描述，請根據這些信息生成正確的 SQL 查詢：
 
-{self.schema_description}
+{schema_description}
 
 重要說明：
 1. 針對預約、時段可用性、服務搜尋等功能，優先使用資料庫函數而非直接編寫複雜查詢。
@@ -392,12 +598,8 @@ class TextToSQLService:
         """建構對話上下文提示詞"""
         prompt = "以下是當前對話的上下文，這些是用戶最近的查詢及生成的SQL，請參考以理解用戶的意圖：\n\n"
         
-        for i, history in enumerate(conversation_history):
-            prompt += f"查詢 {i+1}:\n"
-            prompt += f"用戶問題: {history.user_query}\n"
-            if history.resolved_query and history.resolved_query != history.user_query:
-                prompt += f"解析後問題: {history.resolved_query}\n"
-            prompt += f"生成SQL: {history.generated_sql}\n\n"
+        # 每輪的文字已在對話上下文中渲染，這裡只加上編號
+        prompt += "".join(f"查詢 {i+1}:\n{turn.context_block}" for i, turn in enumerate(conversation_history))
         
         prompt += """
 請根據上述對話歷史，理解用戶的當前查詢。用戶可能會使用代詞（如「它們」、「這些」、「他」）參考之前的實體，
@@ -410,10 +612,11 @@ class TextToSQLService:
 """
         return prompt
         
-    def _resolve_references(self, query: str, conversation_history) -> str:
-        """解析查詢中的引用"""
+    def _resolve_references(self, query: str, conversation_history, model_name: Optional[str] = None,
+                            known_entities: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        """解析查詢中的引用 (conversation_history 為 ConversationTurn 列表，known_entities 為先前已解析的實體引用)"""
         if not conversation_history:
-            return query
+            return query, {}
             
         # 構建系統提示詞
         system_prompt = """你是參考解析專家。你的任務是分析用戶的當前查詢，並解析其中可能存在的代詞或隱含引用。
@@ -437,11 +640,12 @@ class TextToSQLService:
         
         # 格式化對話歷史
         history_text = "\n\n對話歷史:\n"
-        for i, hist in enumerate(conversation_history[-3:]):  # 使用最近3個查詢
-            history_text += f"用戶問題 {i+1}: {hist.user_query}\n"
-            if hist.resolved_query and hist.resolved_query != hist.user_query:
-                history_text += f"解析後問題: {hist.resolved_query}\n"
-            history_text += f"SQL: {hist.generated_sql}\n\n"
+        history_text += "".join(  # 使用最近3個查詢
+            f"用戶問題 {i+1}: {turn.user_query}\n{turn.reference_block}"
+            for i, turn in enumerate(conversation_history[-3:])
+        )
+        if known_entities:
+            history_text += f"先前已解析的實體引用: {json.dumps(known_entities, ensure_ascii=False)}\n\n"
         
         # 添加當前查詢
         user_prompt = f"{history_text}\n\n當前查詢: {query}\n\n請解析當前查詢中的引用，返回一個完整的查詢和識別出的實體引用。"
@@ -450,13 +654,13 @@ class TextToSQLService:
         response = self.llm_service.generate(
             prompt=user_prompt,
             system_prompt=system_prompt,
-            model_name=settings.default_model,
+            model_name=model_name or settings.default_model,
             json_mode=True
         )
         
         if response.is_error():
             self.logger.warning(f"參考解析失敗: {response.error}，使用原始查詢")
-            return query
+            return query, {}
             
         try:
             result = response.get_parsed_json()
@@ -0,0 +1,249 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# 各提供者回報 token 用量使用的欄位名稱
+PROMPT_TOKEN_KEYS = ("prompt_tokens", "input_tokens", "prompt_token_count", "prompt_eval_count")
+COMPLETION_TOKEN_KEYS = ("completion_tokens", "output_tokens", "candidates_token_count", "eval_count")
+TOTAL_TOKEN_KEYS = ("total_tokens", "total_token_count")
+
+# 彙總的維度
+DIMENSIONS = ("model", "endpoint", "session", "stage")
+
+# 記憶體中保留的會話統計數量上限
+MAX_TRACKED_SESSIONS = 10000
+
+
+class TokenBudgetExceeded(Exception):
+    """會話的 token 用量超出預算"""
+    pass
+
+
+# 目前請求的計量標籤 (端點、會話)
+_usage_context: ContextVar[Dict[str, Optional[str]]] = ContextVar("token_usage_context", default={})
+
+
+@contextmanager
+def usage_context(**labels: Optional[str]) -> Iterator[None]:
+    """
+    在區塊內為 token 用量附加標籤 (endpoint、session)
+
+    巢狀使用時會與外層標籤合併，值為 None 的標籤不覆寫外層設定。
+    """
+    merged = dict(_usage_context.get())
+    merged.update({key: value for key, value in labels.items() if value is not None})
+    token = _usage_context.set(merged)
+    try:
+        yield
+    finally:
+        _usage_context.reset(token)
+
+
+def set_usage_labels(**labels: Optional[str]) -> None:
+    """設定目前執行環境的計量標籤 (不會自動還原，適用於 CLI 等單次執行的程序)"""
+    merged = dict(_usage_context.get())
+    merged.update({key: value for key, value in labels.items() if value is not None})
+    _usage_context.set(merged)
+
+
+def get_usage_context() -> Dict[str, Optional[str]]:
+    """獲取目前的計量標籤"""
+    return _usage_context.get()
+
+
+def _first_value(usage: Dict[str, Any], keys) -> Optional[int]:
+    """取得第一個存在的欄位值"""
+    for key in keys:
+        value = usage.get(key)
+        if value is not None:
+            return int(value)
+    return None
+
+
+def normalize_token_usage(
+    token_usage: Optional[Dict[str, Any]],
+    prompt: str,
+    system_prompt: Optional[str],
+    completion: str,
+    model_name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    將各提供者的 token 用量統一為 prompt_tokens / completion_tokens / total_tokens
+
+    提供者未回報的部分以分詞器估算，並標記 estimated=True。
+
+    Args:
+        token_usage: 提供者回報的用量
+        prompt: 用戶提示詞
+        system_prompt: 系統提示詞
+        completion: 生成的內容
+        model_name: 模型名稱，用於選擇分詞器
+
+    Returns:
+        統一格式的 token 用量
+    """
+    # 只有提供者未回報用量時才需要分詞器 (CLI 只設定計量標籤時不載入)
+    from ..utils.tokens import count_tokens
+
+    usage = token_usage or {}
+    estimated = False
+
+    prompt_tokens = _first_value(usage, PROMPT_TOKEN_KEYS)
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(prompt, model_name) + count_tokens(system_prompt, model_name)
+        estimated = True
+
+    completion_tokens = _first_value(usage, COMPLETION_TOKEN_KEYS)
+    if completion_tokens is None:
+        completion_tokens = count_tokens(completion, model_name)
+        estimated = True
+
+    total_tokens = None if estimated else _first_value(usage, TOTAL_TOKEN_KEYS)
+    if total_tokens is None:
+        total_tokens = prompt_tokens + completion_tokens
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "estimated": estimated,
+    }
+
+
+def _empty_totals() -> Dict[str, Any]:
+    """建立空的彙總記錄"""
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "estimated_calls": 0, "cost": 0.0}
+
+
+class TokenMeter:
+    """依模型、端點、會話與處理階段彙總 token 用量與費用"""
+
+    def __init__(self, log_file: Optional[str] = None):
+        """
+        初始化計量器
+
+        Args:
+            log_file: 設定後將每次用量附加寫入此 JSONL 檔案
+        """
+        self.log_file = log_file
+        self.totals = _empty_totals()
+        self.groups: Dict[str, Dict[str, Dict[str, Any]]] = {
+            dimension: ({} if dimension != "session" else OrderedDict()) for dimension in DIMENSIONS
+        }
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        model: str,
+        usage: Dict[str, Any],
+        cost: Optional[float] = None,
+        stage: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> None:
+        """
+        記錄一次 LLM 呼叫的用量
+
+        未指定的端點與會話從目前的 usage_context 取得。
+        """
+        context = get_usage_context()
+        labels = {
+            "model": model,
+            "endpoint": endpoint or context.get("endpoint") or "unknown",
+            "session": session_id or context.get("session"),
+            "stage": stage or "unknown",
+        }
+        self._add(labels, usage, cost)
+
+        if self.log_file:
+            line = json.dumps({"timestamp": time.time(), **labels, **usage, "cost": cost}, ensure_ascii=False)
+            try:
+                with self._lock:
+                    with open(self.log_file, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+            except OSError as e:
+                logger.error(f"寫入 token 用量記錄失敗: {e}")
+
+    def _add(self, labels: Dict[str, Optional[str]], usage: Dict[str, Any], cost: Optional[float]) -> None:
+        """累加至總計與各維度"""
+        with self._lock:
+            targets = [self.totals]
+            for dimension in DIMENSIONS:
+                value = labels.get(dimension)
+                if value is None:
+                    continue
+                group = self.groups[dimension]
+                if value not in group:
+                    group[value] = _empty_totals()
+                    if dimension == "session" and len(group) > MAX_TRACKED_SESSIONS:
+                        group.popitem(last=False)
+                elif dimension == "session":
+                    group.move_to_end(value)
+                targets.append(group[value])
+
+            for totals in targets:
+                totals["calls"] += 1
+                totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                totals["completion_tokens"] += usage.get("completion_tokens", 0)
+                totals["total_tokens"] += usage.get("total_tokens", 0)
+                totals["estimated_calls"] += 1 if usage.get("estimated") else 0
+                totals["cost"] += cost or 0.0
+
+    def get_session_total(self, session_id: str) -> int:
+        """獲取會話已使用的 token 總數"""
+        with self._lock:
+            totals = self.groups["session"].get(session_id)
+            return totals["total_tokens"] if totals else 0
+
+    def get_summary(self, group_by: Optional[str] = None) -> Dict[str, Any]:
+        """
+        獲取用量彙總
+
+        Args:
+            group_by: 只返回指定維度 (model / endpoint / session / stage)，默認返回全部
+
+        Returns:
+            {"total": {...}, "by_<維度>": {值: {...}}}
+        """
+        if group_by and group_by not in DIMENSIONS:
+            raise ValueError(f"未知的彙總維度: {group_by}，可用: {', '.join(DIMENSIONS)}")
+
+        with self._lock:
+            summary: Dict[str, Any] = {"total": dict(self.totals)}
+            for dimension in ([group_by] if group_by else DIMENSIONS):
+                summary[f"by_{dimension}"] = {
+                    value: dict(totals) for value, totals in self.groups[dimension].items()
+                }
+        return summary
+
+    def reset(self) -> None:
+        """清除所有統計"""
+        with self._lock:
+            self.totals = _empty_totals()
+            for group in self.groups.values():
+                group.clear()
+
+    @classmethod
+    def from_log(cls, path: str) -> "TokenMeter":
+        """從 JSONL 用量記錄重建統計 (供 CLI 使用)"""
+        meter = cls()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                labels = {dimension: entry.get(dimension) for dimension in DIMENSIONS}
+                meter._add(labels, entry, entry.get("cost"))
+        return meter
@@ -0,0 +1,148 @@
+"""
+互動式 shell (python -m app shell)
+
+在同一個程序中連續轉換問題：TextToSQLService、schema 目錄與資料庫連線池只建立一次，
+並沿用同一個會話ID，後續問題可以引用先前的結果 (例如「那上週呢？」)。
+"""
+import logging
+import os
+import uuid
+
+# 設定日誌
+logger = logging.getLogger(__name__)
+
+# readline 歷史紀錄檔案
+HISTORY_FILE = os.path.expanduser("~/.text2sql_history")
+
+HELP_TEXT = """輸入自然語言問題轉換為 SQL，或使用以下命令:
+  \\sql <SQL>          執行 SQL 查詢
+  \\execute [on|off]   切換是否執行生成的 SQL
+  \\model [名稱]       顯示或切換語言模型
+  \\session [ID|new]   顯示、切換或重新建立會話
+  \\history [筆數]     查看查詢歷史
+  \\help               顯示此說明
+  \\quit               離開 (或 Ctrl-D)"""
+
+
+def _setup_readline() -> None:
+    """有 readline 時啟用行編輯與跨次啟動的輸入歷史"""
+    try:
+        import readline
+    except ImportError:
+        return
+    try:
+        readline.read_history_file(HISTORY_FILE)
+    except (FileNotFoundError, OSError):
+        pass
+    readline.set_history_length(1000)
+
+    import atexit
+    atexit.register(_save_readline_history, readline)
+
+
+def _save_readline_history(readline) -> None:
+    try:
+        readline.write_history_file(HISTORY_FILE)
+    except OSError as e:
+        logger.debug(f"無法寫入 shell 輸入歷史: {e}")
+
+
+def run_shell(service, args, console) -> None:
+    """
+    執行互動式 shell
+
+    Args:
+        service: CLIServices
+        args: shell 命令參數 (session、model、execute)
+        console: Rich Console
+    """
+    from .cli import print_convert_result, print_execute_result, print_query_history
+    from .daemon import warm_up
+    from .utils import settings
+
+    if args.model and args.model not in settings.models:
+        console.print(f"[bold red]錯誤: 未知的模型 '{args.model}'[/bold red]")
+        console.print(f"可用模型: {', '.join(settings.models)}")
+        return
+
+    session_id = args.session or str(uuid.uuid4())
+    model_name = args.model
+    execute = args.execute
+
+    with console.status("載入服務..."):
+        warm_up(service)
+    _setup_readline()
+
+    console.print("[bold]TextToSQL shell[/bold] — 輸入 \\help 查看命令")
+    console.print(f"[cyan]會話ID: {session_id}[/cyan]")
+
+    try:
+        while True:
+            try:
+                line = input("text2sql> ").strip()
+            except KeyboardInterrupt:
+                # 與 psql 相同，Ctrl-C 只清除目前輸入
+                console.print()
+                continue
+            except EOFError:
+                console.print()
+                break
+
+            if not line:
+                continue
+
+            if not line.startswith("\\"):
+                try:
+                    result = service.text_to_sql(
+                        query=line,
+                        session_id=session_id,
+                        execute=execute,
+                        model_name=model_name
+                    )
+                    print_convert_result(result.model_dump(mode="json"))
+                except KeyboardInterrupt:
+                    console.print("[yellow]已取消[/yellow]")
+                except Exception as e:
+                    logger.error(f"轉換查詢時發生錯誤: {e}")
+                    console.print(f"[bold red]錯誤:[/bold red] {str(e)}")
+                continue
+
+            command, _, argument = line[1:].partition(" ")
+            argument = argument.strip()
+
+            if command in ("q", "quit", "exit"):
+                break
+            elif command in ("h", "help", "?"):
+                console.print(HELP_TEXT, markup=False)
+            elif command == "sql":
+                if not argument:
+                    console.print("[yellow]用法: \\sql SELECT ...[/yellow]")
+                    continue
+                try:
+                    print_execute_result(service.execute_sql(argument).to_dict())
+                except Exception as e:
+                    console.print(f"[bold red]錯誤:[/bold red] {str(e)}")
+            elif command == "execute":
+                execute = (argument.lower() in ("on", "true", "1")) if argument else not execute
+                console.print(f"執行生成的 SQL: {'開啟' if execute else '關閉'}")
+            elif command == "model":
+                if not argument:
+                    console.print(f"目前模型: {model_name or settings.default_model}")
+                elif argument not in settings.models:
+                    console.print(f"[bold red]錯誤: 未知的模型 '{argument}'[/bold red]")
+                    console.print(f"可用模型: {', '.join(settings.models)}")
+                else:
+                    model_name = argument
+                    console.print(f"已切換模型: {model_name}")
+            elif command == "session":
+                if argument:
+                    session_id = str(uuid.uuid4()) if argument == "new" else argument
+                console.print(f"[cyan]會話ID: {session_id}[/cyan]")
+            elif command == "history":
+                limit = int(argument) if argument.isdigit() else 10
+                print_query_history(service, limit)
+            else:
+                console.print(f"[yellow]未知的命令: \\{command}，輸入 \\help 查看命令[/yellow]")
+    finally:
+        # 寫完背景佇列中的查詢歷史
+        service.history_service.close()
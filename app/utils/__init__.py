@@ -1,18 +1,41 @@
-# Utils package initialization
-from .config import settings
-from .db_function_utils import (
-    get_function_suggestion, 
-    generate_function_example, 
-    get_function_examples, 
-    get_fallback_query,
-    is_function_working
-)
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = [
-    "settings", 
-    "get_function_suggestion", 
-    "generate_function_example", 
-    "get_function_examples", 
-    "get_fallback_query",
-    "is_function_working"
-]
\ No newline at end of file
+# 名稱 -> 所在模組；第一次存取時才匯入 (PEP 562)，
+# 匯入 app.utils.tokens、app.utils.metrics 等子模組時不載入設定 (pydantic_settings)
+_EXPORTS = {
+    "settings": "config",
+    "get_function_suggestion": "db_function_utils",
+    "generate_function_example": "db_function_utils",
+    "get_function_examples": "db_function_utils",
+    "get_fallback_query": "db_function_utils",
+    "is_function_working": "db_function_utils",
+    "estimate_tokens": "tokens",
+    "count_tokens": "tokens",
+}
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .config import settings
+    from .db_function_utils import (
+        get_function_suggestion,
+        generate_function_example,
+        get_function_examples,
+        get_fallback_query,
+        is_function_working
+    )
+    from .tokens import estimate_tokens, count_tokens
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value  # 之後直接從模組字典取得
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -15,6 +15,7 @@ class ModelProvider(str, Enum):
     GOOGLE = "google"
     AZURE = "azure"
     LOCAL = "local"
+    REPLAY = "replay"
 
 class ModelConfig(BaseSettings):
     """模型配置"""
@@ -26,6 +27,12 @@ class ModelConfig(BaseSettings):
     supports_json_mode: bool = Field(default=False, description="是否支持JSON模式")
     context_window: int = Field(default=8000, description="上下文窗口大小")
     max_tokens: Optional[int] = Field(default=None, description="最大生成token數")
+    max_concurrency: Optional[int] = Field(default=None, description="模型最大並發請求數")
+    requests_per_minute: Optional[int] = Field(default=None, description="每分鐘請求數上限")
+    tokens_per_minute: Optional[int] = Field(default=None, description="每分鐘token數上限")
+    input_cost_per_1k: Optional[float] = Field(default=None, description="每千個輸入token的費用 (美元)")
+    output_cost_per_1k: Optional[float] = Field(default=None, description="每千個輸出token的費用 (美元)")
+    prompt_token_budget: Optional[int] = Field(default=None, description="提示詞token預算，默認依上下文窗口計算")
     additional_params: Dict[str, Any] = Field(default_factory=dict, description="額外參數")
     
     @validator('api_key_env')
@@ -53,6 +60,85 @@ class Settings(BaseSettings):
     azure_openai_endpoint: Optional[str] = None
     azure_deployment_name: Optional[str] = None
     
+    # LLM 速率限制設定
+    llm_provider_max_concurrency: int = int(os.getenv("LLM_PROVIDER_MAX_CONCURRENCY", "8"))
+    llm_queue_timeout: float = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+    
+    # 批次轉換設定
+    batch_max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+    batch_max_size: int = int(os.getenv("BATCH_MAX_SIZE", "1000"))
+    
+    # HTTP 連線池設定 (所有提供者共用的長連線客戶端)
+    http_max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    http_keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    http_timeout: float = float(os.getenv("HTTP_TIMEOUT", "120"))
+    
+    # 提示詞預算設定 (上下文窗口中可用於提示詞的比例，保留分詞器估算誤差)
+    prompt_budget_ratio: float = float(os.getenv("PROMPT_BUDGET_RATIO", "0.9"))
+    
+    # Token 計量與預算設定
+    token_usage_file: Optional[str] = os.getenv("TOKEN_USAGE_FILE")  # 設定後將每次呼叫的 token 用量附加寫入此 JSONL 檔案
+    session_token_budget: int = int(os.getenv("SESSION_TOKEN_BUDGET", "0"))  # 每個會話的 token 預算，0 表示不限制
+    token_budget_action: str = os.getenv("TOKEN_BUDGET_ACTION", "reject")  # 超出預算時: reject 或 downgrade
+    token_budget_downgrade_model: Optional[str] = os.getenv("TOKEN_BUDGET_DOWNGRADE_MODEL")  # downgrade 時改用的模型
+    
+    # 追蹤與監控設定
+    slow_trace_capacity: int = int(os.getenv("SLOW_TRACE_CAPACITY", "20"))  # 記憶體中保留的最慢追蹤記錄數
+    logfire_token: Optional[str] = os.getenv("LOGFIRE_TOKEN")  # 設定後將 span 傳送至 logfire
+    
+    # 非同步資料庫設定 (API 端點以 asyncpg 連線池執行查詢，不阻塞事件迴圈)
+    async_db_enabled: bool = os.getenv("ASYNC_DB_ENABLED", "true").lower() in ("1", "true", "yes")
+    async_db_pool_size: int = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+    async_db_max_overflow: int = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "10"))
+    
+    # 每個資料庫連線保留的預備語句數量上限 (帶參數的查詢重用執行計畫)，0 表示停用
+    prepared_statement_cache_size: int = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", "100"))
+    
+    # 查詢結果快取設定 (只快取只讀查詢，資料表變更通知使相關結果失效)
+    query_cache_ttl: float = float(os.getenv("QUERY_CACHE_TTL", "30"))  # 結果有效秒數，0 表示停用
+    query_cache_max_entries: int = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+    table_notify_channel: Optional[str] = os.getenv("TABLE_NOTIFY_CHANNEL", "texttosql_table_changed") or None  # 資料表變更通知頻道
+    
+    # 執行前成本檢查設定 (EXPLAIN)
+    explain_gate_enabled: bool = os.getenv("EXPLAIN_GATE_ENABLED", "false").lower() in ("1", "true", "yes")
+    explain_max_cost: float = float(os.getenv("EXPLAIN_MAX_COST", "100000"))  # 預估總成本上限，0 表示不限制
+    explain_max_rows: float = float(os.getenv("EXPLAIN_MAX_ROWS", "100000"))  # 預估返回列數上限，0 表示不限制
+    explain_action: str = os.getenv("EXPLAIN_ACTION", "reject")  # 超出上限時: reject 或 confirm
+    explain_regenerate_attempts: int = int(os.getenv("EXPLAIN_REGENERATE_ATTEMPTS", "1"))  # 被拒絕時帶著規劃器意見重新生成的次數
+    
+    # 資料庫結構快取設定
+    schema_cache_ttl: float = float(os.getenv("SCHEMA_CACHE_TTL", "300"))  # 快取有效秒數，0 表示只依變更通知失效
+    schema_notify_channel: Optional[str] = os.getenv("SCHEMA_NOTIFY_CHANNEL", "texttosql_schema_changed") or None  # DDL 變更通知頻道
+    schema_source: str = os.getenv("SCHEMA_SOURCE", "files")  # 提示詞的結構來源: files (SQL 檔案) 或 live (資料庫即時結構)
+    
+    # 查詢歷史背景批次寫入設定 (請求路徑不包含歷史記錄的 I/O)
+    history_write_behind: bool = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+    history_flush_interval: float = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))  # 背景寫入間隔秒數
+    history_batch_size: int = int(os.getenv("HISTORY_BATCH_SIZE", "100"))  # 每批寫入筆數上限
+    history_max_pending: int = int(os.getenv("HISTORY_MAX_PENDING", "10000"))  # 佇列上限，超過時改為同步寫入
+    
+    # 對話上下文存儲設定 (memory 為程序內 LRU；多個 worker 共用會話時使用 sqlite:///...、postgresql://... 或 redis://...)
+    conversation_store: str = os.getenv("CONVERSATION_STORE", "memory")
+    conversation_max_sessions: int = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))  # 程序內存儲的會話數上限，0 表示不限制
+    conversation_idle_ttl: float = float(os.getenv("CONVERSATION_IDLE_TTL", "3600"))  # 會話閒置秒數上限，0 表示不過期
+    conversation_max_queries: int = int(os.getenv("CONVERSATION_MAX_QUERIES", "50"))  # 每個會話保留的查詢ID數上限
+    conversation_window: int = int(os.getenv("CONVERSATION_WINDOW", "5"))  # 每個會話保留 (供提示詞使用) 的最近輪數
+    
+    # 查詢模板比對設定 (呼叫 LLM 前比對模板，相似度足夠時直接使用模板 SQL)
+    template_match_enabled: bool = os.getenv("TEMPLATE_MATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+    template_match_threshold: float = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.95"))  # 使用模板的最低相似度 (0-1)
+    template_match_refresh: float = float(os.getenv("TEMPLATE_MATCH_REFRESH", "60"))  # 重新載入模板與槽位詞彙的間隔秒數
+    template_match_max_templates: int = int(os.getenv("TEMPLATE_MATCH_MAX_TEMPLATES", "500"))  # 參與比對的模板數上限 (依使用次數)
+    
+    # 服務啟動設定 (main.py；APP_ENV=development 時以單一程序啟動並開啟自動重載)
+    app_env: str = os.getenv("APP_ENV", "production")
+    server_workers: int = int(os.getenv("WEB_CONCURRENCY", "0"))  # worker 程序數，0 表示 CPU 核心數
+    server_graceful_timeout: int = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))  # 關閉時等待進行中請求與 LLM 呼叫的秒數
+    
+    # LLM 錄製設定 (設定後將真實回應寫入此 JSONL 檔案，供 replay 模型重放)
+    llm_record_file: Optional[str] = os.getenv("LLM_RECORD_FILE")
+    
     # 模型配置
     models: Dict[str, ModelConfig] = {
         # OpenAI 模型
@@ -63,7 +149,9 @@ class Settings(BaseSettings):
             temperature=0.0,
             supports_json_mode=True,
             context_window=128000,
-            max_tokens=4096
+            max_tokens=4096,
+            input_cost_per_1k=0.0025,
+            output_cost_per_1k=0.01
         ),
         "gpt-4-turbo": ModelConfig(
             provider=ModelProvider.OPENAI,
@@ -72,7 +160,9 @@ class Settings(BaseSettings):
             temperature=0.0,
             supports_json_mode=True,
             context_window=128000,
-            max_tokens=4096
+            max_tokens=4096,
+            input_cost_per_1k=0.01,
+            output_cost_per_1k=0.03
         ),
         "gpt-3.5-turbo": ModelConfig(
             provider=ModelProvider.OPENAI,
@@ -81,7 +171,9 @@ class Settings(BaseSettings):
             temperature=0.0,
             supports_json_mode=True,
             context_window=16000,
-            max_tokens=4096
+            max_tokens=4096,
+            input_cost_per_1k=0.0005,
+            output_cost_per_1k=0.0015
         ),
         
         # Anthropic 模型
@@ -92,7 +184,9 @@ class Settings(BaseSettings):
             temperature=0.0,
             supports_json_mode=True,
             context_window=200000,
-            max_tokens=4096
+            max_tokens=4096,
+            input_cost_per_1k=0.015,
+            output_cost_per_1k=0.075
         ),
         "claude-3-sonnet": ModelConfig(
             provider=ModelProvider.ANTHROPIC,
@@ -101,7 +195,9 @@ class Settings(BaseSettings):
             temperature=0.0,
             supports_json_mode=True,
             context_window=200000,
-            max_tokens=4096
+            max_tokens=4096,
+            input_cost_per_1k=0.003,
+            output_cost_per_1k=0.015
         ),
         "claude-3-haiku": ModelConfig(
             provider=ModelProvider.ANTHROPIC,
@@ -110,7 +206,9 @@ class Settings(BaseSettings):
             temperature=0.0,
             supports_json_mode=True,
             context_window=200000,
-            max_tokens=4096
+            max_tokens=4096,
+            input_cost_per_1k=0.00025,
+            output_cost_per_1k=0.00125
         ),
         
         # Google 模型
@@ -147,7 +245,22 @@ class Settings(BaseSettings):
             base_url="http://localhost:11434/api",
             temperature=0.0,
             supports_json_mode=False,
-            context_window=8192
+            context_window=8192,
+            max_concurrency=2  # Ollama 預設逐一處理請求
+        ),
+        
+        # 重放錄製的回應 (壓力測試用，不需要網路)
+        "replay": ModelConfig(
+            provider=ModelProvider.REPLAY,
+            model_name="replay",
+            api_key_env="DUMMY_KEY",  # 不需要實際的API密鑰
+            supports_json_mode=True,
+            context_window=128000,
+            additional_params={
+                "recording_file": os.getenv("LLM_REPLAY_FILE", "llm_recordings.jsonl"),
+                "latency": os.getenv("LLM_REPLAY_LATENCY", "recorded"),
+                "on_miss": os.getenv("LLM_REPLAY_ON_MISS", "error")
+            }
         )
     }
     
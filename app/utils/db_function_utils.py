@@ -1,4 +1,4 @@
-from ..schema import db_functions
+from ..schema import get_catalog
 from typing import Dict, List, Any, Optional, Tuple
 import re
 
@@ -61,6 +61,7 @@ def get_function_suggestion(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
     sorted_functions = sorted(function_counts.items(), key=lambda x: x[1], reverse=True)
     
     # 返回出現次數最多且沒有解析錯誤的函數
+    db_functions = get_catalog().functions
     for func_name, _ in sorted_functions:
         if func_name in db_functions:
             func_info = db_functions[func_name]
@@ -135,7 +136,7 @@ def get_function_examples() -> Dict[str, str]:
     """
     examples = {}
     
-    for func_name, func_info in db_functions.items():
+    for func_name, func_info in get_catalog().functions.items():
         # 只為沒有解析錯誤的函數生成示例
         if not func_info.get('has_parse_error', False):
             examples[func_name] = generate_function_example(func_name, func_info)
@@ -265,6 +266,7 @@ def is_function_working(func_name: str) -> bool:
     Returns:
         函數是否可用
     """
+    db_functions = get_catalog().functions
     if func_name not in db_functions:
         return False
     
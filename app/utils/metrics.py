@@ -0,0 +1,167 @@
+import bisect
+import heapq
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 預設的延遲直方圖邊界 (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """格式化 Prometheus 標籤"""
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    """格式化數值 (整數不帶小數點)"""
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Histogram:
+    """Prometheus 格式的直方圖 (累積分桶)"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 標籤值 -> [各分桶計數..., +Inf 計數, 總和]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """記錄一次觀測值"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        """輸出 Prometheus 文字格式"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in sorted(self._series.items())]
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{plain} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{plain} {_format_value(series[-1])}")
+        return lines
+
+
+class Counter:
+    """Prometheus 格式的計數器"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """累加計數"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        """輸出 Prometheus 文字格式"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """指標註冊表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """取得或建立直方圖"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """取得或建立計數器"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, documentation, labelnames)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        """輸出所有指標的 Prometheus 文字格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class SlowTraceStore:
+    """在記憶體中保留最慢的 N 筆追蹤記錄"""
+
+    def __init__(self, capacity: int = 20):
+        self.capacity = capacity
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []  # 最小堆積，堆頂為保留中最快的一筆
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, duration_ms: float, trace: Dict[str, Any]) -> None:
+        """加入一筆追蹤記錄，只保留最慢的 capacity 筆"""
+        if self.capacity <= 0:
+            return
+        item = (duration_ms, next(self._sequence), trace)
+        with self._lock:
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, item)
+            elif duration_ms > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def get_slowest(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """依耗時由慢到快返回追蹤記錄"""
+        with self._lock:
+            items = sorted(self._heap, key=lambda item: item[0], reverse=True)
+        return [trace for _, _, trace in items[:limit]]
+
+    def clear(self) -> None:
+        """清除所有記錄"""
+        with self._lock:
+            self._heap.clear()
+
+
+# 全域指標註冊表
+metrics = MetricsRegistry()
@@ -0,0 +1,220 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .config import settings
+from .metrics import SlowTraceStore, metrics
+
+try:
+    from opentelemetry import trace as otel_trace
+    # 未設定 TracerProvider 時為無操作追蹤器；logfire.configure() 會設定全域 TracerProvider
+    _tracer = otel_trace.get_tracer("texttosql")
+except ImportError:  # pragma: no cover - opentelemetry 為選用依賴
+    _tracer = None
+
+
+# 各階段與整體追蹤的延遲直方圖
+STAGE_DURATION = metrics.histogram(
+    "texttosql_stage_duration_seconds", "各處理階段耗時 (秒)", labelnames=("stage",)
+)
+TRACE_DURATION = metrics.histogram(
+    "texttosql_trace_duration_seconds", "整體處理耗時 (秒)", labelnames=("name",)
+)
+
+# 最慢的追蹤記錄
+slow_traces = SlowTraceStore(capacity=settings.slow_trace_capacity)
+
+
+class StageRecorder:
+    """記錄單次請求各階段耗時與計數器"""
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.attributes: Dict[str, Any] = {}
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}  # 階段名稱 -> 累計耗時 (毫秒)
+        self.spans: List[Dict[str, Any]] = []  # 依開始時間排列的階段時間軸
+        self.counters: Dict[str, float] = {}
+
+    def add_stage(self, name: str, elapsed_ms: float, started_at: Optional[float] = None) -> None:
+        """累加階段耗時"""
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+        if started_at is not None:
+            self.spans.append({
+                "name": name,
+                "offset_ms": (started_at - self.started_at) * 1000,
+                "duration_ms": elapsed_ms,
+            })
+
+    def incr(self, name: str, amount: float = 1) -> None:
+        """累加計數器"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+
+# 目前執行環境 (執行緒 / 協程) 的記錄器
+_current_recorder: ContextVar[Optional[StageRecorder]] = ContextVar(
+    "current_stage_recorder", default=None
+)
+
+# 目前所在 (最內層) 的處理階段，用於標記 LLM 呼叫發生在哪個階段
+_current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+# 程序層級的快取命中統計: 快取名稱 -> {"hits": int, "misses": int}
+_cache_stats: Dict[str, Dict[str, int]] = {}
+_cache_stats_lock = threading.Lock()
+
+
+def _start_span(name: str, attributes: Optional[Dict[str, Any]] = None):
+    """開啟 OpenTelemetry span (未安裝時為空操作)"""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes={
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in (attributes or {}).items() if value is not None
+    })
+
+
+@contextmanager
+def record_stages() -> Iterator[StageRecorder]:
+    """
+    在區塊內啟用階段記錄
+
+    用法:
+        with record_stages() as recorder:
+            service.text_to_sql(query)
+        print(recorder.stages)
+    """
+    recorder = StageRecorder()
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+@contextmanager
+def trace(name: str, **attributes: Any) -> Iterator[StageRecorder]:
+    """
+    追蹤一次完整的處理 (例如一次 text_to_sql 呼叫)
+
+    若外層沒有記錄器，建立新的記錄器，結束時記錄整體耗時並加入最慢追蹤記錄；
+    若已在其他追蹤或 record_stages 內，則作為子階段記錄到外層記錄器。
+    """
+    outer = _current_recorder.get()
+    if outer is not None:
+        with stage(name, **attributes):
+            yield outer
+        return
+
+    recorder = StageRecorder(name)
+    recorder.attributes.update(attributes)
+    token = _current_recorder.set(recorder)
+    try:
+        with _start_span(name, attributes):
+            yield recorder
+    finally:
+        _current_recorder.reset(token)
+        elapsed_ms = (time.perf_counter() - recorder.started_at) * 1000
+        TRACE_DURATION.observe(elapsed_ms / 1000, name=name)
+        slow_traces.add(elapsed_ms, {
+            "name": name,
+            "started_at": datetime.now().isoformat(),
+            "duration_ms": elapsed_ms,
+            "attributes": {key: str(value) for key, value in recorder.attributes.items() if value is not None},
+            "stages": recorder.spans,
+            "counters": recorder.counters,
+        })
+
+
+def traced(name: str) -> Callable:
+    """將整個函數包在 trace() 中的裝飾器"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_trace_attributes(**attributes: Any) -> None:
+    """為目前的追蹤記錄附加屬性 (例如查詢文字、模型名稱)"""
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.attributes.update(attributes)
+    if _tracer is not None:
+        span = otel_trace.get_current_span()
+        for key, value in attributes.items():
+            if value is not None:
+                span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+
+
+@contextmanager
+def stage(name: str, **attributes: Any) -> Iterator[None]:
+    """計時一個處理階段，結果寫入目前的記錄器 (若有)、延遲直方圖與 OpenTelemetry span"""
+    start = time.perf_counter()
+    stage_token = _current_stage.set(name)
+    try:
+        with _start_span(name, attributes):
+            yield
+    finally:
+        _current_stage.reset(stage_token)
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage=name)
+        recorder = _current_recorder.get()
+        if recorder is not None:
+            recorder.add_stage(name, elapsed * 1000, started_at=start)
+
+
+def current_stage() -> Optional[str]:
+    """獲取目前所在的處理階段名稱"""
+    return _current_stage.get()
+
+
+def record_counter(name: str, amount: float = 1) -> None:
+    """累加目前記錄器的計數器"""
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.incr(name, amount)
+
+
+def record_cache_access(name: str, hit: bool) -> None:
+    """
+    記錄一次快取存取
+
+    同時更新程序層級統計與目前記錄器的 cache.<name>.hits / cache.<name>.misses 計數器。
+    """
+    key = "hits" if hit else "misses"
+    with _cache_stats_lock:
+        stats = _cache_stats.setdefault(name, {"hits": 0, "misses": 0})
+        stats[key] += 1
+    record_counter(f"cache.{name}.{key}")
+
+
+def get_cache_stats() -> Dict[str, Dict[str, float]]:
+    """獲取程序層級的快取命中統計"""
+    with _cache_stats_lock:
+        result = {}
+        for name, stats in _cache_stats.items():
+            total = stats["hits"] + stats["misses"]
+            result[name] = {
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "hit_rate": stats["hits"] / total if total else 0.0,
+            }
+        return result
+
+
+def render_metrics() -> str:
+    """輸出 Prometheus 文字格式的所有指標 (含快取命中統計)"""
+    lines = [metrics.render().rstrip("\n")]
+    lines.append("# HELP texttosql_cache_requests_total 快取存取次數")
+    lines.append("# TYPE texttosql_cache_requests_total counter")
+    for name, stats in sorted(get_cache_stats().items()):
+        lines.append(f'texttosql_cache_requests_total{{cache="{name}",result="hit"}} {stats["hits"]}')
+        lines.append(f'texttosql_cache_requests_total{{cache="{name}",result="miss"}} {stats["misses"]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,162 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Set, Tuple
+
+from .profiling import record_cache_access
+
+# 解析結果快取的數量上限
+MAX_CACHED_ANALYSES = 2048
+
+# 有副作用的內建函數 (即使出現在 SELECT 中也不允許)
+SIDE_EFFECT_FUNCTIONS = {
+    "set_config", "pg_sleep", "pg_terminate_backend", "pg_cancel_backend", "pg_reload_conf",
+    "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "pg_stat_file", "lo_import", "lo_export",
+    "dblink", "dblink_exec", "pg_advisory_lock", "pg_advisory_xact_lock", "txid_current",
+}
+
+# 無法解析時的關鍵字檢查 (與舊版 is_safe_query 相同)
+_DANGEROUS_KEYWORDS = [
+    r'\bINSERT\b', r'\bUPDATE\b', r'\bDELETE\b', r'\bDROP\b',
+    r'\bCREATE\b', r'\bALTER\b', r'\bTRUNCATE\b', r'\bRENAME\b',
+    r'\bGRANT\b', r'\bREVOKE\b'
+]
+
+
+class SQLAnalysis:
+    """SQL 語句的解析結果"""
+
+    __slots__ = ("statement_types", "tables", "functions", "is_read_only", "reason", "parse_error", "expressions")
+
+    def __init__(self, statement_types: List[str], tables: Set[str], functions: Set[str], is_read_only: bool,
+                 reason: str = "", parse_error: Optional[str] = None, expressions: Optional[List[Any]] = None):
+        self.statement_types = statement_types  # 各語句類型，例如 ["SELECT"]
+        self.tables = tables  # 讀取或修改的資料表 (不含 CTE 名稱)
+        self.functions = functions  # 呼叫的自訂函數 (非內建函數)
+        self.is_read_only = is_read_only
+        self.reason = reason  # 非只讀時的原因
+        self.parse_error = parse_error  # 無法解析時的錯誤訊息 (此時改用關鍵字檢查)
+        self.expressions = expressions or []  # sqlglot 語法樹
+
+    @property
+    def statement_type(self) -> str:
+        """主要語句類型 (多個語句時為最後一個)"""
+        return self.statement_types[-1] if self.statement_types else "UNKNOWN"
+
+
+def _fallback_analysis(sql: str, error: str) -> SQLAnalysis:
+    """無法解析時以關鍵字檢查判斷是否只讀"""
+    stripped = re.sub(r'--.*?(\n|$)', ' ', sql)
+    stripped = re.sub(r'/\*.*?\*/', ' ', stripped, flags=re.DOTALL)
+    for keyword in _DANGEROUS_KEYWORDS:
+        match = re.search(keyword, stripped, re.IGNORECASE)
+        if match:
+            return SQLAnalysis([], set(), set(), False, f"不允許執行包含 '{match.group(0)}' 的查詢", error)
+    return SQLAnalysis([], set(), set(), True, "", error)
+
+
+def _writing_functions(functions: Set[str]) -> List[str]:
+    """schema 目錄中會修改資料的資料庫函數 (例如 delete_service、create_booking)"""
+    if not functions:
+        return []
+    from ..schema import get_catalog
+
+    catalog = get_catalog()
+    return sorted(name for name in functions if catalog.is_writing_function(name))
+
+
+def _analyze(sql: str) -> SQLAnalysis:
+    """解析 SQL 並檢查是否為只讀查詢"""
+    import sqlglot
+    from sqlglot import exp
+
+    try:
+        expressions = [expression for expression in sqlglot.parse(sql, dialect="postgres") if expression is not None]
+    except sqlglot.errors.SqlglotError as e:
+        return _fallback_analysis(sql, str(e).splitlines()[0])
+
+    statement_types: List[str] = []
+    tables: Set[str] = set()
+    functions: Set[str] = set()
+    reason = ""
+
+    for expression in expressions:
+        statement_type = expression.key.upper()
+        statement_types.append(statement_type)
+
+        cte_names = {cte.alias_or_name.lower() for cte in expression.find_all(exp.CTE)}
+        for table in expression.find_all(exp.Table):
+            if table.name and table.name.lower() not in cte_names:
+                tables.add(table.name.lower())
+        for function in expression.find_all(exp.Anonymous):
+            functions.add(function.name.lower())
+
+        if reason:
+            continue
+        if isinstance(expression, exp.Command):
+            reason = f"不允許執行 {expression.name.upper()} 指令"
+        elif not isinstance(expression, exp.Query):
+            reason = f"只允許查詢語句，不允許 {statement_type}"
+        else:
+            modifying = expression.find(exp.Insert, exp.Update, exp.Delete, exp.Merge)
+            if modifying is not None:
+                reason = f"不允許在查詢中執行 {modifying.key.upper()}"
+            elif expression.find(exp.Into) is not None:
+                reason = "不允許使用 SELECT INTO 建立資料表"
+            elif expression.find(exp.Lock) is not None:
+                reason = "不允許使用 FOR UPDATE / FOR SHARE 鎖定資料列"
+
+    if not expressions:
+        reason = "沒有可執行的 SQL 語句"
+
+    if not reason:
+        side_effects = functions & SIDE_EFFECT_FUNCTIONS
+        if side_effects:
+            reason = f"不允許呼叫 {', '.join(sorted(side_effects))}"
+    if not reason:
+        writing = _writing_functions(functions)
+        if writing:
+            reason = f"不允許呼叫會修改資料的函數 {', '.join(writing)}"
+
+    return SQLAnalysis(statement_types, tables, functions, not reason, reason, None, expressions)
+
+
+_analysis_cache: "OrderedDict[str, SQLAnalysis]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def analyze_sql(sql: str) -> SQLAnalysis:
+    """
+    解析 SQL 語句 (結果依 SQL 雜湊快取)
+
+    解析結果提供只讀檢查、讀取的資料表、呼叫的函數與語句類型，供安全檢查、結果快取等功能共用。
+    結果為共用物件，呼叫端不應修改。
+    """
+    key = hashlib.sha1(sql.encode("utf-8")).hexdigest()
+    with _analysis_cache_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+    record_cache_access("sql_parse", analysis is not None)
+    if analysis is not None:
+        return analysis
+
+    analysis = _analyze(sql)
+    with _analysis_cache_lock:
+        _analysis_cache[key] = analysis
+        while len(_analysis_cache) > MAX_CACHED_ANALYSES:
+            _analysis_cache.popitem(last=False)
+    return analysis
+
+
+def clear_analysis_cache() -> None:
+    """清除解析結果快取 (schema 目錄重新載入後，會修改資料的函數可能不同)"""
+    with _analysis_cache_lock:
+        _analysis_cache.clear()
+
+
+def check_read_only(sql: str) -> Tuple[bool, str]:
+    """檢查 SQL 是否為只讀查詢，返回 (是否安全, 不安全的原因)"""
+    analysis = analyze_sql(sql)
+    return analysis.is_read_only, analysis.reason
@@ -0,0 +1,74 @@
+import re
+from typing import Any, Dict, Optional
+
+# CJK 字元 (中日韓統一表意文字、假名、全形標點等) 大致每個字元對應一個 token
+_CJK_PATTERN = re.compile(
+    r"[　-〿぀-ヿ㐀-䶿一-鿿豈-﫿＀-￯]"
+)
+
+# 非 CJK 文字平均每個 token 約 4 個字元
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    估算文本的 token 數量
+
+    使用字元數進行啟發式估算：CJK 字元每字約一個 token，其餘文字約每 4 個字元一個 token。
+
+    Args:
+        text: 要估算的文本
+
+    Returns:
+        估算的 token 數量
+    """
+    if not text:
+        return 0
+
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+
+    return cjk_count + (other_count + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+# tiktoken 編碼快取: 模型名稱 -> 編碼 (None 表示無法取得)
+_encodings: Dict[str, Any] = {}
+
+
+def _get_encoding(model_name: Optional[str]) -> Any:
+    """取得模型對應的 tiktoken 編碼，未安裝 tiktoken 時返回 None"""
+    key = model_name or ""
+    if key not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            _encodings[key] = None
+            return None
+        try:
+            _encodings[key] = tiktoken.encoding_for_model(model_name) if model_name else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            # 非 OpenAI 模型使用通用編碼作為近似值
+            _encodings[key] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[key]
+
+
+def count_tokens(text: Optional[str], model_name: Optional[str] = None) -> int:
+    """
+    計算文本的 token 數量
+
+    已安裝 tiktoken 時使用分詞器計算，否則退回 estimate_tokens 的啟發式估算。
+
+    Args:
+        text: 要計算的文本
+        model_name: 模型名稱，用於選擇分詞器
+
+    Returns:
+        token 數量
+    """
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
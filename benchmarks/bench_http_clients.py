@@ -0,0 +1,98 @@
+"""
+HTTP 連線重用基準測試
+
+比較每次呼叫建立新連線 (舊版 LocalProvider 使用的 requests.post)
+與共用長連線客戶端 (LocalProvider + http_clients 連線池) 的延遲與連線數。
+
+用法:
+    python -m benchmarks.bench_http_clients --requests 500 --concurrency 8
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from app.services.llm_service import LocalProvider
+from app.utils.config import ModelConfig, ModelProvider
+
+from .ollama_stub import start_stub_server
+
+
+def _run(call: Callable[[], None], total: int, concurrency: int) -> Dict[str, float]:
+    """執行指定次數的呼叫並統計延遲 (毫秒)"""
+    latencies: List[float] = []
+
+    def timed_call(_):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed_call, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "throughput_rps": total / elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP 連線重用基準測試")
+    parser.add_argument("--requests", type=int, default=500, help="每種模式的請求數")
+    parser.add_argument("--concurrency", type=int, default=8, help="並發執行緒數")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="替身伺服器模擬延遲")
+    args = parser.parse_args(argv)
+
+    server, _ = start_stub_server(latency_ms=args.latency_ms)
+    base_url = server.base_url
+    payload = {"model": "llama3", "prompt": "列出所有服務", "stream": False}
+
+    import requests
+
+    def per_call_connection():
+        response = requests.post(f"{base_url}/generate", json=payload)
+        response.raise_for_status()
+
+    provider = LocalProvider(
+        ModelConfig(
+            provider=ModelProvider.LOCAL,
+            model_name="llama3",
+            api_key_env="DUMMY_KEY",
+            base_url=base_url,
+        )
+    )
+
+    def pooled_client():
+        response = provider.generate("列出所有服務")
+        if response.is_error():
+            raise RuntimeError(response.error)
+
+    results = {}
+    for name, call in (("每次新連線", per_call_connection), ("共用連線池", pooled_client)):
+        # 預熱，不計入統計
+        call()
+        server.reset_stats()
+        stats = _run(call, args.requests, args.concurrency)
+        stats["connections"] = server.connection_count
+        results[name] = stats
+
+    server.shutdown()
+
+    print(f"請求數: {args.requests}, 並發: {args.concurrency}")
+    print(f"{'模式':<10}{'平均(ms)':>10}{'P50(ms)':>10}{'P95(ms)':>10}{'RPS':>10}{'TCP連線':>10}")
+    for name, stats in results.items():
+        print(
+            f"{name:<10}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+            f"{stats['p95_ms']:>10.2f}{stats['throughput_rps']:>10.1f}"
+            f"{stats['connections']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
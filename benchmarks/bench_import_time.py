@@ -0,0 +1,99 @@
+"""
+啟動時間基準測試
+
+以全新的直譯器程序量測匯入模組與執行 CLI 命令的耗時 (冷啟動，每次都是新程序)，
+並以 python -X importtime 列出累計耗時最高的模組，找出啟動時被提前載入的依賴。
+
+用法:
+    python -m benchmarks.bench_import_time --runs 10
+    python -m benchmarks.bench_import_time --top 20 --target "history --limit 5"
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# 名稱 -> 直譯器參數
+TARGETS = {
+    "python (空程序)": ["-c", "pass"],
+    "import app.services": ["-c", "import app.services"],
+    "import app.cli": ["-c", "import app.cli"],
+    "text2sql history --limit 5": ["-m", "app", "history", "--limit", "5"],
+    "text2sql tokens": ["-m", "app", "tokens"],
+}
+
+
+def _environment() -> Dict[str, str]:
+    """子程序環境：以專案根目錄為模組路徑"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def time_command(args: List[str], runs: int) -> Dict[str, float]:
+    """執行指定次數並統計耗時 (毫秒)"""
+    env = _environment()
+    # 預熱一次，確保 .pyc 已編譯，不計入統計
+    subprocess.run([sys.executable, *args], cwd=PROJECT_ROOT, env=env, capture_output=True)
+
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=PROJECT_ROOT, env=env, capture_output=True)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    durations.sort()
+    return {
+        "min_ms": durations[0],
+        "p50_ms": statistics.median(durations),
+        "max_ms": durations[-1],
+    }
+
+
+def slowest_imports(args: List[str], top: int) -> List[Tuple[str, float, float]]:
+    """
+    以 -X importtime 找出耗時最高的模組
+
+    Returns:
+        (模組, 自身耗時毫秒, 累計耗時毫秒) 列表，依累計耗時由高到低
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=PROJECT_ROOT, env=_environment(), capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((module.rstrip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="啟動時間基準測試")
+    parser.add_argument("--runs", type=int, default=10, help="每個目標的執行次數")
+    parser.add_argument("--top", type=int, default=15, help="列出耗時最高的模組數")
+    parser.add_argument("--target", type=str, default="history --limit 5", help="以 -X importtime 分析的 CLI 命令")
+    args = parser.parse_args(argv)
+
+    print(f"直譯器: {sys.executable}, 每個目標執行 {args.runs} 次")
+    print(f"{'目標':<30}{'最小(ms)':>10}{'P50(ms)':>10}{'最大(ms)':>10}")
+    for name, command in TARGETS.items():
+        stats = time_command(command, args.runs)
+        print(f"{name:<30}{stats['min_ms']:>10.1f}{stats['p50_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+
+    print(f"\n-X importtime: text2sql {args.target} (依累計耗時)")
+    print(f"{'模組':<50}{'自身(ms)':>10}{'累計(ms)':>10}")
+    for module, self_ms, cumulative_ms in slowest_imports(["-m", "app", *args.target.split()], args.top):
+        print(f"{module:<50}{self_ms:>10.1f}{cumulative_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
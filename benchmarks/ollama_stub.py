@@ -0,0 +1,123 @@
+"""
+本地 Ollama 替身伺服器
+
+模擬 Ollama 的 /api/generate 端點，並統計接受的 TCP 連線數，
+用於在沒有實際模型的情況下測量 HTTP 連線重用與用戶端開銷。
+
+用法:
+    python -m benchmarks.ollama_stub --port 11434 --latency-ms 5
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    """Ollama /api/generate 請求處理器"""
+
+    # 使用 HTTP/1.1 以支援 keep-alive
+    protocol_version = "HTTP/1.1"
+
+    # 與 Ollama (Go net/http) 相同開啟 TCP_NODELAY，避免長連線上的 Nagle 延遲
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connection_count += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.rstrip("/") != "/api/generate":
+            self.send_error(404)
+            return
+
+        with self.server.stats_lock:
+            self.server.request_count += 1
+
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000)
+
+        prompt = body.get("prompt", "")
+        payload = json.dumps(
+            {
+                "model": body.get("model", "llama3"),
+                "response": json.dumps(
+                    {"sql": "SELECT 1;", "explanation": "替身回應", "parameters": {}},
+                    ensure_ascii=False,
+                ),
+                "done": True,
+                "prompt_eval_count": len(prompt) // 4,
+                "eval_count": 16,
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # 關閉每個請求的存取日誌
+        pass
+
+
+class OllamaStubServer(ThreadingHTTPServer):
+    """可統計連線數與請求數的 Ollama 替身伺服器"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency_ms: float = 0.0):
+        super().__init__(address, OllamaStubHandler)
+        self.latency_ms = latency_ms
+        self.stats_lock = threading.Lock()
+        self.connection_count = 0
+        self.request_count = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def reset_stats(self) -> None:
+        with self.stats_lock:
+            self.connection_count = 0
+            self.request_count = 0
+
+
+def start_stub_server(
+    host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0
+) -> Tuple[OllamaStubServer, threading.Thread]:
+    """在背景執行緒啟動替身伺服器，port 為 0 時自動選擇可用埠"""
+    server = OllamaStubServer((host, port), latency_ms=latency_ms)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="本地 Ollama 替身伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="模擬模型延遲")
+    args = parser.parse_args(argv)
+
+    server = OllamaStubServer((args.host, args.port), latency_ms=args.latency_ms)
+    print(f"Ollama 替身伺服器啟動於 {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
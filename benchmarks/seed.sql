@@ -0,0 +1,42 @@
+-- 基準測試用的種子資料 (搭配 n8n_booking_schemas 中的表結構)
+-- 預約日期以 CURRENT_DATE 為基準，讓相對日期的查詢每次執行都有資料
+
+INSERT INTO public.n8n_booking_businesses (id, name, description, address, contact_phone, timezone)
+VALUES ('11111111-1111-1111-1111-111111111111', '悠然美容工作室', '基準測試商家', '台北市大安區忠孝東路一段 1 號', '02-1234-5678', 'Asia/Taipei');
+
+INSERT INTO public.n8n_booking_users (id, name, email, phone, role, business_id) VALUES
+    ('22222222-0000-0000-0000-000000000001', '王小明', 'ming@example.com', '0911000001', 'staff', '11111111-1111-1111-1111-111111111111'),
+    ('22222222-0000-0000-0000-000000000002', '李小華', 'hua@example.com', '0911000002', 'staff', '11111111-1111-1111-1111-111111111111'),
+    ('22222222-0000-0000-0000-000000000003', '陳美玲', 'meiling@example.com', '0922000003', 'customer', '11111111-1111-1111-1111-111111111111');
+
+INSERT INTO public.n8n_booking_services (id, business_id, name, description, duration, price, max_capacity, is_active) VALUES
+    ('33333333-0000-0000-0000-000000000001', '11111111-1111-1111-1111-111111111111', '基礎美容護理', '臉部清潔與保濕', 60, 1200, 2, true),
+    ('33333333-0000-0000-0000-000000000002', '11111111-1111-1111-1111-111111111111', '深層清潔護理', '深層毛孔清潔', 90, 1800, 1, true),
+    ('33333333-0000-0000-0000-000000000003', '11111111-1111-1111-1111-111111111111', '美甲服務', '手部美甲', 45, 800, 3, true),
+    ('33333333-0000-0000-0000-000000000004', '11111111-1111-1111-1111-111111111111', '舊版按摩', '已停止提供', 30, 500, 1, false);
+
+INSERT INTO public.n8n_booking_time_periods (id, business_id, name, start_time, end_time, start_minutes, end_minutes, max_capacity, is_active) VALUES
+    ('44444444-0000-0000-0000-000000000001', '11111111-1111-1111-1111-111111111111', '上午', '09:00', '12:00', 540, 720, 4, true),
+    ('44444444-0000-0000-0000-000000000002', '11111111-1111-1111-1111-111111111111', '下午', '13:00', '17:00', 780, 1020, 6, true),
+    ('44444444-0000-0000-0000-000000000003', '11111111-1111-1111-1111-111111111111', '晚上', '18:00', '21:00', 1080, 1260, 3, true);
+
+INSERT INTO public.n8n_booking_staff_services (staff_id, service_id, is_primary, proficiency_level) VALUES
+    ('22222222-0000-0000-0000-000000000001', '33333333-0000-0000-0000-000000000001', true, 5),
+    ('22222222-0000-0000-0000-000000000001', '33333333-0000-0000-0000-000000000002', false, 3),
+    ('22222222-0000-0000-0000-000000000002', '33333333-0000-0000-0000-000000000003', true, 4);
+
+INSERT INTO public.n8n_booking_service_period_restrictions (service_id, period_id, is_allowed) VALUES
+    ('33333333-0000-0000-0000-000000000002', '44444444-0000-0000-0000-000000000003', false);
+
+INSERT INTO public.n8n_booking_staff_availability (staff_id, business_id, day_of_week, start_time, end_time, is_recurring) VALUES
+    ('22222222-0000-0000-0000-000000000001', '11111111-1111-1111-1111-111111111111', 1, '09:00', '17:00', true),
+    ('22222222-0000-0000-0000-000000000002', '11111111-1111-1111-1111-111111111111', 3, '13:00', '21:00', true);
+
+INSERT INTO public.n8n_booking_bookings (id, business_id, customer_name, customer_email, customer_phone, booking_date, booking_start_time, booking_duration, number_of_people, period_id, service_id, staff_id, status) VALUES
+    ('55555555-0000-0000-0000-000000000001', '11111111-1111-1111-1111-111111111111', '陳美玲', 'meiling@example.com', '0922000003', CURRENT_DATE, '10:00+08', '60 minutes', 1, '44444444-0000-0000-0000-000000000001', '33333333-0000-0000-0000-000000000001', '22222222-0000-0000-0000-000000000001', 'confirmed'),
+    ('55555555-0000-0000-0000-000000000002', '11111111-1111-1111-1111-111111111111', '林志豪', 'hao@example.com', '0933000004', CURRENT_DATE + 1, '14:00+08', '45 minutes', 2, '44444444-0000-0000-0000-000000000002', '33333333-0000-0000-0000-000000000003', '22222222-0000-0000-0000-000000000002', 'confirmed'),
+    ('55555555-0000-0000-0000-000000000003', '11111111-1111-1111-1111-111111111111', '陳美玲', 'meiling@example.com', '0922000003', CURRENT_DATE + 7, '18:30+08', '90 minutes', 1, '44444444-0000-0000-0000-000000000003', '33333333-0000-0000-0000-000000000002', '22222222-0000-0000-0000-000000000001', 'cancelled'),
+    ('55555555-0000-0000-0000-000000000004', '11111111-1111-1111-1111-111111111111', '張雅婷', 'ting@example.com', '0944000005', CURRENT_DATE - 3, '09:30+08', '60 minutes', 1, '44444444-0000-0000-0000-000000000001', '33333333-0000-0000-0000-000000000001', '22222222-0000-0000-0000-000000000001', 'completed');
+
+INSERT INTO public.n8n_booking_history (booking_id, previous_status, new_status, reason) VALUES
+    ('55555555-0000-0000-0000-000000000003', 'confirmed', 'cancelled', '客戶臨時有事');
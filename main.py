@@ -1,6 +1,7 @@
-import uvicorn
-import os
+import argparse
+import importlib.util
 import logging
+import os
 from dotenv import load_dotenv
 
 # 設置日誌
@@ -10,16 +11,121 @@ logger = logging.getLogger(__name__)
 # 載入環境變數
 load_dotenv()
 
-if __name__ == "__main__":
-    # 獲取端口
-    port = int(os.getenv("PORT", "8000"))
-    
-    logger.info(f"啟動TextToSQL服務，端口: {port}")
-    
-    # 啟動 FastAPI 應用程式
+APP_IMPORT = "app.api:app"
+
+
+def _available(module: str) -> bool:
+    """模組是否已安裝 (不實際匯入)"""
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _worker_count(requested: int) -> int:
+    """worker 程序數，0 表示 CPU 核心數"""
+    if requested > 0:
+        return requested
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def preload_catalog() -> None:
+    """
+    在建立 worker 前載入 schema 目錄
+
+    gunicorn 以 fork 建立 worker，目錄直接由所有 worker 共用 (寫入時複製)；
+    uvicorn 以 spawn 建立 worker，預先載入會更新磁碟快取，worker 啟動時只需讀取快取檔案。
+    """
+    from app.schema import get_catalog
+
+    catalog = get_catalog()
+    logger.info(f"已預先載入 schema 目錄: {len(catalog.tables)} 個資料表")
+
+
+def run_development(host: str, port: int) -> None:
+    """開發模式：單一程序並監看檔案自動重載"""
+    import uvicorn
+
+    logger.info(f"以開發模式啟動TextToSQL服務 (自動重載)，端口: {port}")
+    uvicorn.run(APP_IMPORT, host=host, port=port, reload=True)
+
+
+def run_gunicorn(host: str, port: int, workers: int, graceful_timeout: int) -> None:
+    """
+    以 gunicorn 管理 uvicorn worker
+
+    不使用 preload_app：在主程序匯入整個應用會讓 fork 出的 worker 共用資料庫連線池與背景寫入執行緒，
+    因此只預先載入 schema 目錄，其餘服務由各 worker 自行建立。
+    """
+    from gunicorn.app.base import BaseApplication
+
+    worker_class = "uvicorn_worker.UvicornWorker" if _available("uvicorn_worker") else "uvicorn.workers.UvicornWorker"
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": worker_class,
+                # 收到 SIGTERM 後等待進行中的請求完成，逾時才強制結束 worker
+                "graceful_timeout": graceful_timeout,
+                "timeout": max(graceful_timeout, 120),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app.api import app
+            return app
+
+    logger.info(f"以 gunicorn 啟動TextToSQL服務，端口: {port}，worker: {workers} ({worker_class})")
+    Application().run()
+
+
+def run_uvicorn(host: str, port: int, workers: int, graceful_timeout: int) -> None:
+    """以 uvicorn 內建的多程序模式啟動 (未安裝 gunicorn 時使用)"""
+    import uvicorn
+
+    loop = "uvloop" if _available("uvloop") else "asyncio"
+    http = "httptools" if _available("httptools") else "h11"
+    logger.info(f"以 uvicorn 啟動TextToSQL服務，端口: {port}，worker: {workers}，事件迴圈: {loop}，HTTP: {http}")
     uvicorn.run(
-        "app.api:app",
-        host="0.0.0.0",
+        APP_IMPORT,
+        host=host,
         port=port,
-        reload=True
-    )
\ No newline at end of file
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=graceful_timeout,
+    )
+
+
+def main() -> None:
+    from app.utils import settings
+
+    parser = argparse.ArgumentParser(description="啟動TextToSQL API 服務")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"), help="監聽位址")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")), help="監聽端口")
+    parser.add_argument("--workers", type=int, default=settings.server_workers, help="worker 程序數，0 表示 CPU 核心數")
+    parser.add_argument("--reload", action="store_true", default=settings.app_env == "development",
+                        help="開發模式：單一程序並自動重載 (APP_ENV=development 時預設開啟)")
+    parser.add_argument("--server", choices=["auto", "gunicorn", "uvicorn"], default="auto",
+                        help="程序管理方式，auto 表示有安裝 gunicorn 時使用 gunicorn")
+    args = parser.parse_args()
+
+    if args.reload:
+        run_development(args.host, args.port)
+        return
+
+    workers = _worker_count(args.workers)
+    preload_catalog()
+
+    use_gunicorn = args.server == "gunicorn" or (args.server == "auto" and _available("gunicorn"))
+    if use_gunicorn:
+        run_gunicorn(args.host, args.port, workers, settings.server_graceful_timeout)
+    else:
+        run_uvicorn(args.host, args.port, workers, settings.server_graceful_timeout)
+
+
+if __name__ == "__main__":
+    main()
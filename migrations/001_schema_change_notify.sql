@@ -0,0 +1,17 @@
+-- 資料庫結構變更通知
+-- 函數功能：DDL 指令完成後以 NOTIFY 通知應用程式使資料庫結構快取失效
+-- 頻道名稱需與 SCHEMA_NOTIFY_CHANNEL 設定相同 (默認 texttosql_schema_changed)
+-- 建立事件觸發器需要超級用戶權限
+
+CREATE OR REPLACE FUNCTION texttosql_notify_schema_change()
+RETURNS event_trigger AS $$
+BEGIN
+    PERFORM pg_notify('texttosql_schema_changed', tg_tag);
+END;
+$$ LANGUAGE plpgsql;
+
+DROP EVENT TRIGGER IF EXISTS texttosql_schema_change;
+
+CREATE EVENT TRIGGER texttosql_schema_change
+    ON ddl_command_end
+    EXECUTE FUNCTION texttosql_notify_schema_change();
@@ -0,0 +1,34 @@
+-- 資料表變更通知
+-- 函數功能：n8n_booking_* 資料表的資料變更後以 NOTIFY 通知應用程式，使依賴該表的查詢結果快取失效
+-- 頻道名稱需與 TABLE_NOTIFY_CHANNEL 設定相同 (默認 texttosql_table_changed)
+-- 新增資料表後需重新執行此檔案
+
+CREATE OR REPLACE FUNCTION texttosql_notify_table_change()
+RETURNS trigger AS $$
+BEGIN
+    -- 同一交易內相同內容的通知只會送出一次
+    PERFORM pg_notify('texttosql_table_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    target regclass;
+BEGIN
+    FOR target IN
+        SELECT c.oid::regclass
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND c.relname LIKE 'n8n\_booking\_%'
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS texttosql_table_change ON %s', target);
+        EXECUTE format(
+            'CREATE TRIGGER texttosql_table_change '
+            'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %s '
+            'FOR EACH STATEMENT EXECUTE FUNCTION texttosql_notify_table_change()',
+            target
+        );
+    END LOOP;
+END;
+$$;
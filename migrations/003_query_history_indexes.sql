@@ -0,0 +1,17 @@
+-- 查詢歷史索引
+-- 函數功能：支援 /api/history 與 CLI 的游標 (keyset) 分頁，以及收藏、模板與對話歷史的查詢
+-- 排序鍵為 (created_at, id)，B-tree 索引可反向掃描，同時適用 ORDER BY created_at DESC, id DESC
+-- CONCURRENTLY 不能在交易中執行，請以 psql -f 直接執行 (不要加 --single-transaction)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_created_at
+    ON query_history (created_at, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_conversation
+    ON query_history (conversation_id, created_at, id);
+
+-- 收藏與模板只佔少數，使用部分索引
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_favorites
+    ON query_history (created_at, id) WHERE is_favorite;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_templates
+    ON query_history (created_at, id) WHERE is_template;
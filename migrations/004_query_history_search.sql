@@ -0,0 +1,33 @@
+-- 查詢歷史與模板的全文搜尋索引
+-- 函數功能：支援 /api/history/search、CLI 的 history --search 與模板搜尋
+-- tsvector 運算式必須與 app/services/history_service.py 的 SEARCH_DOCUMENT 完全相同，查詢才會使用索引
+-- 'simple' 設定不做詞幹與停用詞處理，適合 SQL 識別字；中文等沒有空白分詞的文字由 pg_trgm 的包含比對 (ILIKE) 處理
+-- pg_trgm 對非 ASCII 字元的切詞需要 UTF-8 資料庫與非 C 的 LC_CTYPE；少於三個字元的搜尋字串無法使用 trigram 索引
+-- CONCURRENTLY 不能在交易中執行，請以 psql -f 直接執行 (不要加 --single-transaction)
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_search
+    ON query_history USING GIN (to_tsvector('simple', coalesce(user_query, '') || ' ' || coalesce(generated_sql, '')));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_user_query_trgm
+    ON query_history USING GIN (user_query gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_history_generated_sql_trgm
+    ON query_history USING GIN (generated_sql gin_trgm_ops);
+
+-- 模板：標籤過濾 (tags @> ARRAY[...]) 與名稱、描述、問題、SQL 的包含比對
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_templates_tags
+    ON query_templates USING GIN (tags);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_templates_name_trgm
+    ON query_templates USING GIN (name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_templates_description_trgm
+    ON query_templates USING GIN (description gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_templates_user_query_trgm
+    ON query_templates USING GIN (user_query gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_query_templates_generated_sql_trgm
+    ON query_templates USING GIN (generated_sql gin_trgm_ops);
@@ -7,7 +7,9 @@ setup(
     install_requires=[
         "pydantic>=2.0.0",
         "pydantic-settings>=2.0.0",
-        "sqlalchemy>=2.0.0",
+        "sqlalchemy[asyncio]>=2.0.0",
+        "asyncpg>=0.29.0",
+        "sqlglot>=25.0.0",
         "openai>=1.0.0",
         "langchain>=0.0.300",
         "python-dotenv>=1.0.0",
@@ -20,6 +22,7 @@ setup(
         "anthropic>=0.18.0",
         "google-generativeai>=0.3.0",
         "requests>=2.31.0",
+        "httpx>=0.24.0",
         "scikit-learn>=1.2.0",
         "numpy>=1.21.0",
         "sentence-transformers>=2.2.2",
@@ -30,6 +33,16 @@ setup(
         "seaborn>=0.12.0",
     ],
     extras_require={
+        "server": [
+            "uvicorn[standard]>=0.23.0",
+            "gunicorn>=21.2.0",
+        ],
+        "redis": [
+            "redis>=4.2.0",
+        ],
+        "parquet": [
+            "pyarrow>=14.0.0",
+        ],
         "test": [
             "pytest>=7.0.0",
             "pytest-cov>=4.0.0",
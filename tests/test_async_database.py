@@ -0,0 +1,32 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from app.services.async_database import coerce_param, coerce_params
+
+
+def test_coerce_iso_dates_and_times():
+    assert coerce_param("2025-05-01") == date(2025, 5, 1)
+    assert coerce_param("2025-05-01T09:30:00") == datetime(2025, 5, 1, 9, 30)
+    assert coerce_param("2025-05-01 09:30").hour == 9
+    assert coerce_param("2025-05-01T09:30:00+08:00").utcoffset() == timedelta(hours=8)
+    assert coerce_param("09:30") == time(9, 30)
+
+
+def test_coerce_numbers():
+    assert coerce_param("42") == 42
+    assert coerce_param("-3") == -3
+    assert coerce_param("12.50") == Decimal("12.50")
+
+
+def test_leaves_other_values_unchanged():
+    for value in ("王小明", "2025-02-30", "0912-345-678", "1e5", "", 7, None):
+        assert coerce_param(value) == value
+
+
+def test_coerce_params_returns_same_object_when_nothing_changes():
+    params = {"name": "王小明", "limit": 10}
+    assert coerce_params(params) is params
+    assert coerce_params(None) is None
+    assert coerce_params({"booking_date": "2025-05-01", "name": "王小明"}) == {
+        "booking_date": date(2025, 5, 1), "name": "王小明"
+    }
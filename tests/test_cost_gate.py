@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app.services.cost_gate import CostGate
+from app.services.database_service import DatabaseService
+
+UNSAFE_SQL = [
+    "SELECT 1; DELETE FROM n8n_booking_bookings",
+    "DELETE FROM n8n_booking_bookings",
+    "SELECT set_config('role', 'admin', false)",
+    "WITH d AS (DELETE FROM n8n_booking_bookings RETURNING id) SELECT * FROM d",
+]
+
+
+class RecordingGate(CostGate):
+    """記錄送去 EXPLAIN 的 SQL，不連接資料庫"""
+
+    def __init__(self):
+        super().__init__(max_cost=1000, max_rows=0)
+        self.explained = []
+
+    def _explain(self, conn, sql, params):
+        self.explained.append(sql)
+        return super()._explain(conn, sql, params)
+
+
+class FakeConnection:
+    def execute(self, statement, params):
+        class Row:
+            def fetchone(self):
+                return ([{"Plan": {"Node Type": "Result", "Total Cost": 1.0, "Plan Rows": 1}}],)
+        return Row()
+
+
+class FakeEngine:
+    @contextmanager
+    def connect(self):
+        yield FakeConnection()
+
+
+@pytest.fixture
+def db_service():
+    service = DatabaseService()
+    service.cost_gate = RecordingGate()
+    service.engine = FakeEngine()
+    service.connect = lambda: True
+    return service
+
+
+@pytest.mark.parametrize("sql", UNSAFE_SQL)
+def test_unsafe_sql_never_reaches_explain(db_service, sql):
+    assert db_service.check_query_cost(sql) is None
+    assert db_service.cost_gate.explained == []
+
+
+@pytest.mark.parametrize("sql", UNSAFE_SQL)
+def test_gate_refuses_unsafe_sql(sql):
+    gate = CostGate(max_cost=1000, max_rows=0)
+    with pytest.raises(ValueError):
+        gate.check(FakeConnection(), sql)
+
+
+def test_read_only_sql_is_explained(db_service):
+    plan_check = db_service.check_query_cost("SELECT id FROM n8n_booking_services WHERE is_active")
+    assert plan_check is not None and plan_check.allowed
+    assert db_service.cost_gate.explained == ["SELECT id FROM n8n_booking_services WHERE is_active"]
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app.services.history_transfer import (
+    _chunked,
+    _prefetch,
+    copy_text_escape,
+    copy_text_unescape,
+)
+
+SPECIAL_VALUES = ["C:\\temp\\new", "a\tb", "第一行\r\n第二行", "\\\\n 不是換行", "\x01\x1f\x7f", "結尾反斜線\\"]
+
+
+@pytest.mark.parametrize("value", SPECIAL_VALUES)
+def test_copy_text_round_trip(value):
+    escaped = copy_text_escape(value)
+    # 跳脫後不含列分隔與欄位分隔字元
+    assert not any(char in escaped for char in "\n\r\t")
+    assert copy_text_unescape(escaped) == value
+
+
+def test_copy_text_round_trip_json_record():
+    record = {"user_query": "\\d 與 \t", "generated_sql": "SELECT '\r\n'\n-- 註解", "parameters": {"path": "C:\\x41"}}
+    lines = "".join(copy_text_escape(json.dumps(record, ensure_ascii=False)) + "\n" for _ in range(2))
+    rows = [json.loads(copy_text_unescape(line)) for line in lines.split("\n") if line]
+    assert rows == [record, record]
+
+
+def test_copy_text_unescape_postgres_sequences():
+    assert copy_text_unescape("a\\bb\\fc\\vd") == "a\bb\fc\vd"
+    assert copy_text_unescape("\\101\\x42\\7") == "AB\x07"
+    assert copy_text_unescape("\\q") == "q"
+
+
+def test_prefetch_producer_stops_when_consumer_fails():
+    produced = []
+
+    def chunks():
+        for index in range(100):
+            produced.append(index)
+            yield [{"index": index}]
+
+    before = threading.active_count()
+    iterator = _prefetch(chunks(), depth=1)
+    assert next(iterator) == [{"index": 0}]
+    iterator.close()
+
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == before
+    assert len(produced) < 100
+
+
+def test_prefetch_producer_error_does_not_block_after_consumer_stops():
+    def chunks():
+        yield [{"index": 0}]
+        yield [{"index": 1}]
+        raise OSError("讀取失敗")
+
+    before = threading.active_count()
+    iterator = _prefetch(chunks(), depth=1)
+    next(iterator)
+    iterator.close()
+
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == before
+
+
+def test_prefetch_closes_source_when_consumer_stops():
+    closed = threading.Event()
+
+    def records():
+        try:
+            for index in range(100):
+                yield {"index": index}
+        finally:
+            closed.set()
+
+    # 保留參照，來源必須由讀取執行緒明確關閉，而不是等垃圾回收
+    chunks = _chunked(records(), 1)
+    iterator = _prefetch(chunks, depth=1)
+    next(iterator)
+    iterator.close()
+    assert closed.wait(2)
+
+
+def test_prefetch_reraises_producer_error():
+    def chunks():
+        yield [{"index": 0}]
+        raise OSError("讀取失敗")
+
+    with pytest.raises(OSError):
+        list(_prefetch(chunks(), depth=1))
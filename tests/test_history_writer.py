@@ -0,0 +1,154 @@
+import json
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+from app.models import QueryHistoryModel
+from app.services.history_service import HistoryService
+from app.services.history_writer import HistoryWriter
+
+
+class FlakyStore:
+    """前 failures 次寫入失敗的批次寫入函式"""
+
+    def __init__(self, failures: int = 1):
+        self.failures = failures
+        self.rows = {}
+
+    def write_batch(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("資料庫暫時無法連線")
+        for query, is_new in batch:
+            self.rows[str(query.id)] = (query, is_new)
+
+
+class RecordingEngine:
+    """記錄交易中執行的 SQL 語句與參數的引擎替身"""
+
+    def __init__(self):
+        self.executed = []
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, statement, params=None):
+        from sqlalchemy.dialects import postgresql
+
+        self.executed.append((str(statement.compile(dialect=postgresql.dialect())), params))
+
+
+def make_query(**kwargs) -> QueryHistoryModel:
+    values = {"id": uuid.uuid4(), "user_query": "今天的預約", "generated_sql": "SELECT 1", "explanation": "測試"}
+    values.update(kwargs)
+    return QueryHistoryModel(**values)
+
+
+def test_failed_batch_is_requeued_not_dropped():
+    store = FlakyStore(failures=1)
+    writer = HistoryWriter(store.write_batch, batch_size=2)
+    queries = [make_query() for _ in range(5)]
+    for query in queries:
+        writer.enqueue(query, is_new=True)
+
+    assert writer.flush() == 0
+    assert writer.has_pending()
+    assert all(writer.get_pending(query.id) is not None for query in queries)
+
+    assert writer.flush() == 5
+    assert not writer.has_pending()
+    assert set(store.rows) == {str(query.id) for query in queries}
+
+
+def test_failure_after_partial_write_keeps_remaining_batches():
+    store = FlakyStore(failures=0)
+    calls = []
+
+    def write_batch(batch):
+        calls.append(len(batch))
+        if len(calls) == 2:
+            raise OSError("寫入逾時")
+        store.write_batch(batch)
+
+    writer = HistoryWriter(write_batch, batch_size=2)
+    queries = [make_query() for _ in range(5)]
+    for query in queries:
+        writer.enqueue(query, is_new=True)
+
+    assert writer.flush() == 2
+    assert writer.flush() == 3
+    assert set(store.rows) == {str(query.id) for query in queries}
+
+
+def test_newer_update_wins_over_requeued_entry():
+    store = FlakyStore(failures=0)
+    query = make_query()
+    updated = query.model_copy(update={"executed": True})
+    writer = HistoryWriter(None, batch_size=10)
+
+    def write_batch(batch):
+        # 寫入期間同一筆查詢又被更新
+        writer.write_batch = store.write_batch
+        writer.enqueue(updated, is_new=False)
+        raise OSError("資料庫暫時無法連線")
+
+    writer.write_batch = write_batch
+    writer.enqueue(query, is_new=True)
+    writer.flush()
+    writer.flush()
+
+    written, is_new = store.rows[str(query.id)]
+    assert written.executed is True
+    assert is_new is True
+
+
+def test_raise_errors_surfaces_failure_and_keeps_entries():
+    store = FlakyStore(failures=1)
+    writer = HistoryWriter(store.write_batch)
+    query = make_query()
+    writer.enqueue(query, is_new=True)
+
+    with pytest.raises(OSError):
+        writer.flush(raise_errors=True)
+    assert writer.get_pending(query.id) is not None
+
+    writer.close()
+    assert str(query.id) in store.rows
+
+
+def test_db_batch_update_does_not_insert_unknown_ids():
+    service = HistoryService(use_db=False, write_behind=False)
+    service.engine = RecordingEngine()
+    new_query = make_query()
+    updated_query = make_query(executed=True)
+
+    service._write_batch_to_db([(new_query, True), (updated_query, False)])
+
+    (insert_sql, _), (update_sql, update_params) = service.engine.executed
+    assert insert_sql.startswith("INSERT INTO query_history")
+    assert "ON CONFLICT (id) DO UPDATE" in insert_sql
+    # 更新只以 UPDATE ... WHERE id 寫入，不存在的 ID 不會被新增
+    assert update_sql.startswith("UPDATE query_history SET")
+    assert "WHERE query_history.id = %(b_id)s" in update_sql
+    assert [row["b_id"] for row in update_params] == [updated_query.id]
+    assert all("b_created_at" not in row for row in update_params)
+
+
+def test_file_batch_update_skips_unknown_ids(tmp_path):
+    service = HistoryService(use_db=False, write_behind=False)
+    service.history_file = str(tmp_path / "query_history.json")
+    existing = make_query()
+    service.write_batch([(existing, True)])
+
+    unknown = make_query()
+    service.write_batch([
+        (existing.model_copy(update={"executed": True}), False),
+        (unknown, False),
+    ])
+
+    with open(service.history_file, encoding="utf-8") as f:
+        records = json.load(f)
+    assert [record["id"] for record in records] == [str(existing.id)]
+    assert records[0]["executed"] is True
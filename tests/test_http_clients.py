@@ -0,0 +1,57 @@
+import asyncio
+
+from app.services.http_clients import close_async_http_clients, get_async_http_client
+from app.services.llm_service import LocalProvider
+from app.utils.config import ModelConfig, ModelProvider
+from benchmarks.ollama_stub import start_stub_server
+
+
+def test_async_client_shared_within_loop_and_closed_on_shutdown():
+    async def run():
+        first = get_async_http_client("test")
+        second = get_async_http_client("test")
+        await close_async_http_clients()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert first.is_closed
+
+
+def test_async_client_recreated_for_new_loop():
+    async def get():
+        return get_async_http_client("test-loop")
+
+    first = asyncio.run(get())
+    second = asyncio.run(get())
+    assert first is not second
+
+    async def close():
+        await close_async_http_clients()
+
+    asyncio.run(close())
+
+
+def test_local_provider_agenerate_reuses_connections():
+    server, _ = start_stub_server()
+    try:
+        provider = LocalProvider(
+            ModelConfig(
+                provider=ModelProvider.LOCAL,
+                model_name="llama3",
+                api_key_env="DUMMY_KEY",
+                base_url=server.base_url,
+            )
+        )
+
+        async def run():
+            try:
+                return [await provider.agenerate("列出所有服務") for _ in range(5)]
+            finally:
+                await close_async_http_clients()
+
+        responses = asyncio.run(run())
+        assert not any(response.is_error() for response in responses)
+        assert server.connection_count == 1
+    finally:
+        server.shutdown()
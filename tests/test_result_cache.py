@@ -0,0 +1,22 @@
+from app.services.result_cache import QueryResultCache
+
+
+def test_make_key_distinguishes_whitespace_inside_literal():
+    first = QueryResultCache.make_key("SELECT * FROM n8n_booking_services WHERE name = 'a  b'")
+    second = QueryResultCache.make_key("SELECT * FROM n8n_booking_services WHERE name = 'a b'")
+    assert first != second
+
+
+def test_make_key_distinguishes_line_comment_boundary():
+    first = QueryResultCache.make_key("SELECT id FROM n8n_booking_services -- 註解\nWHERE is_active")
+    second = QueryResultCache.make_key("SELECT id FROM n8n_booking_services -- 註解 WHERE is_active")
+    assert first != second
+
+
+def test_make_key_ignores_surrounding_whitespace_and_semicolon():
+    assert QueryResultCache.make_key("  SELECT 1;\n") == QueryResultCache.make_key("SELECT 1")
+
+
+def test_make_key_includes_parameters():
+    sql = "SELECT * FROM n8n_booking_services WHERE name = :name"
+    assert QueryResultCache.make_key(sql, {"name": "a"}) != QueryResultCache.make_key(sql, {"name": "b"})
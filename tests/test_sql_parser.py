@@ -0,0 +1,26 @@
+import pytest
+
+from app.schema import get_catalog
+from app.utils.sql_parser import analyze_sql
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT delete_service(:id)",
+    "SELECT * FROM cancel_booking(:booking_id)",
+    "SELECT create_booking(:service_id, :period_id, :customer_name)",
+    "WITH b AS (SELECT * FROM get_all_services()) SELECT update_service(b.id) FROM b",
+])
+def test_catalog_writing_functions_are_not_read_only(sql):
+    analysis = analyze_sql(sql)
+    assert not analysis.is_read_only
+    assert "會修改資料的函數" in analysis.reason
+
+
+def test_every_catalog_writing_function_is_rejected():
+    for name in get_catalog().writing_functions:
+        assert not analyze_sql(f"SELECT {name}()").is_read_only, name
+
+
+def test_catalog_read_functions_stay_read_only():
+    assert analyze_sql("SELECT * FROM get_all_services()").is_read_only
+    assert analyze_sql("SELECT count(*) FROM n8n_booking_services").is_read_only
@@ -0,0 +1,43 @@
+from uuid import uuid4
+
+from app.models import QueryTemplateModel
+from app.services.template_matcher import TemplateMatcher
+
+
+class StubHistoryService:
+    """只提供模板的歷史紀錄服務"""
+
+    templates_version = 0
+
+    def __init__(self, templates):
+        self.templates = templates
+
+    def get_templates(self, limit=20, **kwargs):
+        return self.templates[:limit]
+
+
+def make_matcher():
+    template = QueryTemplateModel(
+        id=uuid4(),
+        name="有空位的時段",
+        user_query="2025-05-01有空位的時段",
+        generated_sql="SELECT * FROM get_period_availability(:business_id, :booking_date) WHERE available > 0;",
+        parameters={"business_id": "11111111-1111-1111-1111-111111111111", "booking_date": "2025-05-01"},
+    )
+    return TemplateMatcher(StubHistoryService([template]), db_service=None, threshold=0.95, refresh_interval=60)
+
+
+def test_match_fills_date_slot():
+    match = make_matcher().match("2025-05-02有空位的時段")
+    assert match is not None
+    assert match.parameters["booking_date"] == "2025-05-02"
+
+
+def test_negated_question_does_not_match():
+    assert make_matcher().match("2025-05-02沒有空位的時段") is None
+
+
+def test_number_difference_does_not_match():
+    matcher = make_matcher()
+    matcher.threshold = 0.8
+    assert matcher.match("2025-05-02有3個空位的時段") is None